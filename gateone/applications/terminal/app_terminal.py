@@ -31,6 +31,10 @@ from utils import cmd_var_swap, RUDict, json_encode, get_settings, short_hash
 from utils import mkdir_p, string_to_syslog_facility, get_plugins, load_modules
 from utils import process_opt_esc_sequence, bind, MimeTypeFail, create_data_uri
 from utils import convert_to_timedelta, which
+from assets import get_bundle, get_cache_dir, static_files
+from assets import plugin_static_files, plugins_bundle_name, render_style
+from watcher import get_file_watcher
+from media import get_media_pool
 
 # 3rd party imports
 import tornado.ioloop
@@ -44,6 +48,8 @@ SESSIONS = {} # This will get replaced with gateone.py's SESSIONS dict
 # This is in case we have relative imports, templates, or whatever:
 APPLICATION_PATH = os.path.split(__file__)[0] # Path to our application
 REGISTERED_HANDLERS = [] # So we don't accidentally re-add handlers
+PLUGINS = {} # Format: {<enabled plugins tuple>: <load_plugins() dict>}
+HIBERNATOR = None # PeriodicCallback that calls hibernate_idle_terminals()
 
 # Terminal-specific command line options.  These become options you can pass to
 # gateone.py (e.g. --session_logging)
@@ -92,6 +98,34 @@ def kill_session(session, kill_dtach=False):
                 if kill_dtach:
                     kill_dtached_proc(session, term)
 
+def hibernate_idle_terminals():
+    """
+    Hibernates (see :meth:`terminal.Terminal.hibernate`) the terminal emulator
+    of every terminal that hasn't produced any output in its owner's
+    'hibernate_after' setting (stored in the terminal's ``term_obj`` as a
+    :class:`datetime.timedelta` by :meth:`TerminalApplication.new_terminal`).
+    They'll wake up automatically as soon as they're written to or viewed.
+
+    .. note:: This function is meant to be called via Tornado's :meth:`~tornado.ioloop.PeriodicCallback`.
+    """
+    now = datetime.now()
+    for session in list(SESSIONS.keys()):
+        for location in SESSIONS[session].get('locations', {}).values():
+            for term, term_obj in location.get('terminal', {}).items():
+                if not isinstance(term, int) or 'multiplex' not in term_obj:
+                    continue
+                hibernate_after = term_obj.get('hibernate_after')
+                if not hibernate_after:
+                    continue # Hibernation is disabled for this terminal
+                multiplex = term_obj['multiplex']
+                if multiplex.last_output > now - hibernate_after:
+                    continue
+                size = multiplex.term.hibernate()
+                if size is not None:
+                    logging.debug(
+                        "Hibernated terminal %s (session: %s): %s bytes" % (
+                        term, session, size))
+
 def policy_new_terminal(cls, policy):
     """
     Called by :func:`terminal_policies`, returns True if the user is
@@ -263,6 +297,115 @@ def terminal_policies(cls):
     return True # Default to permissive if we made it this far
 
 # NOTE:  THE BELOW IS A WORK IN PROGRESS
+def invalidate_plugins():
+    """
+    Forgets everything :func:`load_plugins` knows so the plugins directory will
+    be re-examined the next time a terminal connection is established.  Called
+    automatically when something in the plugins directory changes.
+    """
+    logging.debug("invalidate_plugins()")
+    PLUGINS.clear()
+
+def load_plugins(enabled_plugins=None):
+    """
+    Finds and imports the Terminal application's plugins (only those in
+    *enabled_plugins* if given) and sorts their hooks by type.  The work is
+    done once per process; subsequent calls return the cached result until
+    :func:`invalidate_plugins` is called.  Returns a dict like so::
+
+        {
+            'plugins': <the output of get_plugins()>,
+            'hooks': {<plugin name>: <plugin.hooks>},
+            'modules': [<imported plugin modules with an initialize()>],
+            'web': [<Tornado handlers>],
+            'ws_actions': [(<action>, <function>), ...],
+            'escape': [(<plugin name>, <function>), ...],
+            'events': [(<event>, <callback>), ...],
+            'command': [<function>, ...],
+            'multiplex': [<function>, ...],
+            'term_instance': [<function>, ...],
+            'environment': {<env var>: <value>}
+        }
+
+    .. note:: Python modules that were already imported won't be reloaded; only newly-added plugins will be picked up without a restart.
+    """
+    key = tuple(enabled_plugins or ())
+    if key in PLUGINS:
+        return PLUGINS[key]
+    plugins_dir = os.path.join(APPLICATION_PATH, 'plugins')
+    plugins = get_plugins(plugins_dir, enabled_plugins)
+    js_plugins = [a.split('/')[2] for a in plugins['js']]
+    plugin_list = list(set(plugins['py'] + js_plugins))
+    plugin_list.sort() # So there's consistent ordering
+    logging.info(_("Active Terminal Plugins: %s" % ", ".join(plugin_list)))
+    out = {
+        'plugins': plugins,
+        'hooks': {},
+        'modules': [],
+        'web': [],
+        'ws_actions': [],
+        'escape': [],
+        'events': [],
+        'command': [],
+        'multiplex': [],
+        'term_instance': [],
+        'environment': {}
+    }
+    def as_list(hook):
+        if isinstance(hook, (list, tuple)):
+            return list(hook)
+        return [hook]
+    for plugin in load_modules(plugins['py']):
+        if not hasattr(plugin, 'hooks'):
+            continue # No hooks--probably just a supporting .py file.
+        out['hooks'][plugin.__name__] = plugin.hooks
+        if hasattr(plugin, 'initialize'):
+            out['modules'].append(plugin)
+    # NOTE:  Most of these will soon be replaced with on() and off() events and maybe some functions related to initialization.
+    for plugin_name, hooks in out['hooks'].items():
+        out['web'].extend(hooks.get('Web', []))
+        out['ws_actions'].extend(hooks.get('WebSocket', {}).items())
+        if 'Escape' in hooks:
+            out['escape'].append((plugin_name, hooks['Escape']))
+        if 'Command' in hooks: # Called by new_multiplex
+            out['command'].extend(as_list(hooks['Command']))
+        if 'Multiplex' in hooks: # Called by new_multiplex
+            out['multiplex'].extend(as_list(hooks['Multiplex']))
+        if 'TermInstance' in hooks: # Called by new_terminal
+            out['term_instance'].extend(as_list(hooks['TermInstance']))
+        out['environment'].update(hooks.get('Environment', {}))
+        out['events'].extend(hooks.get('Events', {}).items())
+    PLUGINS[key] = out
+    # Pick up new or removed plugins without a restart:
+    get_file_watcher().watch(plugins_dir, invalidate_plugins)
+    return out
+
+def merge_termupdates(waiting, update):
+    """
+    Merges two 'terminal:termupdate' messages for the same terminal (the
+    *waiting* one hasn't been sent yet) into one.  Since lines that haven't
+    changed since the previous update are empty strings the lines that changed
+    in *waiting* but not in *update* are carried over.
+    """
+    old = waiting['terminal:termupdate']
+    new = update['terminal:termupdate']
+    if len(old['screen']) == len(new['screen']): # Not resized in between
+        new['screen'] = [b or a for a, b in zip(old['screen'], new['screen'])]
+    if not new['scrollback']:
+        new['scrollback'] = old['scrollback']
+    return update
+
+def media_processor(user, func, args, callback):
+    """
+    Runs ``func(*args)`` in the :class:`media.MediaPool` (on behalf of *user*)
+    and calls *callback* with the result.  Assigned (via `partial`) to the
+    `media_processor` attribute of each :class:`terminal.Terminal` so that
+    captured images and PDFs get processed without blocking the IOLoop.
+
+    .. note:: The pool is created on first use (after privileges have been dropped).
+    """
+    get_media_pool().submit(func, args, callback, user=user)
+
 class SharedTermHandler(BaseHandler):
     """
     Renders shared.html which allows an anonymous user to view a shared
@@ -356,82 +499,35 @@ class TerminalApplication(GOApplication):
         })
         if 'terminal' not in self.ws.persist:
             self.ws.persist['terminal'] = {}
-        # Initialize plugins (every time a connection is established so we can
-        # load new plugins with a simple page reload)
+        # Plugins are found and imported once per process (see load_plugins());
+        # all that's left to do per connection is bind their hooks to us.
         enabled_plugins = self.ws.prefs['*']['terminal'].get(
             'enabled_plugins', [])
-        self.plugins = get_plugins(
-            os.path.join(APPLICATION_PATH, 'plugins'), enabled_plugins)
-        js_plugins = [a.split('/')[2] for a in self.plugins['js']]
-        css_plugins = []
-        for i in css_plugins:
-            if '?' in i: # CSS Template
-                css_plugins.append(i.split('plugin=')[1].split('&')[0])
-            else: # Static CSS file
-                css_plugins.append(i.split('/')[1])
-        plugin_list = list(set(self.plugins['py'] + js_plugins + css_plugins))
-        plugin_list.sort() # So there's consistent ordering
-        logging.info(_("Active Terminal Plugins: %s" % ", ".join(plugin_list)))
-        # Attach plugin hooks
-        self.plugin_hooks = {}
-        # TODO: Keep track of plugins and hooks to determine when they've
-        #       changed so we can tell clients to pull updates and whatnot
-        imported = load_modules(self.plugins['py'])
-        for plugin in imported:
-            try:
-                self.plugin_hooks.update({plugin.__name__: plugin.hooks})
-                if hasattr(plugin, 'initialize'):
-                    plugin.initialize(self)
-            except AttributeError:
-                pass # No hooks--probably just a supporting .py file.
-        # Hook up the hooks
-        # NOTE:  Most of these will soon be replaced with on() and off() events and maybe some functions related to initialization.
+        loaded = load_plugins(enabled_plugins)
+        self.plugins = loaded['plugins']
+        self.plugin_hooks = loaded['hooks']
+        for plugin in loaded['modules']:
+            plugin.initialize(self)
+        for handler in loaded['web']:
+            if handler in REGISTERED_HANDLERS:
+                continue # Already registered this one
+            REGISTERED_HANDLERS.append(handler)
+            self.add_handler(handler[0], handler[1])
+        # Apply the plugins' WebSocket actions
+        self.ws.actions.update(
+            (ws_command, bind(func, self))
+            for ws_command, func in loaded['ws_actions'])
+        for plugin_name, func in loaded['escape']:
+            self.on("terminal:opt_esc_handler:%s" % plugin_name, func)
+        for event, callback in loaded['events']:
+            self.on(event, callback)
+        # These are shared by all connections so don't modify them in-place:
         self.plugin_esc_handlers = {}
         self.plugin_auth_hooks = []
-        self.plugin_command_hooks = []
-        self.plugin_new_multiplex_hooks = []
-        self.plugin_new_term_hooks = {}
-        self.plugin_env_hooks = {}
-        for plugin_name, hooks in self.plugin_hooks.items():
-            if 'Web' in hooks:
-                for handler in hooks['Web']:
-                    if handler in REGISTERED_HANDLERS:
-                        continue # Already registered this one
-                    else:
-                        REGISTERED_HANDLERS.append(handler)
-                        self.add_handler(handler[0], handler[1])
-            if 'WebSocket' in hooks:
-                # Apply the plugin's WebSocket actions
-                for ws_command, func in hooks['WebSocket'].items():
-                    self.ws.actions.update({ws_command: bind(func, self)})
-            if 'Escape' in hooks:
-                # Apply the plugin's Escape handler
-                self.on(
-                    "terminal:opt_esc_handler:%s" %
-                    plugin_name, hooks['Escape'])
-            if 'Command' in hooks:
-                # Apply the plugin's 'Command' hooks (called by new_multiplex)
-                if isinstance(hooks['Command'], (list, tuple)):
-                    self.plugin_command_hooks.extend(hooks['Command'])
-                else:
-                    self.plugin_command_hooks.append(hooks['Command'])
-            if 'Multiplex' in hooks:
-                # Apply the plugin's Multiplex hooks (called by new_multiplex)
-                if isinstance(hooks['Multiplex'], (list, tuple)):
-                    self.plugin_new_multiplex_hooks.extend(hooks['Multiplex'])
-                else:
-                    self.plugin_new_multiplex_hooks.append(hooks['Multiplex'])
-            if 'TermInstance' in hooks:
-                # Apply the plugin's TermInstance hooks (called by new_terminal)
-                if isinstance(hooks['TermInstance'], (list, tuple)):
-                    self.plugin_new_term_hooks.extend(hooks['TermInstance'])
-                else:
-                    self.plugin_new_term_hooks.append(hooks['TermInstance'])
-            if 'Environment' in hooks:
-                self.plugin_env_hooks.update(hooks['Environment'])
-            if 'Events' in hooks:
-                for event, callback in hooks['Events'].items():
-                    self.on(event, callback)
+        self.plugin_command_hooks = loaded['command']
+        self.plugin_new_multiplex_hooks = loaded['multiplex']
+        self.plugin_new_term_hooks = loaded['term_instance']
+        self.plugin_env_hooks = loaded['environment']
 
     def open(self):
         """
@@ -464,19 +560,12 @@ class TerminalApplication(GOApplication):
         terminal_css = os.path.join(
             APPLICATION_PATH, 'templates', 'terminal.css')
         self.ws.render_and_send_css(terminal_css)
-        # Send the client our JavaScript files
+        # Send the client our JavaScript files (as a single bundle)
         static_dir = os.path.join(APPLICATION_PATH, 'static')
-        js_files = os.listdir(static_dir)
-        js_files.sort()
-        for fname in js_files:
-            if fname.endswith('.js'):
-                js_file_path = os.path.join(static_dir, fname)
-                if fname == 'terminal.js':
-                    self.ws.send_js(js_file_path)
-                else:
-                    self.ws.send_js(js_file_path, requires='terminal.js')
+        js_files = static_files(static_dir, 'js', first='terminal.js')
+        terminal_bundle = self.ws.send_bundle('terminal', 'js', js_files)
         self.ws.send_plugin_static_files(
-            os.path.join(APPLICATION_PATH, 'plugins'), requires="terminal.js")
+            os.path.join(APPLICATION_PATH, 'plugins'), requires=terminal_bundle)
         # Send the client the 256-color style information
         self.send_256_colors()
         sess = SESSIONS[self.ws.session]
@@ -487,6 +576,12 @@ class TerminalApplication(GOApplication):
         if "timeout_callbacks" in sess:
             if kill_session not in sess["timeout_callbacks"]:
                 sess["timeout_callbacks"].append(kill_session)
+        # Start hibernating idle terminals (if that isn't happening already)
+        global HIBERNATOR
+        if not HIBERNATOR:
+            HIBERNATOR = tornado.ioloop.PeriodicCallback(
+                hibernate_idle_terminals, 60*1000) # Check once a minute
+            HIBERNATOR.start()
         self.terminals() # Tell the client about open terminals
         # NOTE: The user will often be authenticated before terminal.js is
         # loaded.  This means that self.terminals() will be ignored in most
@@ -751,6 +846,10 @@ class TerminalApplication(GOApplication):
             # Start up a new terminal
             term_obj['created'] = datetime.now()
             # NOTE: Not doing anything with 'created'...  yet!
+            # The owner's settings decide when the terminal gets hibernated
+            # (see hibernate_idle_terminals())
+            term_obj['hibernate_after'] = convert_to_timedelta(
+                self.policy.get('hibernate_after', '10m'))
             now = int(round(time.time() * 1000))
             try:
                 user = self.current_user['upn']
@@ -796,14 +895,28 @@ class TerminalApplication(GOApplication):
                 # This allows plugins to add/override environment variables
                 env.update(self.plugin_env_hooks)
             m.spawn(rows, cols, env=env, em_dimensions=self.em_dimensions)
+            if self.ws.registry: # Let the other nodes know this term is ours
+                self.ws.registry.claim_terminal(
+                    self.ws.session, self.ws.location, term)
             # Give the terminal emulator a path to store temporary files
             m.term.temppath = os.path.join(session_dir, 'downloads')
             if not os.path.exists(m.term.temppath):
                 os.mkdir(m.term.temppath)
-            # Tell it how to serve them up
-            m.term.linkpath = "%sdownloads" % self.settings['url_prefix']
+            # Tell it how to serve them up.  Use an absolute URL so it works
+            # when Gate One is embedded in another site.
+            m.term.linkpath = "%s://%s%sdownloads" % (
+                self.ws.request.protocol, self.ws.request.host,
+                self.settings['url_prefix'])
+            if not self.ws.http_downloads_available():
+                # DownloadHandler needs the gateone_user cookie (e.g. the client
+                # used API authentication).  A linkpath that isn't a URL makes
+                # captured images get inlined as data URIs instead.
+                m.term.linkpath = m.term.temppath
             # Make sure it can generate pretty icons for file downloads
             m.term.icondir = os.path.join(GATEONE_DIR, 'static', 'icons')
+            # Decode images and generate thumbnails without blocking the IOLoop
+            m.term.media_processor = partial(
+                media_processor, self.current_user['upn'])
             if resumed_dtach:
                 # Send an extra Ctrl-L to refresh the screen and fix the sizing
                 # after it has been reattached.
@@ -938,6 +1051,10 @@ class TerminalApplication(GOApplication):
             #self.add_terminal_callbacks(term, multiplex, callback_id)
         # Remove old location:
         del self.loc_terms[existing_term]
+        if self.ws.registry:
+            self.ws.registry.release_terminal(
+                self.ws.session, self.ws.location, existing_term)
+            self.ws.registry.claim_terminal(self.ws.session, new_location, term)
         details = {
             'term': term,
             'location': new_location
@@ -971,6 +1088,9 @@ class TerminalApplication(GOApplication):
                     # Because now I don't have to worry about it!
         finally:
             del self.loc_terms[term]
+            if self.ws.registry:
+                self.ws.registry.release_terminal(
+                    self.ws.session, self.ws.location, term)
         self.trigger("terminal:kill_terminal", term)
 
     @require(authenticated())
@@ -1146,14 +1266,12 @@ class TerminalApplication(GOApplication):
                     'ratelimiter': multiplex.ratelimiter_engaged
                 }
             }
-            try:
-                self.write_message(json_encode(output_dict))
-            except IOError: # Socket was just closed, no biggie
-                logging.info(
-                    _("WebSocket closed (%s)") % self.current_user['upn'])
-                multiplex = term_obj['multiplex']
-                multiplex.remove_callback( # Stop trying to write
-                    multiplex.CALLBACK_UPDATE, self.callback_id)
+            # Updates for the same terminal that pile up before the WebSocket
+            # gets flushed are merged into one (a full refresh supersedes
+            # whatever was waiting).
+            self.ws.queue_message(output_dict,
+                key=('terminal:termupdate', term),
+                merge=None if full else merge_termupdates)
 
     @require(authenticated())
     def refresh_screen(self, term, full=False):
@@ -1425,31 +1543,15 @@ class TerminalApplication(GOApplication):
             prefix=prefix,
             url_prefix=go_url
         )
-        out_dict = {'files': []}
         colors_filename = "%s.css" % colors
         colors_path = os.path.join(term_colors_path, colors_filename)
-        rendered_path = self.ws.render_style(colors_path, **template_args)
-        filename = "term_colors.css" # Make sure it's the same every time
-        mtime = os.stat(rendered_path).st_mtime
-        kind = 'css'
+        style = self.ws.render_style(colors_path, **template_args)
         #print_css_path = os.path.join(printing_path, "default.css")
         #rendered_path = self.render_style(print_css_path, **template_args)
         # TODO: Do something about the print stylesheet (needs to go in terminal)
-        out_dict['files'].append({
-            'filename': filename,
-            'mtime': mtime,
-            'kind': kind,
-            'element_id': 'text_colors' # To ensure the filename isn't used
-        })
-        self.ws.file_cache[filename] = {
-            'filename': filename,
-            'kind': kind,
-            'path': rendered_path,
-            'mtime': mtime,
-            'element_id': 'text_colors'
-        }
-        message = {'go:file_sync': out_dict}
-        self.write_message(message)
+        # Make sure the filename is the same every time:
+        self.ws.sync_bundle(
+            style, filename="term_colors.css", element_id='text_colors')
 
 # Terminal sharing TODO (not in any particular order or priority):
 #   * GUI elements that allow a user to share a terminal:
@@ -1576,6 +1678,9 @@ class TerminalApplication(GOApplication):
         out_dict['share_id'] = share_id
         shared_terms[share_id] = share_dict
         term_obj['share_id'] = share_id # So we can quickly tell it's shared
+        if self.ws.registry:
+            self.ws.registry.add_share(
+                share_id, self.ws.session, self.ws.location, term)
         # Make a note of this shared terminal in the logs
         logging.info(_(
             "%s shared terminal %s (%s)" % (
@@ -1604,6 +1709,8 @@ class TerminalApplication(GOApplication):
         for share_id, share_dict in shared_terms.items():
             if share_dict['term_obj'] == term_obj:
                 del shared_terms[share_id]
+                if self.ws.registry:
+                    self.ws.registry.remove_share(share_id)
                 break
         del term_obj['share_id']
         self.trigger("terminal:unshare_terminal", term)
@@ -1730,6 +1837,15 @@ class TerminalApplication(GOApplication):
                 share_obj = share_dict
                 break # This is the share_dict we want
         if not share_obj:
+            owner = None
+            if self.ws.registry:
+                owner = self.ws.registry.share_owner(settings['share_id'])
+            if owner and not self.ws.registry.is_local(owner):
+                # Shared terminals can only be viewed from the node running them
+                self.ws.send_message(_(
+                    "Requested shared terminal is hosted on %s." %
+                    owner['node_id']))
+                return
             self.ws.send_message(_("Requested shared terminal does not exist."))
             return
         if share_obj['password'] and password != share_obj['password']:
@@ -1788,51 +1904,54 @@ class TerminalApplication(GOApplication):
             self.ws.send_message(message, upn=term_obj['user']['upn'])
         self.trigger("terminal:attach_shared_terminal", term)
 
-    def render_256_colors(self):
+    def _256_colors_css(self, colors_json_path, container=None):
         """
-        Renders the CSS for 256 color support and saves the result as
-        '256_colors.css' in Gate One's configured `cache_dir`.  If that file
-        already exists and has not been modified since the last time it was
-        generated rendering will be skipped.
-
-        Returns the path to that file as a string.
+        Generates the CSS for 256 color support using the color map in
+        *colors_json_path* for the given *container*.
         """
-        # NOTE:  Why generate this every time?  Presumably these colors can be
-        #        changed on-the-fly by terminal programs.  That functionality
-        #        has yet to be implemented but this function will enable use to
-        #        eventually do that.
         # Use the get_settings() function to import our 256 colors (convenient)
-        cache_dir = self.ws.prefs['*']['gateone']['cache_dir']
-        cached_256_colors = os.path.join(cache_dir, '256_colors.css')
-        if os.path.exists(cached_256_colors):
-            return cached_256_colors
-        colors_json_path = os.path.join(APPLICATION_PATH, '256colors.json')
         color_map = get_settings(colors_json_path, add_default=False)
         # Setup our 256-color support CSS:
-        colors_256 = ""
+        colors_256 = []
         for i in xrange(256):
             i = str(i)
             fg = "#%s span.fx%s {color: #%s;}" % (
-                self.ws.container, i, color_map[i])
+                container, i, color_map[i])
             bg = "#%s span.bx%s {background-color: #%s;} " % (
-                self.ws.container, i, color_map[i])
+                container, i, color_map[i])
             fg_rev =(
                 "#%s span.reverse.fx%s {background-color: #%s; color: "
-                "inherit;}" % (self.ws.container, i, color_map[i]))
+                "inherit;}" % (container, i, color_map[i]))
             bg_rev =(
                 "#%s span.reverse.bx%s {color: #%s; background-color: "
-                "inherit;} " % (self.ws.container, i, color_map[i]))
-            colors_256 += "%s %s %s %s\n" % (fg, bg, fg_rev, bg_rev)
-        with open(cached_256_colors, 'w') as f:
-            f.write(colors_256)
-        # send_css() will take care of minifiying and caching further
-        return cached_256_colors
+                "inherit;} " % (container, i, color_map[i]))
+            colors_256.append("%s %s %s %s\n" % (fg, bg, fg_rev, bg_rev))
+        return "".join(colors_256)
+
+    def render_256_colors(self):
+        """
+        Renders the CSS for 256 color support and returns it as an
+        :class:`assets.Bundle` (the CSS itself is in its `data` attribute).
+        The result is cached in memory and only regenerated if
+        '256colors.json' is modified or a different container is used.
+        """
+        # NOTE:  Why generate this at all?  Presumably these colors can be
+        #        changed on-the-fly by terminal programs.  That functionality
+        #        has yet to be implemented but this function will enable use to
+        #        eventually do that.
+        colors_json_path = os.path.join(APPLICATION_PATH, '256colors.json')
+        return render_style(
+            '256_colors', colors_json_path, self._256_colors_css,
+            minify=not self.ws.settings['debug'], container=self.ws.container)
 
     def send_256_colors(self):
         """
         Sends the client the CSS to handle 256 color support.
         """
-        self.ws.send_css(self.render_256_colors())
+        send_css = self.ws.prefs['*']['gateone'].get('send_css', True)
+        if not send_css:
+            return
+        self.ws.sync_bundle(self.render_256_colors())
 
     @require(authenticated())
     def debug_terminal(self, term):
@@ -1924,6 +2043,7 @@ def init(settings):
             r"-a '-oUserKnownHostsFile=\"%USERDIR%/%USER%/.ssh/known_hosts\"'")
         settings['*']['terminal'].update({
             'dtach': True,
+            'hibernate_after': "10m",
             'session_logging': True,
             'session_logs_max_age': "30d",
             'syslog_session_logging': False,
@@ -1961,6 +2081,24 @@ def init(settings):
                 "'/ssh/known_hosts'.  Applying a termporary fix..."))
             term_settings['commands'][name] = command.replace('/ssh/', '/.ssh/')
 
+def build_assets(settings):
+    """
+    Called by Gate One at startup; builds (and minifies) the Terminal
+    application's JavaScript bundles so the first client to connect doesn't have
+    to wait for it.
+    """
+    cache_dir = get_cache_dir(settings)
+    minify = not settings['*']['gateone'].get('debug', False)
+    js_files = static_files(
+        os.path.join(APPLICATION_PATH, 'static'), 'js', first='terminal.js')
+    get_bundle('terminal', 'js', js_files, cache_dir, minify=minify)
+    plugins_dir = os.path.join(APPLICATION_PATH, 'plugins')
+    for kind in ('js', 'css'):
+        paths = plugin_static_files(plugins_dir, kind)
+        if paths:
+            get_bundle(plugins_bundle_name(plugins_dir), kind, paths,
+                cache_dir, minify=minify)
+
 # Tell Gate One which classes are applications
 apps = [TerminalApplication]
 # Tell Gate One about our static file handler
@@ -14,13 +14,13 @@ This Python plugin file implements the following hooks::
         'Web': [
             (r"/bookmarks/fetchicon", FaviconHandler),
             (r"/bookmarks/export", ExportHandler),
-            (r"/bookmarks/import", ImportHandler),
         ],
         'WebSocket': {
             'bookmarks_sync': save_bookmarks,
             'bookmarks_get': get_bookmarks,
             'bookmarks_deleted': delete_bookmarks,
             'bookmarks_rename_tags': rename_tags,
+            'bookmarks_import': import_bookmarks,
         }
     }
 
@@ -35,12 +35,17 @@ __version_info__ = (1, 0)
 __author__ = 'Dan McDougall <daniel.mcdougall@liftoffsoftware.com>'
 
 # Python stdlib
-import os, sys, logging, time
+import os, re, sys, json, logging, time, bisect, hashlib, tempfile, codecs
 from functools import partial
+from collections import OrderedDict, deque
+from datetime import timedelta
+from HTMLParser import HTMLParser, HTMLParseError
+from htmlentitydefs import name2codepoint
+from urlparse import urlparse, urljoin
 
 # Our stuff
 from gateone import BaseHandler
-from utils import noop, json_encode
+from utils import json_encode
 
 # Tornado stuff
 import tornado.web
@@ -52,6 +57,26 @@ PLUGIN_PATH = os.path.split(__file__)[0]
 sys.path.append(os.path.join(PLUGIN_PATH, "dependencies"))
 
 # Globals
+DELETED_URL = "web+deleted:bookmarks/" # The special "deleted bookmarks" URL
+BOOKMARK_DBS = {} # Format: {<bookmarks.json path>: <BookmarksDB instance>}
+# The journal gets folded into bookmarks.json once it has more entries than
+# there are bookmarks (or this many, whichever is greater):
+JOURNAL_MIN_ENTRIES = 100
+FAVICON_CACHE = None # Gets set by get_favicon_cache()
+# Valid favicon mime types
+FAVICON_MIMETYPES = [
+    'image/vnd.microsoft.icon',
+    'image/x-icon',
+    'image/png',
+    'image/svg+xml',
+    'image/gif',
+    'image/jpeg'
+]
+MAX_FAVICON_SIZE = 256*1024 # Icons bigger than this are ignored
+IMPORT_CHUNK_SIZE = 64*1024 # How much of an import gets parsed at a time
+IMPORT_BATCH_SIZE = 500 # Bookmarks saved per IOLoop iteration when importing
+JSON_DECODER = json.JSONDecoder()
+JSON_WHITESPACE = re.compile(r'[ \t\n\r]*')
 boolean_fix = {
     True: True,
     False: False,
@@ -62,212 +87,333 @@ boolean_fix = {
 }
 
 # Helper functions
-def unescape(s):
+def normalize_timestamp(timestamp):
     """
-    Unescape HTML code refs; c.f. http://wiki.python.org/moin/EscapingHtml
+    Returns *timestamp* as a JavaScript-style 13-digit epoch (milliseconds).
+    Browsers use all sorts of precisions (Chrome uses seconds, Delicious goes
+    out to microseconds).  If *timestamp* is empty the current time will be
+    used.
     """
-    import re
-    from htmlentitydefs import name2codepoint
-    # Fix the missing one:
-    name2codepoint['#39'] = 39
-    return re.sub('&(%s);' % '|'.join(name2codepoint), lambda m: unichr(name2codepoint[m.group(1)]), s)
+    if not timestamp:
+        return int(round(time.time() * 1000))
+    timestamp = int(timestamp)
+    if timestamp > 9999999999999: # Delicious goes out to 16
+        timestamp = int(timestamp/1000)
+    elif timestamp < 10000000000: # Chrome only goes to 10 digits
+        timestamp = int(timestamp*1000)
+    return timestamp
+
+def new_bookmark(url, name, tags, notes="", date=None, icon=None):
+    """
+    Returns a bookmark (dict) for an imported *url* that hasn't been assigned
+    an updateSequenceNum yet.
+    """
+    date = normalize_timestamp(date)
+    return {
+        'url': url,
+        'name': name.strip(),
+        'tags': [a for a in tags if a], # Remove empty tags
+        'notes': notes,
+        'visits': 0,
+        'updated': date,
+        'created': date,
+        'updateSequenceNum': 0,
+        'images': {'favicon': icon}
+    }
+
+class NetscapeBookmarkParser(HTMLParser):
+    """
+    An incremental parser for Netscape-style bookmarks.html files (which is
+    what every browser exports).  Feed it the file a piece at a time via
+    :meth:`feed` and completed bookmarks will be appended to
+    :attr:`bookmarks` as they're found (so they can be taken away as you go).
+
+    Folder names (<H3>) become tags for the bookmarks inside them.
+    """
+    def __init__(self):
+        HTMLParser.__init__(self)
+        self.bookmarks = []
+        self.folders = [] # The names of the folders (<DL>s) we're inside of
+        self.folder_name = None # Name of the folder whose <DL> comes next
+        self.text = None # The text we're collecting (if any)
+        self.collecting = None # What the text is for: 'a', 'h3', or 'dd'
+        self.current = None # The last <A> (waiting for a possible <DD>)
+
+    def _flush_text(self):
+        """
+        Puts the text we've been collecting wherever it belongs.
+        """
+        if self.collecting == 'a':
+            self.current['name'] = ''.join(self.text).strip()
+        elif self.collecting == 'h3':
+            self.folder_name = ''.join(self.text).strip()
+        elif self.collecting == 'dd' and self.current:
+            self.current['notes'] = ''.join(self.text).strip()
+        self.text = None
+        self.collecting = None
+
+    def _finish_bookmark(self):
+        """
+        Adds the current bookmark (if any) to :attr:`bookmarks`.
+        """
+        self._flush_text()
+        if self.current:
+            if self.current['url']:
+                self.bookmarks.append(self.current)
+            self.current = None
+
+    def handle_starttag(self, tag, attrs):
+        if tag not in ('dt', 'dd', 'dl', 'h3', 'a'):
+            return # Formatting and such
+        if tag == 'dd' and self.current:
+            self._flush_text()
+            self.text, self.collecting = [], 'dd'
+            return
+        self._finish_bookmark()
+        if tag == 'dl':
+            self.folders.append(self.folder_name)
+            self.folder_name = None
+        elif tag == 'h3':
+            self.text, self.collecting = [], 'h3'
+        elif tag == 'a':
+            attrs = dict(attrs)
+            tags = [a for a in self.folders if a]
+            if attrs.get('tags'): # Delicious-style
+                tags = attrs['tags'].split(',')
+            self.current = new_bookmark(
+                attrs.get('href'), u'', tags,
+                date=attrs.get('add_date'), icon=attrs.get('icon'))
+            self.text, self.collecting = [], 'a'
+
+    def handle_endtag(self, tag):
+        if tag == 'dl':
+            self._finish_bookmark()
+            if self.folders:
+                self.folders.pop()
+        elif tag in ('a', 'h3'):
+            self._flush_text()
+
+    def handle_data(self, data):
+        if self.text is not None:
+            self.text.append(data)
+
+    def handle_entityref(self, name):
+        if name in name2codepoint:
+            self.handle_data(unichr(name2codepoint[name]))
+        else:
+            self.handle_data(u'&%s;' % name)
+
+    def handle_charref(self, name):
+        try:
+            if name.lower().startswith('x'):
+                self.handle_data(unichr(int(name[1:], 16)))
+            else:
+                self.handle_data(unichr(int(name)))
+        except ValueError:
+            self.handle_data(u'&#%s;' % name)
+
+    def close(self):
+        HTMLParser.close(self)
+        self._finish_bookmark()
+
+def iter_bookmarks_html(html, chunk_size=IMPORT_CHUNK_SIZE):
+    """
+    Parses the Netscape-style bookmarks.html in *html* (string) *chunk_size*
+    bytes at a time and yields each bookmark as it is found like so::
+
+        (<bookmark>, <bytes of *html* parsed so far>)
+    """
+    parser = NetscapeBookmarkParser()
+    decoder = codecs.getincrementaldecoder('utf-8')('replace')
+    for offset in range(0, len(html), chunk_size):
+        chunk = html[offset:offset+chunk_size]
+        if not isinstance(chunk, unicode):
+            chunk = decoder.decode(chunk)
+        try:
+            parser.feed(chunk)
+        except HTMLParseError as e:
+            logging.error("Error parsing bookmarks HTML: %s" % e)
+            break
+        bookmarks, parser.bookmarks = parser.bookmarks, []
+        for bm in bookmarks:
+            yield (bm, min(offset + chunk_size, len(html)))
+    try:
+        parser.close()
+    except HTMLParseError:
+        pass
+    for bm in parser.bookmarks:
+        yield (bm, len(html))
 
 def parse_bookmarks_html(html):
     """
     Reads the Netscape-style bookmarks.html in string, *html* and returns a
     list of Bookmark objects.
     """
-    # If this looks impossibly complicated it's because parsing HTML streams is
-    # dark voodoo.  I had to push my brains back behind my eyes and into my ears
-    # a few times while writing this.
-    import html5lib
-    out_list = []
-    p = html5lib.HTMLParser(tree=html5lib.treebuilders.getTreeBuilder("dom"))
-    dom_tree = p.parse(html)
-    walker = html5lib.treewalkers.getTreeWalker("dom")
-    stream = walker(dom_tree)
-    level = 0
-    tags = []
-    h3on = False
-    aon = False
-    ddon = False
-    add_date = None
-    url = None
-    icon = None
-    name = ""
-    notes = ""
-    for token in stream:
-        if 'name' in token:
-            if token['name'] == 'dl':
-                if token['type'] == 'StartTag':
-                    level += 1
-                elif token['type'] == 'EndTag':
-                    if tags:
-                        tags.pop()
-                    level -= 1
-            if token['name'] == 'dd':
-                if token['type'] == 'StartTag':
-                    ddon = True
-                elif token['type'] == 'EndTag':
-                    ddon = False
-            if token['name'] == 'h3':
-                if token['type'] == 'StartTag':
-                    h3on = True
-                elif token['type'] == 'EndTag':
-                    h3on = False
-            if token['name'] == 'a':
-                if token['type'] == 'StartTag':
-                    aon = True
-                elif token['type'] == 'EndTag':
-                    aon = False
-                    if not add_date: # JavaScript-style 13-digit epoch:
-                        add_date = int(round(time.time() * 1000))
-                    add_date = int(add_date)
-                    if add_date > 9999999999999: # Delicious goes out to 16
-                        add_date = int(add_date/1000)
-                    if add_date < 10000000000: # Chrome only goes to 10 digits
-                        add_date = int(add_date*1000)
-                    bm = {
-                        'url': url,
-                        'name': name.strip(),
-                        'tags': [a for a in tags if a], # Remove empty tags
-                        'notes': "", # notes
-                        'visits': 0, # visits
-                        'updated': add_date, # updated
-                        'created': add_date, # created
-                        'updateSequenceNum': 0, # updateSequenceNum
-                        'images': {'favicon': icon}
-                    }
-                    out_list.append(bm)
-                    # Reset everything (just in case)
-                    add_date = None
-                    url = None
-                    icon = None
-                    name = ""
-        if h3on:
-            if token['data']:
-                if type(token['data']) == str:
-                    tags.append(token['data'])
-                elif type(token['data']) == unicode:
-                    tags.append(token['data'])
-        if ddon: # Indicates that there's notes here
-            if token['data']:
-                if token['type'] == 'Characters':
-                    # Notes get attached to the bookmark we just created
-                    out_list[-1]['notes'] = unescape(token['data'].strip())
-        if aon:
-            if token['type'] == 'StartTag':
-                # html5lib changed from using lists to using dicts at some point
-                # after 0.90.  Hence the two conditionals below
-                if isinstance(token['data'], list):
-                    for tup in token['data']:
-                        if tup[0] == 'add_date':
-                            add_date = tup[1]
-                        elif tup[0] == 'href':
-                            url = tup[1]
-                        elif tup[0] == 'icon':
-                            icon = tup[1]
-                        elif tup[0] == 'tags':
-                            tags = tup[1].split(',') # Delicious-style
-                elif isinstance(token['data'], dict):
-                    for tup in token['data']:
-                        if 'add_date' in tup:
-                            add_date = token['data'][tup]
-                        elif 'href' in tup:
-                            url = token['data'][tup]
-                        elif 'icon' in tup:
-                            icon = token['data'][tup]
-                        elif 'tags' in tup:
-                            tags = token['data'][tup].split(',') # Delicious
-            elif token['type'] == 'Characters':
-                name += unescape(token['data'])
-    return out_list
-
-def get_json_tags(json_dict, url):
-    """
-    Recursively looks inside *json_dict* trying to find tags associated with the
-    given *url*.  Returns the tags found as a list.
-    """
-    tags = []
-    # This function has been brought to you by your favorite stock symbol
-    if json_dict.has_key('root') and json_dict.has_key('children'):
-        for item in json_dict['children']:
-            if item['title'] == 'Tags':
-                for child in item['children']:
-                    if child['type'] == 'text/x-moz-place-container':
-                        for subchild in child['children']:
-                            if subchild['type'] == 'text/x-moz-place':
-                                if subchild['uri'] == url:
-                                    tags.append(child['title'])
-                                        # "Ahhhhhhh"
-                                            # "hhhhhhhh"
-                                                # "hhhhhhh"
-                                                    # "hhhhhh"
-                                                        # "hhhhh"
-                                                            # "!!!"
-                                                                # <splat>
-    return tags
-
-def get_ns_json_bookmarks(json_dict, bookmarks):
-    """
-    Given a *json_dict*, updates *urls_list* with each URL as it is found
-    within.
-
-    .. note:: Only works with Netscape-style bookmarks.json files.
-    """
-    children = []
-    if json_dict.has_key('children'):
-        for child in json_dict['children']:
-            if child['type'] == 'text/x-moz-place':
-                if not bookmarks[0].has_key(child['uri']):
-                    # Browser won't let you load file: URIs from HTTP pages
-                    if child['uri'][0:6] not in ['place:', 'file:/']:
-                        # Note the use of json_dict as bookmarks[1] here:
-                        tags = get_json_tags(bookmarks[1], child['uri'])
-                        if not tags:
-                            tags = ['Untagged']
-                        if child.has_key("annos"):
-                            notes = child["annos"]
-                        else:
-                            notes = ""
-                        if child['lastModified'] > 9999999999999:
-                            # Chop off the microseconds to make it 13 digits
-                            child['lastModified'] = int(child['lastModified']/1000)
-                        elif child['lastModified'] < 10000000000:
-                            child['lastModified'] = int(child['lastModified']*1000)
-                        if child['dateAdded'] > 9999999999999: # Delicious
-                            # Chop off the microseconds to make it 13 digits
-                            child['dateAdded'] = int(child['dateAdded']/1000)
-                        elif child['dateAdded'] < 10000000000: # Chrome
-                            child['dateAdded'] = int(child['dateAdded']*1000)
-                        bm = {
-                            'url': child['uri'],
-                            'name': child['title'].strip(),
-                            'tags': tags,
-                            'notes': notes,
-                            'visits': 0, # visits
-                            'updated': child['lastModified'], # updated
-                            'created': child['dateAdded'], # created
-                            'updateSequenceNum': 0, # updateSequenceNum
-                            'images': {} # No icons in JSON :(
-                        }
-                        bookmarks[0].update({child['uri']: bm})
-            elif child['type'] == 'text/x-moz-place-container':
-                get_ns_json_bookmarks(child, bookmarks)
+    return [bm for bm, offset in iter_bookmarks_html(html)]
+
+def iter_json_objects(json_str):
+    """
+    Walks the bookmarks.json in *json_str* without decoding all of it at once
+    and yields each object in it (innermost first) like so::
+
+        (<titles of the folders it's in>, <object>, <offset of its end>)
+
+    Only the 'children' arrays are walked piece by piece; every other value is
+    decoded as-is (with :meth:`json.JSONDecoder.raw_decode`).  Yielded objects
+    won't have a 'children' key since their children will have already been
+    yielded.
+
+    .. note:: Folder titles are only known if they come before 'children' (which is how Firefox writes them).
+    """
+    decode = JSON_DECODER.raw_decode
+    skip = JSON_WHITESPACE.match
+    pos = skip(json_str).end()
+    if json_str[pos:pos+1] != '{':
+        raise ValueError("Not a JSON object")
+    # Each item is either an object being decoded (a dict) or a 'children'
+    # array being walked (a list of folder titles):
+    stack = [{}]
+    pos += 1
+    while stack:
+        pos = skip(json_str, pos).end()
+        char = json_str[pos:pos+1]
+        if not char:
+            raise ValueError("Unexpected end of JSON data")
+        if char == ',':
+            pos += 1
+        elif isinstance(stack[-1], dict):
+            if char == '}':
+                obj = stack.pop()
+                pos += 1
+                yield (stack[-1] if stack else [], obj, pos)
+                continue
+            key, pos = decode(json_str, pos)
+            pos = skip(json_str, pos).end()
+            if json_str[pos:pos+1] != ':':
+                raise ValueError("Expected ':' at offset %s" % pos)
+            pos = skip(json_str, pos + 1).end()
+            if key == 'children' and json_str[pos:pos+1] == '[':
+                titles = stack[-2] if len(stack) > 1 else []
+                stack.append(titles + [stack[-1].get('title')])
+                pos += 1
+            else:
+                stack[-1][key], pos = decode(json_str, pos)
+        elif char == ']':
+            stack.pop()
+            pos += 1
+        elif char == '{':
+            stack.append({})
+            pos += 1
+        else: # Not an object; not interested
+            pos = decode(json_str, pos)[1]
+
+def iter_bookmarks_json(json_str):
+    """
+    Yields the bookmarks in the Netscape-style (Firefox) bookmarks.json in
+    *json_str* like so::
+
+        (<bookmark>, <bytes of *json_str* parsed so far>)
+
+    Bookmarks in the special "Tags" folder are used to tag the others.  The
+    JSON is walked incrementally (see :func:`iter_json_objects`) so only one
+    bookmark is decoded at a time but it gets walked twice:  Once to find the
+    "Tags" folder (which comes after the other folders) and once more to yield
+    the bookmarks.
+    """
+    # TODO: Get this recognizing and parsing our own JSON format.
+    # Figure out everyone's tags first
+    url_tags = {} # Format: {<url>: [<tag>, <tag>, ...]}
+    for titles, item, offset in iter_json_objects(json_str):
+        if len(titles) == 1 and item.get('title') == 'Tags':
+            break # That's all the tags
+        if (len(titles) == 3 and titles[1] == 'Tags'
+                and item.get('type') == 'text/x-moz-place'):
+            url_tags.setdefault(item.get('uri'), []).append(titles[2])
+    seen = set()
+    for titles, place, offset in iter_json_objects(json_str):
+        if place.get('type') != 'text/x-moz-place':
+            continue
+        url = place.get('uri')
+        # Browser won't let you load file: URIs from HTTP pages
+        if not url or url in seen or url[0:6] in ['place:', 'file:/']:
+            continue
+        seen.add(url)
+        notes = ""
+        for anno in place.get('annos', []):
+            if anno.get('name') == 'bookmarkProperties/description':
+                notes = anno.get('value', "")
+        bm = new_bookmark(
+            url, place.get('title') or u'',
+            url_tags.get(url, ['Untagged']), notes=notes,
+            date=place.get('dateAdded'))
+        bm['updated'] = normalize_timestamp(place.get('lastModified'))
+        bm['images'] = {} # No icons in JSON :(
+        yield (bm, offset)
 
 def parse_bookmarks_json(json_str):
     """
     Given *json_str*, returns a list of bookmark objects representing the data
     contained therein.
     """
-    # TODO: Get this recognizing and parsing our own JSON format.
-    json_obj = json.loads(json_str)
-    out_list = []
-    bookmarks = [{}, json_obj] # Inside a list for persistence
-    get_ns_json_bookmarks(json_obj, bookmarks) # Updates urls in-place
-    for url, bm in bookmarks[0].items():
-        out_list.append(bm)
-    return out_list
+    return [bm for bm, offset in iter_bookmarks_json(json_str)]
+
+class BookmarkImporter(object):
+    """
+    Imports the Netscape-style bookmarks.html or bookmarks.json in *data* into
+    *bookmarks_db* (a :class:`BookmarksDB`).  Bookmarks get parsed and saved in
+    batches of *batch_size* with the IOLoop getting a chance to do other things
+    in between.  After each batch
+    ``progress(<count>, <bytes>, <total bytes>, <saved bookmarks>)`` will be
+    called (if given) and when everything's done ``callback(<count>, <errors>)``
+    will be called.
+    """
+    def __init__(self, data, bookmarks_db, callback, progress=None,
+            batch_size=IMPORT_BATCH_SIZE, io_loop=None):
+        import tornado.ioloop
+        self.data = data
+        self.bookmarks_db = bookmarks_db
+        self.callback = callback
+        self.progress = progress
+        self.batch_size = batch_size
+        self.io_loop = io_loop or tornado.ioloop.IOLoop.instance()
+        self.count = 0
+        self.offset = 0
+        self.errors = []
+        if data.lstrip().startswith('{'): # This is a JSON file
+            self.bookmarks = iter_bookmarks_json(data)
+        else:
+            self.bookmarks = iter_bookmarks_html(data)
+
+    def start(self):
+        self.io_loop.add_callback(self._next_batch)
+
+    def _next_batch(self):
+        """
+        Parses and saves the next batch of bookmarks.
+        """
+        batch = []
+        finished = False
+        try:
+            for bm, self.offset in self.bookmarks:
+                batch.append(bm)
+                if len(batch) >= self.batch_size:
+                    break
+            else:
+                finished = True
+        except Exception as e:
+            logging.error("Error importing bookmarks: %s" % e)
+            self.errors.append(str(e))
+            finished = True
+        if batch:
+            self.bookmarks_db.sync_bookmarks(batch)
+            self.count += len(batch)
+            if self.progress:
+                self.progress(self.count, self.offset, len(self.data), batch)
+        if finished:
+            self.data = None
+            self.callback(self.count, self.errors)
+            return
+        self.io_loop.add_callback(self._next_batch)
 
 # Data Structures
 class BookmarksDB(object):
@@ -275,37 +421,149 @@ class BookmarksDB(object):
     Used to read and write bookmarks to a file on disk.  Can also synchronize
     a given list of bookmarks with what's on disk.  Uses a given bookmark's
     ``updateSequenceNum`` to track what wins the "who is newer?" comparison.
+
+    Bookmarks are indexed by URL, by ``updateSequenceNum``, and by tag so that
+    none of the operations below need to scan every bookmark.  Changes get
+    appended to a journal (bookmarks.journal: one JSON-encoded change per line)
+    which gets folded into bookmarks.json once it grows large enough (see
+    :meth:`save_bookmarks`).
     """
     def __init__(self, user_dir, user):
         """
         Sets up our bookmarks database object and reads everything in.
         """
-        self.bookmarks = [] # For temp storage of all bookmarks
+        self.bookmarks = {} # Format: {<url>: <bookmark>}
+        # Sorted list of [(<updateSequenceNum>, <url>), ...]:
+        self.usn_index = []
+        self.tags = {} # Format: {<tag>: set([<url>, <url>, ...])}
+        self.journal_entries = 0 # Number of changes in the journal
         self.user_dir = user_dir
         self.user = user
         users_dir = os.path.join(user_dir, user) # "User's dir"
         self.bookmarks_path = os.path.join(users_dir, "bookmarks.json")
+        self.journal_path = os.path.join(users_dir, "bookmarks.journal")
+        self.disk_state = None # Set by _update_disk_state()
         # Read existing bookmarks into self.bookmarks
         self.open_bookmarks()
 
+    def _index(self, bm):
+        """
+        Adds *bm* to our indexes (replacing any existing bookmark with the same
+        URL).
+        """
+        self._unindex(bm['url'])
+        self.bookmarks[bm['url']] = bm
+        key = (bm['updateSequenceNum'], bm['url'])
+        if not self.usn_index or key > self.usn_index[-1]:
+            self.usn_index.append(key) # The usual case (it's the newest)
+        else:
+            bisect.insort(self.usn_index, key)
+        for tag in bm['tags']:
+            self.tags.setdefault(tag, set()).add(bm['url'])
+
+    def _unindex(self, url):
+        """
+        Removes the bookmark with the given *url* from our indexes and returns
+        it (or `None` if there's no such bookmark).
+        """
+        bm = self.bookmarks.pop(url, None)
+        if not bm:
+            return None
+        key = (bm['updateSequenceNum'], url)
+        i = bisect.bisect_left(self.usn_index, key)
+        if i < len(self.usn_index) and self.usn_index[i] == key:
+            del self.usn_index[i]
+        for tag in bm['tags']:
+            urls = self.tags.get(tag)
+            if urls:
+                urls.discard(url)
+                if not urls:
+                    del self.tags[tag]
+        return bm
+
+    def _update_disk_state(self):
+        """
+        Records the state of our files on disk so :meth:`changed_on_disk` can
+        tell if something else modified them.
+        """
+        state = []
+        for path in (self.bookmarks_path, self.journal_path):
+            try:
+                st = os.stat(path)
+                state.append((st.st_ino, st.st_size, st.st_mtime))
+            except OSError:
+                state.append(None)
+        self.disk_state = tuple(state)
+
+    def changed_on_disk(self):
+        """
+        Returns `True` if the bookmarks have been modified on disk by something
+        other than this instance (e.g. another Gate One server process).
+        """
+        previous = self.disk_state
+        self._update_disk_state()
+        return previous != self.disk_state
+
     def open_bookmarks(self):
         """
-        Opens the bookmarks stored in self.user_dir.  If not present, an
-        empty file will be created.
+        Opens the bookmarks stored in self.user_dir (replaying any changes in
+        the journal).  If not present, an empty file will be created.
         """
         if not os.path.exists(self.bookmarks_path):
             with open(self.bookmarks_path, 'w') as f:
                 f.write('[]') # That's an empty JSON list
-            return # Default of empty list will do
-        with open(self.bookmarks_path) as f:
-            self.bookmarks = json_decode(f.read())
+        else:
+            with open(self.bookmarks_path) as f:
+                for bm in json_decode(f.read()):
+                    self._index(bm)
+        if os.path.exists(self.journal_path):
+            with open(self.journal_path) as f:
+                for line in f:
+                    try:
+                        change = json_decode(line)
+                    except ValueError:
+                        # Partial write (e.g. we crashed); ignore it
+                        logging.warning(
+                            "Skipping bad line in %s" % self.journal_path)
+                        continue
+                    if 'put' in change:
+                        self._index(change['put'])
+                    elif 'delete' in change:
+                        self._unindex(change['delete'])
+                    self.journal_entries += 1
+        self._update_disk_state()
 
     def save_bookmarks(self):
         """
-        Saves self.bookmarks to self.bookmarks_path as a JSON-encoded list.
+        Saves self.bookmarks to self.bookmarks_path as a JSON-encoded list and
+        removes the (now redundant) journal.
         """
-        with open(self.bookmarks_path, 'w') as f:
-            f.write(json_encode(self.bookmarks))
+        bookmarks = [self.bookmarks[url] for usn, url in self.usn_index]
+        tmp_path = '%s.tmp' % self.bookmarks_path
+        with open(tmp_path, 'w') as f:
+            f.write(json_encode(bookmarks))
+        os.rename(tmp_path, self.bookmarks_path) # Atomic
+        if os.path.exists(self.journal_path):
+            os.remove(self.journal_path)
+        self.journal_entries = 0
+        self._update_disk_state()
+
+    def _journal(self, changes):
+        """
+        Appends *changes* (a list of ``{'put': <bookmark>}`` and
+        ``{'delete': <url>}`` dicts) to the journal.  Calls
+        :meth:`save_bookmarks` instead if the journal has gotten too big.
+        """
+        if not changes:
+            return
+        self.journal_entries += len(changes)
+        limit = max(JOURNAL_MIN_ENTRIES, len(self.bookmarks))
+        if self.journal_entries > limit:
+            self.save_bookmarks()
+            return
+        with open(self.journal_path, 'a') as f:
+            f.write(''.join(json_encode(change) + '\n' for change in changes))
+        self._update_disk_state()
 
     def sync_bookmarks(self, bookmarks):
         """
@@ -313,89 +571,76 @@ class BookmarksDB(object):
         resolution and whatnot.
         """
         highest_USN = self.get_highest_USN()
-        changed = False # For if there's changes that need to be written
+        changes = [] # For changes that need to be written
         updated_bookmarks = [] # For bookmarks that are newer on the server
         for bm in bookmarks:
-            if bm['url'] == "web+deleted:bookmarks/":
-                # Remove the existing deleted entry if it exists
-                for j, deleted_bm in enumerate(bm['notes']):
-                    if deleted_bm['url'] == bookmark['url']:
-                        # Remove the deleted bookmark entry
-                        bm['notes'].pop(j)
-            found_existing = False
-            for i, db_bookmark in enumerate(self.bookmarks):
-                if bm['url'] == db_bookmark['url']:
-                    # Bookmark already exists, check which is newer
-                    found_existing = True
-                    if bm['updateSequenceNum'] > db_bookmark['updateSequenceNum']:
-                        # The given bookmark is newer than what's in the DB
-                        self.bookmarks[i] = bm # Replace it
-                        highest_USN += 1 # Increment the USN
-                        self.bookmarks[i]['updateSequenceNum'] = highest_USN
-                        changed = True
-                    elif bm['updateSequenceNum'] < db_bookmark['updateSequenceNum']:
-                        # DB has a newer bookmark.  Add it to the list to send
-                        # to the client.
-                        updated_bookmarks.append(db_bookmark)
-                    # Otherwise the USNs are equal and there's nothing to do
-            if not found_existing:
+            db_bookmark = self.bookmarks.get(bm['url'])
+            if db_bookmark:
+                # Bookmark already exists, check which is newer
+                if bm['updateSequenceNum'] > db_bookmark['updateSequenceNum']:
+                    # The given bookmark is newer than what's in the DB
+                    highest_USN += 1 # Increment the USN
+                    bm['updateSequenceNum'] = highest_USN
+                    self._index(bm) # Replace it
+                    changes.append({'put': bm})
+                elif bm['updateSequenceNum'] < db_bookmark['updateSequenceNum']:
+                    # DB has a newer bookmark.  Add it to the list to send
+                    # to the client.
+                    updated_bookmarks.append(db_bookmark)
+                # Otherwise the USNs are equal and there's nothing to do
+            else:
                 # This is a new bookmark.  Add it
                 highest_USN += 1 # Increment the USN
                 bm['updateSequenceNum'] = highest_USN
-                self.bookmarks.append(bm)
-                changed = True # So it will be saved
-        if changed:
-            # Write the changes to disk
-            self.save_bookmarks()
+                self._index(bm)
+                changes.append({'put': bm})
+        # Write the changes to disk
+        self._journal(changes)
         # Let the client know what's newer on the server
         return updated_bookmarks
 
     def delete_bookmark(self, bookmark):
         """Deletes the given *bookmark*."""
         highest_USN = self.get_highest_USN()
-        for i, db_bookmark in enumerate(self.bookmarks):
-            if bookmark['url'] == db_bookmark['url']:
-                # Remove it
-                deleted = self.bookmarks.pop(i)
-                # Add it to the list of deleted bookmarks
-                special_deleted_bm = None
-                for bm in self.bookmarks:
-                    if bm['url'] == "web+deleted:bookmarks/":
-                        special_deleted_bm = bm
-                # The deleted bookmarks 'bookmark' is just a list of URLs that
-                # have been deleted along with the time it happened.  This lets
-                # us keep multiple browsers in sync with what's been deleted
-                # so we don't inadvertently end up re-adding bookmarks that were
-                # deleted by another client.
-                if not special_deleted_bm:
-                    # Make our first entry
-                    special_deleted_bm = {
-                        'url': "web+deleted:bookmarks/",
-                        'name': "Deleted Bookmarks",
-                        'tags': [],
-                        'notes': [bookmark],
-                        'visits': highest_USN + 1,
-                        'updated': int(round(time.time() * 1000)),
-                        'created': int(round(time.time() * 1000)),
-                        'updateSequenceNum': 0,
-                        'images': {}
-                    }
-                    self.bookmarks.append(special_deleted_bm)
-                else:
-                    # Check for pre-existing
-                    updated = False
-                    for j, deleted_bm in enumerate(special_deleted_bm['notes']):
-                        if deleted_bm['url'] == bookmark['url']:
-                            # Update it in place
-                            special_deleted_bm['notes'][j] = bookmark
-                            updated = True
-                    if not updated:
-                        special_deleted_bm['notes'].append(bookmark)
-                    highest_USN += 1
-                    special_deleted_bm['updateSequenceNum'] = highest_USN
-                break
+        if not self._unindex(bookmark['url']):
+            return # Nothing to delete
+        changes = [{'delete': bookmark['url']}]
+        # Add it to the list of deleted bookmarks.
+        # The deleted bookmarks 'bookmark' is just a list of URLs that have been
+        # deleted along with the time it happened.  This lets us keep multiple
+        # browsers in sync with what's been deleted so we don't inadvertently
+        # end up re-adding bookmarks that were deleted by another client.
+        special_deleted_bm = self.bookmarks.get(DELETED_URL)
+        if not special_deleted_bm:
+            # Make our first entry
+            special_deleted_bm = {
+                'url': DELETED_URL,
+                'name': "Deleted Bookmarks",
+                'tags': [],
+                'notes': [bookmark],
+                'visits': highest_USN + 1,
+                'updated': int(round(time.time() * 1000)),
+                'created': int(round(time.time() * 1000)),
+                'updateSequenceNum': 0,
+                'images': {}
+            }
+        else:
+            self._unindex(DELETED_URL) # Its USN is about to change
+            # Check for pre-existing
+            updated = False
+            for j, deleted_bm in enumerate(special_deleted_bm['notes']):
+                if deleted_bm['url'] == bookmark['url']:
+                    # Update it in place
+                    special_deleted_bm['notes'][j] = bookmark
+                    updated = True
+            if not updated:
+                special_deleted_bm['notes'].append(bookmark)
+            highest_USN += 1
+            special_deleted_bm['updateSequenceNum'] = highest_USN
+        self._index(special_deleted_bm)
+        changes.append({'put': special_deleted_bm})
         # Save the change to disk
-        self.save_bookmarks()
+        self._journal(changes)
 
     def get_bookmarks(self, updateSequenceNum=0):
         """
@@ -403,19 +648,15 @@ class BookmarksDB(object):
         If *updateSequenceNum* is 0 or undefined, all bookmarks will be
         returned.
         """
-        out_bookmarks = []
-        for bm in self.bookmarks:
-            if bm['updateSequenceNum'] > updateSequenceNum:
-                out_bookmarks.append(bm)
-        return out_bookmarks
+        # (updateSequenceNum + 1,) sorts before any (updateSequenceNum + 1, url)
+        start = bisect.bisect_left(self.usn_index, (updateSequenceNum + 1,))
+        return [self.bookmarks[url] for usn, url in self.usn_index[start:]]
 
     def get_highest_USN(self):
         """Returns the highest updateSequenceNum in self.bookmarks"""
-        highest_USN = 0
-        for bm in self.bookmarks:
-            if bm['updateSequenceNum'] > highest_USN:
-                highest_USN = bm['updateSequenceNum']
-        return highest_USN
+        if not self.usn_index:
+            return 0
+        return max(self.usn_index[-1][0], 0)
 
     def rename_tag(self, old_tag, new_tag):
         """
@@ -423,35 +664,333 @@ class BookmarksDB(object):
         *new_tag*.
         """
         highest_USN = self.get_highest_USN()
-        for bm in self.bookmarks:
-            if old_tag in bm['tags']:
-                highest_USN += 1
-                i = bm['tags'].index(old_tag)
-                bm['tags'][i] = new_tag
-                # Made a change so we need to increment the USN to ensure sync
-                bm['updateSequenceNum'] = highest_USN
-                bm['updated'] = int(round(time.time() * 1000))
+        changes = []
+        for url in sorted(self.tags.get(old_tag, ())):
+            bm = self._unindex(url)
+            highest_USN += 1
+            i = bm['tags'].index(old_tag)
+            bm['tags'][i] = new_tag
+            # Made a change so we need to increment the USN to ensure sync
+            bm['updateSequenceNum'] = highest_USN
+            bm['updated'] = int(round(time.time() * 1000))
+            self._index(bm)
+            changes.append({'put': bm})
         # Save the change to disk
-        self.save_bookmarks()
+        self._journal(changes)
+
+def get_bookmarks_db(user_dir, user):
+    """
+    Returns the :class:`BookmarksDB` for *user* (keeping it around in
+    :data:`BOOKMARK_DBS` so it doesn't have to be re-read for every request).
+    If the bookmarks were changed on disk by something else they will be
+    re-read.
+    """
+    bookmarks_path = os.path.join(user_dir, user, "bookmarks.json")
+    bookmarks_db = BOOKMARK_DBS.get(bookmarks_path)
+    if not bookmarks_db or bookmarks_db.changed_on_disk():
+        bookmarks_db = BookmarksDB(user_dir, user)
+        BOOKMARK_DBS[bookmarks_path] = bookmarks_db
+    return bookmarks_db
+
+class FaviconLinkParser(HTMLParser):
+    """
+    Collects the ``<link rel="icon">`` (or "shortcut icon") tags in a page as a
+    list of ``(<href>, <type>)`` tuples (:attr:`icons`).  Sets :attr:`done`
+    once it gets to the ``<body>`` (since icons won't be found after that).
+    """
+    def __init__(self):
+        HTMLParser.__init__(self)
+        self.icons = []
+        self.done = False
+
+    def handle_starttag(self, tag, attrs):
+        if self.done:
+            return
+        if tag == 'link':
+            attrs = dict(attrs)
+            rel = (attrs.get('rel') or '').lower().split()
+            if 'icon' in rel and attrs.get('href'):
+                self.icons.append((attrs['href'], attrs.get('type')))
+        elif tag == 'body':
+            self.done = True
+
+def find_favicon_url(html):
+    """
+    Parses *html* looking for a favicon URL.  Returns a tuple of::
+
+        (<url>, <mimetime>)
+
+    If no favicon can be found, returns::
+
+        (None, None)
+    """
+    parser = FaviconLinkParser()
+    try:
+        # Feed it in chunks so we can stop as soon as we hit the <body>
+        for i in range(0, len(html), 4096):
+            parser.feed(html[i:i+4096])
+            if parser.done:
+                break
+    except HTMLParseError:
+        pass # Go with whatever we found before things went sideways
+    for href, mimetype in parser.icons:
+        if not mimetype:
+            mimetype = "image/x-icon"
+        if mimetype in FAVICON_MIMETYPES:
+            return (href, mimetype)
+    return (None, None)
+
+class FaviconCache(object):
+    """
+    A process-wide cache of favicons (as data URIs) keyed by origin (e.g.
+    'https://example.com').  Icons are kept in memory (least recently used
+    ones get evicted once the total exceeds *max_size* bytes) and in
+    *cache_dir* (so they survive restarts).  Icons expire after *ttl* and
+    failures (no icon) get cached too (for *negative_ttl*) so broken sites
+    aren't hammered.
+
+    Concurrent requests for the same origin share a single fetch and no more
+    than *max_fetches* origins will be fetched at a time (the rest wait their
+    turn).  *http_client* may be anything with a Tornado-style
+    ``fetch(url, callback, **kwargs)`` method (defaults to
+    `tornado.httpclient.AsyncHTTPClient`).
+    """
+    def __init__(self, cache_dir=None, max_size=5*1024*1024,
+            ttl=timedelta(days=1), negative_ttl=timedelta(hours=1),
+            max_fetches=4, timeout=5.0, http_client=None):
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        self.ttl = ttl.days * 86400 + ttl.seconds
+        self.negative_ttl = negative_ttl.days * 86400 + negative_ttl.seconds
+        self.max_fetches = max_fetches
+        self.timeout = timeout
+        self.http_client = http_client
+        self.entries = OrderedDict() # Format: {<origin>: (<expires>, <data URI>)}
+        self.size = 0 # Total size of everything in self.entries
+        self.pending = {} # Format: {<origin>: [<callback>, <callback>, ...]}
+        self.waiting = deque() # Format: [(<origin>, <url>), ...]
+        self.fetching = 0 # Number of origins currently being fetched
+        if cache_dir:
+            if not os.path.exists(cache_dir):
+                os.makedirs(cache_dir)
+            self.prune()
+
+    @staticmethod
+    def get_origin(url):
+        """
+        Returns the origin (scheme://host[:port]) of *url* or `None` if it isn't
+        an http(s) URL.
+        """
+        parsed = urlparse(url)
+        if parsed.scheme not in ('http', 'https') or not parsed.netloc:
+            return None
+        return '%s://%s' % (parsed.scheme, parsed.netloc.lower())
+
+    def _path(self, origin):
+        return os.path.join(
+            self.cache_dir, hashlib.sha1(origin.encode('utf-8')).hexdigest())
+
+    def prune(self):
+        """
+        Removes expired icons from :attr:`cache_dir`.
+        """
+        now = time.time()
+        for filename in os.listdir(self.cache_dir):
+            path = os.path.join(self.cache_dir, filename)
+            try:
+                with open(path) as f:
+                    expires = json_decode(f.read())['expires']
+            except (IOError, ValueError, KeyError, TypeError):
+                expires = 0 # Corrupt
+            if expires < now:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+    def _remember(self, origin, expires, data_uri):
+        """
+        Stores *data_uri* (or `None` if there's no icon) in memory, evicting the
+        least recently used icons if we're over :attr:`max_size`.
+        """
+        self._forget(origin)
+        self.entries[origin] = (expires, data_uri)
+        self.size += len(origin) + len(data_uri or '')
+        while self.size > self.max_size and len(self.entries) > 1:
+            self._forget(next(iter(self.entries)))
+
+    def _forget(self, origin):
+        entry = self.entries.pop(origin, None)
+        if entry:
+            self.size -= len(origin) + len(entry[1] or '')
+
+    def get(self, origin):
+        """
+        Returns ``(True, <data URI or None>)`` if *origin* has a (non-expired)
+        entry in the cache.  Otherwise returns ``(False, None)``.
+        """
+        now = time.time()
+        entry = self.entries.get(origin)
+        if entry:
+            if entry[0] > now:
+                # Move it to the end (most recently used)
+                del self.entries[origin]
+                self.entries[origin] = entry
+                return (True, entry[1])
+            self._forget(origin)
+        if self.cache_dir:
+            path = self._path(origin)
+            try:
+                with open(path) as f:
+                    saved = json_decode(f.read())
+            except (IOError, ValueError):
+                return (False, None)
+            if saved.get('origin') == origin and saved['expires'] > now:
+                self._remember(origin, saved['expires'], saved['data_uri'])
+                return (True, saved['data_uri'])
+        return (False, None)
+
+    def set(self, origin, data_uri):
+        """
+        Caches *data_uri* (or `None` if *origin* doesn't have an icon) in memory
+        and on disk.
+        """
+        ttl = self.ttl if data_uri else self.negative_ttl
+        expires = time.time() + ttl
+        self._remember(origin, expires, data_uri)
+        if self.cache_dir:
+            path = self._path(origin)
+            try:
+                with open(path + '.tmp', 'w') as f:
+                    f.write(json_encode({
+                        'origin': origin,
+                        'expires': expires,
+                        'data_uri': data_uri
+                    }))
+                os.rename(path + '.tmp', path)
+            except (IOError, OSError) as e:
+                logging.error("Could not save favicon for %s: %s" % (origin, e))
+
+    def fetch(self, url, callback):
+        """
+        Calls ``callback(<data URI or None>)`` with the icon for the origin of
+        *url* (fetching it if it isn't already cached).
+        """
+        origin = self.get_origin(url)
+        if not origin:
+            callback(None)
+            return
+        found, data_uri = self.get(origin)
+        if found:
+            callback(data_uri)
+            return
+        if origin in self.pending: # Already being fetched
+            self.pending[origin].append(callback)
+            return
+        self.pending[origin] = [callback]
+        if self.fetching < self.max_fetches:
+            self._start(origin, url)
+        else:
+            self.waiting.append((origin, url))
+
+    def _http_fetch(self, url, callback):
+        """
+        Fetches *url* and calls ``callback(response)`` (with `None` if the
+        fetch couldn't even be started).
+        """
+        if not self.http_client:
+            import tornado.httpclient
+            self.http_client = tornado.httpclient.AsyncHTTPClient()
+        try:
+            self.http_client.fetch(url, callback,
+                connect_timeout=self.timeout, request_timeout=self.timeout)
+        except Exception as e: # e.g. gaierror (no such host)
+            logging.debug("Error fetching %s: %s" % (url, e))
+            callback(None)
+
+    def _start(self, origin, url):
+        self.fetching += 1
+        self._http_fetch(url, partial(self._got_page, origin, url))
+
+    def _got_page(self, origin, url, response):
+        """
+        Looks for the icon URL in the page we fetched then starts fetching it
+        (falling back to /favicon.ico).
+        """
+        urls = []
+        mimetype = "image/x-icon" # Default
+        if response and not response.error and response.body:
+            fetch_url, icon_mimetype = find_favicon_url(
+                response.body.decode('utf-8', 'replace'))
+            if fetch_url:
+                fetch_url = urljoin(url, fetch_url)
+                if self.get_origin(fetch_url): # http(s) only
+                    urls.append(fetch_url)
+                    mimetype = icon_mimetype
+        favicon_ico = '%s/favicon.ico' % origin
+        if favicon_ico not in urls:
+            urls.append(favicon_ico)
+        self._fetch_icon(origin, urls, mimetype)
+
+    def _fetch_icon(self, origin, urls, mimetype):
+        url = urls.pop(0)
+        self._http_fetch(url, partial(self._got_icon, origin, urls, mimetype))
+
+    def _got_icon(self, origin, urls, mimetype, response):
+        """
+        Caches the icon in *response* (if it is one) or tries the next URL in
+        *urls*.
+        """
+        data_uri = None
+        if response and not response.error and response.body:
+            content_type = response.headers.get('Content-Type', mimetype)
+            content_type = content_type.split(';')[0].strip().lower()
+            if not content_type.startswith('image/'):
+                content_type = None # e.g. An HTML "not found" page
+            if content_type and len(response.body) <= MAX_FAVICON_SIZE:
+                data_uri = "data:%s;base64,%s" % (
+                    content_type,
+                    response.body.encode('base64').replace('\n', ''))
+        if not data_uri and urls:
+            self._fetch_icon(origin, urls, "image/x-icon")
+            return
+        self._done(origin, data_uri)
+
+    def _done(self, origin, data_uri):
+        """
+        Caches the result, starts the next waiting fetch (if any), and calls
+        everyone that was waiting for *origin*.
+        """
+        self.set(origin, data_uri)
+        self.fetching -= 1
+        if self.waiting:
+            self._start(*self.waiting.popleft())
+        for callback in self.pending.pop(origin, []):
+            try:
+                callback(data_uri)
+            except Exception as e:
+                logging.error("Exception in favicon callback: %s" % e)
+
+def get_favicon_cache(**kwargs):
+    """
+    Returns the process-wide :class:`FaviconCache`, creating it (with
+    *kwargs*) if necessary.
+    """
+    global FAVICON_CACHE
+    if not FAVICON_CACHE:
+        FAVICON_CACHE = FaviconCache(**kwargs)
+    return FAVICON_CACHE
 
 # Handlers
 class FaviconHandler(BaseHandler):
     """
-    Retrives the biggest favicon-like icon at the given URL.  It will try to
-    fetch apple-touch-icons (which can be nice and big) before it falls back
-    to grabbing the favicon.
+    Retrieves the favicon for the site at the given URL (as a data URI) via the
+    process-wide :class:`FaviconCache`.  The icon linked from the page will be
+    used if there is one.  Otherwise it falls back to grabbing /favicon.ico.
 
     .. note:: Works with GET and POST requests but POST is preferred since it keeps the URL from winding up in the server logs.
     """
-    # Valid favicon mime types
-    favicon_mimetypes = [
-        'image/vnd.microsoft.icon',
-        'image/x-icon',
-        'image/png',
-        'image/svg+xml',
-        'image/gif',
-        'image/jpeg'
-    ]
+    favicon_mimetypes = FAVICON_MIMETYPES
     @tornado.web.asynchronous
     def get(self):
         self.process()
@@ -462,153 +1001,26 @@ class FaviconHandler(BaseHandler):
 
     def process(self):
         url = self.get_argument("url")
-        http = tornado.httpclient.AsyncHTTPClient()
-        callback = partial(self.on_response, url)
-        http.fetch(url, callback, connect_timeout=5.0, request_timeout=5.0)
-
-    def get_favicon_url(self, html):
-        """
-        Parses *html* looking for a favicon URL.  Returns a tuple of::
-
-            (<url>, <mimetime>)
-
-        If no favicon can be found, returns::
-
-            (None, None)
-        """
-        import html5lib
-        p = html5lib.HTMLParser(
-            tree=html5lib.treebuilders.getTreeBuilder("dom"))
-        dom_tree = p.parse(html)
-        walker = html5lib.treewalkers.getTreeWalker("dom")
-        stream = walker(dom_tree)
-        fetch_url = None
-        mimetype = None
-        icon = False
-        found_token = None
-        for token in stream:
-            if 'name' in token:
-                if token['name'] == 'link':
-                    for attr in token['data']:
-                        if attr[0] == 'rel':
-                            if 'shortcut icon' in attr[1].lower():
-                                found_token = token
-                                icon = True
-                        elif attr[0] == 'href':
-                            fetch_url = attr[1]
-                        elif attr[0] == 'type':
-                            mimetype = attr[1]
-                    if fetch_url and icon:
-                        if not mimetype:
-                            mimetype = "image/x-icon"
-                        if mimetype in self.favicon_mimetypes:
-                            return (fetch_url, mimetype)
-        return (None, None)
-
-    def on_response(self, url, response):
-        try:
-            from urlparse import urlparse
-        except ImportError: # Python 3.X
-            from urllib import parse as urlparse
-        if response.error:
-            self.write('Unable to fetch icon.')
-            self.finish()
-            return
-        fetch_url = None
-        try:
-            content = response.body.decode('utf-8')
-        except UnicodeDecodeError:
-            content = response.body
-        parsed_url = urlparse(url)
-        (fetch_url, mimetype) = self.get_favicon_url(content)
-        if fetch_url:
-            if not fetch_url.startswith('http'):
-                fetch_url = '%s://%s%s' % (
-                    parsed_url.scheme, parsed_url.netloc, fetch_url)
-        if not mimetype:
-            mimetype = "image/x-icon" # Default
-        if not fetch_url:
-            fetch_url = '%s://%s/favicon.ico' % (
-                parsed_url.scheme, parsed_url.netloc)
-        if fetch_url.startswith('http://') or fetch_url.startswith('https://'):
-            noop()
-        else:
-            raise tornado.web.HTTPError(404)
-        http = tornado.httpclient.AsyncHTTPClient()
-        callback = partial(self.icon_fetch, url, mimetype)
-        try:
-            http.fetch(
-                fetch_url,
-                callback,
-                connect_timeout=5.0,
-                request_timeout=5.0
-            )
-        except gaierror: # No address associated with hostname
-            self.write('Unable to fetch icon.')
-            self.finish()
-            return
+        cache_dir = self.settings.get('cache_dir')
+        if not cache_dir: # Same default as assets.get_cache_dir()
+            cache_dir = os.path.join(tempfile.gettempdir(), 'gateone_cache')
+        favicon_cache = get_favicon_cache(
+            cache_dir=os.path.join(cache_dir, 'favicons'))
+        favicon_cache.fetch(url, self.send_icon)
 
-    def icon_multifetch(self, urls, response):
+    def send_icon(self, data_uri):
         """
-        Fetches the icon at the given URLs, stopping when it finds the biggest.
-        If an icon is not found, calls itself again with the next icon URL.
-        If the icon is found, writes it to the client and finishes the request.
+        Writes *data_uri* (the icon) to the client.
         """
-        if response.error:
-            if urls:
-                url = urls.pop()
-                http = tornado.httpclient.AsyncHTTPClient()
-                callback = partial(self.icon_multifetch, urls)
-                try:
-                    http.fetch(url, callback)
-                except gaierror:
-                    raise tornado.web.HTTPError(404)
-            else:
-                raise tornado.web.HTTPError(404)
-        else:
-            if 'Content-Type' in response.headers:
-                mimetype = response.headers['Content-Type']
-                self.set_header("Content-Type", mimetype)
-            else:
-                mimetype = "image/vnd.microsoft.icon"
-                self.set_header("Content-Type", mimetype)
-            data_uri = "data:%s;base64,%s" % (
-                mimetype,
-                response.body.encode('base64').replace('\n', '')
-            )
-            self.write(data_uri)
-            self.finish()
-
-    def icon_fetch(self, url, mimetype, response):
-        """Returns the fetched icon to the client."""
-        if response.error:
+        if not data_uri:
             self.write('Unable to fetch icon.')
             self.finish()
             return
-        data_uri = "data:%s;base64,%s" % (
-            mimetype,
-            response.body.encode('base64').replace('\n', '')
-        )
+        mimetype = data_uri[len('data:'):].split(';', 1)[0]
         self.set_header("Content-Type", mimetype)
         self.write(data_uri)
         self.finish()
 
-class ImportHandler(tornado.web.RequestHandler):
-    """
-    Takes a bookmarks.html in a POST and returns a list of bookmarks in JSON
-    format
-    """
-    @tornado.web.asynchronous
-    def post(self):
-        html = self.request.body
-        if html.startswith('{'): # This is a JSON file
-            bookmarks = parse_bookmarks_json(html)
-        else:
-            bookmarks = parse_bookmarks_html(html)
-        self.write(tornado.escape.json_encode(bookmarks))
-        self.finish()
-        # NOTE: The client will take care of storing these at the next sync
-
 class ExportHandler(tornado.web.RequestHandler):
     """
     Takes a JSON-encoded list of bookmarks and returns a Netscape-style HTML
@@ -637,7 +1049,7 @@ def save_bookmarks(self, bookmarks):
     }
     try:
         user = self.get_current_user()['upn']
-        bookmarks_db = BookmarksDB(self.ws.settings['user_dir'], user)
+        bookmarks_db = get_bookmarks_db(self.ws.settings['user_dir'], user)
         updates = bookmarks_db.sync_bookmarks(bookmarks)
         out_dict.update({
             'updates': updates,
@@ -665,7 +1077,7 @@ def get_bookmarks(self, updateSequenceNum):
     the client.
     """
     user = self.get_current_user()['upn']
-    bookmarks_db = BookmarksDB(self.settings['user_dir'], user)
+    bookmarks_db = get_bookmarks_db(self.settings['user_dir'], user)
     if updateSequenceNum:
         updateSequenceNum = int(updateSequenceNum)
     else: # This will force a full download
@@ -679,7 +1091,7 @@ def delete_bookmarks(self, deleted_bookmarks):
     Handles deleting bookmars given a *deleted_bookmarks* list.
     """
     user = self.get_current_user()['upn']
-    bookmarks_db = BookmarksDB(self.ws.settings['user_dir'], user)
+    bookmarks_db = get_bookmarks_db(self.ws.settings['user_dir'], user)
     out_dict = {
         'result': "",
         'count': 0,
@@ -704,7 +1116,7 @@ def rename_tags(self, renamed_tags):
     Handles renaming tags.
     """
     user = self.get_current_user()['upn']
-    bookmarks_db = BookmarksDB(self.ws.settings['user_dir'], user)
+    bookmarks_db = get_bookmarks_db(self.ws.settings['user_dir'], user)
     out_dict = {
         'result': "",
         'count': 0,
@@ -718,6 +1130,48 @@ def rename_tags(self, renamed_tags):
     message = {'terminal:bookmarks_renamed_tags': out_dict}
     self.write_message(json_encode(message))
 
+def import_bookmarks(self, data):
+    """
+    Imports the bookmarks.html (or bookmarks.json) in *data* into the user's
+    bookmarks (see :class:`BookmarkImporter`).  As each batch gets saved it
+    will be sent to the client via the 'terminal:bookmarks_import_progress'
+    WebSocket action::
+
+        {"count": 500, "bytes": 65536, "total": 1048576, "bookmarks": [...]}
+
+    When the import is complete the 'terminal:bookmarks_import_result'
+    WebSocket action will be sent::
+
+        {"result": "Success", "count": 1234, "errors": []}
+    """
+    user = self.get_current_user()['upn']
+    bookmarks_db = get_bookmarks_db(self.ws.settings['user_dir'], user)
+    def send_progress(count, offset, total, bookmarks):
+        if self.ws not in self.ws.instances:
+            return # Client disconnected; the import will still complete
+        message = {'terminal:bookmarks_import_progress': {
+            'count': count,
+            'bytes': offset,
+            'total': total,
+            'bookmarks': bookmarks
+        }}
+        self.write_message(json_encode(message))
+    def import_complete(count, errors):
+        if self.ws not in self.ws.instances:
+            return
+        result = "Success"
+        if errors:
+            result = "Import completed but errors were encountered."
+        message = {'terminal:bookmarks_import_result': {
+            'result': result,
+            'count': count,
+            'errors': errors
+        }}
+        self.write_message(json_encode(message))
+    importer = BookmarkImporter(
+        data, bookmarks_db, import_complete, progress=send_progress)
+    importer.start()
+
 def send_bookmarks_css_template(self):
     """
     Sends our bookmarks.css template to the client using the 'load_style'
@@ -731,13 +1185,13 @@ hooks = {
     'Web': [
         (r"/bookmarks/fetchicon", FaviconHandler),
         (r"/bookmarks/export", ExportHandler),
-        (r"/bookmarks/import", ImportHandler),
     ],
     'WebSocket': {
         'terminal:bookmarks_sync': save_bookmarks,
         'terminal:bookmarks_get': get_bookmarks,
         'terminal:bookmarks_deleted': delete_bookmarks,
         'terminal:bookmarks_rename_tags': rename_tags,
+        'terminal:bookmarks_import': import_bookmarks,
     },
     'Events': {
         'terminal:authenticate': send_bookmarks_css_template
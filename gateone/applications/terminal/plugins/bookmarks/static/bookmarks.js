@@ -63,6 +63,7 @@ go.Bookmarks.page = 0; // Used to tracking pagination
 go.Bookmarks.dateTags = [];
 go.Bookmarks.URLTypeTags = [];
 go.Bookmarks.toUpload = []; // Used for tracking what needs to be uploaded to the server
+go.Bookmarks.imported = []; // Bookmarks received from the server during an import
 go.Bookmarks.loginSync = true; // Makes sure we don't display "Synchronization Complete" if the user just logged in (unless it is the first time).
 go.Bookmarks.temp = ""; // Just a temporary holding space for things like drag & drop
 go.Base.update(GateOne.Bookmarks, {
@@ -75,6 +76,8 @@ go.Base.update(GateOne.Bookmarks, {
             GateOne.Net.addAction('terminal:bookmarks_save_result', GateOne.Bookmarks.syncComplete);
             GateOne.Net.addAction('terminal:bookmarks_delete_result', GateOne.Bookmarks.deletedBookmarksSyncComplete);
             GateOne.Net.addAction('terminal:bookmarks_renamed_tags', GateOne.Bookmarks.tagRenameComplete);
+            GateOne.Net.addAction('terminal:bookmarks_import_progress', GateOne.Bookmarks.importProgress);
+            GateOne.Net.addAction('terminal:bookmarks_import_result', GateOne.Bookmarks.importComplete);
         */
         var b = go.Bookmarks,
             goDiv = u.getNode(go.prefs.goDiv),
@@ -144,6 +147,8 @@ go.Base.update(GateOne.Bookmarks, {
         go.Net.addAction('terminal:bookmarks_save_result', b.syncComplete);
         go.Net.addAction('terminal:bookmarks_delete_result', b.deletedBookmarksSyncComplete);
         go.Net.addAction('terminal:bookmarks_renamed_tags', b.tagRenameComplete);
+        go.Net.addAction('terminal:bookmarks_import_progress', b.importProgress);
+        go.Net.addAction('terminal:bookmarks_import_result', b.importComplete);
         // Setup a keyboard shortcut so bookmarks can be keyboard-navigable
         if (!go.prefs.embedded) {
             go.Input.registerShortcut('KEY_B', {'modifiers': {'ctrl': true, 'alt': true, 'meta': false, 'shift': false}, 'action': toggleBookmarks});
@@ -1684,44 +1689,51 @@ go.Base.update(GateOne.Bookmarks, {
         buttonContainer.appendChild(bmSubmit);
         buttonContainer.appendChild(bmCancel);
         bmForm.appendChild(buttonContainer);
-        bmHelp.innerHTML = '<br /><i>Imported bookmarks will be synchronized the next time you click, "Sync Bookmarks".</i>'
+        bmHelp.innerHTML = '<br /><i>Imported bookmarks are saved on the server and will be synchronized as soon as the import completes.</i>'
         bmForm.appendChild(bmHelp);
         var closeDialog = go.Visual.dialog("Import Bookmarks", bmForm);
         bmForm.onsubmit = function(e) {
             // Don't actually submit it
             e.preventDefault();
-            // NOTE:  Using HTML5 file uploads here...  Should work fine in Opera, Firefox, and Webkit
-            var delay = 1000,
-                fileInput = u.getNode('#'+prefix+'bookmarks_upload'),
+            // NOTE:  Using the HTML5 File API here...  Should work fine in Opera, Firefox, and Webkit
+            var fileInput = u.getNode('#'+prefix+'bookmarks_upload'),
                 file = fileInput.files[0],
-                xhr = new XMLHttpRequest(),
-                handleStateChange = function(e) {
-                    var status = null;
-                    try {
-                        status = parseInt(e.target.status);
-                    } catch(e) {
-                        return;
-                    }
-                    if (e.target.readyState == 4 && status == 200 && e.target.responseText) {
-                        var bookmarks = JSON.parse(e.target.responseText),
-                            count = b.storeBookmarks(bookmarks, true);
-                        go.Visual.displayMessage(count+" bookmarks imported.");
-                        go.Visual.displayMessage("Bookmark icons will be retrieved in the background");
-                        closeDialog();
-                    }
-                };
-            if (xhr.addEventListener) {
-                xhr.addEventListener('readystatechange', handleStateChange, false);
-            } else {
-                xhr.onreadystatechange = handleStateChange;
-            }
-            xhr.open('POST', go.prefs.url+'bookmarks/import', true);
-            xhr.setRequestHeader("Content-Type", "application/octet-stream");
-            xhr.setRequestHeader("X-File-Name", file.name);
-            xhr.send(file);
+                reader = new FileReader();
+            reader.onload = function(e) {
+                // The server saves the bookmarks and sends them back in batches (see importProgress())
+                b.imported = [];
+                go.ws.send(JSON.stringify({'terminal:bookmarks_import': e.target.result}));
+            };
+            reader.readAsText(file);
+            closeDialog();
         }
         bmCancel.onclick = closeDialog;
     },
+    importProgress: function(message) {
+        /**:GateOne.Bookmarks.importProgress(message)
+
+        Called when the 'terminal:bookmarks_import_progress' WebSocket action is received from the server.  Updates the progress bar and holds onto the batch of imported bookmarks in *message['bookmarks']* until the import is complete.
+        */
+        var b = go.Bookmarks;
+        b.updateProgress('bm_import_progress', message['total'], message['bytes'], 'Importing bookmarks...');
+        b.imported = b.imported.concat(message['bookmarks']);
+    },
+    importComplete: function(message) {
+        /**:GateOne.Bookmarks.importComplete(message)
+
+        Called when the 'terminal:bookmarks_import_result' WebSocket action is received from the server.  Stores the imported bookmarks (which also queues up the retrieval of their icons) and re-draws the bookmarks panel.
+        */
+        var b = go.Bookmarks,
+            count = 0;
+        b.updateProgress('bm_import_progress', 1, 1, 'Importing bookmarks...');
+        if (message['errors'].length) {
+            go.Visual.displayMessage(message['result']);
+        }
+        count = b.storeBookmarks(b.imported, true);
+        b.imported = [];
+        go.Visual.displayMessage(count+" bookmarks imported.");
+        go.Visual.displayMessage("Bookmark icons will be retrieved in the background");
+    },
     // TODO: Convert this to save the bookmarks locally instead of having to submit them to the server for conversion.
     exportBookmarks: function(/*opt*/bookmarks) {
         /**:GateOne.Bookmarks.exportBookmarks([bookmarks])
@@ -41,6 +41,8 @@ import logging
 import gzip
 import time
 import re
+from urllib import quote
+from functools import partial
 from multiprocessing import Process, Queue
 
 # Our stuff
@@ -48,7 +50,7 @@ from gateone import GATEONE_DIR
 from logviewer import flatten_log, get_frames
 from termio import retrieve_first_frame
 from termio import get_or_update_metadata
-from utils import get_translation, json_encode
+from utils import get_translation, json_encode, mkdir_p
 
 _ = get_translation()
 
@@ -62,6 +64,7 @@ import tornado.ioloop
 PLUGIN_PATH = os.path.split(__file__)[0] # Path to this plugin's directory
 SEPARATOR = u"\U000f0f0f" # The character used to separate frames in the log
 PROCS = {} # For tracking/cancelling background processes
+EXPORT_EXPIRATION = 3600 # Seconds exported recordings stay in downloads_dir
 # Matches Gate One's special optional escape sequence (ssh plugin only)
 RE_OPT_SSH_SEQ = re.compile(
     r'.*\x1b\]_\;(ssh\|.+?)(\x07|\x1b\\)', re.MULTILINE|re.DOTALL)
@@ -106,20 +109,7 @@ def get_256_colors(self):
     """
     Returns the rendered 256-color CSS.
     """
-    colors_256_path = self.render_256_colors()
-    filename = os.path.split(colors_256_path)[1]
-    mtime = os.stat(colors_256_path).st_mtime
-    cached_filename = "%s:%s" % (colors_256_path.replace('/', '_'), mtime)
-    cache_dir = self.ws.prefs['*']['gateone']['cache_dir']
-    cached_file_path = os.path.join(cache_dir, cached_filename)
-    if os.path.exists(cached_file_path):
-        with open(cached_file_path) as f:
-            colors_256 = f.read()
-    else:
-        # Debug mode is enabled
-        with open(os.path.join(cache_dir, '256_colors.css')) as f:
-            colors_256 = f.read()
-    return colors_256
+    return self.render_256_colors().data
 
 # WebSocket commands (not the same as handlers)
 def enumerate_logs(self, limit=None):
@@ -491,6 +481,11 @@ def save_log_playback(self, settings):
     settings['gateone_dir'] = GATEONE_DIR
     settings['url_prefix'] = self.ws.settings['url_prefix']
     settings['256_colors'] = get_256_colors(self)
+    settings['downloads_dir'] = None # Send the data over the WebSocket
+    if self.ws.http_downloads_available():
+        # The exported file gets served by DownloadHandler:
+        settings['downloads_dir'] = os.path.join(
+            self.ws.settings['session_dir'], self.ws.session, 'downloads')
     q = Queue()
     global PROC
     PROC = Process(target=_save_log_playback, args=(q, settings))
@@ -504,6 +499,12 @@ def save_log_playback(self, settings):
         """
         io_loop.remove_handler(fd)
         message = q.get()
+        export_path = message['go:save_file'].pop('path', None)
+        if export_path:
+            # Don't leave exported recordings lying around forever
+            io_loop.add_timeout(
+                time.time() + EXPORT_EXPIRATION,
+                partial(remove_export, export_path))
         self.write_message(message)
     # This is kind of neat:  multiprocessing.Queue() instances have an
     # underlying fd that you can access via the _reader:
@@ -511,6 +512,15 @@ def save_log_playback(self, settings):
     PROC.start()
     return
 
+def remove_export(path):
+    """
+    Removes the exported recording at *path* (if it still exists).
+    """
+    try:
+        os.remove(path)
+    except OSError:
+        pass # Already gone (e.g. the session was cleaned up)
+
 def _save_log_playback(queue, settings):
     """
     Writes a JSON-encoded message to the client containing the log in a
@@ -520,7 +530,10 @@ def _save_log_playback(queue, settings):
 
     The difference between this function and :py:meth:`_retrieve_log_playback`
     is that this one instructs the client to save the file to disk instead of
-    opening it in a new window.
+    opening it in a new window.  If *settings['downloads_dir']* is set the
+    rendered HTML is written there and the client is given a URL to download it
+    from (via :class:`gateone.DownloadHandler`) instead of the data itself
+    since recordings can be huge.
 
     :arg settings['log_filename']: The name of the log to display.
     :arg settings['colors']: The CSS color scheme to use when generating output.
@@ -531,11 +544,14 @@ def _save_log_playback(queue, settings):
 
         {
             'result': "Success",
-            'data': <HTML rendered output>,
+            'url': <URL of the rendered output relative to Gate One's URL>,
             'mimetype': 'text/html'
             'filename': <filename of the log recording>
         }
 
+    (with 'data': <HTML rendered output> instead of 'url' if there's no
+    *settings['downloads_dir']*).
+
     It is expected that the client will create a new window with the result of
     this method.
     """
@@ -543,7 +559,6 @@ def _save_log_playback(queue, settings):
     out_dict = {
         'result': "Success",
         'mimetype': 'text/html',
-        'data': "", # Will be replace with the rendered template
     }
     # Local variables
     gateone_dir = settings['gateone_dir']
@@ -599,7 +614,19 @@ def _save_log_playback(queue, settings):
             recording=json_encode(recording),
             url_prefix=url_prefix
         )
-        out_dict['data'] = playback_html
+        downloads_dir = settings['downloads_dir']
+        if downloads_dir:
+            if not os.path.exists(downloads_dir):
+                mkdir_p(downloads_dir)
+            export_path = os.path.join(downloads_dir, out_dict['filename'])
+            with open(export_path, 'wb') as f:
+                f.write(playback_html)
+            del playback_html, recording # Free up the memory ASAP
+            filename = quote(out_dict['filename'])
+            out_dict['url'] = "downloads/%s?filename=%s" % (filename, filename)
+            out_dict['path'] = export_path # Removed before it gets sent
+        else:
+            out_dict['data'] = playback_html
     else:
         out_dict['result'] = _("ERROR: Log not found")
     message = {'go:save_file': out_dict}
@@ -42,20 +42,7 @@ def get_256_colors(self):
     """
     Returns the rendered 256-color CSS.
     """
-    colors_256_path = self.render_256_colors()
-    filename = os.path.split(colors_256_path)[1]
-    mtime = os.stat(colors_256_path).st_mtime
-    cached_filename = "%s:%s" % (colors_256_path.replace('/', '_'), mtime)
-    cache_dir = self.ws.prefs['*']['gateone']['cache_dir']
-    cached_file_path = os.path.join(cache_dir, cached_filename)
-    if os.path.exists(cached_file_path):
-        with open(cached_file_path) as f:
-            colors_256 = f.read()
-    else:
-        # Debug mode is enabled
-        with open(os.path.join(cache_dir, '256_colors.css')) as f:
-            colors_256 = f.read()
-    return colors_256
+    return self.render_256_colors().data
 
 def save_recording(self, settings):
     """
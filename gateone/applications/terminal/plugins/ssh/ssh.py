@@ -43,14 +43,15 @@ __license__ = "GNU AGPLv3 or Proprietary (see LICENSE.txt)"
 __author__ = 'Dan McDougall <daniel.mcdougall@liftoffsoftware.com>'
 
 # Python stdlib
-import os, logging, re
+import os, logging, re, struct, base64, hashlib
 from datetime import datetime, timedelta
 from functools import partial
 
 # Our stuff
 from gateone import BaseHandler
-from utils import get_translation, mkdir_p, shell_command, which, json_encode
+from utils import get_translation, mkdir_p, which, json_encode
 from utils import noop
+from processes import AsyncCommand, ProcessRunner, run_async
 
 _ = get_translation()
 
@@ -62,12 +63,23 @@ import tornado.ioloop
 OPENSSH_VERSION = None
 DROPBEAR_VERSION = None
 PLUGIN_PATH = os.path.split(__file__)[0] # Path to this plugin's directory
-OPEN_SUBCHANNELS = {}
-SUBCHANNEL_TIMEOUT = timedelta(minutes=5) # How long to wait before auto-closing
-READY_STRING = "GATEONE_SSH_EXEC_CMD_CHANNEL_READY"
-READY_MATCH = re.compile("^%s$" % READY_STRING, re.MULTILINE)
-OUTPUT_MATCH = re.compile(
-    "^{rs}.+^{rs}$".format(rs=READY_STRING), re.MULTILINE|re.DOTALL)
+SUBCHANNEL_POOLS = {} # Format: {<ControlMaster socket path>: SubChannelPool}
+# Max number of commands that will run at once over a given ControlMaster
+# (sshd's MaxSessions defaults to 10 and the user's terminals need some too):
+MAX_SUBCHANNELS = 4
+EXEC_TIMEOUT = timedelta(minutes=1) # Commands taking longer will be killed
+MAX_EXEC_OUTPUT = 10*1024*1024 # 10MB (per stream).  Anything more is discarded
+# Format: {<private key path>: (<stat signature>, <identity dict>)}
+IDENTITY_CACHE = {} # Used by get_identities()
+KEYTYPES = { # The names we give the key types inside public keys
+    'ssh-rsa': 'RSA',
+    'ssh-dss': 'DSA',
+    'ssh-ed25519': 'ED25519',
+    'ecdsa-sha2-nistp256': 'ECDSA',
+    'ecdsa-sha2-nistp384': 'ECDSA',
+    'ecdsa-sha2-nistp521': 'ECDSA',
+}
+RANDOMART_SYMBOLS = " .o+=*BOX@%&#/^SE" # Same as OpenSSH
 VALID_PRIVATE_KEY = valid = re.compile(
     r'^-----BEGIN [A-Z]+ PRIVATE KEY-----.*-----END [A-Z]+ PRIVATE KEY-----$',
     re.MULTILINE|re.DOTALL)
@@ -131,26 +143,19 @@ def get_ssh_dir(self):
                 "Using the .ssh directory." % user))
     return users_ssh_dir
 
-def open_sub_channel(self, term):
-    """
-    Opens a sub-channel of communication by executing a new shell on the SSH
-    server using OpenSSH's `Master mode <http://en.wikibooks.org/wiki/OpenSSH/Cookbook/Multiplexing>`_
-    capability (it spawns a new slave) and returns the resulting
-    :class:`termio.Multiplex` instance.  If a slave has already been opened for
-    this purpose it will re-use the existing channel.
-    """
-    logging.debug("open_sub_channel() term: %s" % term)
-    global OPEN_SUBCHANNELS
-    if term in OPEN_SUBCHANNELS and OPEN_SUBCHANNELS[term].isalive():
-        # Use existing sub-channel (much faster this way)
-        return OPEN_SUBCHANNELS[term]
-    # NOTE: When connecting a slave via ssh you can't tell it to execute a
-    # command like you normally can (e.g. 'ssh user@host <some command>').  This
-    # is why we're using the termio.Multiplex.expect() functionality below...
+def get_socket_path(self, term):
+    """
+    Returns the path to the ControlMaster socket of the SSH connection running
+    in *term* and the path to the user's ssh config file as a tuple::
+
+        (<socket path>, <ssh config path>)
+
+    Raises :exc:`SSHMultiplexingException` if *term* isn't connected via ssh.
+    """
     session = self.ws.session
     session_dir = self.ws.settings['session_dir']
     session_path = os.path.join(session_dir, session)
-    if not session_path:
+    if not os.path.isdir(session_path):
         raise SSHMultiplexingException(_(
             "SSH Plugin: Unable to open slave sub-channel."))
     socket_path = None
@@ -160,13 +165,8 @@ def open_sub_channel(self, term):
             # Grab the SSH socket path from the file
             for line in open(os.path.join(session_path, f)):
                 if line.startswith('SSH_SOCKET'):
-                    # NOTE: This will includes quotes (which is fine):
-                    socket_path = line.split('=')[1].strip()
-    # Interesting: When using an existing socket you don't need to give it all
-    # the same options as you used to open it but you still need to give it
-    # *something* in place of the hostname or it will report a syntax error and
-    # print out the help.  So that's why I've put 'go_ssh_remote_cmd' below.
-    # ...but I could have just used 'foo' :)
+                    # NOTE: It's quoted in the file
+                    socket_path = line.split('=', 1)[1].strip().strip('\'"')
     if not socket_path:
         raise SSHMultiplexingException(_(
             "SSH Plugin: Unable to open slave sub-channel."))
@@ -176,138 +176,103 @@ def open_sub_channel(self, term):
         # Create it (an empty one so ssh doesn't error out)
         with open(ssh_config_path, 'w') as f:
             f.write('\n')
-    # Hopefully 'go_ssh_remote_cmd' will be a clear enough indication of
-    # what is going on by anyone that has to review the logs...
-    ssh = which('ssh')
-    ssh_command = "%s -x -S'%s' -F'%s' go_ssh_remote_cmd" % (
-        ssh, socket_path, ssh_config_path)
-    OPEN_SUBCHANNELS[term] = m = self.new_multiplex(
-        ssh_command, "%s (sub)" % term)
-    # Using huge numbers here so we don't miss much (if anything) if the user
-    # executes something like "ps -ef".
-    fd = m.spawn(rows=100, cols=200) # Hopefully 100/200 lines/cols is enough
-    # ...if it isn't, well, that's not really what this is for :)
-    # Set the term title so it gets a proper name in the logs
-    m.writeline(u'echo -e "\\033]0;Term %s sub-channel\\007"' % term)
-    return m
-
-def wait_for_prompt(term, cmd, errorback, callback, m_instance, matched):
-    """
-    Called by :func:`termio.Multiplex.expect` inside of :func:`execute_command`,
-    clears the screen and executes *cmd*.  Also, sets an
-    :func:`~termio.Multiplex.expect` to call :func:`get_cmd_output` when the
-    end of the command output is detected.
-    """
-    logging.debug('wait_for_prompt()')
-    m_instance.term.clear_screen() # Makes capturing just what we need easier
-    getoutput = partial(get_cmd_output, term, errorback, callback)
-    m_instance.expect(OUTPUT_MATCH,
-        getoutput, errorback=errorback, preprocess=False, timeout=10)
-    # Run our command immediately followed by our separation/ready string
-    m_instance.writeline((
-        u'echo -e "{rs}"; ' # Echo the first READY_STRING
-        u'{cmd}; ' # Execute the command in question
-        u'echo -e "{rs}"' # READY_STRING again so we can capture the between
-    ).format(rs=READY_STRING, cmd=cmd))
-
-def get_cmd_output(term, errorback, callback, m_instance, matched):
-    """
-    Captures the output of the command executed inside of
-    :func:`wait_for_prompt` and calls *callback* if it isn't `None`.
-    """
-    logging.debug('get_cmd_output()')
-    cmd_out = [a.rstrip() for a in m_instance.dump() if a.rstrip()]
-    capture = False
-    out = []
-    for line in cmd_out:
-        if not capture and line.startswith(READY_STRING):
-            capture = True
-        elif capture:
-            if READY_STRING in line:
-                break
-            out.append(line)
-    # This is just a silly trick to get the shell timing out/terminating itself
-    # after a timout (so we don't keep the sub-channel open forever).  It is
-    # easier than starting a timeout thread, timer, IOLoop.add_timeout(), etc
-    # (I tried all those and it seemed to result in m_instance never getting
-    # cleaned up properly by the garbage collector--it would leak memory)
-    m_instance.unexpect() # Clear out any existing patterns (i.e. keepalive ;)
-    m_instance.expect( # Add our inactivity timeout
-        "^SUB-CHANNEL INACTIVITY TIMEOUT$", # ^ and $ to prevent accidents ;)
-        noop, # Don't need to do anything since this should never match
-        errorback=timeout_sub_channel,
-        preprocess=False,
-        timeout=SUBCHANNEL_TIMEOUT)
-    m_instance.scheduler.start() # To ensure the timeout occurs
-    cmd_out = "\n".join(out)
-    if callback:
-        callback(cmd_out, None)
+    return (socket_path, ssh_config_path)
 
-def terminate_sub_channel(m_instance):
+class SSHExec(AsyncCommand):
     """
-    Calls `m_instance.terminate()` and deletes it from the OPEN_SUBCHANNELS dict.
-    """
-    logging.debug("terminate_sub_channel()")
-    global OPEN_SUBCHANNELS
-    m_instance.terminate()
-    # Find the Multiplex object inside of OPEN_SUBCHANNELS and remove it
-    for key, value in list(OPEN_SUBCHANNELS.items()):
-        # This will be something like: {1: <Multiplex instance>}
-        if hash(value) == hash(m_instance):
-            # This is necessary so the interpreter can properly collect garbage:
-            del OPEN_SUBCHANNELS[key]
+    Executes *cmd* on the remote host over an existing `Master mode <http://en.wikibooks.org/wiki/OpenSSH/Cookbook/Multiplexing>`_
+    connection (*socket_path*) as a plain exec request (no PTY, no terminal
+    emulation) and collects its stdout and stderr via the IOLoop.  When the
+    command completes (or after *timeout*) *callback* will be called like so::
 
-def timeout_sub_channel(m_instance):
-    """
-    Called when the sub-channel times out by way of an
-    :class:`termio.Multiplex.expect` pattern that should never match anything.
+        callback(stdout, stderr, exitstatus)
+
+    If the command couldn't be executed or was killed because it took too long
+    *exitstatus* will be `None` and *stderr* will explain what happened.
+
+    .. note:: Only the first *max_output* bytes of each stream are kept.
     """
-    logging.debug(_(
-        "Sub-channel on term %s closed due to inactivity."
-        % repr(m_instance.term_id)))
-    terminate_sub_channel(m_instance)
+    def __init__(self, socket_path, config_path, cmd, callback,
+            timeout=EXEC_TIMEOUT, max_output=MAX_EXEC_OUTPUT, io_loop=None):
+        self.socket_path = socket_path
+        self.config_path = config_path
+        self.cmd = cmd
+        # Interesting: When using an existing socket you don't need to give it
+        # all the same options as you used to open it but you still need to
+        # give it *something* in place of the hostname.  Hopefully
+        # 'go_ssh_remote_cmd' makes it clear what's going on in the logs.
+        args = [
+            which('ssh'), '-x', '-T', '-oBatchMode=yes',
+            '-S', socket_path, '-F', config_path,
+            'go_ssh_remote_cmd', cmd]
+        AsyncCommand.__init__(self, args, callback,
+            timeout=timeout, max_output=max_output, io_loop=io_loop)
+        self.name = 'ssh'
 
-def got_error(self, m_instance, match=None, term=None, cmd=None):
+class SubChannelPool(ProcessRunner):
     """
-    Called if :func:`execute_command` encounters a problem/timeout.
+    Runs commands (as :class:`SSHExec` instances) over the ControlMaster
+    connection at *socket_path*.  No more than *limit* commands will run at a
+    time; the rest wait their turn.
 
-    *match* is here in case we want to use it for a positive match of an error.
+    .. note:: Since OpenSSH multiplexes each command over the already-authenticated master connection there's no need to keep shells around (warm) between commands: Starting a new exec session is nearly as quick as writing to an existing shell.
     """
-    logging.error(_(
-        "%s: Got an error trying to capture output inside of "
-        "execute_command() running: %s" % (m_instance.user, m_instance.cmd)))
-    logging.debug("output before error: %s" % m_instance.dump())
-    terminate_sub_channel(m_instance)
-    if self:
-        message = {
-            'terminal:sshjs_cmd_output': {
-                'cmd': cmd,
-                'term': term,
-                'output': None,
-                'result': _(
-                    'Error: Timeout exceeded or command failed to execute.')
-            }
-        }
-        self.write_message(message)
+    def __init__(self, socket_path, config_path, limit=MAX_SUBCHANNELS):
+        ProcessRunner.__init__(self, limit=limit)
+        self.socket_path = socket_path
+        self.config_path = config_path
+
+    def execute(self, cmd, callback, timeout=EXEC_TIMEOUT):
+        """
+        Executes *cmd* and calls ``callback(stdout, stderr, exitstatus)`` when
+        it completes (see :class:`SSHExec`).
+        """
+        self.submit(SSHExec(self.socket_path, self.config_path, cmd, callback,
+            timeout=timeout, io_loop=self.io_loop))
+
+    def _finished(self, job, callback, stdout, stderr, exitstatus):
+        """
+        Logs ssh errors and removes this pool from :data:`SUBCHANNEL_POOLS` if
+        there's nothing left to do.
+        """
+        if exitstatus == 255: # ssh's own exit code when it fails
+            logging.error(_(
+                "SSH Plugin: Error executing '%s' via %s: %s" % (
+                job.cmd, self.socket_path, stderr)))
+        ProcessRunner._finished(
+            self, job, callback, stdout, stderr, exitstatus)
+        if not self.running and not self.waiting:
+            if SUBCHANNEL_POOLS.get(self.socket_path) is self:
+                del SUBCHANNEL_POOLS[self.socket_path]
+
+def get_subchannel_pool(self, term):
+    """
+    Returns the :class:`SubChannelPool` for the SSH connection running in
+    *term* (creating it if necessary).
+    """
+    socket_path, config_path = get_socket_path(self, term)
+    if socket_path not in SUBCHANNEL_POOLS:
+        SUBCHANNEL_POOLS[socket_path] = SubChannelPool(socket_path, config_path)
+    return SUBCHANNEL_POOLS[socket_path]
 
 def execute_command(self, term, cmd, callback=None):
     """
     Execute the given command (*cmd*) on the given *term* using the existing
     SSH tunnel (taking advantage of `Master mode <http://en.wikibooks.org/wiki/OpenSSH/Cookbook/Multiplexing>`_)
-    and call *callback* with the output of said command and the current
-    :class:`termio.Multiplex` instance as arguments like so::
+    and call *callback* with the output of said command like so::
 
-        callback(output, m_instance)
+        callback(stdout, stderr, exitstatus)
 
-    If *callback* is not provided then the command will be executed and any
-    output will be ignored.
+    If the command could not be executed (or timed out) *exitstatus* will be
+    `None` and *stderr* will contain the reason.  If *callback* is not provided
+    then the command will be executed and any output will be ignored.
 
     .. note:: This will not result in a new terminal being opened on the client--it simply executes a command and returns the result using the existing SSH tunnel.
     """
     logging.debug(
         "execute_command(): term: %s, cmd: %s" % (term, cmd))
     try:
-        m = open_sub_channel(self, term)
+        pool = get_subchannel_pool(self, term)
     except SSHMultiplexingException as e:
         logging.error(_(
             "%s: Got an error trying to open sub-channel on term %s..." %
@@ -326,33 +291,26 @@ def execute_command(self, term, cmd, callback=None):
         except: # This is really just a last-ditch thing
             pass
         return
-    # NOTE: We can assume the IOLoop is started and automatically calling read()
-    m.unexpect() # Clear out any existing patterns (if existing sub-channel)
-    m.term.clear_screen() # Clear the screen so nothing mucks up our regexes
-    # Check to make sure we've got a proper prompt by executing an echo
-    # statement and waiting for it to complete.  This is more reliable than
-    # using a regular expression to match a shell prompt (which could be set
-    # to anything).  It also gives us a clear indication as to where the command
-    # output begins and ends.
-    errorback = partial(got_error, self, term=term, cmd=cmd)
-    wait = partial(wait_for_prompt, term, cmd, errorback, callback)
-    m.expect(READY_MATCH,
-        callback=wait, errorback=errorback, preprocess=False, timeout=10)
-    logging.debug("Waiting for READY_MATCH inside execute_command()")
-    m.writeline(u'echo -e "\\n%s"' % READY_STRING)
-
-def send_result(self, term, cmd, output, m_instance):
-    """
-    Called by :func:`ws_exec_command` when the output of the executed command
-    has been captured successfully.  Writes a message to the client with the
-    command's output and some relevant metadata.
+    pool.execute(cmd, callback or noop)
+
+def send_result(self, term, cmd, output, errors, exitstatus):
+    """
+    Called by :func:`ws_exec_command` when the command has completed.  Writes
+    a message to the client with the command's output, errors (stderr), exit
+    status, and some relevant metadata.
     """
+    if exitstatus is None:
+        result = _('Error: %s' % errors)
+    else:
+        result = 'Success'
     message = {
         'terminal:sshjs_cmd_output': {
             'term': term,
             'cmd': cmd,
             'output': output,
-            'result': 'Success'
+            'errors': errors,
+            'exitstatus': exitstatus,
+            'result': result
         }
     }
     self.write_message(message)
@@ -632,6 +590,20 @@ def finished(self, m_instance, fingerprint):
     m_instance.terminate()
     self.write_message(message)
 
+def parse_openssh_version(version_string):
+    """
+    Returns the version of OpenSSH in *version_string* (the output of
+    ``ssh -V``) as a float (e.g. 'OpenSSH_5.9p1 Debian-5ubuntu1, ...' -> 5.9).
+    Returns 0.0 if the version could not be determined.
+    """
+    match = re.match(r'OpenSSH_(\d+)\.(\d)', version_string.strip())
+    if not match:
+        logging.error(_(
+            "SSH Plugin: Unable to determine the version of OpenSSH from: %s"
+            % version_string))
+        return 0.0
+    return float("%s.%s" % match.groups())
+
 def openssh_generate_new_keypair(self, name, path,
         keytype=None, passphrase="", bits=None, comment=""):
     """
@@ -645,16 +617,20 @@ def openssh_generate_new_keypair(self, name, path,
     .. note:: Defaults to generating a 521-byte ecdsa key if OpenSSH is version 5.7+. Otherwise a 2048-bit rsa key will be used.
     """
     logging.debug('openssh_generate_new_keypair()')
-    openssh_version = shell_command('ssh -V')[1]
-    ssh_major_version = int(
-        openssh_version.split()[0].split('_')[1].split('.')[0])
+    global OPENSSH_VERSION
+    if OPENSSH_VERSION is None:
+        # Find out (once) without blocking then try again
+        def got_version(stdout, stderr, exitstatus):
+            global OPENSSH_VERSION
+            OPENSSH_VERSION = parse_openssh_version(stderr or stdout)
+            openssh_generate_new_keypair(self, name, path, keytype=keytype,
+                passphrase=passphrase, bits=bits, comment=comment)
+        run_async([which('ssh'), '-V'], got_version,
+            timeout=timedelta(seconds=10))
+        return
     key_path = os.path.join(path, name)
-    ssh_minor_version = int(
-        openssh_version.split()[0].split('_')[1].split('.')[1][0])
-    ssh_version = "%s.%s" % (ssh_major_version, ssh_minor_version)
-    ssh_version = float(ssh_version)
     if not keytype:
-        if ssh_version >= 5.7:
+        if OPENSSH_VERSION >= 5.7:
             keytype = "ecdsa"
         else:
             keytype = "rsa"
@@ -917,6 +893,274 @@ def delete_identity(self, name):
     }
     self.write_message(message)
 
+def _read_string(data, offset):
+    """
+    Returns the SSH wire-format string (length-prefixed) at *offset* in *data*
+    along with the offset of whatever comes after it.
+    """
+    length = struct.unpack('>I', data[offset:offset+4])[0]
+    offset += 4
+    if offset + length > len(data):
+        raise ValueError(_("Truncated key data"))
+    return (data[offset:offset+length], offset + length)
+
+def _mpint_bits(mpint):
+    """
+    Returns the number of bits in *mpint* (an SSH wire-format big integer).
+    """
+    mpint = mpint.lstrip(b'\x00')
+    if not mpint:
+        return 0
+    first = ord(mpint[0:1])
+    return (len(mpint) - 1) * 8 + len(bin(first)) - 2
+
+def parse_public_key(blob):
+    """
+    Parses *blob* (a decoded public key or certificate in SSH wire format) and
+    returns a dict like this::
+
+        {'type': 'ssh-rsa', 'keytype': 'RSA', 'bits': 2048, 'cert': False}
+
+    Certificates will also include 'key' (the certified key as its own blob)
+    and 'offset' (where the certificate-specific fields begin).  Raises
+    `ValueError` if the key can't be parsed.
+    """
+    key_type, offset = _read_string(blob, 0)
+    key_type = key_type.decode('ascii')
+    out = {'type': key_type, 'cert': False}
+    base_type = key_type
+    if key_type.endswith('-cert-v01@openssh.com'):
+        base_type = key_type[:-len('-cert-v01@openssh.com')]
+        out['cert'] = True
+        nonce, offset = _read_string(blob, offset)
+    key_start = offset
+    if base_type == 'ssh-rsa':
+        e, offset = _read_string(blob, offset)
+        n, offset = _read_string(blob, offset)
+        out['bits'] = _mpint_bits(n)
+    elif base_type == 'ssh-dss':
+        p, offset = _read_string(blob, offset)
+        out['bits'] = _mpint_bits(p)
+        for i in range(3): # q, g, y
+            value, offset = _read_string(blob, offset)
+    elif base_type.startswith('ecdsa-sha2-nistp'):
+        curve, offset = _read_string(blob, offset)
+        point, offset = _read_string(blob, offset)
+        out['bits'] = int(base_type[len('ecdsa-sha2-nistp'):])
+    elif base_type == 'ssh-ed25519':
+        point, offset = _read_string(blob, offset)
+        out['bits'] = 256
+    else:
+        raise ValueError(_("Unsupported key type: %s" % key_type))
+    out['keytype'] = KEYTYPES[base_type]
+    if out['cert']:
+        # Re-assemble the certified key so it can be fingerprinted
+        encoded_type = base_type.encode('ascii')
+        out['key'] = (struct.pack('>I', len(encoded_type)) + encoded_type +
+            blob[key_start:offset])
+        out['offset'] = offset
+    return out
+
+def md5_fingerprint(blob):
+    """
+    Returns the MD5 fingerprint of *blob* (a public key in SSH wire format)
+    like ssh-keygen does (e.g. '83:f5:b1:...').
+    """
+    digest = hashlib.md5(blob).hexdigest()
+    return ':'.join(digest[i:i+2] for i in range(0, len(digest), 2))
+
+def sha256_fingerprint(blob):
+    """
+    Returns the SHA256 fingerprint of *blob* (a public key in SSH wire format)
+    like newer versions of ssh-keygen do (e.g. 'SHA256:bQ9lgAhj...').
+    """
+    digest = base64.b64encode(hashlib.sha256(blob).digest())
+    return 'SHA256:%s' % digest.decode('ascii').rstrip('=')
+
+def bubblebabble(blob):
+    """
+    Returns the bubblebabble representation of the SHA-1 digest of *blob*
+    (what ``ssh-keygen -B`` outputs).
+    """
+    vowels = 'aeiouy'
+    consonants = 'bcdfghklmnprstvzx'
+    digest = bytearray(hashlib.sha1(blob).digest())
+    rounds = len(digest) // 2 + 1
+    seed = 1
+    out = ['x']
+    for i in range(rounds):
+        if i + 1 < rounds or len(digest) % 2:
+            byte1 = digest[2*i]
+            out.append(vowels[(((byte1 >> 6) & 3) + seed) % 6])
+            out.append(consonants[(byte1 >> 2) & 15])
+            out.append(vowels[((byte1 & 3) + seed // 6) % 6])
+            if i + 1 < rounds:
+                byte2 = digest[2*i + 1]
+                out.append(consonants[(byte2 >> 4) & 15])
+                out.append('-')
+                out.append(consonants[byte2 & 15])
+                seed = (seed * 5 + byte1 * 7 + byte2) % 36
+        else:
+            out.append(vowels[seed % 6])
+            out.append(consonants[16])
+            out.append(vowels[seed // 6])
+    out.append('x')
+    return ''.join(out)
+
+def randomart(blob, keytype, bits):
+    """
+    Returns the "randomart" picture of the MD5 fingerprint of *blob* (the
+    OpenSSH "drunken bishop" algorithm) with *keytype* and *bits* in the
+    title--just like ``ssh-keygen -E md5 -lv``.
+    """
+    width, height = 17, 9
+    field = [[0] * height for i in range(width)]
+    top = len(RANDOMART_SYMBOLS) - 1 # The 'E' (where the bishop stopped)
+    x, y = width // 2, height // 2
+    for byte in bytearray(hashlib.md5(blob).digest()):
+        for i in range(4):
+            x += 1 if byte & 0x1 else -1
+            y += 1 if byte & 0x2 else -1
+            x = min(max(x, 0), width - 1)
+            y = min(max(y, 0), height - 1)
+            if field[x][y] < top - 2:
+                field[x][y] += 1
+            byte >>= 2
+    field[width // 2][height // 2] = top - 1 # 'S' (where it started)
+    field[x][y] = top
+    def border(title):
+        left = (width - len(title)) // 2
+        return '+%s%s%s+' % (
+            '-' * left, title, '-' * (width - left - len(title)))
+    lines = [border('[%s %s]' % (keytype, bits))]
+    for row in range(height):
+        lines.append('|%s|' % ''.join(
+            RANDOMART_SYMBOLS[field[col][row]] for col in range(width)))
+    lines.append(border('[MD5]'))
+    return '\n'.join(lines)
+
+def certificate_info(blob):
+    """
+    Returns a human-readable description of the OpenSSH certificate in *blob*
+    (similar to ``ssh-keygen -L``).
+    """
+    key = parse_public_key(blob)
+    offset = key['offset']
+    serial, cert_type = struct.unpack('>QI', blob[offset:offset+12])
+    key_id, offset = _read_string(blob, offset + 12)
+    principals_data, offset = _read_string(blob, offset)
+    valid_after, valid_before = struct.unpack('>QQ', blob[offset:offset+16])
+    critical_data, offset = _read_string(blob, offset + 16)
+    extensions_data, offset = _read_string(blob, offset)
+    reserved, offset = _read_string(blob, offset)
+    ca_blob, offset = _read_string(blob, offset)
+    def names(data):
+        out = []
+        index = 0
+        while index < len(data):
+            name, index = _read_string(data, index)
+            out.append(name.decode('utf-8', 'replace'))
+        return out
+    def options(data):
+        out = []
+        index = 0
+        while index < len(data):
+            name, index = _read_string(data, index)
+            value, index = _read_string(data, index)
+            out.append(name.decode('utf-8', 'replace'))
+        return out
+    def timestamp(seconds):
+        if seconds >= 0xFFFFFFFFFFFFFFFF:
+            return 'forever'
+        return datetime.utcfromtimestamp(seconds).isoformat()
+    if valid_after == 0 and valid_before >= 0xFFFFFFFFFFFFFFFF:
+        validity = 'forever'
+    else:
+        validity = 'from %s to %s' % (
+            timestamp(valid_after), timestamp(valid_before))
+    ca = parse_public_key(ca_blob)
+    lines = [
+        'Type: %s %s certificate' % (
+            key['type'], 'host' if cert_type == 2 else 'user'),
+        'Public key: %s-CERT %s' % (
+            key['keytype'], md5_fingerprint(key['key'])),
+        'Signing CA: %s %s' % (ca['keytype'], md5_fingerprint(ca_blob)),
+        'Key ID: "%s"' % key_id.decode('utf-8', 'replace'),
+        'Serial: %s' % serial,
+        'Valid: %s' % validity,
+    ]
+    for title, values in (
+            ('Principals', names(principals_data)),
+            ('Critical Options', options(critical_data)),
+            ('Extensions', options(extensions_data))):
+        if values:
+            lines.append('%s: ' % title)
+            lines.extend(' %s' % a for a in values)
+        else:
+            lines.append('%s: (none)' % title)
+    return '\n'.join(lines) + '\n'
+
+def identity_info(id_path):
+    """
+    Returns a dict of information about the identity (private key) at
+    *id_path* using its public key (*id_path*.pub) and certificate
+    (*id_path*-cert.pub, if present).  Everything is worked out by parsing the
+    keys directly (no ssh-keygen) and the result is cached in
+    :data:`IDENTITY_CACHE` until one of those files changes.
+    """
+    pub_key_path = id_path + '.pub'
+    cert_path = id_path + '-cert.pub'
+    signature = []
+    for path in (pub_key_path, cert_path):
+        try:
+            st = os.stat(path)
+            signature.append((st.st_ino, st.st_size, st.st_mtime))
+        except OSError:
+            signature.append(None)
+    signature = tuple(signature)
+    cached = IDENTITY_CACHE.get(id_path)
+    if cached and cached[0] == signature:
+        return dict(cached[1])
+    with open(pub_key_path) as f:
+        public_key_contents = f.read()
+    fields = public_key_contents.split()
+    info = {
+        'public': public_key_contents,
+        'comment': ' '.join(public_key_contents.split(' ')[2:]).rstrip(),
+        'keytype': 'Unknown',
+        'bits': '',
+        'fingerprint': '',
+        'sha256_fingerprint': '',
+        'bubblebabble': '',
+        'randomart': '',
+        'certinfo': '',
+    }
+    try:
+        blob = base64.b64decode(fields[1])
+        key = parse_public_key(blob)
+        info.update({
+            'keytype': key['keytype'],
+            'bits': str(key['bits']),
+            'fingerprint': md5_fingerprint(blob),
+            'sha256_fingerprint': sha256_fingerprint(blob),
+            'bubblebabble': bubblebabble(blob),
+            'randomart': randomart(blob, key['keytype'], key['bits']),
+        })
+    except (IndexError, ValueError, KeyError, TypeError, struct.error) as e:
+        logging.warning(_("Could not parse public key %s: %s" % (
+            pub_key_path, e)))
+    if signature[1]: # There's a certificate
+        try:
+            with open(cert_path) as f:
+                info['certinfo'] = certificate_info(
+                    base64.b64decode(f.read().split()[1]))
+        except (IndexError, ValueError, KeyError, TypeError, struct.error,
+                IOError) as e:
+            logging.warning(_("Could not parse certificate %s: %s" % (
+                cert_path, e)))
+    IDENTITY_CACHE[id_path] = (signature, info)
+    return dict(info)
+
 def get_identities(self, anything):
     """
     Sends a message to the client with a list of the identities stored on the
@@ -924,73 +1168,28 @@ def get_identities(self, anything):
 
     *anything* is just there because the client needs to send *something* along
     with the 'action'.
+
+    .. note:: The information about each identity comes from :func:`identity_info` (which caches it).
     """
     logging.debug('get_identities()')
     out_dict = {'result': 'Success'}
     users_ssh_dir = get_ssh_dir(self)
     out_dict['identities'] = []
-    ssh_keygen_path = which('ssh-keygen')
-    keytype_re = re.compile('.*\(([A-Z]+)\)$', re.MULTILINE)
-    # TODO:  Switch this from using ssh-keygen to determine the keytype to using the string inside the public key.
     try:
         if os.path.exists(users_ssh_dir):
             ssh_files = os.listdir(users_ssh_dir)
             for f in ssh_files:
-                if f.endswith('.pub'):
+                if f.endswith('.pub') and not f.endswith('-cert.pub'):
                     # Double-check there's also a private key...
                     identity = f[:-4] # Will be the same name minus '.pub'
                     if identity in ssh_files:
                         id_path = os.path.join(users_ssh_dir, identity)
-                        pub_key_path = os.path.join(users_ssh_dir, f)
-                        public_key_contents = open(pub_key_path).read()
-                        comment = ' '.join(public_key_contents.split(' ')[2:])
-                        if public_key_contents.startswith('ecdsa'):
-                            keytype = 'ECDSA'
-                        elif public_key_contents.startswith('ssh-dss'):
-                            keytype = 'DSA'
-                        elif public_key_contents.startswith('ssh-rsa'):
-                            keytype = 'RSA'
-                        else:
-                            keytype = 'Unknown'
-                        keygen_cmd = "'%s' -vlf '%s'" % (
-                            ssh_keygen_path, id_path)
-                        retcode, key_info = shell_command(keygen_cmd)
-                        # This will just wind up as an empty string if the
-                        # version of ssh doesn't support randomart:
-                        randomart = '\n'.join(key_info.splitlines()[1:])
-                        bits = key_info.split()[0]
-                        fingerprint = key_info.split()[1]
-                        retcode, bubblebabble = shell_command(
-                            "'%s' -Bf '%s'" % (ssh_keygen_path, id_path))
-                        bubblebabble = bubblebabble.split()[1]
-                        certinfo = ''
-                        cert_path = "'%s-cert.pub'" % id_path
-                        if os.path.exists(cert_path):
-                            retcode, certinfo = shell_command(
-                            "'%s' -Lf '%s'" % (ssh_keygen_path, cert_path))
-                        certinfo = ' '.join(certinfo.split(' ')[1:])
-                        fixed_certinfo = ''
-                        for i, line in enumerate(certinfo.splitlines()):
-                            if i == 0:
-                                line = line.lstrip()
-                            fixed_certinfo += line.replace('    ', ' ')
-                            fixed_certinfo += '\n'
-                        id_obj = {
-                            'name': identity,
-                            'public': public_key_contents,
-                            'keytype': keytype,
-                            'bubblebabble': bubblebabble,
-                            'fingerprint': fingerprint,
-                            'randomart': randomart,
-                            'certinfo': fixed_certinfo,
-                            'bits': bits,
-                            'comment': comment.rstrip(),
-                        }
+                        id_obj = identity_info(id_path)
+                        id_obj['name'] = identity
                         out_dict['identities'].append(id_obj)
         # Figure out which identities are defaults
         default_ids = []
         default_ids_exists = False
-        users_ssh_dir = get_ssh_dir(self)
         default_ids_path = os.path.join(users_ssh_dir, '.default_ids')
         if os.path.exists(default_ids_path):
             default_ids_exists = True
@@ -1128,6 +1327,7 @@ hooks = {
     #'keytype': "ecdsa",
     #'bubblebabble': "xevol-budez-difod-zumif-zofos-vezis-rilep-febel-tufok-lugud-dyxex",
     #'fingerprint': "0e:69:0a:9e:2e:26:2b:91:23:3d:95:4b:65:31:a9:6f",
+    #'sha256_fingerprint': "SHA256:y7C6NQJUrOO5zAg9FIAjZdotTt+ogZN74SkqNGEB1VA",
     #'randomart': "+--[ECDSA  521]---+\n|      oo         |\n|      +.         |\n|     =           |\n|    =  .         |\n| o.o o+ S        |\n|=.oo.oEo         |\n|.oo...  .        |\n|+o               |\n|=o.              |\n+-----------------+",
     #'certinfo': "",
     #'bits': 521,
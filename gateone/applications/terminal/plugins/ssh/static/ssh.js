@@ -447,6 +447,7 @@ go.Base.update(go.SSH, {
             'Keytype': IDObj['keytype'],
             'Bits': IDObj['bits'],
             'Fingerprint': IDObj['fingerprint'],
+            'SHA256 Fingerprint': IDObj['sha256_fingerprint'],
             'Comment': IDObj['comment'],
             'Bubble Babble': IDObj['bubblebabble'],
         };
@@ -1171,14 +1172,16 @@ go.Base.update(go.SSH, {
                 'term': 1,
                 'cmd': 'uptime',
                 'output': ' 20:45:27 up 13 days,  3:44,  9 users,  load average: 1.21, 0.79, 0.57',
+                'errors': '',
+                'exitstatus': 0,
                 'result', 'Success'
             }
 
-        If 'result' is anything other than 'Success' the error will be displayed to the user.
+        'output' and 'errors' are the command's complete stdout and stderr.  If 'result' is anything other than 'Success' (the command couldn't be executed or timed out) the error will be displayed to the user.
 
         If a callback was registered in :js:attr:`GateOne.SSH.remoteCmdCallbacks[term]` it will be called like so::
 
-            callback(message['output'])
+            callback(message['output'], message)
 
         Otherwise the output will just be displayed to the user.  After the callback has executed it will be removed from `GateOne.SSH.remoteCmdCallbacks`.
         */
@@ -1195,7 +1198,7 @@ go.Base.update(go.SSH, {
             return;
         }
         if (go.SSH.remoteCmdCallbacks[term][cmd]) {
-            go.SSH.remoteCmdCallbacks[term][cmd](output);
+            go.SSH.remoteCmdCallbacks[term][cmd](output, message);
             delete go.SSH.remoteCmdCallbacks[term][cmd];
         } else { // If you don't have an associated callback it will display and log the output:  VERY useful in debugging!
             v.displayMessage("Remote command output from terminal " + term + ": " + output);
@@ -0,0 +1,226 @@
+# -*- coding: utf-8 -*-
+#
+#       Copyright 2013 Liftoff Software Corporation
+#
+# For license information see LICENSE.txt
+
+__doc__ = """\
+assets.py - Combines Gate One's JavaScript and CSS files into content-hashed
+bundles.
+
+Instead of sending clients dozens of individual .js and .css files (each with
+its own 'go:file_sync' message) the files belonging to an application or a set
+of plugins are concatenated (in order) into a single bundle.  Each bundle is
+minified (if possible) when it is built--normally at startup via
+:func:`get_bundle` calls made by `main()` and the applications'
+`build_assets()` functions--and kept in memory along with a gzip-compressed
+copy.  Bundle filenames include a hash of their contents (e.g.
+'terminal_3f2a9b1c04.js') so clients only ever need to download a bundle once
+per version.
+
+Bundles are automatically rebuilt (on next use) whenever a file in one of the
+directories they were built from changes.
+
+Rendered CSS templates (themes, text color schemes, application and plugin
+stylesheets) are kept in memory too:  :func:`render_style` caches the result of
+rendering a template (as a :class:`Bundle`) by its path, modification time, and
+template arguments in a size-limited :class:`LRUCache` so that sending a theme to
+a client is (nearly always) just a dictionary lookup.
+"""
+
+# Meta
+__version__ = '1.0'
+__version_info__ = (1, 0)
+__license__ = "AGPLv3 or Proprietary (see LICENSE.txt)"
+__author__ = 'Dan McDougall <daniel.mcdougall@liftoffsoftware.com>'
+
+# Import stdlib stuff
+import os
+import io
+import gzip
+import logging
+import tempfile
+from hashlib import md5
+
+# Import our own stuff
+from utils import get_or_cache, mkdir_p, minify as _minify, LRUCache
+from watcher import get_file_watcher
+
+# Import 3rd party stuff
+from tornado.escape import utf8
+
+# Globals
+BUNDLES = {} # Format: {(<name>, <paths tuple>, <minify>): <Bundle>}
+BUNDLES_BY_FILENAME = {} # Format: {<bundle filename>: <Bundle>}
+FILE_LISTS = {} # Cached results of static_files() and plugin_static_files()
+WATCHED_DIRS = set() # Directories we've asked the file watcher to watch
+
+# Format: {(<template path>, <mtime>, <template args>, <minify>): <Bundle>}
+STYLES = LRUCache(256)
+# Format: {(<theme name>, <template args>, <minify>): <Bundle>}
+THEMES = LRUCache(64)
+
+class Bundle(object):
+    """
+    A concatenation of the files at *paths* (list) of the given *kind* ('js' or
+    'css') with the contents *data*.  Attributes:
+
+        * `name`: The name the bundle was built with (e.g. 'terminal').
+        * `hash`: The first 10 characters of the md5 of *data*.
+        * `filename`: The content-hashed filename (e.g. 'terminal_3f2a9b1c04.js').
+        * `data`: The bundle's contents (bytes).
+        * `gzip`: The gzip-compressed contents (bytes).
+    """
+    def __init__(self, name, kind, paths, data):
+        self.name = name
+        self.kind = kind
+        self.paths = paths
+        self.data = utf8(data)
+        self.hash = md5(self.data).hexdigest()[:10]
+        self.filename = "%s_%s.%s" % (name, self.hash, kind)
+        out = io.BytesIO()
+        gzipper = gzip.GzipFile(fileobj=out, mode='wb')
+        gzipper.write(self.data)
+        gzipper.close()
+        self.gzip = out.getvalue()
+
+    def __repr__(self):
+        return "<Bundle %s (%s files, %s bytes, %s gzipped)>" % (
+            self.filename, len(self.paths), len(self.data), len(self.gzip))
+
+def get_cache_dir(settings):
+    """
+    Returns the `cache_dir` configured in *settings* (the full settings
+    :class:`RUDict`) or the default if not set.
+    """
+    default = os.path.join(tempfile.gettempdir(), 'gateone_cache')
+    return settings['*'].get('gateone', {}).get('cache_dir', default)
+
+def invalidate_bundles():
+    """
+    Forgets all built bundles and combined themes so they'll be rebuilt the
+    next time they're requested.  Called by the file watcher when a bundled
+    file changes.
+
+    .. note:: Entries in `STYLES` don't need to be cleared since they're keyed by modification time (old versions will just fall out of the cache).
+    """
+    logging.debug("invalidate_bundles()")
+    BUNDLES.clear()
+    BUNDLES_BY_FILENAME.clear()
+    FILE_LISTS.clear()
+    THEMES.clear()
+
+def watch_dirs(directories):
+    """
+    Makes sure the given *directories* are being watched so that bundles (and
+    cached file lists) get invalidated when anything inside them changes.
+    """
+    for directory in set(directories):
+        if directory not in WATCHED_DIRS:
+            WATCHED_DIRS.add(directory)
+            get_file_watcher().watch(directory, invalidate_bundles)
+
+def get_bundle(name, kind, paths, cache_dir, minify=True):
+    """
+    Returns a :class:`Bundle` named *name* of the given *kind* ('js' or 'css')
+    containing the files at *paths* (in order).  Bundles are built (and
+    minified if *minify* is `True`) the first time they're requested and cached
+    in memory thereafter.
+    """
+    key = (name, tuple(paths), minify)
+    if key in BUNDLES:
+        return BUNDLES[key]
+    if not os.path.exists(cache_dir):
+        mkdir_p(cache_dir)
+    parts = []
+    for path in paths:
+        parts.append(utf8(get_or_cache(cache_dir, path, minify=minify)))
+    # The semicolon keeps one script's trailing expression from running into
+    # the next one's leading parenthesis:
+    separator = b";\n" if kind == 'js' else b"\n"
+    bundle = Bundle(name, kind, list(paths), separator.join(parts))
+    logging.debug("Built %s" % bundle)
+    BUNDLES[key] = bundle
+    BUNDLES_BY_FILENAME[bundle.filename] = bundle
+    watch_dirs(os.path.dirname(a) for a in paths)
+    return bundle
+
+def static_files(static_dir, kind, first=None):
+    """
+    Returns a sorted list of the paths of all files of the given *kind* ('js' or
+    'css') in *static_dir*.  If *first* (a filename) is given it will be moved
+    to the front of the list.
+    """
+    key = ('static', static_dir, kind, first)
+    if key in FILE_LISTS:
+        return FILE_LISTS[key]
+    out = []
+    if os.path.isdir(static_dir):
+        ext = '.%s' % kind
+        fnames = sorted(a for a in os.listdir(static_dir) if a.endswith(ext))
+        if first in fnames:
+            fnames.remove(first)
+            fnames.insert(0, first)
+        out = [os.path.join(static_dir, a) for a in fnames]
+        watch_dirs([static_dir])
+    FILE_LISTS[key] = out
+    return out
+
+def plugins_bundle_name(plugins_dir):
+    """
+    Returns the name to use for the bundle of the plugins in *plugins_dir*
+    which is based on the name of the directory containing it.  For example,
+    '/opt/gateone/applications/terminal/plugins' would be 'terminal_plugins'.
+    """
+    parent = os.path.dirname(os.path.abspath(plugins_dir.rstrip(os.sep)))
+    return "%s_plugins" % os.path.basename(parent)
+
+def plugin_static_files(plugins_dir, kind, allowed=None):
+    """
+    Returns a list of the paths of all files of the given *kind* ('js' or
+    'css') in the 'static' directories of the plugins in *plugins_dir*.  If an
+    *allowed* list of plugin names is given only those plugins will be
+    included.
+    """
+    key = ('plugins', plugins_dir, kind, tuple(allowed or ()))
+    if key in FILE_LISTS:
+        return FILE_LISTS[key]
+    out = []
+    if os.path.isdir(plugins_dir):
+        for plugin in sorted(os.listdir(plugins_dir)):
+            if allowed and plugin not in allowed:
+                continue
+            plugin_static_path = os.path.join(plugins_dir, plugin, 'static')
+            out.extend(static_files(plugin_static_path, kind))
+        watch_dirs([plugins_dir]) # So newly-added plugins get noticed
+    FILE_LISTS[key] = out
+    return out
+
+def minify_css(css):
+    """
+    Returns the given *css* (string) minified (if possible).
+    """
+    fileobj = io.BytesIO(utf8(css))
+    fileobj.name = 'rendered.css' # So minify() can log something useful
+    return _minify(fileobj, 'css')
+
+def render_style(name, style_path, render, minify=True, **kwargs):
+    """
+    Returns a :class:`Bundle` named *name* containing the result of
+    ``render(style_path, **kwargs)`` (e.g. `RequestHandler.render_string`),
+    minified if *minify* is `True`.  Results are cached in `STYLES` by
+    *style_path*, its modification time, and *kwargs* (which must be hashable)
+    so each template only gets rendered once per version and set of arguments.
+    """
+    mtime = os.stat(style_path).st_mtime
+    key = (style_path, mtime, tuple(sorted(kwargs.items())), minify)
+    style = STYLES.get(key)
+    if style:
+        return style
+    css = render(style_path, **kwargs)
+    if minify:
+        css = minify_css(css)
+    style = Bundle(name, 'css', [style_path], css)
+    logging.debug("Rendered %s" % style)
+    STYLES[key] = style
+    return style
@@ -76,7 +76,7 @@ import os, logging, re
 
 # Import our own stuff
 from utils import mkdir_p, generate_session_id, noop, RUDict
-from utils import get_translation, memoize
+from utils import get_translation
 
 # 3rd party imports
 import tornado.web
@@ -89,42 +89,88 @@ _ = get_translation()
 # Globals
 GATEONE_DIR = os.path.dirname(os.path.abspath(__file__))
 SETTINGS_CACHE = {} # Lists of settings files and their modification times
+# Compiled policy matchers and resolved policies (see applicable_policies()).
+# Both get emptied by invalidate_policies() whenever the settings are reloaded.
+MATCHER_CACHE = {} # Format: {id(policies): (policies, attributes, matchers)}
+POLICY_CACHE = {}  # Format: {(id(policies), app, user values): <RUDict>}
 # The security stuff below is a work-in-progress.  Likely to change all around.
 
 # Authorization stuff
-@memoize
+def compile_policies(policies):
+    """
+    Pre-compiles the 'user=', 'user.upn=', and 'user.<attribute>=' keys in the
+    given *policies* :class:`RUDict` into regular expressions.  Returns a tuple
+    of `(attributes, matchers)` where *attributes* is a tuple of the user
+    attributes the policies care about and *matchers* is a list of
+    `(key, attribute, compiled regex)` tuples in the order they'll be applied.
+
+    The result is cached until :func:`invalidate_policies` is called.
+    """
+    cached = MATCHER_CACHE.get(id(policies), None)
+    # Keeping a reference to *policies* in the cache guarantees its id() can't
+    # be reused by some other object while the entry exists.
+    if cached and cached[0] is policies:
+        return cached[1], cached[2]
+    attributes = ['upn']
+    matchers = []
+    for key in policies.keys():
+        if key == '*':
+            continue # Default policy is handled separately
+        if key.startswith('user=') or key.startswith('user.upn='):
+            # UPNs are very straightforward
+            upn = key.split('=', 1)[1]
+            matchers.append((key, 'upn', re.compile(upn)))
+        elif key.startswith('user.'):
+            # An attribute check (e.g. 'user.ip_address=10.1.1.1')
+            attribute = key.split('.', 1)[1] # Get rid of the 'user.' part
+            attribute, must_match = attribute.split('=', 1)
+            matchers.append((key, attribute, re.compile(must_match)))
+            if attribute not in attributes:
+                attributes.append(attribute)
+        # TODO: Group stuff here (need attribute repo stuff first)
+    attributes = tuple(attributes)
+    MATCHER_CACHE[id(policies)] = (policies, attributes, matchers)
+    return attributes, matchers
+
+def invalidate_policies():
+    """
+    Empties the compiled policy and resolved policy caches.  Must be called
+    whenever the settings (policies) are reloaded.
+    """
+    MATCHER_CACHE.clear()
+    POLICY_CACHE.clear()
+
 def applicable_policies(application, user, policies):
     """
     Given an *application* and a *user* object, returns the merged/resolved
     policies from the given *policies* :class:`RUDict`.
 
+    Results are cached per application and the values of the user attributes
+    that the policies actually check so repeated calls (e.g. on every
+    keystroke) are just a dict lookup.
+
     .. note:: Policy settings always start with '*', 'user', or 'group'.
     """
+    attributes, matchers = compile_policies(policies)
+    cache_key = (
+        id(policies), application, tuple(user.get(a) for a in attributes))
+    try:
+        return POLICY_CACHE[cache_key]
+    except KeyError:
+        pass
     # Start with the default policy
     try:
         policy = RUDict(policies['*'][application])
     except KeyError:
         # No default policy--not good but not mandatory
         policy = RUDict()
-    for key, value in policies.items():
-        if key == '*':
-            continue # Default policy was already handled
+    for key, attribute, regex in matchers:
+        value = policies[key]
         if application not in value:
             continue # No sense processing inapplicable stuff
-        # Handle users and their properties first
-        if key.startswith('user=') or key.startswith('user.upn='):
-            # UPNs are very straightforward
-            upn = key.split('=', 1)[1]
-            if re.match(upn, user['upn']):
-                policy.update(value[application])
-        elif key.startswith('user.'):
-            # An attribute check (e.g. 'user.ip_address=10.1.1.1')
-            attribute = key.split('.', 1)[1] # Get rid of the 'user.' part
-            attribute, must_match = attribute.split('=', 1)
-            if attribute in user:
-                if re.match(must_match, user[attribute]):
-                    policy.update(value[application])
-        # TODO: Group stuff here (need attribute repo stuff first)
+        if attribute in user and regex.match(user[attribute]):
+            policy.update(value[application])
+    POLICY_CACHE[cache_key] = policy
     return policy
 
 class require(object):
@@ -557,9 +603,14 @@ class SSLAuthHandler(BaseAuthHandler):
         else:
             self.redirect(self.settings['url_prefix'])
 
-# Add our KerberosAuthHandler if sso is available
-KerberosAuthHandler = None
-try:
+# NOTE: The Kerberos and PAM handlers need modules that may not be installed
+# (and are slow to import) so they only get defined if they're actually used.
+# See get_auth_handler().
+def _kerberos_auth_handler():
+    """
+    Returns the :class:`KerberosAuthHandler` class.  Raises `ImportError` if
+    the kerberos module isn't available.
+    """
     from sso import KerberosAuthMixin
     class KerberosAuthHandler(BaseAuthHandler, KerberosAuthMixin):
         """
@@ -609,12 +660,13 @@ try:
                 self.redirect(next_url)
             else:
                 self.redirect(self.settings['url_prefix'])
-except ImportError:
-    pass # No SSO available.
+    return KerberosAuthHandler
 
-# Add our PAMAuthHandler if it's available
-PAMAuthHandler = None
-try:
+def _pam_auth_handler():
+    """
+    Returns the :class:`PAMAuthHandler` class.  Raises `ImportError` (or
+    `OSError` if libpam can't be loaded) if PAM isn't available.
+    """
     from authpam import PAMAuthMixin
     class PAMAuthHandler(BaseAuthHandler, PAMAuthMixin):
         """
@@ -664,5 +716,35 @@ try:
                 self.redirect(next_url)
             else:
                 self.redirect(self.settings['url_prefix'])
-except ImportError:
-    pass # No PAM auth available.
+    return PAMAuthHandler
+
+AUTH_HANDLERS = { # Format: {<auth type (--auth)>: <RequestHandler class>}
+    'none': NullAuthHandler,
+    'api': APIAuthHandler,
+    'google': GoogleAuthHandler,
+    'ssl': SSLAuthHandler,
+}
+OPTIONAL_AUTH_HANDLERS = { # Format: {<auth type>: <function>}
+    'kerberos': _kerberos_auth_handler,
+    'pam': _pam_auth_handler,
+}
+AUTH_TYPES = ['none', 'api', 'google', 'ssl', 'kerberos', 'pam']
+
+def get_auth_handler(auth):
+    """
+    Returns the RequestHandler class that handles the given *auth* type (the
+    value of the --auth option).  Handlers that depend on optional modules
+    (kerberos and pam) are created--and their modules imported--the first time
+    they're requested.  Returns `None` if *auth* is unknown or the modules it
+    needs aren't available.
+    """
+    if not auth:
+        return NullAuthHandler
+    if auth not in AUTH_HANDLERS and auth in OPTIONAL_AUTH_HANDLERS:
+        try:
+            AUTH_HANDLERS[auth] = OPTIONAL_AUTH_HANDLERS[auth]()
+        except (ImportError, OSError) as e:
+            logging.error(_(
+                "Could not load the '%s' authentication type: %s" % (auth, e)))
+            AUTH_HANDLERS[auth] = None
+    return AUTH_HANDLERS.get(auth, None)
@@ -242,6 +242,7 @@ Class Docstrings
 # Standard library modules
 import os
 import sys
+import re
 import logging
 import time
 import socket
@@ -250,9 +251,15 @@ import atexit
 import ssl
 import hashlib
 import time
-from functools import wraps
+from functools import wraps, partial
+from collections import OrderedDict
 from datetime import datetime, timedelta
 
+# Time all imports from here on if --profile_startup was given (see startup.py)
+import startup
+if startup.profiling_requested():
+    startup.start()
+
 # Tornado modules (yeah, we use all this stuff)
 try:
     import tornado.httpserver
@@ -263,7 +270,7 @@ try:
     import tornado.template
     import tornado.netutil
     from tornado.websocket import WebSocketHandler
-    from tornado.escape import json_decode
+    from tornado.escape import json_decode, utf8, to_unicode
     from tornado.options import define, options
     from tornado import locale
     from tornado import version as tornado_version
@@ -284,15 +291,20 @@ if tornado_version_info[0] < 2 and tornado_version_info[1] < 4:
 tornado.options.enable_pretty_logging()
 
 # Our own modules
-from auth import NullAuthHandler, KerberosAuthHandler, GoogleAuthHandler
-from auth import APIAuthHandler, SSLAuthHandler, PAMAuthHandler
+from auth import NullAuthHandler, get_auth_handler, AUTH_TYPES
 from auth import require, authenticated, policies, applicable_policies
-from utils import generate_session_id, mkdir_p
+from auth import invalidate_policies
+from utils import generate_session_id, mkdir_p, short_hash
 from utils import gen_self_signed_ssl, killall, get_plugins, load_modules
 from utils import merge_handlers, none_fix, convert_to_timedelta
 from utils import FACILITIES, json_encode, recursive_chown, ChownError
+from utils import json_encode_message
 from utils import write_pid, read_pid, remove_pid, drop_privileges, minify
 from utils import check_write_permissions, get_applications, get_settings
+from utils import parse_byte_range, human_readable_bytes
+from assets import Bundle, get_bundle, get_cache_dir, plugin_static_files
+from assets import plugins_bundle_name, render_style, watch_dirs
+from assets import BUNDLES_BY_FILENAME, THEMES
 
 # Setup the locale functions before anything else
 locale.set_default_locale('en_US')
@@ -321,6 +333,10 @@ FILE_CACHE = {}
 # PERSIST is a generic place for applications and plugins to store stuff in a
 # way that lasts between page loads.  USE RESPONSIBLY.
 PERSIST = {}
+# REGISTRY keeps track of which node owns which session/terminal (see
+# registry.py).  It gets replaced with a SessionRegistry instance in main().
+REGISTRY = None
+REGISTRY_HEARTBEAT = None # PeriodicCallback that calls REGISTRY.heartbeat()
 APPLICATIONS = {}
 PLUGINS = {}
 PLUGIN_WS_CMDS = {} # Gives plugins the ability to extend/enhance ApplicationWebSocket
@@ -488,7 +504,7 @@ def gateone_policies(cls):
         'list_server_users': policy_list_users
     }
     user = instance.current_user
-    policy = applicable_policies('gateone', user, instance.ws.policies)
+    policy = applicable_policies('gateone', user, instance.prefs)
     if not policy: # Empty RUDict
         return True # A world without limits!
     if function.__name__ in policy_functions:
@@ -530,6 +546,10 @@ def timeout_sessions():
             # in reality people will see an idle gateone.py eating up 30 megs of
             # RAM and wonder, "WTF...  No one has connected in weeks."
             logging.info(_("The last idle session has timed out. Reloading..."))
+            # The media workers would otherwise hang on to our listening
+            # socket (and outlive us):
+            import media
+            media.close_media_pool()
             try:
                 os.execv(sys.executable, [sys.executable] + sys.argv)
             except OSError:
@@ -554,6 +574,8 @@ def timeout_sessions():
                         for callback in SESSIONS[session]["timeout_callbacks"]:
                             callback(session)
                 del SESSIONS[session]
+                if REGISTRY:
+                    REGISTRY.release_session(session)
     except Exception as e:
         logging.info(_(
             "Exception encountered in timeout_sessions(): {exception}".format(
@@ -563,6 +585,63 @@ def timeout_sessions():
         traceback.print_exc(file=sys.stdout)
 
 # Classes
+def setup_registry(settings):
+    """
+    Creates the global `REGISTRY` (see registry.py) using the 'session_registry'
+    related values in *settings*, registers this node, and starts sending
+    heartbeats to the other nodes in the cluster (if any).
+    """
+    global REGISTRY
+    global REGISTRY_HEARTBEAT
+    from registry import get_registry
+    backend = settings.get('session_registry', options.session_registry)
+    node_id = settings.get('node_id', options.node_id)
+    node_url = settings.get('node_url', options.node_url)
+    if not node_url:
+        node_url = "%s://%s:%s%sws" % (
+            'ws' if settings['disable_ssl'] else 'wss',
+            socket.getfqdn(), settings['port'], settings['url_prefix'])
+    node_timeout = convert_to_timedelta(
+        settings.get('node_timeout', options.node_timeout))
+    node_timeout = node_timeout.days * 86400 + node_timeout.seconds
+    path = settings.get('session_registry_path', options.session_registry_path)
+    if not path:
+        path = os.path.join(settings['session_dir'], 'registry.db')
+    REGISTRY = get_registry(backend, node_id,
+        node_url=node_url, node_timeout=node_timeout, path=path)
+    REGISTRY.register_node()
+    logging.info(_("Session registry: %s (node URL: %s)" % (
+        REGISTRY, node_url)))
+    # Heartbeat a few times per timeout period so a single missed beat (e.g.
+    # a busy IOLoop) doesn't make us look dead.
+    REGISTRY_HEARTBEAT = tornado.ioloop.PeriodicCallback(
+        REGISTRY.heartbeat, node_timeout * 1000 / 3)
+    REGISTRY_HEARTBEAT.start()
+
+def build_assets(settings, app_modules):
+    """
+    Builds the JavaScript and CSS bundles (see assets.py) for Gate One's plugins
+    and calls the `build_assets()` function of each module in *app_modules*
+    (if it has one) so that bundles are minified and compressed before the
+    first client connects instead of while it waits.  *settings* must be the
+    full settings :class:`RUDict`.
+    """
+    cache_dir = get_cache_dir(settings)
+    do_minify = not settings['*']['gateone'].get('debug', False)
+    plugins_dir = os.path.join(GATEONE_DIR, 'plugins')
+    for kind in ('js', 'css'):
+        paths = plugin_static_files(plugins_dir, kind)
+        if paths:
+            get_bundle(plugins_bundle_name(plugins_dir), kind, paths,
+                cache_dir, minify=do_minify)
+    for module in app_modules:
+        if hasattr(module, 'build_assets'):
+            try:
+                module.build_assets(settings)
+            except Exception as e:
+                logging.error(_(
+                    "Could not build the assets for %s: %s" % (module, e)))
+
 class HTTPSRedirectHandler(tornado.web.RequestHandler):
     """
     A handler to redirect clients from HTTP to HTTPS.
@@ -591,6 +670,31 @@ class StaticHandler(tornado.web.StaticFileHandler):
         """
         self.set_header('Access-Control-Allow-Origin', '*')
 
+class BundleHandler(tornado.web.RequestHandler):
+    """
+    Serves the JavaScript and CSS bundles built by :mod:`assets` straight out
+    of memory (e.g. for embedding Gate One via <script> tags or fronting it with
+    a CDN).  Since bundle filenames contain a hash of their contents they can be
+    cached by clients forever.  The pre-compressed copy of the bundle will be
+    sent to clients that accept gzip encoding.
+    """
+    def get(self, filename):
+        bundle = BUNDLES_BY_FILENAME.get(filename, None)
+        if not bundle:
+            raise tornado.web.HTTPError(404)
+        if bundle.kind == 'js':
+            self.set_header('Content-Type', 'application/javascript')
+        else:
+            self.set_header('Content-Type', 'text/css')
+        self.set_header('Access-Control-Allow-Origin', '*')
+        self.set_header('Cache-Control', 'public, max-age=31536000')
+        self.set_header('Vary', 'Accept-Encoding')
+        if 'gzip' in self.request.headers.get('Accept-Encoding', ''):
+            self.set_header('Content-Encoding', 'gzip')
+            self.write(bundle.gzip)
+        else:
+            self.write(bundle.data)
+
 class BaseHandler(tornado.web.RequestHandler):
     """
     A base handler that all Gate One RequestHandlers will inherit methods from.
@@ -615,10 +719,25 @@ class DownloadHandler(BaseHandler):
     given user's `session_dir` in the 'downloads' directory.  Generally speaking
     these files are generated by the terminal emulator (e.g. cat somefile.pdf)
     but it could be used by plugins as a way to serve up temporary files as
-    well.
+    well (e.g. the logging plugin's exported recordings).
+
+    Files are streamed to the client :attr:`chunk_size` bytes at a time (the
+    next chunk is only read once the previous one has been flushed to the
+    socket) so no matter how big the file is only one chunk per transfer is
+    ever held in memory.  HTTP Range requests (e.g. resuming a download),
+    ETags/If-None-Match, and If-Modified-Since are supported.
+
+    If a 'filename' argument is given (e.g. '?filename=foo.html') the client
+    will be instructed to save the file under that name.
     """
-    # NOTE:  This is a modified version of torando.web.StaticFileHandler
+    # Files named like this (a SHA-1 followed by a suffix) are named after
+    # their contents (see terminal.ImageFile):
+    content_addressed = re.compile(r'^[0-9a-f]{40}\.[A-Za-z0-9]+$')
+    chunk_size = 64 * 1024 # Bytes read (and buffered) at a time per transfer
+    # NOTE:  This started out as a modified version of
+    # torando.web.StaticFileHandler
     @tornado.web.authenticated
+    @tornado.web.asynchronous
     def get(self, path, include_body=True):
         session_dir = self.settings['session_dir']
         user = self.current_user
@@ -626,46 +745,133 @@ class DownloadHandler(BaseHandler):
             session = user['session']
         else:
             logging.error(_("DownloadHandler: Could not determine use session"))
+            self.finish()
             return # Something is wrong
-        filepath = os.path.join(session_dir, session, 'downloads', path)
-        abspath = os.path.abspath(filepath)
+        # Resolve symlinks on both sides so neither can be used to escape
+        downloads_dir = os.path.realpath(
+            os.path.join(session_dir, session, 'downloads'))
+        abspath = os.path.realpath(os.path.join(downloads_dir, path))
+        if not abspath.startswith(downloads_dir + os.sep):
+            raise tornado.web.HTTPError(403, "%s is not a download", path)
         if not os.path.exists(abspath):
             self.set_status(404)
-            self.write(self.get_error_html(404))
+            self.finish(self.get_error_html(404))
             return
         if not os.path.isfile(abspath):
             raise tornado.web.HTTPError(403, "%s is not a file", path)
+        self.send_file(abspath, include_body=include_body)
+
+    def head(self, path):
+        self.get(path, include_body=False)
+
+    def on_connection_close(self):
+        """
+        Closes the file being sent (if any) when the client goes away.
+        """
+        if getattr(self, 'fileobj', None):
+            self.fileobj.close()
+
+    def file_etag(self, abspath, stat_result):
+        """
+        Returns an ETag for the file at *abspath*.  Content-addressed files use
+        the hash in their name.  All others use the file's inode, size, and
+        modification time (hashing the whole file would mean reading it).
+        """
+        filename = os.path.split(abspath)[1]
+        if self.content_addressed.match(filename):
+            return '"%s"' % filename.split('.')[0]
+        return '"%x-%x-%x"' % (
+            stat_result.st_ino, stat_result.st_size,
+            int(stat_result.st_mtime * 1000))
+
+    def send_file(self, abspath, include_body=True):
+        """
+        Sends the file at *abspath* to the client (or just the headers if
+        *include_body* is `False`) honoring any conditional or Range headers in
+        the request.
+        """
         import stat, mimetypes
         stat_result = os.stat(abspath)
+        size = stat_result[stat.ST_SIZE]
         modified = datetime.fromtimestamp(stat_result[stat.ST_MTIME])
+        etag = self.file_etag(abspath, stat_result)
         self.set_header("Last-Modified", modified)
+        self.set_header("Etag", etag)
+        self.set_header("Accept-Ranges", "bytes")
         mime_type, encoding = mimetypes.guess_type(abspath)
         if mime_type:
             self.set_header("Content-Type", mime_type)
+        filename = self.get_argument('filename', None)
+        if filename:
+            filename = os.path.basename(filename).replace('"', '')
+            self.set_header(
+                "Content-Disposition", 'attachment; filename="%s"' % filename)
         # Set the Cache-Control header to private since this file is not meant
         # to be public.
         self.set_header("Cache-Control", "private")
-        # Check the If-Modified-Since, and don't send the result if the
-        # content has not been modified
+        if self.content_addressed.match(os.path.split(abspath)[1]):
+            # Named after its contents (e.g. captured images) so it'll never
+            # change.  Let the client hang on to it.
+            self.set_header("Cache-Control", "private, max-age=31536000")
+        # Don't send the file if the client already has this version of it
+        inm_value = self.request.headers.get("If-None-Match")
         ims_value = self.request.headers.get("If-Modified-Since")
-        if ims_value is not None:
-            import email.utils
-            date_tuple = email.utils.parsedate(ims_value)
-            if_since = datetime.fromtimestamp(time.mktime(date_tuple))
-            if if_since >= modified:
+        if inm_value is not None:
+            etags = [a.strip() for a in inm_value.split(',')]
+            if etag in etags or '*' in etags:
                 self.set_status(304)
+                self.finish()
                 return
-        # Finally, deliver the file
-        with open(abspath, "rb") as file:
-            data = file.read()
-            hasher = hashlib.sha1()
-            hasher.update(data)
-            self.set_header("Etag", '"%s"' % hasher.hexdigest())
-            if include_body:
-                self.write(data)
-            else:
-                assert self.request.method == "HEAD"
-                self.set_header("Content-Length", len(data))
+        elif ims_value is not None:
+            import email.utils
+            date_tuple = email.utils.parsedate(ims_value)
+            if date_tuple:
+                if_since = datetime.fromtimestamp(time.mktime(date_tuple))
+                if if_since >= modified:
+                    self.set_status(304)
+                    self.finish()
+                    return
+        start, end = 0, size
+        range_value = self.request.headers.get("Range")
+        if_range = self.request.headers.get("If-Range")
+        if range_value and (not if_range or if_range == etag):
+            byte_range = parse_byte_range(range_value, size)
+            if byte_range:
+                start, end = byte_range
+                if start >= size:
+                    self.set_status(416) # Range Not Satisfiable
+                    self.set_header("Content-Range", "bytes */%s" % size)
+                    self.finish()
+                    return
+                self.set_status(206) # Partial Content
+                self.set_header(
+                    "Content-Range", "bytes %s-%s/%s" % (start, end - 1, size))
+        self.set_header("Content-Length", end - start)
+        if not include_body or not end - start:
+            self.finish()
+            return
+        self.fileobj = open(abspath, "rb")
+        self.fileobj.seek(start)
+        self.send_chunk(self.fileobj, end - start)
+
+    def send_chunk(self, fileobj, remaining):
+        """
+        Writes the next :attr:`chunk_size` bytes of *fileobj* to the client and
+        calls itself again when they've been flushed to the socket.  Stops
+        after *remaining* bytes have been sent (or the client goes away).
+        """
+        if self.request.connection.stream.closed():
+            fileobj.close() # Client went away
+            return
+        chunk = fileobj.read(min(self.chunk_size, remaining))
+        remaining -= len(chunk)
+        if chunk:
+            self.write(chunk)
+        if not chunk or remaining <= 0:
+            fileobj.close()
+            self.finish()
+            return
+        self.flush(callback=partial(self.send_chunk, fileobj, remaining))
 
     def get_error_html(self, status_code, **kwargs):
         self.require_setting("static_url")
@@ -863,10 +1069,17 @@ class ApplicationWebSocket(WebSocketHandler):
     directly callable over the WebSocket.
     """
     instances = set()
-    # These three attributes handle watching files for changes:
-    watched_files = {}     # Format: {<file path>: <modification time>}
-    file_update_funcs = {} # Format: {<file path>: <function called on update>}
-    file_watcher = None    # Will be replaced with a PeriodicCallback
+    # Indexes of authenticated instances so that _deliver() and
+    # _list_connected_users() only have to touch the instances they care about:
+    authenticated_instances = set() # Instances that have authenticated
+    instances_by_upn = {}     # Format: {<upn>: set([<instance>, ...])}
+    instances_by_session = {} # Format: {<session>: set([<instance>, ...])}
+    # Deliveries to more than this many instances are split into batches that
+    # get written on successive IOLoop iterations:
+    deliver_batch_size = 100
+    # Outbound traffic totals for all connections (see flush_messages()):
+    totals = {'messages': 0, 'frames': 0, 'bytes': 0}
+    file_watcher = None # Will be replaced with a watcher.FileWatcher
     prefs = {} # Gets updated with every call to initialize()
     def __init__(self, application, request, **kwargs):
         self.user = None
@@ -888,47 +1101,40 @@ class ApplicationWebSocket(WebSocketHandler):
         self.prev_signatures = []
         self.origin_denied = True # Only allow valid origins
         self.file_cache = FILE_CACHE # So applications and plugins can reference
+        # The content-hashed bundles this connection has been sent:
+        self.synced_bundles = {} # Format: {(<name>, <kind>): <filename_hash>}
         self.persist = PERSIST # So applications and plugins can reference
+        self.registry = REGISTRY # Ditto
+        # When our session is owned by another node in the cluster all traffic
+        # gets proxied to it via this WebSocket client connection:
+        self.upstream = None
+        self.upstream_pending = None # Messages queued while connecting
+        self.indexed_as = None # (upn, session) once added to the indexes
+        # Messages waiting to be written by flush_messages():
+        self.outbound = OrderedDict() # Format: {<key>: <message>}
+        self.flush_scheduled = False
+        # Format: {'messages': <int>, 'frames': <int>, 'coalesced': <int>,
+        #          'bytes': <int>}
+        self.stats = dict.fromkeys(
+            ('messages', 'frames', 'coalesced', 'bytes'), 0)
         self.apps = [] # Gets filled up by self.initialize()
         # The security dict stores applications' various policy functions
         self.security = {}
         WebSocketHandler.__init__(self, application, request, **kwargs)
 
-    @classmethod
-    def file_checker(cls):
-        #logging.debug("file_checker()") # Kinda noisy so I've commented it out
-        if not SESSIONS:
-            # No connected sessions; no point in watching files
-            cls.file_checker.stop()
-            # Also remove the broadcast file so we know to start up the
-            # file_watcher again if a user connects.
-            session_dir = cls.prefs['*']['gateone']['session_dir']
-            broadcast_file = os.path.join(session_dir, 'broadcast') # Default
-            broadcast_file = cls.prefs['*']['gateone'].get(
-                'broadcast_file', broadcast_file) # If set, use that
-            del cls.watched_files[broadcast_file]
-            del cls.file_update_funcs[broadcast_file]
-            os.remove(broadcast_file)
-        for path, mtime in cls.watched_files.items():
-            if os.stat(path).st_mtime == mtime:
-                continue
-            try:
-                cls.file_update_funcs[path]()
-            except Exception as e:
-                logging.error(_(
-                    "Exception encountered trying to execute the file update "
-                    "function for %s..." % path))
-                logging.error(e)
-
     @classmethod
     def watch_file(cls, path, func):
         """
-        Registers the given file *path* and *func* in
-        `ApplicationWebSocket.watched_files`.  The *func* will be called if the
-        file at *path* is modified.
+        Registers the given file *path* and *func* with Gate One's file watcher
+        (see watcher.py).  The *func* will be called if the file at *path* is
+        modified.
         """
-        cls.watched_files.update({path: os.stat(path).st_mtime})
-        cls.file_update_funcs.update({path: func})
+        if not cls.file_watcher:
+            from watcher import get_file_watcher
+            interval = cls.prefs['*']['gateone'].get(
+                'file_check_interval', 5000) # Only used if inotify isn't
+            cls.file_watcher = get_file_watcher(interval=interval)
+        cls.file_watcher.watch(path, func)
 
     @classmethod
     def broadcast_file_update(cls):
@@ -949,6 +1155,28 @@ class ApplicationWebSocket(WebSocketHandler):
             cls._deliver(message_dict, upn="AUTHENTICATED")
             open(broadcast_file, 'w').write('') # Empty it out
 
+    @classmethod
+    def load_prefs(cls):
+        """
+        (Re)loads all the settings in the settings dir into
+        `ApplicationWebSocket.prefs` and invalidates any cached policies.
+        """
+        # NOTE: Why store prefs in the class itself?  No need for redundancy.
+        prefs = get_settings(options.settings_dir)
+        # Set the cache dir to a default if not set in the prefs
+        prefs['*'].setdefault('gateone', {})['cache_dir'] = get_cache_dir(prefs)
+        cls.prefs = prefs
+        invalidate_policies()
+
+    @classmethod
+    def reload_prefs(cls):
+        """
+        Called when something in the settings dir changes; reloads the settings
+        so that changes take effect without having to restart Gate One.
+        """
+        logging.info(_("Settings changed; reloading %s" % options.settings_dir))
+        cls.load_prefs()
+
     def initialize(self, apps=None, **kwargs):
         """
         This gets called by the Tornado framework when ApplicationWebSocket is
@@ -961,7 +1189,11 @@ class ApplicationWebSocket(WebSocketHandler):
         logging.debug('ApplicationWebSocket.initialize(%s)' % apps)
         # Make sure we have all prefs ready for checking
         cls = ApplicationWebSocket
-        cls.prefs = get_settings(options.settings_dir)
+        if not cls.prefs:
+            # The settings only get parsed once; after that they're reloaded
+            # whenever something in the settings dir changes.
+            cls.load_prefs()
+            cls.watch_file(options.settings_dir, cls.reload_prefs)
         if not apps:
             return
         for app in apps:
@@ -1115,18 +1347,10 @@ class ApplicationWebSocket(WebSocketHandler):
             message = {'go:reauthenticate': True}
             self.write_message(json_encode(message))
             self.close() # Close the WebSocket
-        # NOTE: By getting the prefs with each call to open() we make
-        #       it possible to make changes inside the settings dir without
-        #       having to restart Gate One (just need to wait for users to
-        #       eventually re-connect or reload the page).
-        # NOTE: Why store prefs in the class itself?  No need for redundancy.
-        if 'cache_dir' not in cls.prefs['*']['gateone']:
-            # Set the cache dir to a default if not set in the prefs
-            import tempfile
-            cache_dir = os.path.join(tempfile.gettempdir(), 'gateone_cache')
-            cls.prefs['*']['gateone']['cache_dir'] = cache_dir
-            if self.settings['debug']:
-                # Clean out the cache_dir every page reload when in debug mode
+        if self.settings['debug']:
+            # Clean out the cache_dir every page reload when in debug mode
+            cache_dir = cls.prefs['*']['gateone']['cache_dir']
+            if os.path.isdir(cache_dir):
                 for fname in os.listdir(cache_dir):
                     filepath = os.path.join(cache_dir, fname)
                     os.remove(filepath)
@@ -1141,6 +1365,12 @@ class ApplicationWebSocket(WebSocketHandler):
         if self.origin_denied:
             logging.error(_("Message rejected due to invalid origin."))
             self.close() # Close the WebSocket
+        if self.upstream_pending is not None: # Still connecting to the owner
+            self.upstream_pending.append(message)
+            return
+        if self.upstream: # Our session lives on another node
+            self.upstream.write_message(message)
+            return
         message_obj = None
         try:
             message_obj = json_decode(message) # JSON FTW!
@@ -1180,6 +1410,10 @@ class ApplicationWebSocket(WebSocketHandler):
         """
         logging.debug("on_close()")
         ApplicationWebSocket.instances.discard(self)
+        self._unindex()
+        if self.upstream:
+            self.upstream.close()
+            self.upstream = None
         user = self.current_user
         client_address = self.request.connection.address[0]
         if user and user['session'] in SESSIONS:
@@ -1190,18 +1424,133 @@ class ApplicationWebSocket(WebSocketHandler):
                 _("WebSocket closed (%s %s).") % (user['upn'], client_address))
         else:
             logging.info(_("WebSocket closed (unknown user)."))
+        self.outbound.clear()
+        # Forget any bundles that only this connection was using
+        for filename_hash in self.synced_bundles.values():
+            self._release_bundle(filename_hash)
+        self.synced_bundles.clear()
+        self.report_stats()
         # Call applications' on_close() functions (if any)
         for app in self.apps:
             if hasattr(app, 'on_close'):
                 app.on_close()
 
+    def http_downloads_available(self):
+        """
+        Returns `True` if this client can retrieve files from its session's
+        'downloads' directory via :class:`DownloadHandler`.  That requires the
+        'gateone_user' cookie which clients using API authentication (e.g.
+        embedded in another site) won't have.  Such clients must be sent files
+        over the WebSocket instead.
+        """
+        user_json = self.get_secure_cookie("gateone_user")
+        if not user_json:
+            return False
+        return json_decode(user_json).get('session') == self.session
+
+    def write_message(self, message, binary=False):
+        """
+        Writes *message* to the client as its own WebSocket frame.  If *message*
+        is a dict it will be JSON-encoded (see :func:`utils.json_encode_message`
+        which is why it's best to pass dicts as-is).  Anything waiting in the outbound
+        queue (see :meth:`queue_message`) gets written first so messages always
+        arrive in the order they were sent.
+        """
+        if self.outbound:
+            self.flush_messages()
+        self.stats['messages'] += 1
+        self._write_frame(message, binary=binary)
+
+    def _write_frame(self, message, binary=False):
+        """
+        Writes *message* using :meth:`WebSocketHandler.write_message` and
+        updates `self.stats`.
+        """
+        if isinstance(message, dict):
+            message = json_encode_message(message)
+        size = len(utf8(message))
+        self.stats['frames'] += 1
+        self.stats['bytes'] += size
+        WebSocketHandler.write_message(self, message, binary=binary)
+
+    def queue_message(self, message, key=None, merge=None):
+        """
+        Adds *message* (a dict or an already JSON-encoded string) to the
+        outbound queue.  Everything in the queue gets written to the client in
+        a single frame by :meth:`flush_messages` at the end of the current
+        IOLoop iteration.
+
+        If *key* is given and a message with the same *key* is still waiting
+        to be sent it will be superseded by *message* or, if a *merge* function
+        is given, replaced with ``merge(<waiting message>, message)``.  That's
+        how several screen updates for the same terminal end up as one.
+        """
+        self.stats['messages'] += 1
+        if key is None:
+            key = object() # Never coalesced
+        elif key in self.outbound:
+            self.stats['coalesced'] += 1
+            if merge:
+                message = merge(self.outbound[key], message)
+        self.outbound[key] = message
+        if not self.flush_scheduled:
+            self.flush_scheduled = True
+            io_loop = tornado.ioloop.IOLoop.instance()
+            io_loop.add_callback(self.flush_messages)
+
+    def flush_messages(self):
+        """
+        Writes all the messages in the outbound queue to the client.  A single
+        message gets sent as-is.  Multiple messages get sent in one frame as a
+        'go:batch' message (a list of messages the client will dispatch in
+        order).
+        """
+        self.flush_scheduled = False
+        if not self.outbound:
+            return
+        messages = [
+            a if isinstance(a, basestring) else json_encode_message(a)
+            for a in self.outbound.values()]
+        self.outbound.clear()
+        if len(messages) == 1:
+            frame = messages[0]
+        else: # The messages are already encoded so just stitch them together
+            frame = u'{"go:batch": [%s]}' % u','.join(
+                to_unicode(a) for a in messages)
+        if not self.ws_connection:
+            return # Closed in the interim
+        try:
+            self._write_frame(frame)
+        except IOError: # Socket was just closed, no biggie
+            logging.debug("flush_messages(): WebSocket closed")
+
+    def report_stats(self):
+        """
+        Logs how many messages were sent over this connection, how many frames
+        it took, and how many bytes.  Also adds them to the totals for all
+        connections (`ApplicationWebSocket.totals`).
+        """
+        stats = self.stats
+        totals = ApplicationWebSocket.totals
+        for key in totals:
+            totals[key] += stats[key]
+        if not stats['bytes']:
+            return
+        logging.info(_(
+            "WebSocket traffic: %s messages in %s frames (%s coalesced), "
+            "%s sent.  All connections: %s messages in %s frames, %s sent." % (
+                stats['messages'], stats['frames'], stats['coalesced'],
+                human_readable_bytes(stats['bytes']),
+                totals['messages'], totals['frames'],
+                human_readable_bytes(totals['bytes']))))
+
     def pong(self, timestamp):
         """
         Responds to a client 'ping' request...  Just returns the given
         timestamp back to the client so it can measure round-trip time.
         """
         message = {'go:pong': timestamp}
-        self.write_message(json_encode(message))
+        self.write_message(message)
 
     def authenticate(self, settings):
         """
@@ -1460,6 +1809,24 @@ class ApplicationWebSocket(WebSocketHandler):
             logging.error(_(
                 "Exception encountered trying to authenticate: %s" % e))
             return
+        if self.registry:
+            owner = self.registry.claim_session(
+                self.session, upn=self.current_user['upn'])
+            if owner is None:
+                # Can't tell who owns this session.  Resuming it here could
+                # leave two nodes running it at once so refuse instead.
+                logging.error(_(
+                    "Session registry unavailable; refusing to resume session "
+                    "%s" % short_hash(self.session)))
+                self.write_message(json_encode({'go:notice': _(
+                    "Your session could not be resumed right now.  Please "
+                    "try again in a moment.")}))
+                self.close()
+                return
+            if not self.registry.is_local(owner):
+                # This session's terminals live on another node
+                self.proxy_to_node(owner, {'go:authenticate': settings})
+                return
         try:
             # Execute any post-authentication hooks that plugins have registered
             if PLUGIN_AUTH_HOOKS:
@@ -1494,6 +1861,7 @@ class ApplicationWebSocket(WebSocketHandler):
                 SESSIONS[self.session]['locations'][self.location] = {}
         # A shortcut for SESSIONS[self.session]['locations']:
         self.locations = SESSIONS[self.session]['locations']
+        self._index()
         policy = applicable_policies("gateone", self.current_user, self.prefs)
         # Send our plugin .js and .css files to the client
         self.send_plugin_static_files(os.path.join(GATEONE_DIR, 'plugins'))
@@ -1547,57 +1915,108 @@ class ApplicationWebSocket(WebSocketHandler):
             CLEANER = tornado.ioloop.PeriodicCallback(
                 cleanup_user_logs, interval)
             CLEANER.start()
-        # Startup the file watcher if it isn't already running and get it
-        # watching the broadcast file.
+        # Get the file watcher watching the broadcast file (if it isn't already)
         cls = ApplicationWebSocket
         broadcast_file = os.path.join(self.settings['session_dir'], 'broadcast')
         broadcast_file = self.prefs['*']['gateone'].get(
             'broadcast_file', broadcast_file)
-        if broadcast_file not in cls.watched_files:
-            # No broadcast file means the file watcher isn't running
+        watcher = cls.file_watcher
+        if not watcher or os.path.abspath(broadcast_file) not in watcher.watches:
             open(broadcast_file, 'w').write('') # Touch file
-            check_time = self.prefs['*']['gateone'].get(
-                'file_check_interval', 5000)
             cls.watch_file(broadcast_file, cls.broadcast_file_update)
-            io_loop = tornado.ioloop.IOLoop.instance()
-            cls.file_watcher = tornado.ioloop.PeriodicCallback(
-                cls.file_checker, check_time, io_loop=io_loop)
-            cls.file_watcher.start()
         self.trigger('go:authenticate')
 
+    def proxy_to_node(self, node, first_message):
+        """
+        Opens a WebSocket connection (see :class:`registry.UpstreamConnection`)
+        to the given *node* (a record from `self.registry`) and proxies all
+        further traffic between it and the client.  *first_message* (usually
+        the client's 'go:authenticate' message) will be sent as soon as the
+        connection is established.  If the node can't be reached the client
+        gets a notice and the connection is closed.
+
+        .. note:: For this to work all nodes must share the same `cookie_secret` and `origins` settings.
+        """
+        from registry import proxy_headers, UpstreamConnection
+        logging.info(_("Proxying session %s to node %s (%s)" % (
+            short_hash(self.session), node['node_id'], node['url'])))
+        validate_cert = self.prefs['*']['gateone'].get(
+            'cluster_validate_certs', True)
+        # Pass along the client's cookie (and friends) so the owning node sees
+        # the same user we do:
+        headers = proxy_headers(self.request.headers, self.request.remote_ip)
+        self.upstream_pending = [json_encode(first_message)]
+        self.upstream = UpstreamConnection(
+            node['url'], headers,
+            on_message=self._upstream_message,
+            on_close=self._upstream_closed,
+            validate_cert=validate_cert)
+        self.upstream.connect(self._upstream_connected)
+
+    def _upstream_connected(self):
+        """
+        Called when the connection started by :meth:`proxy_to_node` completes.
+        Sends any messages the client sent in the meantime.
+        """
+        pending = self.upstream_pending
+        self.upstream_pending = None
+        if self not in ApplicationWebSocket.instances:
+            # Client went away while we were connecting
+            self.upstream.close()
+            self.upstream = None
+            return
+        for message in pending:
+            self.upstream.write_message(message)
+
+    def _upstream_message(self, message):
+        """
+        Relays a message from the upstream node to the client.
+        """
+        if self in ApplicationWebSocket.instances:
+            self.write_message(message)
+
+    def _upstream_closed(self):
+        """
+        Called when the connection to the upstream node goes away (or couldn't
+        be established).  Closes the client's connection too.
+        """
+        connecting = self.upstream_pending is not None
+        self.upstream = None
+        self.upstream_pending = None
+        if self not in ApplicationWebSocket.instances:
+            return
+        if connecting:
+            logging.error(_("Could not connect to the node that owns session "
+                            "%s" % short_hash(self.session)))
+            self.write_message(json_encode({'go:notice': _(
+                "The server hosting your session is unavailable.")}))
+        self.close()
+
+    def _render_template(self, template_path, **kwargs):
+        """
+        Renders the template at *template_path* via `self.render_string()`
+        after making sure Tornado won't use a stale copy of it.  Only gets
+        called when a rendered style isn't already in the cache.
+        """
+        template_loaders = tornado.web.RequestHandler._template_loaders
+        # This wierd little bit empties Tornado's template cache:
+        for web_template_path in template_loaders:
+            template_loaders[web_template_path].reset()
+        return self.render_string(template_path, **kwargs)
+
     def render_style(self, style_path, **kwargs):
         """
         Renders the CSS template at *style_path* using *kwargs* and returns the
-        path to the rendered result.  If the given style has already been
-        rendered the existing cache path will be returned.
-
-        This method also cleans up older versions of the same rendered template.
+        result as an :class:`assets.Bundle` (use its `data` attribute to get at
+        the CSS).  Rendered styles are cached in memory by path, modification
+        time, and *kwargs* so a given version of a template only ever gets
+        rendered once per set of arguments.
         """
-        cache_dir = self.prefs['*']['gateone']['cache_dir']
-        mtime = os.stat(style_path).st_mtime
-        safe_path = style_path.replace('/', '_')
-        rendered_filename = 'rendered_%s_%s' % (safe_path, int(mtime))
-        rendered_path = os.path.join(cache_dir, rendered_filename)
-        if not os.path.exists(rendered_path):
-            style_css = self.render_string(
-                style_path,
-                **kwargs
-            )
-            if bytes != str: # Python 3
-                style_css = str(style_css, 'UTF-8')
-            with open(rendered_path, 'w') as f:
-                f.write(style_css)
-            # Remove older versions of the rendered template if present
-            for fname in os.listdir(cache_dir):
-                if fname == rendered_filename:
-                    continue
-                elif safe_path in fname:
-                    # Older version present.
-                    # Remove it (and it's minified counterpart).
-                    os.remove(os.path.join(cache_dir, fname))
-        return rendered_path
+        name = 'rendered_%s' % style_path.replace('/', '_').split('.')[0]
+        return render_style(
+            name, style_path, self._render_template,
+            minify=not self.settings['debug'], **kwargs)
 
-# TODO:  Get this so that it only renders the theme if a theme file has changed
     def get_theme(self, settings):
         """
         Sends the theme stylesheets matching the properties specified in
@@ -1608,6 +2027,9 @@ class ApplicationWebSocket(WebSocketHandler):
             * **theme** - The name of the CSS theme to be retrieved.
 
         .. note:: This will send the theme files for all applications and plugins that have a matching stylesheet in their 'templates' directory.
+
+        Combined themes are cached in memory (see `assets.THEMES`) until a file
+        in one of the directories they were built from changes.
         """
         logging.debug('get_theme(%s)' % settings)
         send_css = self.prefs['*']['gateone'].get('send_css', True)
@@ -1618,14 +2040,6 @@ class ApplicationWebSocket(WebSocketHandler):
             # So we don't repeat this message a zillion times in the logs:
             self.logged_css_message = True
             return
-        use_client_cache = self.prefs['*']['gateone'].get(
-            'use_client_cache', True)
-        cache_dir = self.prefs['*']['gateone']['cache_dir']
-        if not os.path.exists(cache_dir):
-            mkdir_p(cache_dir)
-        templates_path = os.path.join(GATEONE_DIR, 'templates')
-        themes_path = os.path.join(templates_path, 'themes')
-        #printing_path = os.path.join(templates_path, 'printing')
         go_url = settings['go_url'] # Used to prefix the url_prefix
         if not go_url.endswith('/'):
             go_url += '/'
@@ -1637,91 +2051,72 @@ class ApplicationWebSocket(WebSocketHandler):
             prefix=prefix,
             url_prefix=go_url
         )
-        out_dict = {'files': []}
+        do_minify = not self.settings['debug']
+        key = (theme, tuple(sorted(template_args.items())), do_minify)
+        theme_style = THEMES.get(key)
+        if not theme_style:
+            theme_files = []
+            for theme_css_file in self.enumerate_theme_files(theme):
+                style = self.render_style(theme_css_file, **template_args)
+                theme_files.append(style)
+            # Combine the theme files into one
+            theme_style = Bundle('theme', 'css',
+                [a.paths[0] for a in theme_files],
+                b"\n".join(a.data for a in theme_files))
+            THEMES[key] = theme_style
+        # Don't need a hashed name for the theme:
+        self.sync_bundle(theme_style, filename='theme.css', element_id='theme')
+
+    def enumerate_theme_files(self, theme):
+        """
+        Returns a list of the paths to the stylesheet templates that make up
+        the given *theme*:  Gate One's own followed by those of any plugins,
+        applications, and application plugins that have a matching stylesheet
+        in their 'templates/themes' directory.  The directories that were
+        checked will be watched so that cached themes get invalidated if they
+        change.
+        """
         theme_filename = "%s.css" % theme
-        theme_path = os.path.join(themes_path, theme_filename)
-        template_loaders = tornado.web.RequestHandler._template_loaders
-        # This wierd little bit empties Tornado's template cache:
-        for web_template_path in template_loaders:
-            template_loaders[web_template_path].reset()
-        rendered_path = self.render_style(
-            theme_path, **template_args)
-        filename = os.path.split(rendered_path)[1]
-        mtime = os.stat(rendered_path).st_mtime
-        theme_files = []
-        theme_files.append(rendered_path)
-        # Now enumerate all applications/plugins looking for their own
-        # implementations of this theme (must have same name).
-        theme_paths = []
-        plugins_dir = os.path.join(GATEONE_DIR, 'plugins')
-        # Find plugin's theme-specific CSS files
-        for plugin in os.listdir(plugins_dir):
-            plugin_dir = os.path.join(plugins_dir, plugin)
-            themes_dir = os.path.join(plugin_dir, 'templates', 'themes')
+        templates_path = os.path.join(GATEONE_DIR, 'templates')
+        themes_path = os.path.join(templates_path, 'themes')
+        #printing_path = os.path.join(templates_path, 'printing')
+        theme_files = [os.path.join(themes_path, theme_filename)]
+        checked_dirs = [themes_path]
+        def check(parent_dir):
+            """
+            Adds *parent_dir*/templates/themes/<theme>.css to `theme_files`
+            if it exists.  Returns `True` if it does.
+            """
+            themes_dir = os.path.join(parent_dir, 'templates', 'themes')
+            checked_dirs.append(themes_dir)
             theme_css_file = os.path.join(themes_dir, theme_filename)
             if not os.path.exists(theme_css_file):
-                continue
-            rendered_path = self.render_style(
-                theme_css_file, **template_args)
-            theme_files.append(rendered_path)
+                return False
+            theme_files.append(theme_css_file)
+            return True
+        # Find plugin's theme-specific CSS files
+        plugins_dir = os.path.join(GATEONE_DIR, 'plugins')
+        checked_dirs.append(plugins_dir)
+        for plugin in os.listdir(plugins_dir):
+            check(os.path.join(plugins_dir, plugin))
         # Find application's theme-specific CSS files
         applications_dir = os.path.join(GATEONE_DIR, 'applications')
+        checked_dirs.append(applications_dir)
         for app in os.listdir(applications_dir):
             app_dir = os.path.join(applications_dir, app)
-            themes_dir = os.path.join(app_dir, 'templates', 'themes')
-            theme_css_file = os.path.join(themes_dir, theme_filename)
-            if not os.path.exists(theme_css_file):
+            if not check(app_dir):
                 continue
-            rendered_path = self.render_style(
-                theme_css_file, **template_args)
-            theme_files.append(rendered_path)
             # Find application plugin's theme-specific CSS files
             plugins_dir = os.path.join(app_dir, 'plugins')
             if not os.path.exists(plugins_dir):
                 continue
+            checked_dirs.append(plugins_dir)
             for plugin in os.listdir(plugins_dir):
-                plugin_dir = os.path.join(plugins_dir, plugin)
-                themes_dir = os.path.join(plugin_dir, 'templates', 'themes')
-                theme_css_file = os.path.join(themes_dir, theme_filename)
-                if not os.path.exists(theme_css_file):
-                    continue
-                rendered_path = self.render_style(
-                    theme_css_file, **template_args)
-                theme_files.append(rendered_path)
+                check(os.path.join(plugins_dir, plugin))
         #print_css_path = os.path.join(printing_path, "default.css")
-        #rendered_path = self.render_style(print_css_path, **template_args)
         # TODO: Do something about the print stylesheet (needs to go in terminal)
-        # Combine the theme files into one
-        # Don't need a hashed name for the theme:
-        filename = 'theme.css'
-        cached_theme_path = os.path.join(cache_dir, filename)
-        with open(cached_theme_path, 'w') as f:
-            for path in theme_files:
-                f.write(open(path).read())
-        mtime = os.stat(rendered_path).st_mtime
-        if self.settings['debug']:
-            # This makes sure that the files are always re-downloaded
-            mtime = time.time()
-        kind = 'css'
-        out_dict['files'].append({
-            'filename': filename,
-            'mtime': mtime,
-            'kind': kind,
-            'element_id': 'theme'
-        })
-        self.file_cache[filename] = {
-            'filename': filename,
-            'kind': kind,
-            'path': cached_theme_path,
-            'mtime': mtime,
-            'element_id': 'theme'
-        }
-        if use_client_cache:
-            message = {'go:file_sync': out_dict}
-            self.write_message(message)
-        else:
-            files = [a['filename'] for a in out_dict['files']]
-            self.file_request(files, use_client_cache=use_client_cache)
+        watch_dirs(a for a in checked_dirs if os.path.isdir(a))
+        return theme_files
 
     @require(authenticated())
     def get_js(self, filename):
@@ -1849,6 +2244,12 @@ class ApplicationWebSocket(WebSocketHandler):
         if filename_hash.endswith('.js'):
             # The file_cache uses hashes; convert it
             filename_hash = md5(filename_hash.split('.')[0]).hexdigest()[:10]
+        if filename_hash not in self.file_cache:
+            # e.g. a bundle that was superseded before the client asked for it
+            logging.warning(_(
+                "Client %s requested a file that is no longer available: %s"
+                % (self.request.remote_ip, filename_hash)))
+            return
         # Get the file info out of the file_cache so we can send it
         element_id = self.file_cache[filename_hash].get('element_id', None)
         path = self.file_cache[filename_hash]['path']
@@ -1871,7 +2272,14 @@ class ApplicationWebSocket(WebSocketHandler):
             # problem really only applies to rendered CSS template files anyway
             out_dict['filename'] = filename
         cache_dir = self.prefs['*']['gateone']['cache_dir']
-        if self.settings['debug']:
+        if 'bundle' in self.file_cache[filename_hash]:
+            # Bundles are already built (and minified); send as-is
+            out_dict['data'] = self.file_cache[filename_hash]['bundle'].data
+            if self.file_cache[filename_hash]['connections']:
+                # Content-hashed; lets the client drop its older versions
+                out_dict['bundle'] = self.file_cache[filename_hash][
+                    'bundle'].name
+        elif self.settings['debug']:
             out_dict['data'] = get_or_cache(cache_dir, path, minify=False)
         else:
             out_dict['data'] = get_or_cache(cache_dir, path, minify=True)
@@ -1956,7 +2364,7 @@ class ApplicationWebSocket(WebSocketHandler):
                 })
             if use_client_cache:
                 message = {'go:file_sync': out_dict}
-                self.write_message(message)
+                self.queue_message(message)
             else:
                 files = [a['filename'] for a in out_dict['files']]
                 self.file_request(files, use_client_cache=use_client_cache)
@@ -2001,7 +2409,7 @@ class ApplicationWebSocket(WebSocketHandler):
         }]}
         if use_client_cache:
             message = {'go:file_sync': out_dict}
-            self.write_message(message)
+            self.queue_message(message)
         else:
             files = [a['filename'] for a in out_dict['files']]
             self.file_request(files, use_client_cache=use_client_cache)
@@ -2018,10 +2426,120 @@ class ApplicationWebSocket(WebSocketHandler):
         """
         self.send_js_or_css(path, 'css')
 
+    def send_bundle(self, name, kind, paths, requires=None):
+        """
+        Combines the files at *paths* (list) of the given *kind* ('js' or 'css')
+        into a single :class:`assets.Bundle` named *name* and initiates a file
+        synchronization of it with the client.  Since bundles are named after
+        (and versioned by) a hash of their contents the client will only
+        download a given bundle once no matter how many files it contains.
+
+        Optionally, a *requires* string or list/tuple may be given which will
+        ensure that the bundle gets loaded after any dependencies.
+
+        Returns the bundle's filename (so other bundles can require it) or
+        `None` if nothing was sent.
+
+        .. note:: Just like `send_js_or_css()` this respects the `send_js` and `send_css` settings.
+        """
+        if not paths:
+            return None
+        setting = 'send_%s' % kind
+        if not self.prefs['*']['gateone'].get(setting, True):
+            if not hasattr(self, 'logged_%s_message' % kind):
+                logging.info(_(
+                    "%s is false; will not send %s bundles." % (setting, kind)))
+            # So we don't repeat this message a zillion times in the logs:
+            setattr(self, 'logged_%s_message' % kind, True)
+            return None
+        bundle = get_bundle(
+            name, kind, paths,
+            cache_dir=self.prefs['*']['gateone']['cache_dir'],
+            minify=not self.settings['debug'])
+        self.sync_bundle(bundle, requires=requires)
+        return bundle.filename
+
+    def sync_bundle(self,
+        bundle, filename=None, element_id=None, requires=None):
+        """
+        Initiates a file synchronization of the given *bundle* (an
+        :class:`assets.Bundle`) with the client.  The bundle's contents will be
+        served straight out of memory if the client requests it.
+
+        If a *filename* is given (e.g. 'theme.css') it will be used instead of
+        the bundle's (content-hashed) filename.  This is useful for things like
+        themes where the client should only ever have one version.
+
+        Optionally, *element_id* may be provided which will be assigned to the
+        <script> or <style> tag that winds up being created.
+
+        Optionally, a *requires* string or list/tuple may be given which will
+        ensure that the bundle gets loaded after any dependencies.
+        """
+        from hashlib import md5
+        kind = bundle.kind
+        use_client_cache = self.prefs['*']['gateone'].get(
+            'use_client_cache', True)
+        if requires and not isinstance(requires, (tuple, list)):
+            requires = [requires] # This makes the logic simpler at the client
+        connections = set()
+        if filename:
+            filename_hash = filename
+            # The client only checks for inequality:
+            mtime = bundle.hash
+        else:
+            filename = bundle.filename
+            filename_hash = md5(filename.split('.')[0]).hexdigest()[:10]
+            if kind != 'js':
+                filename = filename_hash # Same as send_js_or_css()
+            # The filename changes whenever the contents do
+            mtime = 0
+            old_hash = self.synced_bundles.get((bundle.name, kind))
+            if old_hash != filename_hash:
+                self._release_bundle(old_hash)
+            self.synced_bundles[(bundle.name, kind)] = filename_hash
+            if filename_hash in self.file_cache:
+                connections = self.file_cache[filename_hash]['connections']
+            connections.add(self)
+        self.file_cache[filename_hash] = {
+            'filename': bundle.filename,
+            'kind': kind,
+            'path': None,
+            'bundle': bundle,
+            'mtime': mtime,
+            'element_id': element_id,
+            'requires': requires,
+            'connections': connections
+        }
+        if use_client_cache:
+            message = {'go:file_sync': {'files': [{
+                'filename': filename,
+                'mtime': mtime,
+                'kind': kind,
+                'element_id': element_id,
+                'requires': requires
+            }]}}
+            self.queue_message(message)
+        else:
+            self.file_request(filename, use_client_cache=use_client_cache)
+
+    def _release_bundle(self, filename_hash):
+        """
+        Removes this connection from the list of connections referencing the
+        bundle at *filename_hash* in `self.file_cache`.  The bundle will be
+        forgotten once no connections reference it anymore.
+        """
+        file_obj = self.file_cache.get(filename_hash, None)
+        if not file_obj or 'connections' not in file_obj:
+            return
+        file_obj['connections'].discard(self)
+        if not file_obj['connections']:
+            del self.file_cache[filename_hash]
+
     def render_and_send_css(self, css_path, **kwargs):
         """
-        Renders, caches (in the `cache_dir`), and sends a stylesheet template at
-        the given *css_path*.  The template will be rendered with the following
+        Renders, caches (in memory), and sends a stylesheet template at the
+        given *css_path*.  The template will be rendered with the following
         keyword arguments::
 
             container = self.container
@@ -2029,7 +2547,7 @@ class ApplicationWebSocket(WebSocketHandler):
             url_prefix = self.settings['url_prefix']
             **kwargs
 
-        Returns the path to the rendered template.
+        Returns the rendered template as an :class:`assets.Bundle`.
 
         .. note:: If you want to serve Gate One's CSS via a different mechanism (e.g. nginx) this functionality can be completely disabled by adding `'send_css': false` to gateone/settings/10server.conf
         """
@@ -2040,39 +2558,15 @@ class ApplicationWebSocket(WebSocketHandler):
             # So we don't repeat this message a zillion times in the logs:
             self.logged_css_message = True
             return
-        cache_dir = self.prefs['*']['gateone']['cache_dir']
-        mtime = os.stat(css_path).st_mtime
-        safe_path = css_path.replace('/', '_') # So we can name the file safely
-        rendered_filename = 'rendered_%s_%s' % (safe_path, int(mtime))
-        rendered_path = os.path.join(cache_dir, rendered_filename)
-        if os.path.exists(rendered_path):
-            self.send_css(rendered_path)
-            return
-        with open(css_path) as f:
-            css_template = tornado.template.Template(f.read())
-        template_loaders = tornado.web.RequestHandler._template_loaders
-        # This wierd little bit empties Tornado's template cache:
-        for web_template_path in template_loaders:
-            template_loaders[web_template_path].reset()
-        rendered = self.render_string(
+        style = self.render_style(
             css_path,
             container=self.container,
             prefix=self.prefix,
             url_prefix=self.settings['url_prefix'],
             **kwargs
         )
-        with open(rendered_path, 'w') as f:
-            f.write(rendered)
-        self.send_css(rendered_path)
-        # Remove older versions of the rendered template if present
-        for fname in os.listdir(cache_dir):
-            if fname == rendered_filename:
-                continue
-            elif safe_path in fname:
-                # Older version present.
-                # Remove it (and it's minified counterpart).
-                os.remove(os.path.join(cache_dir, fname))
-        return rendered_path
+        self.sync_bundle(style)
+        return style
 
     def send_plugin_static_files(self,
         plugins_dir, application=None, requires=None):
@@ -2082,45 +2576,24 @@ class ApplicationWebSocket(WebSocketHandler):
         apply to the current user for that application will be used to determine
         whether or not a given plugin's static files will be sent.
 
-        If *requires* is given it will be passed along to `self.send_js()`.
+        All of the plugins' JavaScript files get sent as a single bundle (as do
+        the CSS files).  See :meth:`ApplicationWebSocket.send_bundle`.
+
+        If *requires* is given it will be passed along to `self.send_bundle()`.
 
         .. note:: If you want to serve Gate One's JavaScript via a different mechanism (e.g. nginx) this functionality can be completely disabled by adding `'send_js': false` to gateone/settings/10server.conf
         """
         logging.debug('send_plugin_static_files(%s)' % plugins_dir)
-        send_js = self.prefs['*']['gateone'].get('send_js', True)
-        if not send_js:
-            if not hasattr('logged_js_message', self):
-                logging.info(_("send_js is false; will not send JavaScript."))
-            # So we don't repeat this message a zillion times in the logs:
-            self.logged_js_message = True
-            return
         policy = applicable_policies(application, self.current_user, self.prefs)
         # This controls the client-side plugins that will be sent
         allowed_client_side_plugins = policy.get('user_plugins', [])
-        # Build a list of plugins
-        plugins = []
-        if not os.path.exists(plugins_dir):
-            return # Nothing to do
-        for f in os.listdir(plugins_dir):
-            if os.path.isdir(os.path.join(plugins_dir, f)):
-                if allowed_client_side_plugins:
-                    if f in allowed_client_side_plugins:
-                        plugins.append(f)
-                else:
-                    plugins.append(f)
-        # Add each found JS file to the respective dict
-        for plugin in plugins:
-            plugin_static_path = os.path.join(plugins_dir, plugin, 'static')
-            if os.path.exists(plugin_static_path):
-                static_files = os.listdir(plugin_static_path)
-                static_files.sort()
-                for f in static_files:
-                    if f.endswith('.js'):
-                        js_file_path = os.path.join(plugin_static_path, f)
-                        self.send_js(js_file_path, requires=requires)
-                    elif f.endswith('.css'):
-                        css_file_path = os.path.join(plugin_static_path, f)
-                        self.send_css(css_file_path)
+        name = plugins_bundle_name(plugins_dir)
+        js_files = plugin_static_files(
+            plugins_dir, 'js', allowed=allowed_client_side_plugins)
+        self.send_bundle(name, 'js', js_files, requires=requires)
+        css_files = plugin_static_files(
+            plugins_dir, 'css', allowed=allowed_client_side_plugins)
+        self.send_bundle(name, 'css', css_files)
 
 # TODO:  Separate generic Gate One css from the terminal-specific stuff.
     def enumerate_themes(self):
@@ -2205,7 +2678,6 @@ class ApplicationWebSocket(WebSocketHandler):
         'list_users' policy are allowed to execute this action.
         """
         users = ApplicationWebSocket._list_connected_users()
-        print(users)
         # Remove things that users should not see such as their session ID
         filtered_users = []
         policy = applicable_policies('gateone', self.current_user, self.prefs)
@@ -2220,9 +2692,40 @@ class ApplicationWebSocket(WebSocketHandler):
                     user_dict[key] = value
             filtered_users.append(user_dict)
         message = {'go:user_list': filtered_users}
-        self.write_message(json_encode(message))
+        self.write_message(message)
         self.trigger('go:user_list', filtered_users)
 
+    def _index(self):
+        """
+        Adds this instance to the indexes used by :meth:`_deliver` and
+        :meth:`_list_connected_users`.  Called at the end of a successful
+        :meth:`authenticate`.
+        """
+        cls = ApplicationWebSocket
+        self._unindex() # In case the client re-authenticated as someone else
+        user = self.current_user
+        self.indexed_as = (user['upn'], user['session'])
+        cls.authenticated_instances.add(self)
+        cls.instances_by_upn.setdefault(user['upn'], set()).add(self)
+        cls.instances_by_session.setdefault(user['session'], set()).add(self)
+
+    def _unindex(self):
+        """
+        Removes this instance from the indexes that :meth:`_index` added it to.
+        """
+        cls = ApplicationWebSocket
+        if not self.indexed_as:
+            return
+        upn, session = self.indexed_as
+        cls.authenticated_instances.discard(self)
+        for index, key in ((cls.instances_by_upn, upn),
+                           (cls.instances_by_session, session)):
+            if key in index:
+                index[key].discard(self)
+                if not index[key]:
+                    del index[key]
+        self.indexed_as = None
+
     @classmethod
     def _deliver(cls, message, upn="AUTHENTICATED", session=None):
         """
@@ -2232,20 +2735,35 @@ class ApplicationWebSocket(WebSocketHandler):
 
         Alternatively a *session* ID may be specified instead of a *upn*.  This
         is useful when more than one user shares a UPN (i.e. ANONYMOUS).
+
+        If *message* isn't a string it will be JSON-encoded (once) before being
+        sent.  Deliveries to more than `cls.deliver_batch_size` users are
+        written in batches on successive IOLoop iterations so that a large
+        broadcast can't hold up everything else (e.g. keystrokes).
         """
         logging.debug("_deliver(%s, upn=%s, session=%s)" %
             (message, upn, session))
-        for instance in cls.instances:
-            try: # Only send to users that have authenticated
-                user = instance.current_user
-            except AttributeError:
-                continue
-            if session and user['session'] == session:
-                instance.write_message(message)
-            elif upn == "AUTHENTICATED":
-                instance.write_message(message)
-            elif upn == user['upn']:
-                instance.write_message(message)
+        if session:
+            recipients = cls.instances_by_session.get(session, ())
+        elif upn == "AUTHENTICATED":
+            recipients = cls.authenticated_instances
+        else:
+            recipients = cls.instances_by_upn.get(upn, ())
+        if not recipients:
+            return
+        if not isinstance(message, basestring):
+            message = json_encode_message(message) # Once for all recipients
+        # Copy so connections coming and going don't affect the iteration
+        recipients = list(recipients)
+        batch_size = cls.deliver_batch_size
+        def write_batch(start):
+            for instance in recipients[start:start+batch_size]:
+                if instance in cls.instances: # Might have closed in the interim
+                    instance.queue_message(message)
+            if start + batch_size < len(recipients):
+                io_loop = tornado.ioloop.IOLoop.instance()
+                io_loop.add_callback(partial(write_batch, start + batch_size))
+        write_batch(0)
 
     @classmethod
     def _list_connected_users(cls):
@@ -2254,13 +2772,7 @@ class ApplicationWebSocket(WebSocketHandler):
         currently connected (and authenticated) to this Gate One server.
         """
         logging.debug("_list_connected_users()")
-        out = []
-        for instance in cls.instances:
-            try: # We only care about authenticated users
-                out.append(instance.current_user)
-            except AttributeError:
-                continue
-        return tuple(out)
+        return tuple(a.current_user for a in cls.authenticated_instances)
 
 class ErrorHandler(tornado.web.RequestHandler):
     """
@@ -2319,16 +2831,8 @@ class GateOneApp(tornado.web.Application):
         # Setup the configured authentication type
         AuthHandler = NullAuthHandler # Default
         if 'auth' in settings and settings['auth']:
-            if settings['auth'] == 'kerberos' and KerberosAuthHandler:
-                AuthHandler = KerberosAuthHandler
-            elif settings['auth'] == 'pam' and PAMAuthHandler:
-                AuthHandler = PAMAuthHandler
-            elif settings['auth'] == 'google':
-                AuthHandler = GoogleAuthHandler
-            elif settings['auth'] == 'ssl':
-                AuthHandler = SSLAuthHandler
-            elif settings['auth'] == 'api':
-                AuthHandler = APIAuthHandler
+            # NOTE: Optional auth modules (e.g. kerberos) get imported here
+            AuthHandler = get_auth_handler(settings['auth']) or NullAuthHandler
             logging.info(_("Using %s authentication" % settings['auth']))
         else:
             logging.info(_(
@@ -2374,6 +2878,7 @@ class GateOneApp(tornado.web.Application):
         handlers.append(
             (r"%sstatic/(.*)" % url_prefix, StaticHandler, {"path": static_url}
         ))
+        handlers.append((r"%sassets/(.*)" % url_prefix, BundleHandler))
         # Hook up the hooks
         for plugin_name, hooks in PLUGIN_HOOKS.items():
             if 'Web' in hooks:
@@ -2467,11 +2972,7 @@ def define_options():
     user_locale = locale.get(default_locale)
     # NOTE: The locale setting above is only for the --help messages.
     # Simplify the auth option help message
-    auths = "none, api, google, ssl"
-    if KerberosAuthHandler:
-        auths += ", kerberos"
-    if PAMAuthHandler:
-        auths += ", pam"
+    auths = ", ".join(AUTH_TYPES)
     # Simplify the syslog_facility option help message
     facilities = list(FACILITIES.keys())
     facilities.sort()
@@ -2513,6 +3014,12 @@ def define_options():
         help=_("Enable debugging features such as auto-restarting when files "
                "are modified.")
     )
+    define(
+        "profile_startup",
+        default=False,
+        help=_("Log how long Gate One took to start listening along with the "
+               "time taken by the slowest module imports.")
+    )
     define("cookie_secret", # 45 chars is, "Good enough for me" (cookie joke =)
         default=None,
         help=_("Use the given 45-character string for cookie encryption."),
@@ -2626,6 +3133,45 @@ def define_options():
         "seconds, minutes, hours, and days.  Default is '5d' (5 days)."),
         type=basestring
     )
+    define(
+        "session_registry",
+        default="local",
+        help=_("Where to keep track of which Gate One node owns which session. "
+               "Must be one of 'local' (single server) or 'sqlite' (cluster of "
+               "servers sharing the database at session_registry_path).  "
+               "Default: local"),
+        type=basestring
+    )
+    define(
+        "session_registry_path",
+        default="",
+        help=_("Path to the session registry database when session_registry "
+               "is 'sqlite'.  Every node in the cluster must use the same file."
+               "  Default: <session_dir>/registry.db"),
+        type=basestring
+    )
+    define(
+        "node_id",
+        default=socket.gethostname(),
+        help=_("A name for this Gate One server that is unique within the "
+               "cluster.  Default: The hostname."),
+        type=basestring
+    )
+    define(
+        "node_url",
+        default="",
+        help=_("The WebSocket URL other nodes in the cluster should use to "
+               "proxy sessions to this node (e.g. 'wss://10.1.1.5:443/ws').  "
+               "Default: Generated from the hostname, port, and url_prefix."),
+        type=basestring
+    )
+    define(
+        "node_timeout",
+        default="30s",
+        help=_("How long a node may go without a heartbeat before its sessions"
+               " can be taken over by other nodes.  Default: '30s'"),
+        type=basestring
+    )
     define(
         "new_api_key",
         default=False,
@@ -3344,11 +3890,27 @@ def main():
         os.close(tempfd2)
         if uid != os.getuid():
             drop_privileges(uid, gid, [tty_gid])
+        # Started after dropping privileges so the registry db has the right
+        # owner.
+        setup_registry(go_settings)
+        build_assets(all_settings, app_modules)
+        if options.profile_startup:
+            startup.stop()
+            for line in startup.report().splitlines():
+                logging.info(line)
         tornado.ioloop.IOLoop.instance().start()
     except KeyboardInterrupt: # ctrl-c
         logging.info(_("Caught KeyboardInterrupt.  Killing sessions..."))
     finally:
         tornado.ioloop.IOLoop.instance().stop()
+        import media
+        media.close_media_pool() # Stop the image/thumbnail worker processes
+        import processes
+        if processes.PROCESS_RUNNER: # Kill any commands that are still running
+            processes.PROCESS_RUNNER.close()
+        if processes.STATS: # How long external commands took
+            for line in processes.stats_report().splitlines():
+                logging.info(line)
         remove_pid(go_settings['pid_file'])
         logging.info(_("pid file removed."))
         # TODO: Move this dtach stuff to app_terminal.py
@@ -3359,6 +3921,8 @@ def main():
             # when Gate One is closed.  This is primarily to handle that
             # specific situation.
             killall(go_settings['session_dir'], go_settings['pid_file'])
+            if REGISTRY: # Our sessions are gone; let other nodes know
+                REGISTRY.unregister_node()
             # Cleanup the session_dir (it's supposed to only contain temp stuff)
             import shutil
             shutil.rmtree(go_settings['session_dir'], ignore_errors=True)
@@ -0,0 +1,299 @@
+# -*- coding: utf-8 -*-
+#
+#       Copyright 2013 Liftoff Software Corporation
+#
+# For license information see LICENSE.txt
+
+__doc__ = """\
+media.py - Processes captured images and PDFs in a pool of worker processes so
+that decoding, resizing, and thumbnailing never blocks the IOLoop.
+
+Terminals (see terminal.py) hand slow work to a *media processor*: a function
+that takes a worker function, its arguments, and a callback.  The
+:class:`MediaPool` in this module provides one (:meth:`MediaPool.submit`) that
+runs the worker function in a separate process and calls the callback (on the
+IOLoop) with the result.  Each user may only have a limited number of jobs
+running at a time; the rest wait their turn so one user cat'ing a directory full
+of images can't monopolize the pool.
+
+The worker functions (:func:`process_image` and :func:`pdf_thumbnail`) must be
+importable at the module level so they can be pickled.  They return `None`
+instead of raising exceptions.
+
+This module also includes :func:`image_dimensions` which reads the width and
+height of a PNG or JPEG straight out of its header (no decoding required) so
+the terminal emulator can reserve the right amount of space for an image before
+the worker is done with it.
+"""
+
+# Meta
+__version__ = '1.0'
+__version_info__ = (1, 0)
+__license__ = "AGPLv3 or Proprietary (see LICENSE.txt)"
+__author__ = 'Dan McDougall <daniel.mcdougall@liftoffsoftware.com>'
+
+# Import stdlib stuff
+import os
+import stat
+import signal
+import struct
+import logging
+import tempfile
+import subprocess
+from functools import partial
+from collections import deque
+
+# Globals
+MAX_IMAGE_SIZE = (640, 480) # Images bigger than this get shrunk to fit
+PDF_THUMBNAIL_SIZE = (90, 120)
+MEDIA_POOL = None # Gets set by get_media_pool()
+# JPEG "start of frame" markers (the ones that contain the dimensions)
+JPEG_SOF_MARKERS = set(range(0xC0, 0xD0)) - set([0xC4, 0xC8, 0xCC])
+
+def image_dimensions(data):
+    """
+    Returns the (width, height) of the PNG or JPEG image in *data* (string) by
+    examining its header.  Returns `None` if the dimensions couldn't be
+    determined.
+    """
+    if data.startswith(b'\x89PNG\r\n\x1a\n') or data.startswith(b'\x89PNG\n'):
+        # The IHDR chunk always comes first: <length><'IHDR'><width><height>
+        index = data.find(b'IHDR')
+        if index == -1 or len(data) < index + 12:
+            return None
+        return struct.unpack('>II', data[index+4:index+12])
+    if data.startswith(b'\xff\xd8'):
+        offset = 2
+        while offset + 9 < len(data):
+            if data[offset:offset+1] != b'\xff':
+                return None # Corrupt (or something we don't understand)
+            marker = ord(data[offset+1:offset+2])
+            if marker == 0xFF: # Padding
+                offset += 1
+                continue
+            length = struct.unpack('>H', data[offset+2:offset+4])[0]
+            if marker in JPEG_SOF_MARKERS:
+                height, width = struct.unpack('>HH', data[offset+5:offset+9])
+                return (width, height)
+            offset += 2 + length
+    return None
+
+def fit_dimensions(size, max_size=MAX_IMAGE_SIZE):
+    """
+    Returns *size* (width, height) scaled down (preserving the aspect ratio) to
+    fit within *max_size*.  The same math PIL's `Image.thumbnail()` uses.
+    """
+    width, height = size
+    if width > max_size[0]:
+        height = max(height * max_size[0] // width, 1)
+        width = max_size[0]
+    if height > max_size[1]:
+        width = max(width * max_size[1] // height, 1)
+        height = max_size[1]
+    return (width, height)
+
+def process_image(data, max_size=MAX_IMAGE_SIZE):
+    """
+    Decodes the image in *data*, shrinks it to fit within *max_size* (if
+    necessary), and returns `(<format>, (<width>, <height>), <image data>)`.
+    Returns `None` if PIL isn't available or can't make sense of the image.
+
+    .. note:: Meant to be run in a worker process.
+    """
+    from io import BytesIO
+    try:
+        from PIL import Image
+    except ImportError:
+        return None
+    try:
+        im = Image.open(BytesIO(data))
+        image_format = im.format
+        if im.size[0] > max_size[0] or im.size[1] > max_size[1]:
+            im.thumbnail(max_size, Image.ANTIALIAS)
+        out = BytesIO()
+        im.save(out, image_format)
+    except (IOError, ValueError) as e:
+        # i.e. PIL couldn't identify the file or is missing support for it
+        logging.error("process_image(): %s" % e)
+        return None
+    return (image_format, im.size, out.getvalue())
+
+def pdf_thumbnail(path, size=PDF_THUMBNAIL_SIZE):
+    """
+    Uses ghostscript (gs) to render the first page of the PDF at *path* as a
+    JPEG of the given *size*.  Returns the JPEG (string) or `None` if that
+    didn't work (e.g. gs isn't installed).
+
+    .. note:: Meant to be run in a worker process.
+    """
+    thumb = tempfile.NamedTemporaryFile(suffix='.jpg')
+    params = [
+        'gs', # gs must be in your path
+        '-dPDFFitPage',
+        '-dPARANOIDSAFER',
+        '-dBATCH',
+        '-dNOPAUSE',
+        '-dNOPROMPT',
+        '-dFirstPage=1',
+        '-dLastPage=1',
+        '-dMaxBitmap=500000000',
+        '-dAlignToPixels=0',
+        '-dGridFitTT=0',
+        '-dDEVICEWIDTH=%s' % size[0],
+        '-dDEVICEHEIGHT=%s' % size[1],
+        '-dORIENT1=true',
+        '-sDEVICE=jpeg',
+        '-dTextAlphaBits=4',
+        '-dGraphicsAlphaBits=4',
+        '-sOutputFile=%s' % thumb.name,
+        path
+    ]
+    try:
+        with open(os.devnull, 'w') as devnull:
+            retcode = subprocess.call(params, stdout=devnull, stderr=devnull)
+        if retcode != 0:
+            return None
+        with open(thumb.name, 'rb') as f:
+            return f.read() or None
+    except OSError: # gs isn't installed
+        return None
+    finally:
+        thumb.close() # Make sure it gets removed
+
+def _call(func, *args):
+    """
+    Calls *func* with *args* and returns the result.  Any exceptions will be
+    logged and `None` returned instead since :meth:`multiprocessing.Pool.apply_async`
+    would otherwise never call our callback.
+
+    .. note:: Runs in the worker process.
+    """
+    try:
+        return func(*args)
+    except Exception as e:
+        logging.error("Media worker error in %s: %s" % (func.__name__, e))
+        return None
+
+def _close_inherited_fds():
+    """
+    Closes the sockets (e.g. Gate One's listening socket) and character devices
+    (e.g. pty masters) that a worker inherited when it was forked from the
+    server so that the worker doesn't keep them open.  Pipes (which is how
+    :class:`multiprocessing.Pool` talks to its workers) and regular files (log
+    files) are left alone.
+
+    .. note:: Runs in the worker process.
+    """
+    try:
+        fds = [int(fd) for fd in os.listdir('/proc/self/fd')]
+    except OSError: # No /proc (e.g. BSD)
+        import resource
+        fds = range(resource.getrlimit(resource.RLIMIT_NOFILE)[0])
+    for fd in fds:
+        if fd <= 2: # stdin, stdout, stderr
+            continue
+        try:
+            mode = os.fstat(fd).st_mode
+        except OSError: # Not open (or it was the /proc listing itself)
+            continue
+        if stat.S_ISSOCK(mode) or stat.S_ISCHR(mode):
+            try:
+                os.close(fd)
+            except OSError:
+                pass
+
+def _init_worker():
+    """
+    Makes worker processes ignore SIGINT so that a ctrl-c meant for Gate One
+    doesn't spew tracebacks from every worker and closes the file descriptors
+    they shouldn't be holding onto (see :func:`_close_inherited_fds`).
+    """
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    _close_inherited_fds()
+
+class MediaPool(object):
+    """
+    Runs media processing functions in a :class:`multiprocessing.Pool` of
+    *processes* workers (defaults to the number of CPUs).  Results are delivered
+    to callbacks via *io_loop*.  No more than *per_user* jobs will run at a
+    time for any given user.
+    """
+    def __init__(self, processes=None, io_loop=None, per_user=2):
+        import multiprocessing
+        import tornado.ioloop
+        self.io_loop = io_loop or tornado.ioloop.IOLoop.instance()
+        self.per_user = per_user
+        self.pool = multiprocessing.Pool(
+            processes, initializer=_init_worker, maxtasksperchild=100)
+        self.running = {} # Format: {<user>: <number of jobs in progress>}
+        self.waiting = {} # Format: {<user>: deque([<job>, ...])}
+
+    def submit(self, func, args, callback, user=None):
+        """
+        Calls ``func(*args)`` in a worker process then ``callback(result)`` on
+        the IOLoop.  If *user* already has `self.per_user` jobs running the job
+        will be started as soon as one of them finishes.
+        """
+        job = (func, tuple(args), callback)
+        if self.running.get(user, 0) >= self.per_user:
+            self.waiting.setdefault(user, deque()).append(job)
+            return
+        self._start(user, job)
+
+    def _start(self, user, job):
+        func, args, callback = job
+        self.running[user] = self.running.get(user, 0) + 1
+        def done(result):
+            # NOTE: This gets called in one of the Pool's threads
+            self.io_loop.add_callback(
+                partial(self._finished, user, callback, result))
+        self.pool.apply_async(_call, (func,) + args, callback=done)
+
+    def _finished(self, user, callback, result):
+        """
+        Starts the next job waiting for *user* (if any) and calls *callback*
+        with *result*.
+        """
+        self.running[user] -= 1
+        if not self.running[user]:
+            del self.running[user]
+        waiting = self.waiting.get(user, None)
+        if waiting:
+            self._start(user, waiting.popleft())
+            if not waiting:
+                del self.waiting[user]
+        try:
+            callback(result)
+        except Exception as e:
+            logging.error("Exception in media callback %s: %s" % (callback, e))
+
+    def close(self):
+        """
+        Stops all the worker processes and waits for them to exit.
+        """
+        self.pool.terminate()
+        self.pool.join()
+        self.waiting.clear()
+
+def get_media_pool(**kwargs):
+    """
+    Returns the process-wide :class:`MediaPool`, creating it (with *kwargs*) if
+    necessary.
+
+    .. note:: The pool should be created after dropping privileges (it's created on first use) since the workers inherit them.
+    """
+    global MEDIA_POOL
+    if not MEDIA_POOL:
+        MEDIA_POOL = MediaPool(**kwargs)
+    return MEDIA_POOL
+
+def close_media_pool():
+    """
+    Stops the process-wide :class:`MediaPool` (if it was ever started).  Must
+    be called before Gate One re-executes itself or exits so that no workers
+    are left behind.
+    """
+    global MEDIA_POOL
+    if MEDIA_POOL:
+        MEDIA_POOL.close()
+        MEDIA_POOL = None
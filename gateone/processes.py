@@ -0,0 +1,509 @@
+# -*- coding: utf-8 -*-
+#
+#       Copyright 2013 Liftoff Software Corporation
+#
+# For license information see LICENSE.txt
+
+__doc__ = """\
+processes.py - Runs external commands without blocking the IOLoop.
+
+:class:`AsyncCommand` starts a command in its own process group, reads its
+stdout and stderr via the IOLoop as they arrive, and calls a callback with the
+result when the command exits.  If the command takes too long the whole process
+group gets killed (so a shell's children don't outlive it).
+
+:class:`ProcessRunner` limits how many commands run at once (the rest wait
+their turn).  Most code should just use :func:`run_async` which uses the
+process-wide runner::
+
+    >>> from processes import run_async
+    >>> def got_uptime(stdout, stderr, exitstatus):
+    ...     print(stdout)
+    >>> run_async(['uptime'], got_uptime)
+
+For the rare situations where blocking is acceptable (e.g. startup, before the
+IOLoop is running) :func:`run` executes a command synchronously with the same
+timeout/process group handling.
+
+How long each command took (along with how many timed out or failed) is
+recorded in :data:`STATS` which can be summarized via :func:`stats_report`.
+
+This module also keeps track of existing processes:  :func:`process_table`
+reads every process' parent, process group, and command line out of /proc in a
+single pass (falling back to a single ``ps`` on systems without /proc) and
+:func:`process_tree`/:func:`signal_tree` use that table to find (and signal)
+all the descendants of a given process without having to re-scan anything.
+"""
+
+# Meta
+__version__ = '1.0'
+__version_info__ = (1, 0)
+__license__ = "AGPLv3 or Proprietary (see LICENSE.txt)"
+__author__ = 'Dan McDougall <daniel.mcdougall@liftoffsoftware.com>'
+
+# Import stdlib stuff
+import os
+import time
+import errno
+import fcntl
+import signal
+import select
+import logging
+from datetime import timedelta
+from functools import partial
+from collections import deque
+from subprocess import Popen, PIPE
+
+# Globals
+DEFAULT_TIMEOUT = timedelta(seconds=30) # Commands taking longer get killed
+MAX_OUTPUT = 10*1024*1024 # 10MB (per stream).  Anything more is discarded
+MAX_PROCESSES = 8 # How many commands the PROCESS_RUNNER will run at once
+PROC_DIR = '/proc'
+# Used to list processes on systems without /proc (e.g. BSD and Mac OS X):
+PS_COMMAND = ['ps', '-axo', 'pid=,ppid=,pgid=,command=']
+PROCESS_RUNNER = None # Gets set by get_process_runner()
+# Format: {<command name>: {'calls': 0, 'failures': 0, 'timeouts': 0,
+#                           'seconds': 0.0, 'max': 0.0}}
+STATS = {}
+
+def _seconds(timeout):
+    """
+    Returns *timeout* (a `timedelta` or a number of seconds) as a float.
+    """
+    if isinstance(timeout, timedelta):
+        return (
+            timeout.days * 86400 + timeout.seconds +
+            timeout.microseconds / 1000000.0)
+    return float(timeout)
+
+def _command_name(args, shell=False):
+    """
+    Returns a short name for the command in *args* (for :data:`STATS`).
+    """
+    if shell or isinstance(args, basestring):
+        args = args.split()
+    if not args:
+        return 'unknown'
+    return os.path.basename(str(args[0]))
+
+def record(name, duration, exitstatus, timed_out=False):
+    """
+    Records the *duration* (seconds) and result of a command in :data:`STATS`.
+    """
+    stats = STATS.setdefault(name, {
+        'calls': 0, 'failures': 0, 'timeouts': 0, 'seconds': 0.0, 'max': 0.0})
+    stats['calls'] += 1
+    stats['seconds'] += duration
+    stats['max'] = max(stats['max'], duration)
+    if timed_out:
+        stats['timeouts'] += 1
+    elif exitstatus != 0:
+        stats['failures'] += 1
+    logging.debug("%s finished in %.1fms (exit status: %s)" % (
+        name, duration * 1000, exitstatus))
+
+def stats_report():
+    """
+    Returns a string summarizing :data:`STATS` like so::
+
+        command          calls  failures  timeouts   avg (ms)   max (ms)
+        ssh                 12         0         1       35.2      210.3
+    """
+    lines = ["%-16s %6s %9s %9s %10s %10s" % (
+        'command', 'calls', 'failures', 'timeouts', 'avg (ms)', 'max (ms)')]
+    for name, stats in sorted(STATS.items()):
+        lines.append("%-16s %6s %9s %9s %10.1f %10.1f" % (
+            name, stats['calls'], stats['failures'], stats['timeouts'],
+            stats['seconds'] / stats['calls'] * 1000, stats['max'] * 1000))
+    return '\n'.join(lines)
+
+def _kill_group(proc, sig=signal.SIGKILL):
+    """
+    Sends *sig* to the process group led by *proc* (a `Popen` instance).  Falls
+    back to signaling just *proc* if it isn't a process group leader.
+    """
+    try:
+        os.killpg(proc.pid, sig)
+    except OSError:
+        try:
+            os.kill(proc.pid, sig)
+        except OSError:
+            pass # Already dead
+
+def _popen(args, shell=False, env=None, cwd=None):
+    """
+    Starts *args* in a new session (and thus its own process group) with
+    stdin connected to /dev/null and pipes for stdout and stderr.
+    """
+    with open(os.devnull) as devnull:
+        return Popen(args,
+            shell=shell, env=env, cwd=cwd, stdin=devnull, stdout=PIPE,
+            stderr=PIPE, close_fds=True, preexec_fn=os.setsid)
+
+def run(args, timeout=DEFAULT_TIMEOUT, shell=False, env=None, cwd=None,
+        max_output=MAX_OUTPUT):
+    """
+    Executes *args* and waits for it to complete (blocking!).  Returns::
+
+        (stdout, stderr, exitstatus)
+
+    If the command takes longer than *timeout* its process group will be killed
+    and *exitstatus* will be `None`.  The same goes if the command couldn't be
+    executed (e.g. it doesn't exist) in which case *stderr* will explain what
+    happened.
+
+    .. note:: Only use this when blocking is OK (e.g. before the IOLoop has started).  Everywhere else use :func:`run_async`.
+    """
+    name = _command_name(args, shell)
+    started = time.time()
+    deadline = started + _seconds(timeout)
+    try:
+        proc = _popen(args, shell=shell, env=env, cwd=cwd)
+    except (OSError, TypeError) as e: # TypeError: e.g. which() returned None
+        record(name, time.time() - started, None)
+        return (u'', u"Could not execute %s: %s" % (name, e), None)
+    output = {proc.stdout: [], proc.stderr: []}
+    sizes = {proc.stdout: 0, proc.stderr: 0}
+    pipes = [proc.stdout, proc.stderr]
+    timed_out = False
+    while pipes:
+        remaining = deadline - time.time()
+        if remaining <= 0:
+            timed_out = True
+            _kill_group(proc)
+            break
+        try:
+            readable = select.select(pipes, [], [], remaining)[0]
+        except select.error as e:
+            if e.args[0] == errno.EINTR:
+                continue
+            raise
+        for pipe in readable:
+            chunk = os.read(pipe.fileno(), 65536)
+            if not chunk:
+                pipes.remove(pipe)
+            elif sizes[pipe] < max_output:
+                output[pipe].append(chunk)
+            sizes[pipe] += len(chunk)
+    proc.stdout.close()
+    proc.stderr.close()
+    exitstatus = proc.wait()
+    record(name, time.time() - started, exitstatus, timed_out)
+    stdout = b''.join(output[proc.stdout])[:max_output]
+    stderr = b''.join(output[proc.stderr])[:max_output]
+    stdout = stdout.decode('utf-8', 'replace')
+    stderr = stderr.decode('utf-8', 'replace')
+    if timed_out:
+        return (stdout, u"Timeout exceeded (%s)" % timeout, None)
+    return (stdout, stderr, exitstatus)
+
+class AsyncCommand(object):
+    """
+    Executes *args* (a list or, if *shell* is True, a string) in its own
+    process group and collects its stdout and stderr via the IOLoop.  When the
+    command completes (or after *timeout*) *callback* will be called like so::
+
+        callback(stdout, stderr, exitstatus)
+
+    If the command couldn't be executed or was killed because it took too long
+    *exitstatus* will be `None` and *stderr* will explain what happened.
+
+    If *stream_callback* is given it will be called with each chunk of output
+    as it arrives (in addition to *callback* at the end)::
+
+        stream_callback(<'stdout' or 'stderr'>, <chunk of bytes>)
+
+    .. note:: Only the first *max_output* bytes of each stream are kept.
+    """
+    def __init__(self, args, callback, timeout=DEFAULT_TIMEOUT,
+            max_output=MAX_OUTPUT, stream_callback=None, shell=False,
+            env=None, cwd=None, io_loop=None):
+        import tornado.ioloop
+        self.args = args
+        self.callback = callback
+        self.timeout = timeout
+        self.max_output = max_output
+        self.stream_callback = stream_callback
+        self.shell = shell
+        self.env = env
+        self.cwd = cwd
+        self.io_loop = io_loop or tornado.ioloop.IOLoop.instance()
+        self.name = _command_name(args, shell)
+        self.proc = None
+        self.pipes = {} # Format: {<fd>: <pipe (file object)>}
+        self.output = {} # Format: {<fd>: [<chunk>, <chunk>, ...]}
+        self.sizes = {} # Format: {<fd>: <bytes read so far>}
+        self.error = None
+        self.timer = None
+        self.started = None
+        self.duration = None # How long it took (in seconds)
+
+    def start(self):
+        """
+        Starts executing the command.
+        """
+        self.started = time.time()
+        try:
+            self.proc = _popen(
+                self.args, shell=self.shell, env=self.env, cwd=self.cwd)
+        except (OSError, TypeError) as e: # TypeError: which() returned None
+            self.error = "Could not execute %s: %s" % (self.name, e)
+            self.io_loop.add_callback(self._finish)
+            return
+        self.stdout_fd = self.proc.stdout.fileno()
+        self.stderr_fd = self.proc.stderr.fileno()
+        for pipe in (self.proc.stdout, self.proc.stderr):
+            fd = pipe.fileno()
+            flags = fcntl.fcntl(fd, fcntl.F_GETFL)
+            fcntl.fcntl(fd, fcntl.F_SETFL, flags | os.O_NONBLOCK)
+            self.pipes[fd] = pipe
+            self.output[fd] = []
+            self.sizes[fd] = 0
+            self.io_loop.add_handler(
+                fd, self._read, self.io_loop.READ|self.io_loop.ERROR)
+        self.timer = self.io_loop.add_timeout(
+            time.time() + _seconds(self.timeout), self._timed_out)
+
+    def kill(self, sig=signal.SIGKILL):
+        """
+        Sends *sig* to the command's process group.  :attr:`callback` will
+        still be called (once its pipes are closed).
+        """
+        if self.proc and self.proc.returncode is None:
+            _kill_group(self.proc, sig)
+
+    def _read(self, fd, events):
+        """
+        Reads whatever is available from *fd* (stdout or stderr).
+        """
+        try:
+            chunk = os.read(fd, 65536)
+        except OSError as e:
+            if e.errno == errno.EAGAIN: # Nothing to read after all
+                return
+            chunk = b''
+        if not chunk: # EOF
+            self.io_loop.remove_handler(fd)
+            self.pipes.pop(fd).close()
+            if not self.pipes: # Both have been closed
+                self._reap()
+            return
+        if self.sizes[fd] < self.max_output: # Otherwise discard it
+            self.output[fd].append(chunk)
+        self.sizes[fd] += len(chunk)
+        if self.stream_callback:
+            stream = 'stdout' if fd == self.stdout_fd else 'stderr'
+            try:
+                self.stream_callback(stream, chunk)
+            except Exception as e:
+                logging.error(
+                    "Exception in stream callback for %s: %s" % (self.name, e))
+
+    def _reap(self):
+        """
+        Waits (without blocking) for the process to exit and then calls
+        :meth:`_finish`.
+        """
+        if self.proc.poll() is None:
+            # Closed its pipes but hasn't quite exited yet
+            self.io_loop.add_timeout(timedelta(milliseconds=20), self._reap)
+            return
+        self._finish()
+
+    def _timed_out(self):
+        """
+        Kills the process group (which will result in :meth:`_finish` being
+        called once its pipes are closed).
+        """
+        self.timer = None
+        self.error = "Timeout exceeded (%s)" % self.timeout
+        self.kill()
+
+    def _finish(self):
+        """
+        Records how long the command took and calls :attr:`callback` with the
+        results.
+        """
+        if self.timer:
+            self.io_loop.remove_timeout(self.timer)
+            self.timer = None
+        if self.proc:
+            stdout = b''.join(self.output[self.stdout_fd])
+            stderr = b''.join(self.output[self.stderr_fd])
+            stdout = stdout[:self.max_output].decode('utf-8', 'replace')
+            stderr = stderr[:self.max_output].decode('utf-8', 'replace')
+            exitstatus = self.proc.returncode
+        else:
+            stdout, stderr, exitstatus = u'', u'', None
+        self.duration = time.time() - self.started
+        record(self.name, self.duration, exitstatus,
+            timed_out=bool(self.error and self.proc))
+        if self.error:
+            stderr, exitstatus = self.error, None
+        self.output = {}
+        self.callback(stdout, stderr, exitstatus)
+
+class ProcessRunner(object):
+    """
+    Runs :class:`AsyncCommand` instances, no more than *limit* at a time; the
+    rest wait their turn.
+    """
+    def __init__(self, limit=MAX_PROCESSES, io_loop=None):
+        import tornado.ioloop
+        self.io_loop = io_loop or tornado.ioloop.IOLoop.instance()
+        self.limit = limit
+        self.running = set()
+        self.waiting = deque()
+
+    def execute(self, args, callback, **kwargs):
+        """
+        Executes *args* and calls ``callback(stdout, stderr, exitstatus)`` when
+        it completes.  *kwargs* will be passed to :class:`AsyncCommand`.
+        """
+        kwargs.setdefault('io_loop', self.io_loop)
+        self.submit(AsyncCommand(args, callback, **kwargs))
+
+    def submit(self, command):
+        """
+        Starts *command* (an :class:`AsyncCommand`) or queues it up if
+        `self.limit` commands are already running.
+        """
+        command.callback = partial(self._finished, command, command.callback)
+        if len(self.running) < self.limit:
+            self._start(command)
+        else:
+            self.waiting.append(command)
+
+    def _start(self, command):
+        self.running.add(command)
+        command.start()
+
+    def _finished(self, command, callback, stdout, stderr, exitstatus):
+        """
+        Starts the next waiting command (if any) then calls *callback*.
+        """
+        self.running.discard(command)
+        if self.waiting:
+            self._start(self.waiting.popleft())
+        try:
+            callback(stdout, stderr, exitstatus)
+        except Exception as e:
+            logging.error(
+                "Exception in callback for %s: %s" % (command.name, e))
+
+    def close(self):
+        """
+        Kills everything that's running and forgets everything that's waiting.
+        """
+        self.waiting.clear()
+        for command in list(self.running):
+            command.kill()
+
+def get_process_runner(**kwargs):
+    """
+    Returns the process-wide :class:`ProcessRunner`, creating it (with
+    *kwargs*) if necessary.
+    """
+    global PROCESS_RUNNER
+    if not PROCESS_RUNNER:
+        PROCESS_RUNNER = ProcessRunner(**kwargs)
+    return PROCESS_RUNNER
+
+def run_async(args, callback, **kwargs):
+    """
+    Executes *args* via the process-wide :class:`ProcessRunner` and calls
+    ``callback(stdout, stderr, exitstatus)`` when it completes.  *kwargs* will
+    be passed to :class:`AsyncCommand`.
+    """
+    get_process_runner().execute(args, callback, **kwargs)
+
+def parse_ps(output):
+    """
+    Parses the *output* of :data:`PS_COMMAND` and returns it in the same format
+    as :func:`process_table`.
+    """
+    table = {}
+    for line in output.splitlines():
+        try:
+            pid, ppid, pgid, command = line.split(None, 3)
+            table[int(pid)] = (int(ppid), int(pgid), command)
+        except ValueError:
+            continue # Blank line or a process without a command
+    return table
+
+def process_table(proc_dir=PROC_DIR):
+    """
+    Returns a dict describing every process on the system::
+
+        {<pid>: (<parent pid>, <process group id>, <command line>)}
+
+    The information comes from /proc (*proc_dir*).  If that doesn't exist
+    :data:`PS_COMMAND` will be used instead (blocking).
+    """
+    if not os.path.isdir(proc_dir):
+        return parse_ps(run(PS_COMMAND)[0])
+    table = {}
+    for entry in os.listdir(proc_dir):
+        if not entry.isdigit():
+            continue # Not a PID
+        try:
+            with open(os.path.join(proc_dir, entry, 'stat')) as f:
+                stat = f.read()
+            with open(os.path.join(proc_dir, entry, 'cmdline')) as f:
+                cmdline = f.read()
+        except (IOError, OSError):
+            continue # Ended as we were looking at it
+        # The process name (in parens) may contain spaces and parens so skip
+        # past the last paren:  <state> <ppid> <pgrp> <session> ...
+        fields = stat[stat.rfind(')') + 2:].split()
+        try:
+            table[int(entry)] = (
+                int(fields[1]), int(fields[2]),
+                cmdline.replace('\x00', ' ').strip())
+        except (IndexError, ValueError):
+            continue # Something we don't understand (shouldn't happen)
+    return table
+
+def process_tree(parent_pid, table=None):
+    """
+    Returns a list of *parent_pid* and all its descendants (children first,
+    then grandchildren, etc).  If *table* (the output of
+    :func:`process_table`) isn't given it will be read.
+    """
+    if table is None:
+        table = process_table()
+    children = {}
+    for pid, (ppid, pgid, cmdline) in table.items():
+        children.setdefault(ppid, []).append(pid)
+    out = [parent_pid]
+    for pid in out: # NOTE: out grows as we go
+        out.extend(sorted(children.get(pid, ())))
+    return out
+
+def signal_tree(parent_pid, sig=signal.SIGTERM, table=None):
+    """
+    Sends *sig* to *parent_pid*, all its descendants, and every member of the
+    process groups they lead (which catches processes that were orphaned and
+    re-parented to init).  Returns the list of pids in the tree.
+
+    .. note:: Process groups led by something outside the tree (e.g. Gate One's own) are left alone.
+    """
+    if table is None:
+        table = process_table()
+    tree = process_tree(parent_pid, table)
+    members = set(tree)
+    groups = set(
+        table[pid][1] for pid in tree if pid in table and table[pid][1] in members)
+    for pgid in groups:
+        try:
+            os.killpg(pgid, sig)
+        except OSError:
+            pass # Group is already gone
+    for pid in tree:
+        if pid in table and table[pid][1] in groups:
+            continue # Already signaled via its process group
+        try:
+            os.kill(pid, sig)
+        except OSError:
+            pass # Already dead
+    return tree
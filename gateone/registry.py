@@ -0,0 +1,776 @@
+# -*- coding: utf-8 -*-
+#
+#       Copyright 2013 Liftoff Software Corporation
+#
+# For license information see LICENSE.txt
+
+__doc__ = """\
+registry.py - Keeps track of which Gate One node owns which user session,
+terminal, and shared terminal.
+
+A single Gate One server doesn't need any of this; `SESSIONS` and `PERSIST`
+are all it takes.  When several Gate One servers (nodes) sit behind a load
+balancer, however, a user can reconnect to a different node than the one
+running their terminals.  The session registry gives every node a shared view
+of ownership so that the node a user lands on can proxy their WebSocket traffic
+to the node that actually owns their session.
+
+Two backends are provided:
+
+    * :class:`LocalSessionRegistry`: Keeps everything in memory.  This is the
+      default and is only useful for a single node (and for testing).
+    * :class:`SQLiteSessionRegistry`: Keeps everything in an SQLite database.
+      Point all nodes at the same database file (e.g. on shared storage) to
+      form a cluster.
+
+Other backends can be written by subclassing :class:`SessionRegistry` and
+registering the class in :attr:`BACKENDS`.
+
+Every node periodically calls :meth:`SessionRegistry.heartbeat`.  A node that
+hasn't sent a heartbeat in *node_timeout* seconds is considered dead and its
+sessions may be claimed by whichever node the user connects to next.
+
+When a connection gets proxied to another node :func:`proxy_headers` provides
+the headers to send along so the owning node sees the same user and
+:class:`UpstreamConnection` carries the traffic.
+"""
+
+# Meta
+__version__ = '1.0'
+__version_info__ = (1, 0)
+__license__ = "AGPLv3 or Proprietary (see LICENSE.txt)"
+__author__ = 'Dan McDougall <daniel.mcdougall@liftoffsoftware.com>'
+
+# Import stdlib stuff
+import os
+import ssl
+import time
+import array
+import base64
+import socket
+import struct
+import hashlib
+import logging
+import sqlite3
+import urlparse
+from functools import wraps, partial
+from contextlib import contextmanager
+
+# Import 3rd party stuff
+import tornado.ioloop
+from tornado.iostream import IOStream, SSLIOStream
+from tornado.httputil import HTTPHeaders
+
+# Globals
+# Client headers that get passed along when a connection is proxied to the node
+# that owns the session (the cookie is what identifies the user):
+PROXY_HEADERS = ['Origin', 'Cookie', 'User-Agent', 'Accept-Language']
+
+def proxy_headers(headers, remote_ip):
+    """
+    Returns the headers (dict) to use when proxying a client's connection to
+    another node given the client's request *headers* (dict-like) and
+    *remote_ip*.  The headers in :attr:`PROXY_HEADERS` are copied and
+    *remote_ip* is appended to X-Forwarded-For.
+    """
+    out = {}
+    for header in PROXY_HEADERS:
+        if headers.get(header):
+            out[header] = headers[header]
+    forwarded_for = headers.get('X-Forwarded-For')
+    if forwarded_for:
+        out['X-Forwarded-For'] = "%s, %s" % (forwarded_for, remote_ip)
+    else:
+        out['X-Forwarded-For'] = remote_ip
+    return out
+
+WS_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11" # From RFC 6455
+
+def default_ca_certs():
+    """
+    Returns the path to the CA certificates bundle used to validate the
+    certificates of other nodes:  The one that comes with Tornado (< 4.0),
+    certifi's, or the system's.
+    """
+    import tornado
+    bundled = os.path.join(
+        os.path.dirname(tornado.__file__), 'ca-certificates.crt')
+    if os.path.exists(bundled):
+        return bundled
+    try:
+        import certifi
+        return certifi.where()
+    except ImportError:
+        return '/etc/ssl/certs/ca-certificates.crt'
+
+def websocket_mask(mask, data):
+    """
+    Returns *data* (bytes) XOR'd with the 4-byte *mask* as required for
+    frames sent by WebSocket clients.
+    """
+    mask = array.array('B', mask)
+    masked = array.array('B', data)
+    for i in xrange(len(masked)):
+        masked[i] ^= mask[i % 4]
+    return masked.tostring()
+
+class UpstreamConnection(object):
+    """
+    A minimal WebSocket (RFC 6455) client for proxying a client's connection
+    to the node that owns its session.  It only needs Tornado's
+    :class:`~tornado.iostream.IOStream` so it works with every version of
+    Tornado Gate One runs on (`tornado.websocket.websocket_connect` didn't
+    arrive until Tornado 3.2).
+
+    *url* must be a ws:// or wss:// URL and *headers* (dict) get sent along
+    with the handshake (see :func:`proxy_headers`).  *on_message* will be
+    called with every message received and *on_close* will be called
+    (without arguments) when the connection goes away--including when it
+    couldn't be established in the first place--unless :meth:`close` was
+    called first.  If *validate_cert* is `True` the certificates of wss://
+    nodes must be valid and match the host in *url*.
+
+    .. note:: The host in *url* is resolved synchronously so nodes should be given as IP addresses (or names in /etc/hosts).
+    """
+    def __init__(self, url, headers, on_message, on_close,
+        validate_cert=True, connect_timeout=10, io_loop=None):
+        self.url = url
+        self.headers = headers
+        self.on_message = on_message
+        self.on_close = on_close
+        self.validate_cert = validate_cert
+        self.connect_timeout = connect_timeout
+        self.io_loop = io_loop or tornado.ioloop.IOLoop.instance()
+        self.stream = None
+        self.connected = False
+        self._timeout = None
+        self._fragments = []
+        self._fragments_opcode = None
+
+    def connect(self, callback):
+        """
+        Starts connecting to `self.url`.  *callback* will be called (without
+        arguments) as soon as the WebSocket handshake completes.
+        """
+        parsed = urlparse.urlparse(self.url)
+        secure = parsed.scheme == 'wss'
+        port = parsed.port or (443 if secure else 80)
+        try:
+            family, socktype, proto, canonname, address = socket.getaddrinfo(
+                parsed.hostname, port, 0, socket.SOCK_STREAM)[0]
+        except (socket.error, TypeError) as e:
+            logging.error("UpstreamConnection: %s: %s" % (self.url, e))
+            self.io_loop.add_callback(self._on_stream_close)
+            return
+        sock = socket.socket(family, socktype, proto)
+        if secure:
+            ssl_options = {}
+            if self.validate_cert:
+                ssl_options = {
+                    'cert_reqs': ssl.CERT_REQUIRED,
+                    'ca_certs': default_ca_certs()
+                }
+            self.stream = SSLIOStream(
+                sock, io_loop=self.io_loop, ssl_options=ssl_options)
+        else:
+            self.stream = IOStream(sock, io_loop=self.io_loop)
+        self.stream.set_close_callback(self._on_stream_close)
+        self._timeout = self.io_loop.add_timeout(
+            time.time() + self.connect_timeout, self._connect_timed_out)
+        self.stream.connect(
+            address, partial(self._send_handshake, parsed, callback))
+
+    def _connect_timed_out(self):
+        self._timeout = None
+        logging.error("UpstreamConnection: Timed out connecting to %s" %
+            self.url)
+        self.stream.close()
+
+    def _send_handshake(self, parsed, callback):
+        """
+        Sends the WebSocket handshake request (once the TCP/SSL connection is
+        up).
+        """
+        if isinstance(self.stream, SSLIOStream) and self.validate_cert:
+            try:
+                ssl.match_hostname(
+                    self.stream.socket.getpeercert(), parsed.hostname)
+            except (ssl.CertificateError, ValueError) as e:
+                logging.error("UpstreamConnection: %s: %s" % (self.url, e))
+                self.stream.close()
+                return
+        key = base64.b64encode(os.urandom(16))
+        self._accept = base64.b64encode(hashlib.sha1(key + WS_GUID).digest())
+        path = parsed.path or '/'
+        if parsed.query:
+            path += '?' + parsed.query
+        request = [
+            "GET %s HTTP/1.1" % path,
+            "Host: %s" % parsed.netloc,
+            "Upgrade: websocket",
+            "Connection: Upgrade",
+            "Sec-WebSocket-Key: %s" % key,
+            "Sec-WebSocket-Version: 13",
+        ]
+        for header, value in self.headers.items():
+            request.append("%s: %s" % (header, value))
+        self.stream.write(b"\r\n".join(request) + b"\r\n\r\n")
+        self.stream.read_until(
+            b"\r\n\r\n", partial(self._on_handshake, callback))
+
+    def _on_handshake(self, callback, data):
+        """
+        Checks the server's response to our handshake and starts reading
+        frames if all is well.
+        """
+        status_line, sep, headers = data.partition(b"\r\n")
+        headers = HTTPHeaders.parse(headers)
+        status = status_line.split(None, 2)
+        if len(status) < 2 or status[1] != b'101' or (
+                headers.get('Sec-WebSocket-Accept') != self._accept):
+            logging.error("UpstreamConnection: %s refused the WebSocket "
+                "connection: %s" % (self.url, status_line))
+            self.stream.close()
+            return
+        if self._timeout:
+            self.io_loop.remove_timeout(self._timeout)
+            self._timeout = None
+        self.connected = True
+        callback()
+        self._read_frame()
+
+    def _read_frame(self):
+        if self.stream and not self.stream.closed():
+            self.stream.read_bytes(2, self._on_frame_start)
+
+    def _on_frame_start(self, data):
+        header, length = struct.unpack('BB', data)
+        self._final = header & 0x80
+        self._opcode = header & 0x0f
+        if length & 0x80: # Servers must never mask their frames
+            logging.error("UpstreamConnection: Masked frame from %s" %
+                self.url)
+            self.stream.close()
+            return
+        length &= 0x7f
+        if length == 126:
+            self.stream.read_bytes(2, lambda data:
+                self._read_payload(struct.unpack('!H', data)[0]))
+        elif length == 127:
+            self.stream.read_bytes(8, lambda data:
+                self._read_payload(struct.unpack('!Q', data)[0]))
+        else:
+            self._read_payload(length)
+
+    def _read_payload(self, length):
+        if length:
+            self.stream.read_bytes(length, self._on_payload)
+        else:
+            self._on_payload(b"")
+
+    def _on_payload(self, data):
+        opcode = self._opcode
+        if opcode == 0x8: # Close
+            self._write_frame(0x8, data[:2])
+            self.stream.close()
+            return
+        elif opcode == 0x9: # Ping
+            self._write_frame(0xA, data)
+        elif opcode in (0x0, 0x1, 0x2): # Continuation, text, binary
+            if opcode:
+                self._fragments = []
+                self._fragments_opcode = opcode
+            self._fragments.append(data)
+            if self._final:
+                message = b"".join(self._fragments)
+                self._fragments = []
+                if self._fragments_opcode == 0x1:
+                    message = message.decode('utf-8')
+                self.on_message(message)
+        self._read_frame()
+
+    def _write_frame(self, opcode, data):
+        if not self.stream or self.stream.closed():
+            return
+        length = len(data)
+        if length < 126:
+            header = struct.pack('BB', 0x80 | opcode, 0x80 | length)
+        elif length <= 0xffff:
+            header = struct.pack('!BBH', 0x80 | opcode, 0x80 | 126, length)
+        else:
+            header = struct.pack('!BBQ', 0x80 | opcode, 0x80 | 127, length)
+        mask = os.urandom(4)
+        self.stream.write(header + mask + websocket_mask(mask, data))
+
+    def write_message(self, message):
+        """
+        Sends *message* (a string) to the upstream node as a text frame.
+        """
+        if isinstance(message, unicode):
+            message = message.encode('utf-8')
+        self._write_frame(0x1, message)
+
+    def close(self):
+        """
+        Closes the connection.  `self.on_close` will *not* be called.
+        """
+        self.on_close = None
+        if self.stream and not self.stream.closed():
+            if self.connected:
+                self._write_frame(0x8, struct.pack('!H', 1000)) # Normal
+            self.stream.close()
+
+    def _on_stream_close(self):
+        if self._timeout:
+            self.io_loop.remove_timeout(self._timeout)
+            self._timeout = None
+        self.connected = False
+        on_close, self.on_close = self.on_close, None
+        if on_close:
+            on_close()
+
+class SessionRegistry(object):
+    """
+    The base class for all session registry backends.  *node_id* must be
+    unique to each node in the cluster and *node_url* must be the WebSocket URL
+    other nodes should use to reach this node (e.g. 'wss://10.1.1.5:443/ws').
+
+    Nodes that haven't sent a heartbeat in *node_timeout* seconds are
+    considered dead.
+
+    Node records are returned as dicts with the following keys::
+
+        {'node_id': <string>, 'url': <string>, 'heartbeat': <float>}
+    """
+    def __init__(self, node_id, node_url='', node_timeout=30):
+        self.node_id = node_id
+        self.node_url = node_url
+        self.node_timeout = node_timeout
+
+    def __repr__(self):
+        return "%s: %s" % (self.__class__.__name__, self.node_id)
+
+    def alive(self, node):
+        """
+        Returns `True` if the given *node* record has sent a heartbeat within
+        the last `self.node_timeout` seconds.  Our own node is always alive.
+        """
+        if not node:
+            return False
+        if node['node_id'] == self.node_id:
+            return True
+        return time.time() - node['heartbeat'] < self.node_timeout
+
+    def is_local(self, node):
+        """
+        Returns `True` if the given *node* record refers to this node.
+        """
+        return bool(node) and node['node_id'] == self.node_id
+
+    def register_node(self):
+        """
+        Adds (or updates) this node's record in the registry.
+        """
+        raise NotImplementedError
+
+    def unregister_node(self):
+        """
+        Removes this node and everything it owns from the registry.
+        """
+        raise NotImplementedError
+
+    def heartbeat(self):
+        """
+        Lets the other nodes know that this node is still alive.  Meant to be
+        called periodically (e.g. via a PeriodicCallback).
+        """
+        raise NotImplementedError
+
+    def node(self, node_id):
+        """
+        Returns the record of the node matching *node_id* or `None`.
+        """
+        raise NotImplementedError
+
+    def nodes(self):
+        """
+        Returns a list of the records of all the live nodes.
+        """
+        raise NotImplementedError
+
+    def claim_session(self, session, upn=None, force=False):
+        """
+        Claims ownership of *session* for this node unless it is already owned
+        by another live node.  Returns the record of the node that owns the
+        session once this call completes (which will be this node if the claim
+        succeeded).  If *force* is `True` the session will be claimed no matter
+        who owns it.
+
+        Returns `None` if the registry couldn't be consulted.  Callers must not
+        treat that as ownership (the session may well be running elsewhere).
+        """
+        raise NotImplementedError
+
+    def session_owner(self, session):
+        """
+        Returns the record of the live node that owns *session* or `None`.
+        """
+        raise NotImplementedError
+
+    def release_session(self, session):
+        """
+        Removes *session* (and all of its terminals and shares) from the
+        registry.
+        """
+        raise NotImplementedError
+
+    def claim_terminal(self, session, location, term):
+        """
+        Records that this node is running *term* at *location* for *session*.
+        """
+        raise NotImplementedError
+
+    def release_terminal(self, session, location, term):
+        """
+        Removes the record of *term* at *location* for *session*.
+        """
+        raise NotImplementedError
+
+    def terminals(self, session):
+        """
+        Returns a list of `(location, term, node_id)` tuples for all the
+        terminals belonging to *session*.
+        """
+        raise NotImplementedError
+
+    def add_share(self, share_id, session, location, term):
+        """
+        Records that the terminal at *session*, *location*, *term* is shared
+        as *share_id* from this node.
+        """
+        raise NotImplementedError
+
+    def remove_share(self, share_id):
+        """
+        Removes *share_id* from the registry.
+        """
+        raise NotImplementedError
+
+    def share_owner(self, share_id):
+        """
+        Returns the record of the live node hosting *share_id* or `None`.
+        """
+        raise NotImplementedError
+
+class LocalSessionRegistry(SessionRegistry):
+    """
+    A :class:`SessionRegistry` that keeps everything in memory.  Since nothing
+    is shared with other processes every session will always be owned by this
+    node.
+    """
+    def __init__(self, node_id, node_url='', node_timeout=30, **kwargs):
+        SessionRegistry.__init__(self, node_id, node_url, node_timeout)
+        self._nodes = {}     # {node_id: node record}
+        self._sessions = {}  # {session: node_id}
+        self._terminals = {} # {(session, location, term): node_id}
+        self._shares = {}    # {share_id: (session, location, term, node_id)}
+
+    def register_node(self):
+        self._nodes[self.node_id] = {
+            'node_id': self.node_id,
+            'url': self.node_url,
+            'heartbeat': time.time()
+        }
+
+    def unregister_node(self):
+        self._nodes.pop(self.node_id, None)
+        for session, node_id in list(self._sessions.items()):
+            if node_id == self.node_id:
+                self.release_session(session)
+
+    def heartbeat(self):
+        if self.node_id not in self._nodes:
+            self.register_node()
+        self._nodes[self.node_id]['heartbeat'] = time.time()
+
+    def node(self, node_id):
+        return self._nodes.get(node_id, None)
+
+    def nodes(self):
+        return [a for a in self._nodes.values() if self.alive(a)]
+
+    def claim_session(self, session, upn=None, force=False):
+        owner = self.session_owner(session)
+        if force or not owner:
+            self._sessions[session] = self.node_id
+            return self.node(self.node_id)
+        return owner
+
+    def session_owner(self, session):
+        node = self.node(self._sessions.get(session, None))
+        if self.alive(node):
+            return node
+
+    def release_session(self, session):
+        self._sessions.pop(session, None)
+        for key in list(self._terminals.keys()):
+            if key[0] == session:
+                del self._terminals[key]
+        for share_id, share in list(self._shares.items()):
+            if share[0] == session:
+                del self._shares[share_id]
+
+    def claim_terminal(self, session, location, term):
+        self._terminals[(session, location, term)] = self.node_id
+
+    def release_terminal(self, session, location, term):
+        self._terminals.pop((session, location, term), None)
+
+    def terminals(self, session):
+        out = []
+        for key, node_id in self._terminals.items():
+            if key[0] == session:
+                out.append((key[1], key[2], node_id))
+        out.sort()
+        return out
+
+    def add_share(self, share_id, session, location, term):
+        self._shares[share_id] = (session, location, term, self.node_id)
+
+    def remove_share(self, share_id):
+        self._shares.pop(share_id, None)
+
+    def share_owner(self, share_id):
+        share = self._shares.get(share_id, None)
+        if not share:
+            return None
+        node = self.node(share[3])
+        if self.alive(node):
+            return node
+
+def unavailable_returns(default=None):
+    """
+    Decorates :class:`SQLiteSessionRegistry` methods so that if the database
+    can't be used (e.g. another node has had it locked for longer than
+    `busy_timeout`) the error gets logged and *default* is returned instead of
+    stalling (or raising an exception on) the IOLoop.  If *default* is callable
+    it will be called with the registry instance to get the return value.
+    """
+    def decorator(method):
+        @wraps(method)
+        def wrapper(self, *args, **kwargs):
+            try:
+                return method(self, *args, **kwargs)
+            except sqlite3.OperationalError as e:
+                logging.error("SQLiteSessionRegistry.%s(): %s" % (
+                    method.__name__, e))
+                if callable(default):
+                    return default(self)
+                return default
+        return wrapper
+    return decorator
+
+class SQLiteSessionRegistry(SessionRegistry):
+    """
+    A :class:`SessionRegistry` that stores everything in the SQLite database at
+    *path*.  All the nodes in a cluster must use the same database file.
+
+    Claims are made inside of an immediate (write-locked) transaction so two
+    nodes can't claim the same session at the same time.
+
+    Since the registry gets used from the IOLoop no query will wait more than
+    *busy_timeout* seconds for another node to release its lock.  If that
+    happens the failure is logged and the method returns as if nothing was
+    found.  :meth:`claim_session` returns `None` in that case so that two
+    nodes never end up running the same session.
+    """
+    schema = (
+        "CREATE TABLE IF NOT EXISTS nodes ("
+            "node_id TEXT PRIMARY KEY, url TEXT, heartbeat REAL)",
+        "CREATE TABLE IF NOT EXISTS sessions ("
+            "session TEXT PRIMARY KEY, node_id TEXT, upn TEXT, claimed REAL)",
+        "CREATE TABLE IF NOT EXISTS terminals ("
+            "session TEXT, location TEXT, term INTEGER, node_id TEXT, "
+            "PRIMARY KEY (session, location, term))",
+        "CREATE TABLE IF NOT EXISTS shares ("
+            "share_id TEXT PRIMARY KEY, session TEXT, location TEXT, "
+            "term INTEGER, node_id TEXT)",
+    )
+    def __init__(self, node_id, node_url='', node_timeout=30,
+        path='registry.db', busy_timeout=0.25, **kwargs):
+        SessionRegistry.__init__(self, node_id, node_url, node_timeout)
+        self.path = path
+        # isolation_level=None so we can manage transactions ourselves
+        self.db = sqlite3.connect(
+            path, timeout=busy_timeout, isolation_level=None)
+        self.db.row_factory = sqlite3.Row
+        for statement in self.schema:
+            self.db.execute(statement)
+
+    def _node_dict(self, row):
+        """
+        Converts the given nodes table *row* into a node record (dict).
+        """
+        if row is None:
+            return None
+        return {
+            'node_id': row['node_id'],
+            'url': row['url'],
+            'heartbeat': row['heartbeat']
+        }
+
+    def _local_node(self):
+        """
+        Returns a node record for this node without touching the database.
+        """
+        return {
+            'node_id': self.node_id,
+            'url': self.node_url,
+            'heartbeat': time.time()
+        }
+
+    @contextmanager
+    def _transaction(self):
+        """
+        Runs the statements in the `with` block inside of an immediate
+        (write-locked) transaction.
+        """
+        self.db.execute("BEGIN IMMEDIATE")
+        try:
+            yield
+            self.db.execute("COMMIT")
+        except:
+            self.db.execute("ROLLBACK")
+            raise
+
+    @unavailable_returns()
+    def register_node(self):
+        self.db.execute(
+            "INSERT OR REPLACE INTO nodes (node_id, url, heartbeat) "
+            "VALUES (?, ?, ?)", (self.node_id, self.node_url, time.time()))
+
+    @unavailable_returns()
+    def unregister_node(self):
+        with self._transaction():
+            for table in ('terminals', 'shares', 'sessions', 'nodes'):
+                self.db.execute(
+                    "DELETE FROM %s WHERE node_id = ?" % table, (self.node_id,))
+
+    def heartbeat(self):
+        try:
+            cursor = self.db.execute(
+                "UPDATE nodes SET heartbeat = ? WHERE node_id = ?",
+                (time.time(), self.node_id))
+            if not cursor.rowcount: # Someone removed us
+                self.register_node()
+        except sqlite3.Error as e:
+            # Don't let a temporarily locked/unavailable database take down
+            # the PeriodicCallback calling us
+            logging.error("SQLiteSessionRegistry.heartbeat(): %s" % e)
+
+    @unavailable_returns()
+    def node(self, node_id):
+        row = self.db.execute(
+            "SELECT * FROM nodes WHERE node_id = ?", (node_id,)).fetchone()
+        return self._node_dict(row)
+
+    @unavailable_returns(default=lambda self: [])
+    def nodes(self):
+        rows = self.db.execute("SELECT * FROM nodes").fetchall()
+        return [a for a in map(self._node_dict, rows) if self.alive(a)]
+
+    def _owner(self, table, column, value):
+        """
+        Returns the record of the live node that owns the row in *table* where
+        *column* == *value*.
+        """
+        row = self.db.execute(
+            "SELECT nodes.* FROM %s JOIN nodes USING (node_id) "
+            "WHERE %s.%s = ?" % (table, table, column), (value,)).fetchone()
+        node = self._node_dict(row)
+        if self.alive(node):
+            return node
+
+    @unavailable_returns()
+    def claim_session(self, session, upn=None, force=False):
+        with self._transaction():
+            owner = self._owner('sessions', 'session', session)
+            if force or not owner:
+                self.db.execute(
+                    "INSERT OR REPLACE INTO sessions "
+                    "(session, node_id, upn, claimed) VALUES (?, ?, ?, ?)",
+                    (session, self.node_id, upn, time.time()))
+                # Whatever a previous (dead or overridden) owner had is no
+                # longer reachable
+                for table in ('terminals', 'shares'):
+                    self.db.execute(
+                        "DELETE FROM %s WHERE session = ? AND node_id != ?"
+                        % table, (session, self.node_id))
+                owner = None
+        return owner or self.node(self.node_id) or self._local_node()
+
+    @unavailable_returns()
+    def session_owner(self, session):
+        return self._owner('sessions', 'session', session)
+
+    @unavailable_returns()
+    def release_session(self, session):
+        with self._transaction():
+            for table in ('terminals', 'shares', 'sessions'):
+                self.db.execute(
+                    "DELETE FROM %s WHERE session = ? AND node_id = ?" % table,
+                    (session, self.node_id))
+
+    @unavailable_returns()
+    def claim_terminal(self, session, location, term):
+        self.db.execute(
+            "INSERT OR REPLACE INTO terminals (session, location, term, node_id)"
+            " VALUES (?, ?, ?, ?)", (session, location, term, self.node_id))
+
+    @unavailable_returns()
+    def release_terminal(self, session, location, term):
+        self.db.execute(
+            "DELETE FROM terminals WHERE session = ? AND location = ? "
+            "AND term = ?", (session, location, term))
+
+    @unavailable_returns(default=lambda self: [])
+    def terminals(self, session):
+        rows = self.db.execute(
+            "SELECT location, term, node_id FROM terminals WHERE session = ? "
+            "ORDER BY location, term", (session,)).fetchall()
+        return [(a['location'], a['term'], a['node_id']) for a in rows]
+
+    @unavailable_returns()
+    def add_share(self, share_id, session, location, term):
+        self.db.execute(
+            "INSERT OR REPLACE INTO shares "
+            "(share_id, session, location, term, node_id) "
+            "VALUES (?, ?, ?, ?, ?)",
+            (share_id, session, location, term, self.node_id))
+
+    @unavailable_returns()
+    def remove_share(self, share_id):
+        self.db.execute("DELETE FROM shares WHERE share_id = ?", (share_id,))
+
+    @unavailable_returns()
+    def share_owner(self, share_id):
+        return self._owner('shares', 'share_id', share_id)
+
+# Maps the values of the 'session_registry' setting to backend classes
+BACKENDS = {
+    'local': LocalSessionRegistry,
+    'sqlite': SQLiteSessionRegistry,
+}
+
+def get_registry(backend, node_id, **kwargs):
+    """
+    Returns an instance of the :class:`SessionRegistry` subclass registered as
+    *backend* in :attr:`BACKENDS` using *node_id* and *kwargs* as arguments.
+    """
+    try:
+        cls = BACKENDS[backend]
+    except KeyError:
+        raise ValueError(
+            "Unknown session registry backend: %s (valid: %s)" % (
+                backend, ", ".join(sorted(BACKENDS.keys()))))
+    return cls(node_id, **kwargs)
@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+#
+#       Copyright 2013 Liftoff Software Corporation
+#
+# For license information see LICENSE.txt
+
+__doc__ = """\
+startup.py - Measures how long it takes Gate One to start up.
+
+When Gate One is started with the --profile_startup option every module import
+gets timed (by wrapping `__import__`) from the moment this module is imported
+until Gate One starts listening for connections.  At that point a report like
+this gets logged::
+
+    Startup took 0.912s (cold start to listening)
+    Slowest imports (self/total seconds):
+        0.214 / 0.301 tornado.auth
+        0.118 / 0.118 ssl
+        ...
+
+"Self" time excludes the time spent importing other modules from within the
+module in question.  Use it to find the imports that are worth deferring.
+
+.. note:: This module is deliberately dependency-free (it gets imported before Tornado).
+"""
+
+# Meta
+__version__ = '1.0'
+__version_info__ = (1, 0)
+__license__ = "AGPLv3 or Proprietary (see LICENSE.txt)"
+__author__ = 'Dan McDougall <daniel.mcdougall@liftoffsoftware.com>'
+
+# Import stdlib stuff
+import sys
+import time
+try:
+    import __builtin__ as builtins
+except ImportError: # Python 3
+    import builtins
+
+# Globals
+STARTED = time.time() # Close enough to when the process started
+IMPORTS = {} # Format: {<module name>: [<total seconds>, <self seconds>]}
+_STACK = [] # Time spent importing children of the imports in progress
+_ORIGINAL_IMPORT = None # Set by start()
+
+def profiling_requested(argv=None):
+    """
+    Returns `True` if --profile_startup (or --profile-startup) was passed on
+    the command line (*argv*, defaults to `sys.argv`).  This has to be checked
+    before Tornado's options get parsed since by then most of the importing is
+    over with.
+    """
+    for arg in (argv or sys.argv)[1:]:
+        name, sep, value = arg.lstrip('-').partition('=')
+        if name.replace('-', '_') == 'profile_startup':
+            return value.lower() not in ('false', '0', 'no')
+    return False
+
+def _profiled_import(name, *args, **kwargs):
+    """
+    A wrapper around `__import__` that records how long each new import took.
+    """
+    fromlist = args[2] if len(args) > 2 else kwargs.get('fromlist', None)
+    if name in sys.modules and not fromlist:
+        return _ORIGINAL_IMPORT(name, *args, **kwargs) # Nothing to measure
+    start = time.time()
+    _STACK.append(0.0)
+    try:
+        return _ORIGINAL_IMPORT(name, *args, **kwargs)
+    finally:
+        elapsed = time.time() - start
+        children = _STACK.pop()
+        if _STACK:
+            _STACK[-1] += elapsed
+        record = IMPORTS.setdefault(name, [0.0, 0.0])
+        record[0] += elapsed
+        record[1] += elapsed - children
+
+def start():
+    """
+    Starts timing imports.
+    """
+    global _ORIGINAL_IMPORT
+    if _ORIGINAL_IMPORT:
+        return # Already started
+    _ORIGINAL_IMPORT = builtins.__import__
+    builtins.__import__ = _profiled_import
+
+def stop():
+    """
+    Stops timing imports.
+    """
+    global _ORIGINAL_IMPORT
+    if _ORIGINAL_IMPORT:
+        builtins.__import__ = _ORIGINAL_IMPORT
+        _ORIGINAL_IMPORT = None
+
+def report(limit=25, threshold=0.001):
+    """
+    Returns a string summarizing how long startup took along with the *limit*
+    slowest imports (by self time).  Imports that took less than *threshold*
+    seconds are left out.
+    """
+    out = ["Startup took %.3fs (cold start to listening)" % (
+        time.time() - STARTED)]
+    slowest = sorted(
+        IMPORTS.items(), key=lambda a: a[1][1], reverse=True)[:limit]
+    slowest = [a for a in slowest if a[1][1] >= threshold]
+    if slowest:
+        out.append("Slowest imports (self/total seconds):")
+        for name, (total, own) in slowest:
+            out.append("    %.3f / %.3f %s" % (own, total, name))
+    return "\n".join(out)
@@ -1428,13 +1428,20 @@ GateOne.Base.update(GateOne.Utils, {
         //      *message['result']* - Either 'Success' or a descriptive error message.
         //      *message['filename']* - The name we'll give to the file when we save it.
         //      *message['data']* - The content of the file we're saving.
+        //      *message['url']* - Optional:  Instead of *data*, the URL (relative to GateOne.prefs.url) where the file can be downloaded.  Used for large files so they can be streamed straight to disk.
         //      *message['mimetype']* - Optional:  The mimetype we'll be instructing the browser to associate with the file (so it will handle it appropriately).  Will default to 'text/plain' if not given.
         var u = go.Utils,
             result = message['result'],
             data = message['data'],
             filename = message['filename'],
-            mimetype = 'text/plain';
-        if (result == 'Success') {
+            mimetype = 'text/plain',
+            clickEvent, saveLink;
+        if (result == 'Success' && message['url']) {
+            clickEvent = document.createEvent('MouseEvents');
+            saveLink = u.createElement('a', {'href': go.prefs.url + message['url'], 'name': filename, 'download': filename});
+            clickEvent.initMouseEvent('click', true, true, document.defaultView, 1, 0, 0, 0, 0, false, false, false, false, 0, null);
+            saveLink.dispatchEvent(clickEvent);
+        } else if (result == 'Success') {
             if (message['mimetype']) {
                 mimetype = message['mimetype'];
             }
@@ -2076,6 +2083,14 @@ GateOne.Base.update(GateOne.Net, {
                 }, 10000);
             }
         }
+        n.dispatch(messageObj);
+    },
+    dispatch: function(messageObj) {
+        /**:GateOne.Net.dispatch(messageObj)
+
+        Calls the action (in `GateOne.Net.actions`) associated with each key in *messageObj* with its respective value.
+        */
+        var n = GateOne.Net;
         // Execute each respective action
         for (var key in messageObj) {
             var val = messageObj[key];
@@ -2084,6 +2099,15 @@ GateOne.Base.update(GateOne.Net, {
             }
         }
     },
+    batch: function(messages) {
+        /**:GateOne.Net.batch(messages)
+
+        Handles the 'go:batch' action which the server uses to send multiple *messages* (an Array of message objects) in a single WebSocket frame.  Each message gets dispatched (in order) as if it arrived on its own.
+        */
+        for (var i = 0; i < messages.length; i++) {
+            GateOne.Net.dispatch(messages[i]);
+        }
+    },
     timeoutAction: function() {
         /**:GateOne.Net.timeoutAction()
 
@@ -2127,6 +2151,7 @@ GateOne.Base.update(GateOne.Net, {
 // Protocol actions
 GateOne.Net.actions = {
 // These are what will get called when the server sends us each respective action
+    'go:batch': GateOne.Net.batch,
     'go:log': GateOne.Net.log,
     'go:ping': GateOne.Net.ping,
     'go:pong': GateOne.Net.pong,
@@ -4153,6 +4178,7 @@ GateOne.Base.update(GateOne.Storage, {
         logDebug('cacheJS caching ' + fileObj['filename']);
         var fileCache = GateOne.Storage.dbObject('fileCache');
         fileCache.put('js', fileObj);
+        go.Storage.uncacheSuperseded(fileObj, 'js');
     },
     uncacheJS: function(fileObj) {
         /**:GateOne.Storage.uncacheJS(fileObj)
@@ -4188,6 +4214,25 @@ GateOne.Base.update(GateOne.Storage, {
         logDebug('cacheStyle caching ' + fileObj['filename']);
         var fileCache = GateOne.Storage.dbObject('fileCache');
         fileCache.put(kind, fileObj);
+        go.Storage.uncacheSuperseded(fileObj, kind);
+    },
+    uncacheSuperseded: function(fileObj, kind) {
+        /**:GateOne.Storage.uncacheSuperseded(fileObj, kind)
+
+        Bundles are named after a hash of their contents so every new version winds up with a new filename.  If the given *fileObj* is a bundle (i.e. it has a 'bundle' name) this removes any older versions of it from the store matching *kind* so the cache doesn't grow without bound.
+        */
+        var fileCache = GateOne.Storage.dbObject('fileCache');
+        if (!fileObj['bundle']) {
+            return;
+        }
+        fileCache.dump(kind, function(objects) {
+            objects.forEach(function(cachedObj) {
+                if (cachedObj['bundle'] == fileObj['bundle'] && cachedObj['filename'] != fileObj['filename']) {
+                    logDebug("Deleting superseded file: " + cachedObj['filename']);
+                    fileCache.delete(kind, cachedObj['filename']);
+                }
+            });
+        });
     },
     uncacheStyle: function(fileObj, kind) {
         /**:GateOne.Storage.uncacheStyle(fileObj, kind)
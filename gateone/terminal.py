@@ -129,7 +129,8 @@ Whenever a :meth:`Terminal.scroll_up` event occurs, the line (or lines) that
 will be removed from the top of the screen will be placed into
 :attr:`Terminal.scrollback_buf`. Then whenever :meth:`Terminal.dump_html` is
 called the scrollback buffer will be returned along with the screen output and
-reset to an empty state.
+reset to an empty state.  Only the most recent
+:attr:`Terminal.scrollback_limit` lines are kept in between.
 
 Why do this?  In the event that a very large :meth:`Terminal.write` occurs (e.g.
 'ps aux'), it gives the controlling program the ability to capture what went
@@ -146,11 +147,19 @@ Class Docstrings
 """
 
 # Import stdlib stuff
-import os, sys, re, logging, base64, StringIO, codecs, unicodedata, tempfile
+import os, sys, re, logging, base64, codecs, unicodedata, tempfile
+import hashlib
+import zlib
+try:
+    import cPickle as pickle
+except ImportError: # Python 3
+    import pickle
+from media import image_dimensions, fit_dimensions, process_image
+from media import pdf_thumbnail, PDF_THUMBNAIL_SIZE
 from array import array
 from datetime import datetime, timedelta
 from functools import partial
-from collections import defaultdict
+from collections import defaultdict, Mapping
 try:
     from collections import OrderedDict
 except ImportError: # Python <2.7 didn't have OrderedDict in collections
@@ -170,21 +179,38 @@ import gettext
 gettext.install('terminal')
 
 # Import 3rd party stuff
-try:
-    # We need PIL to detect image types and get their dimensions.  Without the
-    # dimenions, the browser will render the terminal screen much slower than
-    # normal.  Without PIL images will be displayed simply as:
-    #   <i>Image file</i>
-    from PIL import Image
-except ImportError:
-    Image = None
-    logging.warning(_(
-        "Could not import the Python Imaging Library (PIL).  "
-        "Images will not be displayed in the terminal."))
-    logging.info(_(
-        "TIP: Pillow is a 'friendly fork' of PIL that has been updated to work "
-        "with Python 3 (also works in Python 2.X).  You can install it with "
-        "'pip install --upgrade Pillow'."))
+# NOTE: PIL is imported the first time an image is encountered (see
+# get_pil_image()) since importing it is slow and most terminals never display
+# an image.
+Image = None
+PIL_IMPORT_ATTEMPTED = False
+
+def get_pil_image():
+    """
+    Returns PIL's `Image` module, importing it the first time this function is
+    called.  Returns `None` if PIL isn't installed.
+    """
+    global Image
+    global PIL_IMPORT_ATTEMPTED
+    if PIL_IMPORT_ATTEMPTED:
+        return Image
+    PIL_IMPORT_ATTEMPTED = True
+    try:
+        # We need PIL to detect image types and get their dimensions.  Without
+        # the dimenions, the browser will render the terminal screen much slower
+        # than normal.  Without PIL images will be displayed simply as:
+        #   <i>Image file</i>
+        from PIL import Image
+    except ImportError:
+        Image = None
+        logging.warning(_(
+            "Could not import the Python Imaging Library (PIL).  "
+            "Images will not be displayed in the terminal."))
+        logging.info(_(
+            "TIP: Pillow is a 'friendly fork' of PIL that has been updated to "
+            "work with Python 3 (also works in Python 2.X).  You can install "
+            "it with 'pip install --upgrade Pillow'."))
+    return Image
 
 # Globals
 CALLBACK_SCROLL_UP = 1    # Called after a scroll up event (new line)
@@ -625,6 +651,10 @@ class FileType(object):
     thumbnail = None
     html_template = "" # Must be overridden
     html_icon_template = "" # Must be overridden
+    # Takes up space while something is being processed:
+    placeholder_template = (
+        '<span style="display: inline-block; width: {width}px; '
+        'height: {height}px;"></span>')
     def __init__(self,
         name, mimetype, re_header, re_capture, suffix="", path="", linkpath="", icondir=None):
         """
@@ -702,37 +732,75 @@ class ImageFile(FileType):
     A subclass of :class:`FileType` for images (specifically to override
     :meth:`self.html` and :meth:`self.capture`).
     """
+    # These get set by capture():
+    format = None # e.g. 'PNG'
+    dimensions = (0, 0) # (width, height)
+    digest = None # SHA-1 of the image (as saved)
+    html_cache = None # The output of html()
+    pending = False # True while a media processor is working on the image
     def capture(self, data, term_instance):
         """
         Captures the image contained within *data*.  Will use *term_instance*
         to make room for the image in the terminal screen.
 
+        If *term_instance* has a `media_processor` (see media.py) the image
+        will be decoded and resized by a worker process.  Room will be made
+        for it right away (using the dimensions in the image's header) and the
+        image will be filled in when the worker is done.
+
         .. note::  Unlike :class:`FileType`, *term_instance* is mandatory.
         """
         logging.debug('ImageFile.capture()')
         # Image file formats don't usually like carriage returns:
         data = str(data).replace('\r\n', '\n')
-        if Image: # PIL is loaded--try to guess how many lines the image takes
-            i = StringIO.StringIO(data)
-            try:
-                im = Image.open(i)
-            except IOError:
-                # i.e. PIL couldn't identify the file
-                logging.error(_("PIL couldn't process the image"))
-                return # Don't do anything--bad image
-        else: # No PIL means no images.  Don't bother wasting memory.
-            return
-        # Resize the image to be small enough to fit within a typical terminal
-        if im.size[0] > 640 or im.size[1] > 480:
-            im.thumbnail((640, 480), Image.ANTIALIAS)
+        if not get_pil_image():
+            return # No PIL means no images.  Don't bother wasting memory.
+        processor = term_instance.media_processor
+        size = image_dimensions(data) if processor else None
+        if size:
+            self.pending = True
+            self.dimensions = fit_dimensions(size)
+            self._make_room(term_instance)
+            processor(process_image, (data,),
+                partial(self._processed, term_instance))
+            return None
+        # Decode (and resize to fit within a typical terminal) it right here
+        result = process_image(data)
+        if not result:
+            logging.error(_("PIL couldn't process the image"))
+            return # Don't do anything--bad image
+        self.format, self.dimensions, data = result
+        self._make_room(term_instance)
+        return self._store(data)
+
+    def _processed(self, term_instance, result):
+        """
+        Called when the media processor is done with our image; stores the
+        *result* of :func:`media.process_image` and tells *term_instance* to
+        update the screen.
+        """
+        self.pending = False
+        if not result:
+            logging.error(_("PIL couldn't process the image"))
+        else:
+            self.format, self.dimensions, data = result
+            self._store(data)
+        self.html_cache = None
+        term_instance.prev_dump = [] # So the image's line gets re-rendered
+        term_instance.send_update()
+
+    def _make_room(self, term_instance):
+        """
+        Moves the cursor of *term_instance* (and our reference in the screen)
+        so that there's enough room for an image of `self.dimensions`.
+        """
         # Get the current image location and reference so we can move it around
         img_Y = term_instance.cursorY
         img_X = term_instance.cursorX
         ref = term_instance.screen[img_Y][img_X]
         if term_instance.em_dimensions:
             # Make sure the image will fit properly in the screen
-            width = im.size[0]
-            height = im.size[1]
+            width, height = self.dimensions
             if height <= term_instance.em_dimensions['height']:
                 # Fits within a line.  No need for a newline
                 num_chars = int(width/term_instance.em_dimensions['width'])
@@ -762,58 +830,77 @@ class ImageFile(FileType):
             # Make some space at the bottom too just in case
             term_instance.newline()
             term_instance.newline()
+
+    def _store(self, data):
+        """
+        Saves the image *data* to disk (see :attr:`self.path`) and returns the
+        resulting file object.
+        """
+        self.digest = hashlib.sha1(data).hexdigest()
         # Write the captured image to disk
         if self.path:
-            if os.path.exists(self.path):
-                if os.path.isdir(self.path):
-                    # Assume that a path was given for a reason and use a
-                    # NamedTemporaryFile instead of TemporaryFile.
-                    self.file_obj = tempfile.NamedTemporaryFile(
-                        suffix=self.suffix, dir=self.path)
-                    # Update self.path to use the new, actual file path
-                    self.path = self.file_obj.name
-                else:
-                    self.file_obj = open(self.path, 'rb+')
+            if os.path.isdir(self.path) and self.linkpath != self.path:
+                # The directory is being served (e.g. the session's downloads
+                # dir) so name the file after its contents.  That way the same
+                # image always winds up with the same URL (see html()) and only
+                # gets stored once.
+                self.path = os.path.join(
+                    self.path, "%s%s" % (self.digest, self.suffix))
+                if not os.path.exists(self.path):
+                    with open(self.path, 'wb') as f:
+                        f.write(data)
+                self.file_obj = open(self.path, 'rb')
+            elif os.path.isdir(self.path):
+                # Assume that a path was given for a reason and use a
+                # NamedTemporaryFile instead of TemporaryFile.
+                self.file_obj = tempfile.NamedTemporaryFile(
+                    suffix=self.suffix, dir=self.path)
+                # Update self.path to use the new, actual file path
+                self.path = self.file_obj.name
+                self.file_obj.write(data)
+            else:
+                self.file_obj = open(self.path, 'wb+')
+                self.file_obj.write(data)
         else:
             self.file_obj = tempfile.TemporaryFile()
-        try:
-            im.save(self.file_obj, im.format)
-        except IOError:
-            # PIL was compiled without (complete) support for this format
-            logging.error(_(
-                "PIL is missing support for this image type (%s).  You probably"
-                " need to install zlib-devel and libjpeg-devel then re-install "
-                "it with 'pip install --upgrade PIL' or 'pip install "
-                "--upgrade Pillow'" % self.name))
-            self.file_obj.close() # Can't do anything with it
-            return None
+            self.file_obj.write(data)
         self.file_obj.flush()
         self.file_obj.seek(0) # Go back to the start
         return self.file_obj
 
     def html(self):
         """
-        Returns :attr:`self.file_obj` as an <img> tag with the src set to a
-        data::URI.
+        Returns an <img> tag representing the captured image.  If the image was
+        saved to disk (:attr:`self.path`) and :attr:`self.linkpath` is a URL
+        (as opposed to just the directory the file was saved in) the tag's src
+        will point to the image's (content-addressed) URL so clients can cache
+        it.  Otherwise the src will be a data::URI.
+
+        The result is cached since this gets called every time the screen is
+        dumped.
         """
+        if self.pending: # Still being processed
+            return self.placeholder_template.format(
+                width=self.dimensions[0], height=self.dimensions[1])
         if not self.file_obj:
             return u""
-        self.file_obj.seek(0)
-        try:
-            im = Image.open(self.file_obj)
-        except IOError:
-            # i.e. PIL couldn't identify the file
-            return u"<i>Error displaying image</i>"
-        self.file_obj.seek(0)
-        # Need to encode base64 to create a data URI
-        encoded = base64.b64encode(self.file_obj.read())
-        data_uri = "data:image/%s;base64,%s" % (
-            im.format.lower(), encoded)
+        if self.html_cache:
+            return self.html_cache
+        directory, filename = os.path.split(self.path or '')
+        if filename and self.linkpath and self.linkpath != directory:
+            src = "%s/%s" % (self.linkpath, filename)
+        else:
+            # Need to encode base64 to create a data URI
+            self.file_obj.seek(0)
+            encoded = base64.b64encode(self.file_obj.read())
+            self.file_obj.seek(0)
+            src = "data:image/%s;base64,%s" % (self.format.lower(), encoded)
+        template = self.html_template
         if self.thumbnail:
-            return self.html_icon_template.format(
-                src=data_uri, width=im.size[0], height=im.size[1])
-        return self.html_template.format(
-            src=data_uri, width=im.size[0], height=im.size[1])
+            template = self.html_icon_template
+        self.html_cache = template.format(
+            src=src, width=self.dimensions[0], height=self.dimensions[1])
+        return self.html_cache
 
 class PNGFile(ImageFile):
     """
@@ -827,11 +914,13 @@ class PNGFile(ImageFile):
     re_capture = re.compile('(\x89PNG\r.+IEND\xaeB`\x82)', re.DOTALL)
     html_template = '<img src="{src}" width="{width}" height="{height}">'
 
-    def __init__(self, path="", **kwargs):
+    def __init__(self, path="", linkpath="", **kwargs):
         """
-        **path:** (optional) The path to a file or directory where the file should be stored.  If *path* is a directory a random filename will be chosen.
+        **path:** (optional) The path to a file or directory where the file should be stored.  If *path* is a directory the file will be named after a hash of its contents.
+        **linkpath:** (optional) The URL of the directory the file will be served from (see :meth:`ImageFile.html`).
         """
         self.path = path
+        self.linkpath = linkpath
         self.file_obj = None
         # Images will be displayed inline so no icons unless overridden:
         self.html_icon_template = self.html_template
@@ -850,11 +939,13 @@ class JPEGFile(ImageFile):
         '(\xff\xd8\xff.+\xff\xd9)', re.DOTALL
     )
     html_template = '<img src="{src}" width="{width}" height="{height}">'
-    def __init__(self, path="", **kwargs):
+    def __init__(self, path="", linkpath="", **kwargs):
         """
-        **path:** (optional) The path to a file or directory where the file should be stored.  If *path* is a directory a random filename will be chosen.
+        **path:** (optional) The path to a file or directory where the file should be stored.  If *path* is a directory the file will be named after a hash of its contents.
+        **linkpath:** (optional) The URL of the directory the file will be served from (see :meth:`ImageFile.html`).
         """
         self.path = path
+        self.linkpath = linkpath
         self.file_obj = None
         # Images will be displayed inline so no icons unless overridden:
         self.html_icon_template = self.html_template
@@ -899,39 +990,43 @@ class PDFFile(FileType):
         """
         If available, will use ghostscript (gs) to generate a thumbnail of this
         PDF in the form of an <img> tag with the src set to a data::URI.
+
+        .. note:: This blocks until gs is done.  :meth:`capture` uses the terminal's `media_processor` to do this in the background instead.
         """
-        from commands import getstatusoutput
-        thumb = tempfile.NamedTemporaryFile()
-        params = [
-            'gs', # gs must be in your path
-            '-dPDFFitPage',
-            '-dPARANOIDSAFER',
-            '-dBATCH',
-            '-dNOPAUSE',
-            '-dNOPROMPT',
-            '-dMaxBitmap=500000000',
-            '-dAlignToPixels=0',
-            '-dGridFitTT=0',
-            '-dDEVICEWIDTH=90',
-            '-dDEVICEHEIGHT=120',
-            '-dORIENT1=true',
-            '-sDEVICE=jpeg',
-            '-dTextAlphaBits=4',
-            '-dGraphicsAlphaBits=4',
-            '-sOutputFile=%s' % thumb.name,
-            self.path
-        ]
-        retcode, output = getstatusoutput(" ".join(params))
-        if retcode == 0:
-            # Success
-            data = None
-            with open(thumb.name) as f:
-                data = f.read()
-            thumb.close() # Make sure it gets removed now we've read it
-            if data:
-                encoded = base64.b64encode(data)
-                data_uri = "data:image/jpeg;base64,%s" % encoded
-                return '<img src="%s">' % data_uri
+        return self._thumbnail_html(pdf_thumbnail(self.path))
+
+    @staticmethod
+    def _thumbnail_html(jpeg):
+        """
+        Returns an <img> tag for the given *jpeg* thumbnail (or `None` if
+        there's no *jpeg*).
+        """
+        if jpeg:
+            encoded = base64.b64encode(jpeg)
+            data_uri = "data:image/jpeg;base64,%s" % encoded
+            return '<img src="%s">' % data_uri
+
+    def _thumbnail_ready(self, term_instance, jpeg):
+        """
+        Called when the media processor is done generating our thumbnail;
+        swaps it in and tells *term_instance* to update the screen.
+        """
+        thumbnail = self._thumbnail_html(jpeg)
+        if thumbnail:
+            self.thumbnail = thumbnail
+        elif self.thumbnail == self._placeholder():
+            self.thumbnail = None # No thumbnail; just use the name
+        else:
+            return # Keep the icon; nothing changed
+        term_instance.prev_dump = [] # So the link's line gets re-rendered
+        term_instance.send_update()
+
+    def _placeholder(self):
+        """
+        Returns :attr:`self.placeholder_template` sized for a thumbnail.
+        """
+        width, height = PDF_THUMBNAIL_SIZE
+        return self.placeholder_template.format(width=width, height=height)
 
     def capture(self, data, term_instance):
         """
@@ -962,15 +1057,20 @@ class PDFFile(FileType):
             self.path = self.file_obj.name
         self.file_obj.write(data)
         self.file_obj.flush()
-        # Ghostscript-based thumbnail generation disabled due to its slow,
-        # blocking nature.  Works great though!
-        #self.thumbnail = self.generate_thumbnail()
-        # TODO: Figure out a way to do non-blocking thumbnail generation
         if self.icondir:
             pdf_icon = os.path.join(self.icondir, self.icon)
             if os.path.exists(pdf_icon):
                 with open(pdf_icon) as f:
                     self.thumbnail = f.read()
+        processor = term_instance.media_processor
+        if processor:
+            # Ghostscript is too slow to run on the IOLoop but it works great
+            # in a worker process.  Until it's done we'll show the icon (or an
+            # empty space the size of the thumbnail).
+            if not self.thumbnail:
+                self.thumbnail = self._placeholder()
+            processor(pdf_thumbnail, (self.path,),
+                partial(self._thumbnail_ready, term_instance))
         if self.thumbnail:
             # Make room for our link
             img_Y = term_instance.cursorY
@@ -1012,6 +1112,25 @@ class NotFoundError(Exception):
     """
     pass
 
+class BoundHandlers(Mapping):
+    """
+    A read-only mapping of the (unbound) handlers in *table* (one of the tables
+    returned by :meth:`Terminal.handler_tables`) to those handlers bound to
+    *term*.  Trying to add or replace a handler raises a `TypeError`.
+    """
+    def __init__(self, term, table):
+        self.term = term
+        self.table = table
+
+    def __getitem__(self, key):
+        return partial(self.table[key], self.term)
+
+    def __iter__(self):
+        return iter(self.table)
+
+    def __len__(self):
+        return len(self.table)
+
 class Terminal(object):
     """
     Terminal controller class.
@@ -1079,6 +1198,11 @@ class Terminal(object):
     RE_OPT_SEQ = re.compile(r'\x1b\]_\;(.+?)(\x07|\x1b\\)')
     RE_NUMBERS = re.compile('\d*') # Matches any number
     RE_SIGINT = re.compile('.*\^C', re.MULTILINE|re.DOTALL)
+    # These get serialized into self.snapshot by hibernate():
+    hibernated_attrs = (
+        'screen', 'renditions', 'scrollback_buf', 'scrollback_renditions',
+        'alt_screen', 'alt_renditions')
+    snapshot = None # Compressed state of a hibernating terminal
 
     def __init__(self, rows=24, cols=80, em_dimensions=None, temppath='/tmp',
         linkpath='/tmp', icondir=None, encoding='utf-8', debug=False):
@@ -1130,6 +1254,13 @@ class Terminal(object):
         and the icon it is looking for happens to be available at *icondir*.
 
         If *debug* is True, the root logger will have its level set to DEBUG.
+
+        After initialization the `media_processor` attribute may be set to a
+        function like ``processor(func, args, callback)`` that runs
+        ``func(*args)`` somewhere other than the current thread (e.g.
+        :meth:`media.MediaPool.submit`) and passes the result to *callback*.
+        If set, captured images will be decoded/resized and PDF thumbnails
+        generated that way instead of blocking :meth:`Terminal.write`.
         """
         if debug:
             logger = logging.getLogger()
@@ -1137,6 +1268,7 @@ class Terminal(object):
         self.temppath = temppath
         self.linkpath = linkpath
         self.icondir = icondir
+        self.media_processor = None # See above
         self.encoding = encoding
         # This controls how often we send a message to the client when capturing
         # a special file type.  The default is to update the user of progress
@@ -1153,11 +1285,14 @@ class Terminal(object):
         """
         Initializes the terminal (the actual equivalent to :meth:`__init__`).
         """
+        self.snapshot = None # Everything below replaces what was hibernating
         self.cols = cols
         self.rows = rows
         self.em_dimensions = em_dimensions
         self.scrollback_buf = []
         self.scrollback_renditions = []
+        # 1000 lines ought to be enough for anybody:
+        self.scrollback_limit = 1000
         self.title = "Gate One"
         # This variable can be referenced by programs implementing Terminal() to
         # determine if anything has changed since the last dump*()
@@ -1177,93 +1312,6 @@ class Terminal(object):
         self.top_margin = 0
         self.bottom_margin = self.rows - 1
         self.timeout_capture = None
-        self.specials = {
-            self.ASCII_NUL: self.__ignore,
-            self.ASCII_BEL: self.bell,
-            self.ASCII_BS: self.backspace,
-            self.ASCII_HT: self.horizontal_tab,
-            self.ASCII_LF: self.newline,
-            self.ASCII_VT: self.newline,
-            self.ASCII_FF: self.newline,
-            self.ASCII_CR: self.carriage_return,
-            self.ASCII_SO: self.use_g1_charset,
-            self.ASCII_SI: self.use_g0_charset,
-            self.ASCII_XON: self._xon,
-            self.ASCII_CAN: self._cancel_esc_sequence,
-            self.ASCII_XOFF: self._xoff,
-            #self.ASCII_ESC: self._sub_esc_sequence,
-            self.ASCII_ESC: self._escape,
-            self.ASCII_CSI: self._csi,
-        }
-        self.esc_handlers = {
-            # TODO: Make a different set of these for each respective emulation mode (VT-52, VT-100, VT-200, etc etc)
-            '#': self._set_line_params, # Varies
-            '\\': self._string_terminator, # ST
-            'c': self.clear_screen, # Reset terminal
-            'D': self.__ignore, # Move/scroll window up one line    IND
-            'M': self.reverse_linefeed, # Move/scroll window down one line RI
-            'E': self.next_line, # Move to next line NEL
-            'F': self.__ignore, # Enter Graphics Mode
-            'G': self.next_line, # Exit Graphics Mode
-            '6': self._dsr_get_cursor_position, # Get cursor position   DSR
-            '7': self.save_cursor_position, # Save cursor position and attributes   DECSC
-            '8': self.restore_cursor_position, # Restore cursor position and attributes   DECSC
-            'H': self._set_tabstop, # Set a tab at the current column   HTS
-            'I': self.reverse_linefeed,
-            '(': self.set_G0_charset, # Designate G0 Character Set
-            ')': self.set_G1_charset, # Designate G1 Character Set
-            'N': self.__ignore, # Set single shift 2    SS2
-            'O': self.__ignore, # Set single shift 3    SS3
-            '5': self._device_status_report, # Request: Device status report DSR
-            '0': self.__ignore, # Response: terminal is OK  DSR
-            'P': self._dcs_handler, # Device Control String  DCS
-            # NOTE: = and > are ignored because the user can override/control
-            # them via the numlock key on their keyboard.  To do otherwise would
-            # just confuse people.
-            '=': self.__ignore, # Application Keypad  DECPAM
-            '>': self.__ignore, # Exit alternate keypad mode
-            '<': self.__ignore, # Exit VT-52 mode
-            'Z': self._csi_device_identification,
-        }
-        self.csi_handlers = {
-            'A': self.cursor_up,
-            'B': self.cursor_down,
-            'C': self.cursor_right,
-            'D': self.cursor_left,
-            'E': self.cursor_next_line, # NOTE: Not the same as next_line()
-            'F': self.cursor_previous_line,
-            'G': self.cursor_horizontal_absolute,
-            'H': self.cursor_position,
-            'L': self.insert_line,
-            'M': self.delete_line,
-            #'b': self.repeat_last_char, # TODO
-            'c': self._csi_device_identification, # Device status report (DSR)
-            'g': self.__ignore, # TODO: Tab clear
-            'h': self.set_expanded_mode,
-            'i': self.__ignore, # ESC[5i is "redirect to printer", ESC[4i ends it
-            'l': self.reset_expanded_mode,
-            'f': self.cursor_position,
-            'd': self.cursor_position_vertical, # Vertical Line Position Absolute (VPA)
-            #'e': self.cursor_position_vertical_relative, # VPR TODO
-            'J': self.clear_screen_from_cursor,
-            'K': self.clear_line_from_cursor,
-            'S': self.scroll_up,
-            'T': self.scroll_down,
-            's': self.save_cursor_position,
-            'u': self.restore_cursor_position,
-            'm': self._set_rendition,
-            'n': self._csi_device_status_report, # <ESC>[6n is the only one I know of (request cursor position)
-            'p': self.reset, # TODO: "!p" is "Soft terminal reset".  Also, "Set conformance level" (VT100, VT200, or VT300)
-            'r': self._set_top_bottom, # DECSTBM (used by many apps)
-            'q': self.set_led_state, # Seems a bit silly but you never know
-            'P': self.delete_characters, # DCH Deletes the specified number of chars
-            'X': self._erase_characters, # ECH Same as DCH but also deletes renditions
-            'Z': self.insert_characters, # Inserts the specified number of chars
-            '@': self.insert_characters, # Inserts the specified number of chars
-            #'`': self._char_position_row, # Position cursor (row only)
-            #'t': self.window_manipulation, # TODO
-            #'z': self.locator, # TODO: DECELR "Enable locator reporting"
-        }
         # Used to store what expanded modes are active
         self.expanded_modes = {
             # Important defaults
@@ -1389,6 +1437,138 @@ class Terminal(object):
         self.html_cache = [] # Ditto
         self.watcher = None # Placeholder for the file watcher thread (if used)
 
+    @classmethod
+    def handler_tables(cls):
+        """
+        Returns the ``(specials, esc_handlers, csi_handlers)`` dispatch tables
+        used by :meth:`write` to map special characters, ESC sequences, and CSI
+        sequences to the methods that handle them.  The tables are built once
+        per class (so subclasses can override handler methods) and shared by
+        every instance.  The handlers are plain functions so they must be
+        called with the terminal instance as the first argument.
+
+        .. note:: Since the tables are shared :attr:`specials`, :attr:`esc_handlers`, and :attr:`csi_handlers` are read-only; assigning to them raises a `TypeError` instead of silently doing nothing.  To change how something gets handled override the handler method in a subclass.
+        """
+        if '_handler_tables' in cls.__dict__: # Don't use a parent's tables
+            return cls._handler_tables
+        specials = {
+            cls.ASCII_NUL: cls.__ignore,
+            cls.ASCII_BEL: cls.bell,
+            cls.ASCII_BS: cls.backspace,
+            cls.ASCII_HT: cls.horizontal_tab,
+            cls.ASCII_LF: cls.newline,
+            cls.ASCII_VT: cls.newline,
+            cls.ASCII_FF: cls.newline,
+            cls.ASCII_CR: cls.carriage_return,
+            cls.ASCII_SO: cls.use_g1_charset,
+            cls.ASCII_SI: cls.use_g0_charset,
+            cls.ASCII_XON: cls._xon,
+            cls.ASCII_CAN: cls._cancel_esc_sequence,
+            cls.ASCII_XOFF: cls._xoff,
+            #cls.ASCII_ESC: cls._sub_esc_sequence,
+            cls.ASCII_ESC: cls._escape,
+            cls.ASCII_CSI: cls._csi,
+        }
+        esc_handlers = {
+            # TODO: Make a different set of these for each respective emulation mode (VT-52, VT-100, VT-200, etc etc)
+            '#': cls._set_line_params, # Varies
+            '\\': cls._string_terminator, # ST
+            'c': cls.clear_screen, # Reset terminal
+            'D': cls.__ignore, # Move/scroll window up one line    IND
+            'M': cls.reverse_linefeed, # Move/scroll window down one line RI
+            'E': cls.next_line, # Move to next line NEL
+            'F': cls.__ignore, # Enter Graphics Mode
+            'G': cls.next_line, # Exit Graphics Mode
+            '6': cls._dsr_get_cursor_position, # Get cursor position   DSR
+            '7': cls.save_cursor_position, # Save cursor position and attributes   DECSC
+            '8': cls.restore_cursor_position, # Restore cursor position and attributes   DECSC
+            'H': cls._set_tabstop, # Set a tab at the current column   HTS
+            'I': cls.reverse_linefeed,
+            '(': cls.set_G0_charset, # Designate G0 Character Set
+            ')': cls.set_G1_charset, # Designate G1 Character Set
+            'N': cls.__ignore, # Set single shift 2    SS2
+            'O': cls.__ignore, # Set single shift 3    SS3
+            '5': cls._device_status_report, # Request: Device status report DSR
+            '0': cls.__ignore, # Response: terminal is OK  DSR
+            'P': cls._dcs_handler, # Device Control String  DCS
+            # NOTE: = and > are ignored because the user can override/control
+            # them via the numlock key on their keyboard.  To do otherwise would
+            # just confuse people.
+            '=': cls.__ignore, # Application Keypad  DECPAM
+            '>': cls.__ignore, # Exit alternate keypad mode
+            '<': cls.__ignore, # Exit VT-52 mode
+            'Z': cls._csi_device_identification,
+        }
+        csi_handlers = {
+            'A': cls.cursor_up,
+            'B': cls.cursor_down,
+            'C': cls.cursor_right,
+            'D': cls.cursor_left,
+            'E': cls.cursor_next_line, # NOTE: Not the same as next_line()
+            'F': cls.cursor_previous_line,
+            'G': cls.cursor_horizontal_absolute,
+            'H': cls.cursor_position,
+            'L': cls.insert_line,
+            'M': cls.delete_line,
+            #'b': cls.repeat_last_char, # TODO
+            'c': cls._csi_device_identification, # Device status report (DSR)
+            'g': cls.__ignore, # TODO: Tab clear
+            'h': cls.set_expanded_mode,
+            'i': cls.__ignore, # ESC[5i is "redirect to printer", ESC[4i ends it
+            'l': cls.reset_expanded_mode,
+            'f': cls.cursor_position,
+            'd': cls.cursor_position_vertical, # Vertical Line Position Absolute (VPA)
+            #'e': cls.cursor_position_vertical_relative, # VPR TODO
+            'J': cls.clear_screen_from_cursor,
+            'K': cls.clear_line_from_cursor,
+            'S': cls.scroll_up,
+            'T': cls.scroll_down,
+            's': cls.save_cursor_position,
+            'u': cls.restore_cursor_position,
+            'm': cls._set_rendition,
+            'n': cls._csi_device_status_report, # <ESC>[6n is the only one I know of (request cursor position)
+            'p': cls.reset, # TODO: "!p" is "Soft terminal reset".  Also, "Set conformance level" (VT100, VT200, or VT300)
+            'r': cls._set_top_bottom, # DECSTBM (used by many apps)
+            'q': cls.set_led_state, # Seems a bit silly but you never know
+            'P': cls.delete_characters, # DCH Deletes the specified number of chars
+            'X': cls._erase_characters, # ECH Same as DCH but also deletes renditions
+            'Z': cls.insert_characters, # Inserts the specified number of chars
+            '@': cls.insert_characters, # Inserts the specified number of chars
+            #'`': cls._char_position_row, # Position cursor (row only)
+            #'t': cls.window_manipulation, # TODO
+            #'z': cls.locator, # TODO: DECELR "Enable locator reporting"
+        }
+        def unbound(table):
+            return dict(
+                (k, getattr(v, '__func__', v)) for k, v in table.items())
+        cls._handler_tables = (
+            unbound(specials), unbound(esc_handlers), unbound(csi_handlers))
+        return cls._handler_tables
+
+    @property
+    def specials(self):
+        """
+        The special character handlers (see :meth:`handler_tables`) bound to
+        this instance.  Read-only (see :class:`BoundHandlers`).
+        """
+        return BoundHandlers(self, self.handler_tables()[0])
+
+    @property
+    def esc_handlers(self):
+        """
+        The ESC sequence handlers (see :meth:`handler_tables`) bound to this
+        instance.  Read-only (see :class:`BoundHandlers`).
+        """
+        return BoundHandlers(self, self.handler_tables()[1])
+
+    @property
+    def csi_handlers(self):
+        """
+        The CSI sequence handlers (see :meth:`handler_tables`) bound to this
+        instance.  Read-only (see :class:`BoundHandlers`).
+        """
+        return BoundHandlers(self, self.handler_tables()[2])
+
     def add_magic(self, filetype):
         """
         Adds the given *filetype* to :attr:`self.supported_magic` and generates
@@ -1498,6 +1678,63 @@ class Terminal(object):
         self.scrollback_buf = []
         self.scrollback_renditions = []
 
+    def compact_renditions(self):
+        """
+        Removes the renditions in :attr:`self.renditions_store` that aren't
+        referenced anywhere anymore (the screen, scrollback buffer, or
+        alternate screen).
+        """
+        # u' ' and unichr(1000) (reset) must always be present
+        in_use = set([u' ', unichr(1000), self.cur_rendition])
+        if isinstance(self.saved_rendition, basestring):
+            in_use.add(self.saved_rendition)
+        for rows in (self.renditions, self.scrollback_renditions,
+                     self.alt_renditions or []):
+            for row in rows:
+                in_use.update(row)
+        for key in list(self.renditions_store.keys()):
+            if key not in in_use:
+                del self.renditions_store[key]
+
+    def hibernate(self):
+        """
+        Frees up most of the memory used by this terminal while it sits idle:
+        The rendering caches get emptied and the screen, renditions, and
+        scrollback buffer are serialized into a compressed snapshot
+        (:attr:`self.snapshot`).  They'll be restored automatically (see
+        :meth:`wake`) as soon as anything tries to use them (e.g. new output
+        or a client asking for the screen).
+
+        Returns the size of the snapshot (in bytes) or `None` if the terminal
+        is already hibernating or is in the middle of capturing a file.
+        """
+        if self.snapshot or self.capture:
+            return None
+        self.compact_renditions()
+        state = dict((a, self.__dict__.pop(a)) for a in self.hibernated_attrs)
+        self.snapshot = zlib.compress(
+            pickle.dumps(state, pickle.HIGHEST_PROTOCOL))
+        self.prev_dump = []
+        self.prev_dump_rend = []
+        self.html_cache = []
+        return len(self.snapshot)
+
+    def wake(self):
+        """
+        Restores the state that was saved by :meth:`hibernate`.
+        """
+        snapshot, self.snapshot = self.snapshot, None
+        if snapshot:
+            self.__dict__.update(pickle.loads(zlib.decompress(snapshot)))
+
+    def __getattr__(self, name):
+        # Only gets called if the attribute wasn't found the usual way which
+        # is what happens when something needs a hibernating terminal's screen
+        if name in self.hibernated_attrs and self.snapshot:
+            self.wake()
+            return getattr(self, name)
+        raise AttributeError(name)
+
     def add_callback(self, event, callback, identifier=None):
         """
         Attaches the given *callback* to the given *event*.  If given,
@@ -1907,9 +2144,7 @@ class Terminal(object):
         # suggestions on how to speed it up are welcome!
 
         # Speedups (don't want dots in loops if they can be avoided)
-        specials = self.specials
-        esc_handlers = self.esc_handlers
-        csi_handlers = self.csi_handlers
+        specials, esc_handlers, csi_handlers = self.handler_tables()
         RE_ESC_SEQ = self.RE_ESC_SEQ
         RE_CSI_ESC_SEQ = self.RE_CSI_ESC_SEQ
         magic = self.magic
@@ -2035,7 +2270,7 @@ class Terminal(object):
         for char in chars:
             charnum = ord(char)
             if charnum in specials:
-                specials[charnum]()
+                specials[charnum](self)
             else:
                 # Now handle the regular characters and escape sequences
                 if self.esc_buffer: # We've got an escape sequence going on...
@@ -2048,9 +2283,9 @@ class Terminal(object):
                             # Call the matching ESC handler
                             #logging.debug('ESC seq: %s' % seq_type)
                             if len(seq_type) == 1: # Single-character sequnces
-                                esc_handlers[seq_type]()
+                                esc_handlers[seq_type](self)
                             else: # Multi-character stuff like '\x1b)B'
-                                esc_handlers[seq_type[0]](seq_type[1:])
+                                esc_handlers[seq_type[0]](self, seq_type[1:])
                             self.esc_buffer = '' # All done with this one
                             continue
                         # Next try to handle CSI ESC sequences
@@ -2062,7 +2297,7 @@ class Terminal(object):
                                 #'CSI: %s, %s' % (csi_type, csi_values))
                             # Call the matching CSI handler
                             try:
-                                csi_handlers[csi_type](csi_values)
+                                csi_handlers[csi_type](self, csi_values)
                             except ValueError:
                             # Commented this out because it can be super noisy
                                 #logging.error(_(
@@ -2163,16 +2398,17 @@ class Terminal(object):
         for x in xrange(int(n)):
             line = self.screen.pop(self.top_margin) # Remove the top line
             self.scrollback_buf.append(line) # Add it to the scrollback buffer
-            if len(self.scrollback_buf) > 1000:
-                # 1000 lines ought to be enough for anybody
-                self.init_scrollback()
-                # NOTE:  This would only be if 1000 lines piled up before the
-                # next dump_html() or dump().
             # Add it to the bottom of the window:
             self.screen.insert(self.bottom_margin, empty_line[:]) # A copy
             # Remove top line's rendition information
             rend = self.renditions.pop(self.top_margin)
             self.scrollback_renditions.append(rend)
+            if len(self.scrollback_buf) > self.scrollback_limit:
+                # Only keep the most recent lines.  NOTE:  This would only
+                # happen if that many lines piled up before the next
+                # dump_html() or dump().
+                del self.scrollback_buf[0]
+                del self.scrollback_renditions[0]
             # Insert a new empty rendition as well:
             self.renditions.insert(self.bottom_margin, empty_rend[:])
         # Execute our callback indicating lines have been updated
@@ -2268,7 +2504,7 @@ class Terminal(object):
                 self.cursorX = stop + 1
                 break
         else:
-            self.cursorX = self.columns - 1
+            self.cursorX = self.cols - 1
 
     def _set_tabstop(self):
         """Sets a tabstop at the current position of :attr:`self.cursorX`."""
@@ -3596,15 +3832,9 @@ class Terminal(object):
 
         .. note:: This method does not empty the scrollback buffer.
         """
-        out = []
-        for line in self.screen:
-            line_out = ""
-            for char in line:
-                if len(char) > 1: # This is an image (or similar)
-                    line_out += u'⬚' # Use a dotted square as a placeholder
-                else:
-                    line_out += char
-            out.append(line_out)
+        # NOTE: Lines are arrays of single characters (files/images are
+        # represented by a single reference character) so tounicode() works
+        out = [line.tounicode() for line in self.screen]
         self.modified = False
         return out
 
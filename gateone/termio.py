@@ -96,7 +96,7 @@ Module Functions and Classes
 """
 
 # Stdlib imports
-import os, sys, time, struct, io, gzip, re, logging, signal
+import os, sys, time, struct, io, gzip, re, logging, signal, codecs, errno
 from datetime import timedelta, datetime
 from functools import partial
 from itertools import izip
@@ -121,8 +121,65 @@ RE_OPT_SSH_SEQ = re.compile(
 # Matches an xterm title sequence
 RE_TITLE_SEQ = re.compile(
     r'.*\x1b\][0-2]\;(.+?)(\x07|\x1b\\)', re.DOTALL|re.MULTILINE)
+# These are used by BaseMultiplex._fast_forward() to pick out the escape
+# sequences that affect the state of the terminal (as opposed to the screen)
+# from output that is going to be skipped:
+RE_FF_STATE_SEQ = re.compile(
+    b'(\x1b\\[[0-9;:]*m)' # SGR (renditions)
+    b'|(\x1b\\][0-2_]\\;.*?(?:\x07|\x1b\\\\))' # Titles and our optional seq
+    b'|(\x1b\\[[?>]?[0-9;]*[hlncr]' # Modes, margins, and status requests
+    b'|\x1b[()][0-9A-Za-z=<>]|[\x0e\x0f])', # Charset designation and shifts
+    re.DOTALL)
+# Used by BaseMultiplex.read_until() to see everything that comes in:
+RE_ANYTHING = re.compile('.+', re.DOTALL)
+# Used by combine_patterns() to pick apart regular expressions:
+RE_INLINE_FLAGS = re.compile(r'^\(\?[iLmsux]+\)')
+RE_BACKREFERENCE = re.compile(r'\\[1-9]|\(\?P=|\(\?\(')
+# Flags that only ever make a regex match *more* (safe to combine)
+COMBINABLE_FLAGS = re.IGNORECASE|re.MULTILINE|re.DOTALL
+# Sequences that move the cursor vertically (fast-forwarding by line count
+# isn't possible when these are present):
+RE_FF_CURSOR_SEQ = re.compile(
+    b'\x1b\\[[0-9;]*[ABEFGHJLMSTdfrsu]|\x1b[78DEGIMc]')
+RE_FF_ALT_SCREEN = re.compile(b'\x1b\\[\\?(?:47|1047|1049)[hl]')
+RE_FF_MARGINS = re.compile(b'\x1b\\[[0-9;]*r')
 
 # Helper functions
+def _read_fd(fd, limit=-1):
+    """
+    Reads up to *limit* bytes from the non-blocking file descriptor *fd*.  If
+    *limit* is -1 (default) everything that's available will be read.  Returns
+    an empty string if there was nothing to read.
+
+    .. note:: Unlike a buffered reader this won't throw away what it read if the end of the output (EIO on a pty) is hit along the way.
+
+    .. note:: A short read means the kernel had nothing more to give so this stops there rather than calling `os.read` again (which would block forever if *fd* somehow isn't in non-blocking mode).
+    """
+    output = b""
+    while limit < 0 or len(output) < limit:
+        size = 65536 if limit < 0 else limit - len(output)
+        try:
+            chunk = os.read(fd, size)
+        except OSError as e:
+            if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK, errno.EIO):
+                break
+            raise
+        output += chunk
+        if len(chunk) < size:
+            break # Short read (or EOF):  Nothing more available right now
+    return output
+
+def _ioloop_running(io_loop):
+    """
+    Returns True if *io_loop* has been started.  `IOLoop.running()` went away
+    in Tornado 3.0 so this checks whatever the installed version provides.
+    """
+    if hasattr(io_loop, 'running'): # Tornado < 3.0
+        return io_loop.running()
+    if hasattr(io_loop, 'asyncio_loop'): # Tornado 5.0+
+        return io_loop.asyncio_loop.is_running()
+    return getattr(io_loop, '_running', False) # Tornado 3.x and 4.x
+
 def debug_expect(m_instance, match, pattern):
     """
     This method is used by :meth:`BaseMultiplex.expect` if :attr:`self.debug` is
@@ -314,6 +371,39 @@ class ProgramTerminated(Exception):
     """
     pass
 
+def combine_patterns(regexes):
+    """
+    Returns a single compiled regular expression that matches wherever any of
+    the given *regexes* (compiled) would match--and possibly in a few places
+    where none of them would (the flags of all *regexes* get applied to the
+    whole thing).  In other words, if the result doesn't match a string then
+    none of the *regexes* will either.  Used by :meth:`BaseMultiplex.postprocess`
+    to rule out a whole bunch of patterns with a single scan.
+
+    Returns a tuple: ``(<combined regex or None>, <regexes that can't be combined>)``
+
+    .. note:: Regular expressions that use backreferences or the VERBOSE, LOCALE, or UNICODE flags can't be combined (they could end up matching *less*).
+    """
+    sources = []
+    flags = 0
+    leftovers = []
+    for regex in regexes:
+        source = regex.pattern
+        if (regex.flags & (re.VERBOSE|re.LOCALE|re.UNICODE)
+                or RE_BACKREFERENCE.search(source)):
+            leftovers.append(regex)
+            continue
+        flags |= regex.flags & COMBINABLE_FLAGS
+        sources.append('(?:%s)' % RE_INLINE_FLAGS.sub('', source))
+    if not sources:
+        return (None, list(regexes))
+    try:
+        return (re.compile('|'.join(sources), flags), leftovers)
+    except (re.error, AssertionError, OverflowError):
+        # e.g. Too many groups for Python 2's re module or inline flags in the
+        # middle of a pattern (an error in newer versions of Python)
+        return (None, list(regexes))
+
 # Classes
 class Pattern(object):
     """
@@ -344,7 +434,9 @@ class Pattern(object):
 
     :timeout: A :obj:`datetime.timedelta` object indicating how long we should wait before calling :meth:`errorback`.
 
-    :created: A :obj:`datetime.datetime` object that gets set when the Pattern is instantiated by :meth:`BaseMultiplex.expect`.  It is used to determine if and when a timeout has been reached.
+    :created: A :obj:`datetime.datetime` object that gets set when the Pattern is instantiated by :meth:`BaseMultiplex.expect`.
+
+    :deadline: The time (as returned by :func:`time.time`) at which the pattern will time out (calculated from *created* and *timeout*) or `None` if it never will.
     """
     def __init__(self, pattern, callback,
             optional=False,
@@ -364,6 +456,15 @@ class Pattern(object):
         self.preprocess = preprocess
         self.timeout = timeout
         self.created = datetime.now()
+        self.deadline = None # Wait forever
+        if timeout:
+            if isinstance(timeout, timedelta):
+                timeout = timeout.days * 86400 + timeout.seconds + (
+                    timeout.microseconds / 1000000.0)
+            self.deadline = time.time() + float(timeout)
+        # The BaseMultiplex.screen_version this pattern was last checked
+        # against without matching (no need to check it again until it changes)
+        self.scanned = None
 
 class BaseMultiplex(object):
     """
@@ -412,10 +513,22 @@ class BaseMultiplex(object):
         self.capture_ratelimiter = False
         self.ctrl_c_pressed = False
         self.capturing_timeout = timedelta(seconds=2)
+        # When the output handed to term_write() is larger than this many
+        # screenfuls only the tail end will be emulated (see _fast_forward())
+        self.fast_forward = True
+        self.fast_forward_factor = 4
         self.rows = 24
         self.cols = 80
         self.pid = -1 # Means "no pid yet"
         self.started = "Never"
+        self.last_output = datetime.now() # Used to find idle terminals
+        # These are used by screen_text() to avoid rebuilding the whole thing:
+        self._screen_lines = []
+        self._screen_text = u''
+        self.screen_version = 0 # Incremented every time the screen changes
+        # Format: {<tuple of regex objects>: (<combined regex>, [leftovers])}
+        self._combined_patterns = {}
+        self._futures = [] # Unresolved Futures from expect_async()/read_until()
         self._patterns = []
         self._handling_match = False
         # Setup our callbacks
@@ -629,6 +742,10 @@ class BaseMultiplex(object):
         # Handle preprocess patterns (for expect())
         if self._patterns:
             self.preprocess(stream)
+        if self.fast_forward:
+            # Only the tail end of runaway output needs to be emulated
+            stream = self._fast_forward(stream)
+        self.last_output = datetime.now()
         self.term.write(stream)
         # Handle post-process patterns (for expect())
         if self._patterns:
@@ -637,6 +754,75 @@ class BaseMultiplex(object):
             for callback in self.callbacks[self.CALLBACK_UPDATE].values():
                 self._call_callback(callback)
 
+    def _fast_forward(self, stream):
+        """
+        Returns the portion of *stream* that actually needs to be written to
+        the terminal emulator in order to end up with the same screen as if all
+        of *stream* had been emulated.  If *stream* isn't larger than
+        :attr:`fast_forward_factor` screenfuls it will be returned as-is.
+
+        The output is skipped up to the point where the remaining lines are
+        enough to completely refill both the screen and the terminal's
+        scrollback buffer (:attr:`terminal.Terminal.scrollback_limit`) on their
+        own.  Escape sequences that affect the state of the terminal (SGR,
+        modes, charsets, titles, etc) are picked out of the skipped portion and
+        prepended to the tail so they still get applied.
+
+        .. note:: Skipped output *is* recorded in the session log (:meth:`term_write` logs everything before calling this method).
+        """
+        if len(stream) <= self.fast_forward_factor * self.rows * self.cols:
+            return stream
+        term = self.term
+        if getattr(term, 'esc_buffer', '') or getattr(term, 'capture', ''):
+            # In the middle of an escape sequence or a file capture
+            return stream
+        for magic_header in getattr(term, 'magic', {}):
+            if magic_header.match(stream):
+                return stream # Let the terminal emulator capture the file
+        if getattr(term, 'top_margin', 0) != 0 or getattr(
+                term, 'bottom_margin', self.rows - 1) != self.rows - 1:
+            return stream # The tail needs to scroll the whole screen
+        # The first screenful of lines in the tail may be written over whatever
+        # was left on the screen so it takes two screenfuls plus a full
+        # scrollback buffer before the result is entirely up to the tail.
+        # NOTE: Newlines always come with carriage returns from a pty
+        lines = 2 * self.rows + getattr(term, 'scrollback_limit', 1000)
+        cut = len(stream)
+        for i in xrange(lines):
+            cut = stream.rfind(b'\r\n', 0, cut)
+            if cut < 1:
+                return stream # Not enough lines to skip anything
+        if RE_FF_CURSOR_SEQ.search(stream, cut):
+            # The tail has to scroll line-by-line from the bottom of the screen
+            return stream
+        if RE_FF_MARGINS.search(stream, 0, cut) or RE_FF_ALT_SCREEN.search(
+                stream, 0, cut):
+            # Scrolling regions and the alternate screen buffer need the
+            # skipped output to be emulated properly
+            return stream
+        # Preserve the state-changing sequences from the skipped output
+        sgr = []
+        title = None
+        other = []
+        for match in RE_FF_STATE_SEQ.finditer(stream, 0, cut):
+            rendition, osc, mode = match.groups()
+            if rendition:
+                if rendition in (b'\x1b[m', b'\x1b[0m'):
+                    sgr = [] # Everything before a reset doesn't matter
+                sgr.append(rendition)
+            elif osc:
+                if osc.startswith(b'\x1b]_'): # Optional sequence (ssh plugin)
+                    other.append(osc)
+                else:
+                    title = osc # Only the last title matters
+            else:
+                other.append(mode)
+        if title:
+            other.append(title)
+        logging.debug("Fast-forwarded past %s bytes of output" % cut)
+        move_cursor = b'\x1b[%d;1H' % self.rows
+        return b''.join(other + sgr) + move_cursor + stream[cut:]
+
     def preprocess(self, stream):
         """
         Handles preprocess patterns registered by :meth:`expect`.  That
@@ -675,45 +861,113 @@ class BaseMultiplex(object):
                 # We only match the first non-optional pattern
                 finished_non_sticky = True
 
+    def screen_text(self):
+        """
+        Returns the terminal emulator's screen as a single string with trailing
+        whitespace removed from each line (and the end).  This is what
+        post-process patterns (see :meth:`expect`) get checked against.
+
+        The result is cached and only the lines that changed since the last call
+        get stripped and joined again.  :attr:`screen_version` is incremented
+        whenever the result changes.
+        """
+        screen = getattr(self.term, 'screen', None)
+        if screen is None: # A terminal emulator that only provides dump()
+            lines = self.term.dump()
+        else:
+            # tounicode() is a straight copy (much faster than dump())
+            lines = [
+                line.tounicode() if hasattr(line, 'tounicode')
+                else u''.join(line) for line in screen]
+        cache = self._screen_lines
+        if len(cache) != len(lines):
+            cache[:] = [(None, u'')] * len(lines)
+        changed = False
+        for i, line in enumerate(lines):
+            if cache[i][0] != line:
+                cache[i] = (line, line.rstrip())
+                changed = True
+        if changed:
+            self._screen_text = u"\n".join(a[1] for a in cache).rstrip()
+            self.screen_version += 1
+        return self._screen_text
+
     def postprocess(self):
         """
         Handles post-process patterns registered by :meth:`expect`.
+
+        All the patterns that need checking are first combined (see
+        :func:`combine_patterns`) into a single regular expression.  If that
+        doesn't match the screen then none of the patterns it was made from
+        will either and they can all be skipped.  Patterns that already failed
+        to match the current screen (:attr:`screen_version`) are skipped too.
         """
         # Check the terminal emulator screen for any matching patterns.
-        post_patterns = (a for a in self._patterns if not a.preprocess)
+        # NOTE: For post-processing matches we search the terminal emulator's
+        # screen as a single string.  This allows for full-screen screen
+        # scraping in addition to typical 'expect-like' functionality.
+        # The big difference being that with traditional expect (and
+        # pexpect) you don't get to examine the program's output as it
+        # would be rendered in an actual terminal.
+        # By using post-processing of the text after it has been handled
+        # by a terminal emulator we don't have to worry about hidden
+        # characters and escape sequences that we may not be aware of or
+        # could make our regular expressions much more complicated than
+        # they should be.
+        post_patterns = []
         finished_non_sticky = False
-        for pattern_obj in post_patterns:
-            # For post-processing matches we search the terminal emulator's
-            # screen as a single string.  This allows for full-screen screen
-            # scraping in addition to typical 'expect-like' functionality.
-            # The big difference being that with traditional expect (and
-            # pexpect) you don't get to examine the program's output as it
-            # would be rendered in an actual terminal.
-            # By using post-processing of the text after it has been handled
-            # by a terminal emulator we don't have to worry about hidden
-            # characters and escape sequences that we may not be aware of or
-            # could make our regular expressions much more complicated than
-            # they should be.
+        for pattern_obj in self._patterns:
+            if pattern_obj.preprocess:
+                continue
             if finished_non_sticky and not pattern_obj.sticky:
                 continue # We only want sticky patterns at this point
-            # For convenience, trailing whitespace is removed from the lines
-            # output from the terminal emulator.  This is so we don't have to
-            # put '\w*' before every '$' to match the end of a line.
-            term_lines = "\n".join(
-                [a.rstrip() for a in self.term.dump()]).rstrip()
+            post_patterns.append(pattern_obj)
+            if not pattern_obj.optional and not pattern_obj.sticky:
+                # We only match the first non-optional pattern
+                finished_non_sticky = True
+        if not post_patterns:
+            return
+        # For convenience, trailing whitespace is removed from the lines
+        # output from the terminal emulator.  This is so we don't have to
+        # put '\w*' before every '$' to match the end of a line.
+        term_lines = self.screen_text()
+        version = self.screen_version
+        post_patterns = [a for a in post_patterns if a.scanned != version]
+        regexes = []
+        for pattern_obj in post_patterns:
             if isinstance(pattern_obj.pattern, (list, tuple)):
-                for pat in pattern_obj.pattern:
-                    match = pat.search(term_lines)
-                    if match:
-                        self._handle_match(pattern_obj, match)
-                        break
+                regexes.extend(pattern_obj.pattern)
             else:
-                match = pattern_obj.pattern.search(term_lines)
+                regexes.append(pattern_obj.pattern)
+        key = tuple(regexes)
+        if key not in self._combined_patterns:
+            if len(self._combined_patterns) > 100: # Don't let it grow forever
+                self._combined_patterns.clear()
+            self._combined_patterns[key] = combine_patterns(regexes)
+        combined, leftovers = self._combined_patterns[key]
+        if combined and not combined.search(term_lines):
+            # Only the patterns that couldn't be combined can possibly match
+            leftovers = set(leftovers)
+            for pattern_obj in post_patterns:
+                pats = pattern_obj.pattern
+                if not isinstance(pats, (list, tuple)):
+                    pats = (pats,)
+                if not leftovers.intersection(pats):
+                    pattern_obj.scanned = version
+            post_patterns = [a for a in post_patterns if a.scanned != version]
+        for pattern_obj in post_patterns:
+            if pattern_obj not in self._patterns:
+                continue # Removed by the callback of a previous match
+            pats = pattern_obj.pattern
+            if not isinstance(pats, (list, tuple)):
+                pats = (pats,)
+            for pat in pats:
+                match = pat.search(term_lines)
                 if match:
                     self._handle_match(pattern_obj, match)
-            if not pattern_obj.optional and not pattern_obj.sticky:
-                # We only match the first non-optional pattern
-                finished_non_sticky = True
+                    break
+            else:
+                pattern_obj.scanned = version
 
     def _handle_match(self, pattern_obj, match):
         """
@@ -835,30 +1089,34 @@ class BaseMultiplex(object):
     def timeout_check(self, timeout_now=False):
         """
         Iterates over :attr:`BaseMultiplex._patterns` checking each to
-        determine if it has timed out.  If a timeout has occurred for a
-        `Pattern` and said Pattern has an *errorback* function that function
-        will be called.
+        determine if it has timed out (reached its :attr:`Pattern.deadline`).
+        If a timeout has occurred for a `Pattern` and said Pattern has an
+        *errorback* function that function will be called.
 
         Returns True if there are still non-sticky patterns remaining.  False
         otherwise.
 
         If *timeout_now* is True, will force the first errorback to be called
         and will empty out self._patterns.
+
+        .. note:: The errorback of a sticky pattern only gets called once (sticky patterns stay put when they time out).
         """
         remaining_patterns = False
-        for pattern_obj in self._patterns:
+        now = time.time()
+        for pattern_obj in list(self._patterns):
             if timeout_now:
                 if pattern_obj.errorback:
                     errorback = partial(pattern_obj.errorback, self)
                     self._call_callback(errorback)
                     self.unexpect()
                     return False
-            if not pattern_obj.timeout:
+            if not pattern_obj.deadline:
                 # Timeouts of 0 or None mean "wait forever"
-                remaining_patterns = True
+                if not pattern_obj.sticky:
+                    remaining_patterns = True
                 continue
-            elapsed = datetime.now() - pattern_obj.created
-            if elapsed > pattern_obj.timeout:
+            if now >= pattern_obj.deadline:
+                pattern_obj.deadline = None # Only time out once
                 if not pattern_obj.sticky:
                     self.unexpect(hash(pattern_obj))
                 if pattern_obj.errorback:
@@ -868,6 +1126,25 @@ class BaseMultiplex(object):
                 remaining_patterns = True
         return remaining_patterns
 
+    def next_deadline(self):
+        """
+        Returns the earliest :attr:`Pattern.deadline` of all the patterns in
+        :attr:`BaseMultiplex._patterns` or `None` if none of them can time out.
+        """
+        deadlines = [a.deadline for a in self._patterns if a.deadline]
+        if deadlines:
+            return min(deadlines)
+        return None
+
+    def _schedule_timeouts(self):
+        """
+        Called whenever :attr:`BaseMultiplex._patterns` changes so that
+        subclasses can arrange for :meth:`timeout_check` to be called at
+        :meth:`next_deadline`.  Does nothing by default (timeouts only get
+        checked when :meth:`read` is called).
+        """
+        pass
+
     def expect(self, patterns, callback,
             optional=False,
             sticky=False,
@@ -1048,6 +1325,7 @@ class BaseMultiplex(object):
             self._patterns.insert(position, pattern_obj)
         else:
             self._patterns.append(pattern_obj)
+        self._schedule_timeouts()
         return hash(pattern_obj)
 
     def unexpect(self, ref=None):
@@ -1058,10 +1336,9 @@ class BaseMultiplex(object):
         """
         if not ref:
             self._patterns = [] # Reset
-            return
-        for i, item in enumerate(self._patterns):
-            if hash(item) == ref:
-                self._patterns.pop(i)
+        else:
+            self._patterns = [a for a in self._patterns if hash(a) != ref]
+        self._schedule_timeouts()
 
     def await(self, timeout=15, **kwargs):
         """
@@ -1077,12 +1354,13 @@ class BaseMultiplex(object):
         As a convenience, if :meth:`isalive` resolves to False,
         :meth:`spawn` will be called automatically with *\*\*kwargs*
 
+        .. note:: This doesn't poll: It sleeps until there's output from the child process (see :meth:`_wait_for_output`) or the next pattern times out.
+
         await
             To wait with expectation.
         """
         if not self.isalive():
             self.spawn(**kwargs)
-        start = datetime.now()
         # Convert timeout to a timedelta if necessary
         if isinstance(timeout, (str, int, float)):
             timeout = timedelta(seconds=float(timeout))
@@ -1090,37 +1368,207 @@ class BaseMultiplex(object):
             raise TypeError(_(
                 "The timeout value must be a string, integer, float, or a "
                 "timedelta object"))
-        remaining_patterns = True
-        # This starts up the scheduler that constantly checks patterns
-        output = self.read() # Remember:  read() is non-blocking
-        # TODO: Add an extra "too much" debug option for "those times"...
-        #if output and self.debug:
-            #print("await: %s" % repr(output))
-        while remaining_patterns:
-            # First we need to discount optional patterns
-            remaining_patterns = False
-            if not self._patterns:
+        give_up = time.time() + timeout.days * 86400 + timeout.seconds + (
+            timeout.microseconds / 1000000.0)
+        woke = False
+        while True:
+            # NOTE: Calling _read() directly (instead of read()) because
+            # subclasses may rate-limit read() which would make us spin
+            output = self._read()
+            if woke and not output:
+                # Readable but nothing to read means the child is on its way
+                # out.  Don't spin while that happens.
+                time.sleep(0.01)
+            self.timeout_check()
+            if self._patterns:
+                self.isalive() # Cleans up (including self._patterns) if dead
+            # Optional and sticky patterns don't count
+            remaining_patterns = [
+                a for a in self._patterns if not a.optional and not a.sticky]
+            if not remaining_patterns:
                 break
-            for pattern in self._patterns:
-                if not pattern.optional and not pattern.sticky:
-                    remaining_patterns = True
-                    break
-            # Now check if we've timed out
-            if (datetime.now() - start) > timeout:
-                for pattern in self._patterns:
-                    if not pattern.sticky and not pattern.optional:
-                        print(
-                          "We were waiting on this pattern before timeout: %s" %
-                          repr(pattern.pattern.pattern))
+            now = time.time()
+            if now > give_up:
+                for pattern in remaining_patterns:
+                    logging.warning(_(
+                        "We were waiting on this pattern before timeout: %s" %
+                        repr(pattern.pattern.pattern)))
                 raise Timeout("Lingered longer than %s" % timeout.seconds)
-            # Lastly we perform a read() to ensure the output is processed
-            output = self.read() # Remember:  read() is non-blocking
-            # TODO: Add this to the "too much" debug option
-            #if output and self.debug:
-                #print("await: %s" % repr(output))
-            time.sleep(0.01) # So we don't eat up all the CPU
+            # Sleep until there's more output or the next pattern times out
+            wait = give_up - now
+            deadline = self.next_deadline()
+            if deadline:
+                wait = min(wait, deadline - now)
+            woke = self._wait_for_output(max(wait, 0))
         return True
 
+    def _future(self):
+        """
+        Returns a new :class:`tornado.concurrent.Future` that will be failed
+        with :exc:`ProgramTerminated` if the underlying program terminates
+        before it is resolved.
+
+        .. note:: Requires Tornado 3.0+.
+        """
+        from tornado.concurrent import Future
+        future = Future()
+        self._futures.append(future)
+        return future
+
+    def _resolve(self, future, result=None, exception=None):
+        """
+        Sets the *result* (or *exception*) of *future* unless it has already
+        been resolved (callbacks can arrive after :meth:`terminate`).
+        """
+        if future in self._futures:
+            self._futures.remove(future)
+        if future.done():
+            return
+        if exception:
+            future.set_exception(exception)
+        else:
+            future.set_result(result)
+
+    def _fail_futures(self):
+        """
+        Fails all the Futures that are still waiting on patterns with
+        :exc:`ProgramTerminated`.  Called by :meth:`terminate`.
+        """
+        futures, self._futures = self._futures, []
+        for future in futures:
+            if not future.done():
+                future.set_exception(ProgramTerminated(_(
+                    "Child process terminated: %s" % self.cmd)))
+
+    def _timed_out(self, future, pattern):
+        """
+        Fails *future* with :exc:`Timeout` (or :exc:`ProgramTerminated` if
+        we're terminating).  Used as the errorback for :meth:`expect_async`
+        and :meth:`read_until`.
+        """
+        if getattr(self, 'terminating', False):
+            self._fail_futures()
+            return
+        pattern = getattr(pattern, 'pattern', pattern)
+        self._resolve(future, exception=Timeout(
+            "Timed out waiting for %s" % repr(pattern)))
+
+    def expect_async(self, patterns,
+            optional=False,
+            timeout=15,
+            position=None,
+            preprocess=True):
+        """
+        Just like :meth:`expect` but instead of taking a callback it returns a
+        :class:`tornado.concurrent.Future` that resolves to the matched string.
+        If the pattern times out the Future will raise :exc:`Timeout`.  If the
+        underlying program terminates first it will raise
+        :exc:`ProgramTerminated`.  Meant to be used inside of coroutines::
+
+            >>> from tornado import gen
+            >>> @gen.coroutine
+            ... def change_password(user, password):
+            ...     with termio.spawn('passwd %s' % user) as m:
+            ...         yield m.expect_async('(?i)password:', preprocess=False)
+            ...         m.writeline(password)
+            ...         yield m.expect_async('(?i)retype.*password:', preprocess=False)
+            ...         m.writeline(password)
+            ...         result = yield m.read_until('updated successfully')
+            ...     raise gen.Return(result)
+
+        Since nothing blocks, any number of these can run concurrently on the
+        same IOLoop.
+
+        .. note:: Requires Tornado 3.0+.
+        """
+        future = self._future()
+        self.expect(patterns,
+            lambda m, matched: self._resolve(future, matched),
+            optional=optional,
+            errorback=lambda m: self._timed_out(future, patterns),
+            timeout=timeout,
+            position=position,
+            preprocess=preprocess)
+        return future
+
+    def read_until(self, pattern, timeout=15, window=4096):
+        """
+        Returns a :class:`tornado.concurrent.Future` that resolves to all the
+        output (the raw stream, escape sequences and all) that comes in from
+        the time this method is called up to and including the first match of
+        *pattern* (string or :class:`re.RegexObject`).  The Future will raise
+        :exc:`Timeout` if *pattern* isn't seen within *timeout* seconds.
+
+        Unlike :meth:`expect`, *pattern* can match across reads.  Only the new
+        output (plus the *window* characters before it) gets searched each time
+        something comes in so matches may not start more than *window*
+        characters before the latest read.
+
+        .. note:: Requires Tornado 3.0+.
+        """
+        if isinstance(pattern, (str, unicode)):
+            pattern = re.compile(pattern, re.MULTILINE|re.DOTALL)
+        future = self._future()
+        # Multibyte characters can be split across reads:
+        decoder = codecs.getincrementaldecoder(self.encoding)('replace')
+        received = [] # Decoded output
+        # Format: {'length': <len(received) in chars>, 'tail': <last chars>}
+        state = {'length': 0, 'tail': u''}
+        refs = []
+        def collect(m_instance, chunk):
+            if future.done():
+                return
+            if isinstance(chunk, bytes):
+                chunk = decoder.decode(chunk)
+            if not chunk:
+                return
+            received.append(chunk)
+            tail = state['tail']
+            text = tail + chunk
+            # When the tail has been trimmed its first character is only there
+            # so that a '^' at the start of the window works properly:
+            start = 1 if state['length'] > len(tail) else 0
+            match = pattern.search(text, start)
+            if match:
+                end = state['length'] - len(tail) + match.end()
+                self.unexpect(refs[0])
+                self._resolve(future, u''.join(received)[:end])
+                return
+            state['length'] += len(chunk)
+            state['tail'] = text[-(window + 1):]
+        def errorback(m_instance):
+            self.unexpect(refs[0])
+            self._timed_out(future, pattern)
+        refs.append(self.expect(RE_ANYTHING, collect,
+            sticky=True, errorback=errorback, timeout=timeout, preprocess=True))
+        return future
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        """
+        Terminates the underlying program (if it's still running) so a
+        Multiplex can be used as a context manager::
+
+            >>> with termio.spawn('top') as m:
+            ...     do_stuff(m)
+        """
+        if self.isalive():
+            self.terminate()
+
+    def _wait_for_output(self, timeout):
+        """
+        Blocks until there's output waiting to be read from the underlying
+        terminal program or *timeout* (seconds) is reached.  Returns True if
+        there's output.  Used by :meth:`await`.
+
+        Subclasses of `BaseMultiplex` should override this in order to avoid
+        polling (by default it just sleeps for up to 10ms and returns False).
+        """
+        time.sleep(min(timeout, 0.01))
+        return False
+
     def terminate(self):
         """
         This method must be overridden by suclasses of `BaseMultiplex`.  It is
@@ -1179,12 +1627,15 @@ class MultiplexPOSIXIOLoop(BaseMultiplex):
         #self.io_loop.set_blocking_signal_threshold(2, self._blocked_io_handler)
         #signal.signal(signal.SIGALRM, self._blocked_io_handler)
         self.reenable_timeout = None
-        interval = 100 # A 0.1 second interval should be fast enough
-        self.scheduler = ioloop.PeriodicCallback(self._timeout_checker,interval)
+        # The IOLoop timeout that calls _timeout_checker() at next_deadline():
+        self._timeout_handle = None
+        self._timeout_deadline = None
         self.exitstatus = None
         self._checking_patterns = False
         self.read_timeout = datetime.now()
         self.capture_limit = -1 # Huge reads by default
+        # Max amount of output _read() will hold on to before calling term_write
+        self.backlog_limit = 1048576 # 1MB
         self.restore_rate = None
 
     def __del__(self):
@@ -1202,7 +1653,7 @@ class MultiplexPOSIXIOLoop(BaseMultiplex):
         iteration (which is thread safe).  If the IOLoop isn't started
         *callback* will get called immediately and directly.
         """
-        if self.io_loop.running():
+        if _ioloop_running(self.io_loop):
             self.io_loop.add_callback(callback)
         else:
             callback()
@@ -1346,15 +1797,15 @@ class MultiplexPOSIXIOLoop(BaseMultiplex):
                     cols=cols,
                     encoding=self.encoding
                 )
+            # Set non-blocking so we don't wait forever for a read()
+            import fcntl
+            fl = fcntl.fcntl(fd, fcntl.F_GETFL)
+            fcntl.fcntl(fd, fcntl.F_SETFL, fl | os.O_NONBLOCK)
             # Tell our IOLoop instance to start watching the child
             self.io_loop.add_handler(
                 fd, self._ioloop_read_handler, self.io_loop.READ)
             self.prev_output = {}
             self.shared_scrollback = []
-            # Set non-blocking so we don't wait forever for a read()
-            import fcntl
-            fl = fcntl.fcntl(sys.stdin, fcntl.F_GETFL)
-            fcntl.fcntl(self.fd, fcntl.F_SETFL, fl | os.O_NONBLOCK)
             # Set the size of the terminal
             resize = partial(self.resize, rows, cols, ctrl_l=False)
             self.io_loop.add_timeout(timedelta(seconds=2), resize)
@@ -1416,7 +1867,8 @@ class MultiplexPOSIXIOLoop(BaseMultiplex):
 
     def terminate(self):
         """
-        Kill the child process associated with `self.fd`.
+        Kill the child process (and its process group) associated with
+        `self.fd`.
 
         .. note:: If dtach is being used this only kills the dtach process.
         """
@@ -1446,20 +1898,23 @@ class MultiplexPOSIXIOLoop(BaseMultiplex):
             # This can happen when the fd is removed by the underlying process
             # before the next cycle of the IOLoop.  Not really a problem.
             pass
-        self.scheduler.stop()
-        # NOTE: Without this 'del' we end up with a memory leak every time
-        # a new instance of Multiplex is created.  Apparently the references
-        # inside of PeriodicCallback pointing to self prevent proper garbage
-        # collection.
-        del self.scheduler
+        if self._timeout_handle:
+            # NOTE: Without this we end up with a memory leak every time a new
+            # instance of Multiplex is created (the IOLoop holds a reference
+            # to self via the callback until the timeout is reached).
+            self.io_loop.remove_timeout(self._timeout_handle)
+            self._timeout_handle = None
         try:
             # TODO: Make this walk the series from SIGINT to SIGKILL
-            #os.kill(self.pid, signal.SIGINT)
-            os.kill(self.pid, signal.SIGTERM)
-            #os.kill(self.pid, signal.SIGKILL)
+            # pty.fork() makes the child a session (and process group) leader
+            # so this takes care of everything in its process group at once.
+            os.killpg(self.pid, signal.SIGTERM)
         except OSError:
-            # The process is already dead--great.
-            pass
+            try:
+                os.kill(self.pid, signal.SIGTERM)
+            except OSError:
+                # The process is already dead--great.
+                pass
         if self.exitstatus == None:
             try:
                 pid, status = os.waitpid(self.pid, 0)
@@ -1482,6 +1937,7 @@ class MultiplexPOSIXIOLoop(BaseMultiplex):
         if self._patterns:
             self.timeout_check(timeout_now=True)
             self.unexpect()
+        self._fail_futures()
         # Call the exitfunc (if set)
         if self.exitfunc:
             self.exitfunc(self, self.exitstatus)
@@ -1526,7 +1982,11 @@ class MultiplexPOSIXIOLoop(BaseMultiplex):
                 "Apparently fd %s just died (event: %s)" % (self.fd, event)))
             #if self.debug:
                 #print(repr("".join([a for a in self.term.dump() if a.strip()])))
-            self.terminate()
+            if event & self.io_loop.READ:
+                # Whatever the child wrote on its way out is still waiting
+                self._read()
+            # Let any pattern callbacks that output triggered go first:
+            self._call_callback(self.terminate)
 
     def _read(self, bytes=-1):
         """
@@ -1547,62 +2007,75 @@ class MultiplexPOSIXIOLoop(BaseMultiplex):
             self.capture_limit = -1
             self.restore_rate = None
         try:
-            with io.open(self.fd, 'rb', closefd=False,buffering=1024) as reader:
-                if bytes == -1:
-                    # 2 seconds of blocking is too much.
-                    timeout = timedelta(seconds=2)
-                    loop_start = datetime.now()
-                    if self.ctrl_c_pressed:
-                        # If the user pressed Ctrl-C and the ratelimiter was
-                        # engaged then we'd best discard the (possibly huge)
-                        # buffer so we don't waste CPU cyles processing it.
-                        discard = reader.read(-1)
-                        self.ctrl_c_pressed = False
-                        return u'^C\n' # Let the user know what happened
-                    if self.restore_rate:
-                        # Need at least three seconds of inactivity to go back
-                        # to unlimited reads
-                        self.io_loop.remove_timeout(self.restore_rate)
-                        self.restore_rate = self.io_loop.add_timeout(
-                            timedelta(seconds=6), restore_capture_limit)
-                    while True:
-                        updated = reader.read(self.capture_limit)
-                        if not updated:
-                            break
-                        result += updated
-                        self.term_write(updated)
-                        if self.ratelimiter_engaged or self.capture_ratelimiter:
-                            break # Only allow one read per IOLoop loop
-                        if self.capture_limit == 2048:
-                            # Block for a little while: Enough to keep things
-                            # moving but not fast enough to slow everyone else
-                            # down
-                            self._blocked_io_handler(wait=1000)
-                            break
-                        if datetime.now() - loop_start > timeout:
-                            # Engage the rate limiter
-                            if self.term.capture:
-                                self.capture_ratelimiter = True
-                                self.capture_limit = 65536
-                                # Make sure we eventually get back to defaults:
-                                self.io_loop.add_timeout(
-                                    timedelta(seconds=10),
-                                    restore_capture_limit)
-                                # NOTE: The capture_ratelimiter doesn't remove
-                                # self.fd from the IOLoop (that's the diff)
-                            else:
-                                # Set the capture limit to a smaller value so
-                                # when we re-start output again the noisy
-                                # program won't be able to take over again.
-                                self.capture_limit = 2048
-                                self.restore_rate = self.io_loop.add_timeout(
-                                    timedelta(seconds=6),
-                                    restore_capture_limit)
-                                self._blocked_io_handler()
-                            break
-                elif bytes:
-                    result = reader.read(bytes)
-                    self.term_write(result)
+            if bytes == -1:
+                # 2 seconds of blocking is too much.
+                timeout = timedelta(seconds=2)
+                loop_start = datetime.now()
+                if self.ctrl_c_pressed:
+                    # If the user pressed Ctrl-C and the ratelimiter was
+                    # engaged then we'd best discard the (possibly huge)
+                    # buffer so we don't waste CPU cyles processing it.
+                    discard = _read_fd(self.fd, -1)
+                    self.ctrl_c_pressed = False
+                    return u'^C\n' # Let the user know what happened
+                if self.restore_rate:
+                    # Need at least three seconds of inactivity to go back
+                    # to unlimited reads
+                    self.io_loop.remove_timeout(self.restore_rate)
+                    self.restore_rate = self.io_loop.add_timeout(
+                        timedelta(seconds=6), restore_capture_limit)
+                backlog = b""
+                while True:
+                    updated = _read_fd(self.fd, self.capture_limit)
+                    if not updated:
+                        break
+                    result += updated
+                    # Output is handed to term_write() in big chunks so
+                    # that runaway output can be fast-forwarded
+                    backlog += updated
+                    timed_out = datetime.now() - loop_start > timeout
+                    limited = (
+                        self.ratelimiter_engaged or
+                        self.capture_ratelimiter or
+                        self.capture_limit == 2048)
+                    if len(backlog) >= self.backlog_limit or (
+                            timed_out or limited):
+                        self.term_write(backlog)
+                        backlog = b""
+                    if self.ratelimiter_engaged or self.capture_ratelimiter:
+                        break # Only allow one read per IOLoop loop
+                    if self.capture_limit == 2048:
+                        # Block for a little while: Enough to keep things
+                        # moving but not fast enough to slow everyone else
+                        # down
+                        self._blocked_io_handler(wait=1000)
+                        break
+                    if timed_out:
+                        # Engage the rate limiter
+                        if self.term.capture:
+                            self.capture_ratelimiter = True
+                            self.capture_limit = 65536
+                            # Make sure we eventually get back to defaults:
+                            self.io_loop.add_timeout(
+                                timedelta(seconds=10),
+                                restore_capture_limit)
+                            # NOTE: The capture_ratelimiter doesn't remove
+                            # self.fd from the IOLoop (that's the diff)
+                        else:
+                            # Set the capture limit to a smaller value so
+                            # when we re-start output again the noisy
+                            # program won't be able to take over again.
+                            self.capture_limit = 2048
+                            self.restore_rate = self.io_loop.add_timeout(
+                                timedelta(seconds=6),
+                                restore_capture_limit)
+                            self._blocked_io_handler()
+                        break
+                if backlog:
+                    self.term_write(backlog)
+            elif bytes:
+                result = _read_fd(self.fd, bytes)
+                self.term_write(result)
         except IOError as e:
             # IOErrors can happen when self.fd is closed before we finish
             # reading from it.  Not a big deal.
@@ -1622,50 +2095,70 @@ class MultiplexPOSIXIOLoop(BaseMultiplex):
                 print("_read(): %s" % repr(result))
         return result
 
+    def _schedule_timeouts(self):
+        """
+        Makes sure :meth:`_timeout_checker` will be called by the IOLoop right
+        when the next pattern in :attr:`self._patterns` times out (see
+        :meth:`BaseMultiplex.next_deadline`).  Only a single IOLoop timeout is
+        ever pending for each instance.
+        """
+        deadline = self.next_deadline()
+        if deadline == self._timeout_deadline:
+            return # Already scheduled
+        if self._timeout_handle:
+            self.io_loop.remove_timeout(self._timeout_handle)
+            self._timeout_handle = None
+        self._timeout_deadline = deadline
+        if deadline and not self.terminating:
+            # NOTE: Using a timedelta since IOLoop.time() isn't necessarily
+            # the same clock as time.time()
+            self._timeout_handle = self.io_loop.add_timeout(
+                timedelta(seconds=max(deadline - time.time(), 0)),
+                self._timeout_checker)
+
     def _timeout_checker(self):
         """
-        Runs `timeout_check` and if there are no more non-sticky
-        patterns in :attr:`self._patterns`, stops :attr:`scheduler`.
+        Runs `timeout_check` and schedules the next call (if any patterns can
+        still time out).
         """
+        self._timeout_handle = None
+        self._timeout_deadline = None
         if not self._checking_patterns:
             self._checking_patterns = True
-            remaining_patterns = self.timeout_check()
-            if not remaining_patterns:
-                # No reason to keep the PeriodicCallback going
-                logging.debug("Stopping self.scheduler (no remaining patterns)")
-                try:
-                    self.scheduler.stop()
-                except AttributeError:
-                # Now this is a neat trick:  The way IOLoop works with its
-                # stack_context thingamabob the scheduler doesn't actualy end up
-                # inside the MultiplexPOSIXIOLoop instance inside of this
-                # instance of _timeout_checker() *except* inside the main
-                # thread.  It is absolutely wacky but it works and works well :)
-                    pass
+            self.timeout_check()
             self._checking_patterns = False
+        self._schedule_timeouts()
+
+    def _wait_for_output(self, timeout):
+        """
+        Blocks (using :func:`select.select`) until `self.fd` is readable or
+        *timeout* (seconds) is reached.  Returns True if there's output to read.
+        """
+        import select
+        try:
+            readable = select.select([self.fd], [], [], timeout)[0]
+        except (select.error, ValueError, TypeError, OSError):
+            # EINTR or self.fd was closed out from under us
+            return False
+        return bool(readable)
 
     def read(self, bytes=-1):
         """
         .. note:: This is an override of `BaseMultiplex.read` in order to take advantage of the IOLoop for ensuring `BaseMultiplex.expect` patterns timeout properly.
 
         Calls `_read` and checks if any timeouts have been reached
-        in :attr:`self._patterns`.  Returns the result of :meth:`_read`.  This
-        is an override of `BaseMultiplex.read` that will create a
-        :class:`tornado.ioloop.PeriodicCallback` (as `self.scheduler`) that
-        executes :attr:`timeout_check` at a regular interval.  The
-        `PeriodicCallback` will automatically cancel itself if there are no more
-        non-sticky patterns in :attr:`self._patterns`.
+        in :attr:`self._patterns`.  Returns the result of :meth:`_read`.
+        Pattern timeouts are scheduled on the IOLoop (see
+        :meth:`_schedule_timeouts`) so they'll be handled at the right time
+        even if there's no more output.
         """
         # 50ms basic output rate limit on everything
         rate_wait = timedelta(milliseconds=50)
         if datetime.now() - self.read_timeout > rate_wait:
             result = self._read(bytes)
             self.read_timeout = datetime.now()
-            remaining_patterns = self.timeout_check()
-            if remaining_patterns and not self.scheduler._running:
-                # Start 'er up in case we don't get any more output
-                logging.debug("Starting self.scheduler to check for timeouts")
-                self.scheduler.start()
+            self.timeout_check()
+            self._schedule_timeouts()
             self.isalive() # This just ensures the exitfunc is called (if necessary)
             return result
 
@@ -1736,6 +2229,12 @@ def spawn(cmd, rows=24, cols=80, env=None, em_dimensions=None, *args, **kwargs):
         >>> m = Multiplex(cmd, *args, **kwargs)
         >>> m.spawn(rows, cols, env)
         >>> return m
+
+    The result can be used as a context manager (the program will be
+    terminated when the block exits)::
+
+        >>> with spawn('sh') as m:
+        ...     output = yield m.read_until('\$ ') # Inside a coroutine
     """
     m = Multiplex(cmd, *args, **kwargs)
     m.spawn(rows, cols, env, em_dimensions=em_dimensions)
@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#       Copyright 2013 Liftoff Software Corporation
+#
+
+# Meta
+__author__ = 'Dan McDougall <daniel.mcdougall@liftoffsoftware.com>'
+
+"""
+Measures how long :meth:`termio.BaseMultiplex.postprocess` takes to check a
+bunch of (sticky, non-matching) patterns against the screen after every write
+compared to the way it used to work (dumping and searching the whole screen
+once per pattern)::
+
+    python tests/benchmark_expect.py --rows=100 --cols=200 --patterns=10
+"""
+
+# Import Python built-ins
+import os, sys, time
+from optparse import OptionParser
+tests_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.abspath(os.path.join(tests_dir, '../')))
+import termio, terminal
+
+def legacy_postprocess(self):
+    """
+    The old :meth:`termio.BaseMultiplex.postprocess` (minus the comments).
+    """
+    post_patterns = (a for a in self._patterns if not a.preprocess)
+    finished_non_sticky = False
+    for pattern_obj in post_patterns:
+        if finished_non_sticky and not pattern_obj.sticky:
+            continue
+        term_lines = "\n".join(
+            [a.rstrip() for a in legacy_dump(self.term)]).rstrip()
+        match = pattern_obj.pattern.search(term_lines)
+        if match:
+            self._handle_match(pattern_obj, match)
+        if not pattern_obj.optional and not pattern_obj.sticky:
+            finished_non_sticky = True
+
+def legacy_dump(term):
+    """
+    The old :meth:`terminal.Terminal.dump`.
+    """
+    out = []
+    for line in term.screen:
+        line_out = ""
+        for char in line:
+            if len(char) > 1:
+                line_out += u'⬚'
+            else:
+                line_out += char
+        out.append(line_out)
+    term.modified = False
+    return out
+
+def run(postprocess, options):
+    """
+    Returns the average number of milliseconds each write took (including the
+    terminal emulator's own processing).
+    """
+    m = termio.BaseMultiplex('true')
+    m.rows, m.cols = options.rows, options.cols
+    m.term = terminal.Terminal(options.rows, options.cols)
+    m.postprocess = lambda: postprocess(m)
+    for i in range(options.patterns):
+        m.expect('(?i)error %s:.*failed$' % i, lambda m, s: None,
+            sticky=True, preprocess=False)
+    chunks = [
+        u'%s [ok] building component %s\r\n' % (i, u'x' * (i % 150))
+        for i in range(options.writes)]
+    chunks.append(u'\r\n' * options.rows) # Clear it
+    for chunk in chunks[-options.rows:]: # Fill the screen first
+        m.term_write(chunk)
+    start = time.time()
+    for chunk in chunks:
+        m.term_write(chunk)
+    return (time.time() - start) / len(chunks) * 1000
+
+def main():
+    parser = OptionParser(usage=__doc__)
+    parser.add_option("--rows", type="int", default=100,
+        help="Rows in the terminal.  Default: 100")
+    parser.add_option("--cols", type="int", default=200,
+        help="Columns in the terminal.  Default: 200")
+    parser.add_option("--patterns", type="int", default=10,
+        help="Number of sticky patterns.  Default: 10")
+    parser.add_option("--writes", type="int", default=500,
+        help="Number of writes.  Default: 500")
+    options, args = parser.parse_args()
+    print("Milliseconds per write (%sx%s, %s patterns):" % (
+        options.rows, options.cols, options.patterns))
+    print("%-12s %8.3f" % (
+        'legacy', run(legacy_postprocess, options)))
+    print("%-12s %8.3f" % (
+        'incremental', run(termio.BaseMultiplex.postprocess, options)))
+    options.patterns = 0
+    print("%-12s %8.3f" % ('no patterns', run(lambda m: None, options)))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#       Copyright 2013 Liftoff Software Corporation
+#
+
+# Meta
+__author__ = 'Dan McDougall <daniel.mcdougall@liftoffsoftware.com>'
+
+"""
+Measures how much memory an idle terminal uses before and after
+:meth:`terminal.Terminal.hibernate` (and how long hibernating and waking up
+take)::
+
+    python tests/benchmark_hibernate.py --rows=50 --cols=200 --scrollback=500
+
+The terminal is filled with colorful output (so it has plenty of renditions)
+until its scrollback buffer holds *scrollback* lines.
+"""
+
+# Import Python built-ins
+import os, sys, time
+from optparse import OptionParser
+tests_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.abspath(os.path.join(tests_dir, '../')))
+import terminal
+
+def deep_sizeof(obj, seen=None):
+    """
+    Returns the size (in bytes) of *obj* and everything it references
+    (containers and instance dicts).
+    """
+    if seen is None:
+        seen = set()
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        for k, v in obj.items():
+            size += deep_sizeof(k, seen) + deep_sizeof(v, seen)
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        for item in obj:
+            size += deep_sizeof(item, seen)
+    elif isinstance(obj, terminal.Terminal):
+        size += deep_sizeof(obj.__dict__, seen)
+    return size
+
+def fill(term, lines, cols):
+    for i in range(lines):
+        line = u''
+        for col in range(0, cols - 10, 10):
+            line += u'\x1b[%s;%sm%-10s' % (
+                31 + (i + col) % 7, 41 + col % 7, i * col)
+        term.write(line + u'\x1b[0m\r\n')
+
+def main():
+    parser = OptionParser(usage=__doc__)
+    parser.add_option("--rows", type="int", default=50,
+        help="Rows in the terminal.  Default: 50")
+    parser.add_option("--cols", type="int", default=200,
+        help="Columns in the terminal.  Default: 200")
+    parser.add_option("--scrollback", type="int", default=500,
+        help="Lines of scrollback (max 1000).  Default: 500")
+    options, args = parser.parse_args()
+    term = terminal.Terminal(options.rows, options.cols)
+    fill(term, options.scrollback + options.rows, options.cols)
+    awake = deep_sizeof(term)
+    start = time.time()
+    term.hibernate()
+    hibernate_time = time.time() - start
+    hibernating = deep_sizeof(term)
+    start = time.time()
+    term.wake()
+    wake_time = time.time() - start
+    print("Terminal memory (%sx%s, %s lines of scrollback):" % (
+        options.rows, options.cols, len(term.scrollback_buf)))
+    print("%-14s %10.1f KB" % ('awake', awake / 1024.0))
+    print("%-14s %10.1f KB" % ('hibernating', hibernating / 1024.0))
+    print("hibernate(): %0.2fms  wake(): %0.2fms" % (
+        hibernate_time * 1000, wake_time * 1000))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#       Copyright 2013 Liftoff Software Corporation
+#
+
+# Meta
+__author__ = 'Dan McDougall <daniel.mcdougall@liftoffsoftware.com>'
+
+"""
+Measures how long it takes to JSON-encode a terminal screen update (the
+'terminal:termupdate' message) using plain :func:`utils.json_encode` versus
+:func:`utils.json_encode_message` (which caches encoded lines)::
+
+    python tests/benchmark_json.py --rows=50 --cols=200 --refreshes=1000
+
+Three kinds of refreshes are timed:
+
+    * full:  Every line of the screen (e.g. a new client or a shared terminal).
+    * diff:  Only a couple of lines changed (typical typing/output).
+    * viewers:  The same full refresh encoded for 10 viewers.
+"""
+
+# Import Python built-ins
+import os, sys, time
+from optparse import OptionParser
+tests_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.abspath(os.path.join(tests_dir, '../')))
+import utils
+
+def make_screen(rows, cols):
+    """
+    Returns a list of *rows* lines of span-heavy HTML resembling the output of
+    `Terminal.dump_html()`.
+    """
+    screen = []
+    for row in range(rows):
+        line = []
+        for col in range(0, cols, 8):
+            line.append(
+                u'<span class="✈f%s ✈b%s">%s</span>' % (
+                    (row + col) % 8, col % 8, u'x' * 8))
+        screen.append(u''.join(line))
+    return screen
+
+def termupdate(screen):
+    return {
+        'terminal:termupdate': {
+            'term': 1,
+            'scrollback': [],
+            'screen': screen,
+            'ratelimiter': False
+        }
+    }
+
+def timeit(func, message, refreshes):
+    """
+    Returns the average number of microseconds it took to encode *message*
+    with *func* over *refreshes* runs.
+    """
+    start = time.time()
+    for i in range(refreshes):
+        func(message)
+    return (time.time() - start) / refreshes * 1000000
+
+def main():
+    parser = OptionParser(usage=__doc__)
+    parser.add_option("--rows", type="int", default=50,
+        help="Rows in the screen.  Default: 50")
+    parser.add_option("--cols", type="int", default=200,
+        help="Columns in the screen.  Default: 200")
+    parser.add_option("--refreshes", type="int", default=1000,
+        help="Number of refreshes to encode.  Default: 1000")
+    options, args = parser.parse_args()
+    screen = make_screen(options.rows, options.cols)
+    diff = [u''] * len(screen)
+    diff[-2:] = screen[-2:]
+    print("JSON backend: %s" % ('ujson' if utils.fast_json else 'json'))
+    print("Microseconds per refresh (%sx%s screen):" % (
+        options.rows, options.cols))
+    print("%-10s %12s %22s" % ('', 'json_encode', 'json_encode_message'))
+    for name, message, copies in (
+            ('full', termupdate(screen), 1),
+            ('diff', termupdate(diff), 1),
+            ('viewers', termupdate(screen), 10)):
+        def plain(message):
+            for i in range(copies):
+                utils.json_encode(message)
+        def cached(message):
+            for i in range(copies):
+                utils.json_encode_message(message)
+        print("%-10s %12.1f %22.1f" % (
+            name,
+            timeit(plain, message, options.refreshes),
+            timeit(cached, message, options.refreshes)))
+
+if __name__ == "__main__":
+    main()
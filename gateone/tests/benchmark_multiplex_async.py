@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#       Copyright 2013 Liftoff Software Corporation
+#
+
+# Meta
+__author__ = 'Dan McDougall <daniel.mcdougall@liftoffsoftware.com>'
+
+"""
+Drives a bunch of local `sh` processes through a short prompt/response
+exchange using :meth:`termio.BaseMultiplex.expect_async` and
+:meth:`termio.BaseMultiplex.read_until` (all at once, on one IOLoop) and
+compares that to doing the same thing one at a time with the blocking
+:meth:`termio.BaseMultiplex.await`::
+
+    python tests/benchmark_multiplex_async.py --children=200
+
+.. note:: Requires Tornado 3.0+ (for `tornado.gen.coroutine`).
+"""
+
+# Import Python built-ins
+import os, sys, time
+from optparse import OptionParser
+tests_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.abspath(os.path.join(tests_dir, '../')))
+import termio
+
+# 3rd party imports
+from tornado import gen
+from tornado.ioloop import IOLoop
+
+# Simulates something like an SSH login: A delay, a prompt, and a response
+COMMAND = "sh -c 'sleep 0.2; printf \"Password: \"; read x; echo welcome'"
+
+@gen.coroutine
+def converse():
+    with termio.spawn(COMMAND) as m:
+        yield m.expect_async('Password:', preprocess=False)
+        m.writeline(u'secret')
+        output = yield m.read_until('welcome')
+    raise gen.Return(output)
+
+@gen.coroutine
+def run_concurrently(children):
+    results = yield [converse() for i in range(children)]
+    raise gen.Return(results)
+
+def run_serially(children):
+    for i in range(children):
+        m = termio.Multiplex(COMMAND)
+        m.expect('Password:', u'secret\n', preprocess=False)
+        m.expect('welcome', lambda m, matched: None, preprocess=False)
+        m.await(10)
+        m.terminate()
+
+def main():
+    parser = OptionParser(usage=__doc__)
+    parser.add_option("--children", type="int", default=200,
+        help="Number of child processes.  Default: 200")
+    parser.add_option("--serial", type="int", default=20,
+        help="Number of child processes to run serially (for comparison).  "
+             "Default: 20")
+    options, args = parser.parse_args()
+    start = time.time()
+    results = IOLoop.instance().run_sync(
+        lambda: run_concurrently(options.children), timeout=120)
+    elapsed = time.time() - start
+    assert len(results) == options.children
+    print("Concurrent (expect_async): %s children in %0.2fs (%0.1fms each)" % (
+        options.children, elapsed, elapsed / options.children * 1000))
+    start = time.time()
+    run_serially(options.serial)
+    elapsed = time.time() - start
+    print("Serial (await): %s children in %0.2fs (%0.1fms each)" % (
+        options.serial, elapsed, elapsed / options.serial * 1000))
+
+if __name__ == "__main__":
+    main()
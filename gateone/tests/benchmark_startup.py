@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#       Copyright 2013 Liftoff Software Corporation
+#
+
+# Meta
+__author__ = 'Dan McDougall <daniel.mcdougall@liftoffsoftware.com>'
+
+"""
+Measures how long it takes Gate One to go from a cold start to accepting
+connections.  Gate One gets started (with throwaway settings/session/user
+directories) several times and the time until its port accepts a TCP
+connection is recorded.  Exits with a non-zero status if the median is above
+the target so it can be used to keep an eye on startup time::
+
+    python tests/benchmark_startup.py --runs=5 --target=2.0
+
+Run Gate One with --profile_startup to find out where the time is going.
+"""
+
+# Import Python built-ins
+import os, sys, time, socket, signal, shutil, tempfile, subprocess
+from optparse import OptionParser
+
+tests_dir = os.path.dirname(os.path.abspath(__file__))
+GATEONE_PY = os.path.abspath(os.path.join(tests_dir, '../gateone.py'))
+TARGET = 2.0 # Seconds (median cold start to listening)
+
+def free_port():
+    """
+    Returns a TCP port that nothing is listening on (probably).
+    """
+    sock = socket.socket()
+    sock.bind(('127.0.0.1', 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+def time_startup(timeout=30):
+    """
+    Starts Gate One and returns the number of seconds it took before its port
+    accepted a connection.  Returns `None` if that didn't happen within
+    *timeout* seconds.
+    """
+    tempdir = tempfile.mkdtemp(prefix='gateone_benchmark')
+    port = free_port()
+    args = [
+        sys.executable, GATEONE_PY,
+        '--port=%s' % port,
+        '--address=127.0.0.1',
+        '--disable_ssl',
+        '--settings_dir=%s' % os.path.join(tempdir, 'settings'),
+        '--session_dir=%s' % os.path.join(tempdir, 'sessions'),
+        '--user_dir=%s' % os.path.join(tempdir, 'users'),
+        '--pid_file=%s' % os.path.join(tempdir, 'gateone.pid'),
+        '--logging=warning',
+    ]
+    with open(os.devnull, 'w') as devnull:
+        start = time.time()
+        proc = subprocess.Popen(
+            args, cwd=os.path.dirname(GATEONE_PY),
+            stdout=devnull, stderr=devnull)
+        try:
+            while time.time() - start < timeout:
+                if proc.poll() is not None:
+                    return None # Gate One exited (check its output)
+                try:
+                    socket.create_connection(('127.0.0.1', port), 0.1).close()
+                    return time.time() - start
+                except socket.error:
+                    time.sleep(0.01)
+            return None
+        finally:
+            if proc.poll() is None:
+                proc.send_signal(signal.SIGINT)
+                proc.wait()
+            shutil.rmtree(tempdir, ignore_errors=True)
+
+def main():
+    parser = OptionParser(usage=__doc__)
+    parser.add_option("--runs", type="int", default=5,
+        help="Number of times to start Gate One.  Default: 5")
+    parser.add_option("--target", type="float", default=TARGET,
+        help="Fail if the median startup time exceeds this many seconds.  "
+             "Default: %s" % TARGET)
+    options, args = parser.parse_args()
+    results = []
+    for i in range(options.runs):
+        elapsed = time_startup()
+        if elapsed is None:
+            print("Run %s: Gate One did not start" % (i + 1))
+            sys.exit(2)
+        print("Run %s: %.3fs" % (i + 1, elapsed))
+        results.append(elapsed)
+    results.sort()
+    median = results[len(results)//2]
+    print("min: %.3fs  median: %.3fs  max: %.3fs  (target: %.3fs)" % (
+        results[0], median, results[-1], options.target))
+    if median > options.target:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
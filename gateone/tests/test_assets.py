@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#       Copyright 2013 Liftoff Software Corporation
+#
+
+# Meta
+__author__ = 'Dan McDougall <daniel.mcdougall@liftoffsoftware.com>'
+
+"""
+Tests the bundle and rendered style caching in assets.py.
+"""
+
+# Import Python built-ins
+import os, sys, unittest, tempfile, shutil
+tests_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.abspath(os.path.join(tests_dir, '../')))
+import assets
+
+class TestBundles(unittest.TestCase):
+    """
+    Tests for :func:`assets.get_bundle` and :func:`assets.render_style`.
+    """
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp(prefix='gateone_assets')
+        self.cache_dir = os.path.join(self.tempdir, 'cache')
+        self.static_dir = os.path.join(self.tempdir, 'static')
+        os.mkdir(self.static_dir)
+        for name in ('b.js', 'a.js', 'main.js', 'style.css'):
+            with open(os.path.join(self.static_dir, name), 'w') as f:
+                f.write("/* %s */\n" % name)
+        self.renders = 0
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir, ignore_errors=True)
+        assets.invalidate_bundles()
+        assets.STYLES.clear()
+
+    def test_static_files_order(self):
+        paths = assets.static_files(self.static_dir, 'js', first='main.js')
+        self.assertEqual(
+            [os.path.basename(a) for a in paths], ['main.js', 'a.js', 'b.js'])
+
+    def test_bundle(self):
+        paths = assets.static_files(self.static_dir, 'js')
+        bundle = assets.get_bundle(
+            'test', 'js', paths, self.cache_dir, minify=False)
+        self.assertTrue(bundle.filename.startswith('test_'))
+        self.assertTrue(bundle.filename.endswith('.js'))
+        self.assertTrue(b'a.js' in bundle.data and b'b.js' in bundle.data)
+        self.assertTrue(bundle.data.index(b'a.js') < bundle.data.index(b'b.js'))
+        # Same bundle every time until something changes
+        self.assertTrue(assets.get_bundle(
+            'test', 'js', paths, self.cache_dir, minify=False) is bundle)
+        self.assertTrue(assets.BUNDLES_BY_FILENAME[bundle.filename] is bundle)
+
+    def render(self, path, **kwargs):
+        self.renders += 1
+        return "#%(container)s { color: red; }" % kwargs
+
+    def test_render_style(self):
+        path = os.path.join(self.static_dir, 'style.css')
+        style = assets.render_style(
+            'style', path, self.render, minify=False, container='go')
+        self.assertEqual(style.data, b"#go { color: red; }")
+        assets.render_style(
+            'style', path, self.render, minify=False, container='go')
+        self.assertEqual(self.renders, 1) # Served from the cache
+        other = assets.render_style(
+            'style', path, self.render, minify=False, container='other')
+        self.assertEqual(self.renders, 2)
+        self.assertNotEqual(style.filename, other.filename)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,441 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#       Copyright 2013 Liftoff Software Corporation
+#
+
+# Meta
+__author__ = 'Dan McDougall <daniel.mcdougall@liftoffsoftware.com>'
+
+"""
+Tests the bookmarks database, the favicon cache, and the importers in the
+bookmarks plugin (bookmarks.py).
+"""
+
+# Import Python built-ins
+import os, sys, unittest, tempfile, shutil
+from datetime import timedelta
+tests_dir = os.path.dirname(os.path.abspath(__file__))
+gateone_dir = os.path.abspath(os.path.join(tests_dir, '../'))
+sys.path.append(gateone_dir)
+sys.path.append(os.path.join(
+    gateone_dir, 'applications', 'terminal', 'plugins', 'bookmarks'))
+import bookmarks
+
+ICON = b'\x00\x00\x01\x00' + b'\x00' * 60 # Close enough to an .ico
+
+def make_bookmark(url, tags=(), usn=0):
+    return {
+        'url': url,
+        'name': url,
+        'tags': list(tags),
+        'notes': '',
+        'visits': 0,
+        'updated': 1000,
+        'created': 1000,
+        'updateSequenceNum': usn,
+        'images': {}
+    }
+
+# A (trimmed down) Firefox bookmarks.json export:
+FIREFOX_JSON = """{"title": "", "id": 1, "type": "text/x-moz-place-container",
+ "root": "placesRoot", "children": [
+  {"title": "Bookmarks Menu", "type": "text/x-moz-place-container",
+   "children": [
+    {"title": "Gate One", "type": "text/x-moz-place",
+     "uri": "http://liftoffsoftware.com/", "dateAdded": 1370000000000000,
+     "lastModified": 1370000001000000, "annos": [
+      {"name": "bookmarkProperties/description", "value": "Web terminals"}]},
+    {"title": "Empty", "type": "text/x-moz-place-container", "children": []},
+    {"title": "Nested", "type": "text/x-moz-place-container", "children": [
+      {"title": "Python", "type": "text/x-moz-place",
+       "uri": "http://python.org/", "dateAdded": 1370000000000000,
+       "lastModified": 1370000000000000},
+      {"title": "Local", "type": "text/x-moz-place", "uri": "file:///etc/"},
+      {"title": "Recent", "type": "text/x-moz-place",
+       "uri": "place:sort=8&maxResults=10"},
+      {"title": "Separator", "type": "text/x-moz-place-separator"}]},
+    {"title": "Gate One again", "type": "text/x-moz-place",
+     "uri": "http://liftoffsoftware.com/"}]},
+  {"title": "Tags", "type": "text/x-moz-place-container", "children": [
+    {"title": "ssh", "type": "text/x-moz-place-container", "children": [
+      {"title": null, "type": "text/x-moz-place",
+       "uri": "http://liftoffsoftware.com/"}]},
+    {"title": "python", "type": "text/x-moz-place-container", "children": [
+      {"title": null, "type": "text/x-moz-place",
+       "uri": "http://liftoffsoftware.com/"},
+      {"title": null, "type": "text/x-moz-place",
+       "uri": "http://python.org/"}]}]}]}"""
+
+class FakeResponse(object):
+    def __init__(self, body=b'', code=200, content_type='text/html'):
+        self.body = body
+        self.code = code
+        self.error = None
+        if code != 200:
+            self.error = Exception("HTTP %s" % code)
+        self.headers = {'Content-Type': content_type}
+
+class FakeHTTPClient(object):
+    """
+    Stands in for `tornado.httpclient.AsyncHTTPClient`.  Responses are looked up
+    in *pages* (by URL) and, unless *defer* is `True`, delivered right away.
+    """
+    def __init__(self, pages, defer=False):
+        self.pages = pages
+        self.defer = defer
+        self.fetched = [] # Format: [(<url>, <kwargs>), ...]
+        self.deferred = [] # Format: [(<callback>, <response>), ...]
+
+    def fetch(self, url, callback, **kwargs):
+        self.fetched.append((url, kwargs))
+        response = self.pages.get(url, FakeResponse(code=404))
+        if self.defer:
+            self.deferred.append((callback, response))
+        else:
+            callback(response)
+
+    def respond(self):
+        callback, response = self.deferred.pop(0)
+        callback(response)
+
+class TestBookmarksDB(unittest.TestCase):
+    """
+    Tests for :class:`bookmarks.BookmarksDB`.
+    """
+    def setUp(self):
+        self.user_dir = tempfile.mkdtemp(prefix='bookmarks')
+        os.mkdir(os.path.join(self.user_dir, 'bob'))
+        self.db = bookmarks.BookmarksDB(self.user_dir, 'bob')
+
+    def tearDown(self):
+        shutil.rmtree(self.user_dir)
+        bookmarks.BOOKMARK_DBS.clear()
+
+    def assertConsistent(self, db):
+        """
+        Checks *db*'s indexes against what they'd be if they were built from
+        scratch.
+        """
+        self.assertEqual(db.usn_index, sorted(
+            (bm['updateSequenceNum'], url) for url, bm in db.bookmarks.items()))
+        tags = {}
+        for url, bm in db.bookmarks.items():
+            self.assertEqual(bm['url'], url)
+            for tag in bm['tags']:
+                tags.setdefault(tag, set()).add(url)
+        self.assertEqual(db.tags, tags)
+
+    def assertSameDB(self, db1, db2):
+        self.assertEqual(db1.bookmarks, db2.bookmarks)
+        self.assertEqual(db1.usn_index, db2.usn_index)
+        self.assertEqual(db1.tags, db2.tags)
+
+    def populate(self):
+        self.db.sync_bookmarks([
+            make_bookmark('http://a.com/', ['Work', 'News']),
+            make_bookmark('http://b.com/', ['News']),
+            make_bookmark('ssh://c', ['Servers']),
+        ])
+
+    def test_lookups(self):
+        self.populate()
+        self.assertEqual(
+            sorted(self.db.bookmarks), ['http://a.com/', 'http://b.com/', 'ssh://c'])
+        self.assertEqual(self.db.get_highest_USN(), 3)
+        self.assertEqual(
+            [bm['url'] for bm in self.db.get_bookmarks()],
+            ['http://a.com/', 'http://b.com/', 'ssh://c'])
+        self.assertEqual(
+            [bm['url'] for bm in self.db.get_bookmarks(2)], ['ssh://c'])
+        self.assertEqual(self.db.get_bookmarks(3), [])
+        self.assertEqual(
+            self.db.tags['News'], set(['http://a.com/', 'http://b.com/']))
+        self.assertEqual(self.db.tags['Servers'], set(['ssh://c']))
+        self.assertConsistent(self.db)
+
+    def test_sync_conflicts(self):
+        self.populate()
+        # The client has an older version; it gets the server's
+        updates = self.db.sync_bookmarks([make_bookmark('http://a.com/', usn=0)])
+        self.assertEqual([bm['url'] for bm in updates], ['http://a.com/'])
+        self.assertEqual(updates[0]['tags'], ['Work', 'News'])
+        # The client has a newer version; it replaces the server's
+        updates = self.db.sync_bookmarks(
+            [make_bookmark('http://b.com/', ['Other'], usn=10)])
+        self.assertEqual(updates, [])
+        self.assertEqual(self.db.bookmarks['http://b.com/']['tags'], ['Other'])
+        self.assertEqual(
+            self.db.bookmarks['http://b.com/']['updateSequenceNum'], 4)
+        self.assertEqual(self.db.tags['News'], set(['http://a.com/']))
+        self.assertEqual(
+            [bm['url'] for bm in self.db.get_bookmarks(3)], ['http://b.com/'])
+        self.assertConsistent(self.db)
+
+    def test_rename_tag(self):
+        self.populate()
+        self.db.rename_tag('News', 'Reading')
+        self.assertFalse('News' in self.db.tags)
+        self.assertEqual(
+            self.db.tags['Reading'], set(['http://a.com/', 'http://b.com/']))
+        self.assertEqual(
+            self.db.bookmarks['http://a.com/']['tags'], ['Work', 'Reading'])
+        # Renamed bookmarks get new USNs so clients pick up the change
+        self.assertEqual(
+            sorted(bm['url'] for bm in self.db.get_bookmarks(3)),
+            ['http://a.com/', 'http://b.com/'])
+        self.db.rename_tag('Nonexistent', 'Whatever')
+        self.assertEqual(self.db.get_highest_USN(), 5)
+        self.assertConsistent(self.db)
+
+    def test_delete(self):
+        self.populate()
+        self.db.delete_bookmark(make_bookmark('http://b.com/'))
+        self.assertFalse('http://b.com/' in self.db.bookmarks)
+        self.assertEqual(self.db.tags['News'], set(['http://a.com/']))
+        deleted = self.db.bookmarks[bookmarks.DELETED_URL]
+        self.assertEqual([bm['url'] for bm in deleted['notes']], ['http://b.com/'])
+        self.db.delete_bookmark(make_bookmark('ssh://c'))
+        self.assertFalse('Servers' in self.db.tags) # Last one with that tag
+        deleted = self.db.bookmarks[bookmarks.DELETED_URL]
+        self.assertEqual(
+            [bm['url'] for bm in deleted['notes']], ['http://b.com/', 'ssh://c'])
+        self.assertEqual(
+            [bm['url'] for bm in self.db.get_bookmarks(3)],
+            [bookmarks.DELETED_URL])
+        # Deleting something that isn't there doesn't change anything
+        highest_USN = self.db.get_highest_USN()
+        self.db.delete_bookmark(make_bookmark('http://nope.com/'))
+        self.assertEqual(self.db.get_highest_USN(), highest_USN)
+        self.assertConsistent(self.db)
+
+    def test_journal_replay(self):
+        self.populate()
+        self.db.delete_bookmark(make_bookmark('http://b.com/'))
+        self.db.rename_tag('Work', 'Job')
+        # Everything so far is in the journal; bookmarks.json is still empty
+        with open(self.db.bookmarks_path) as f:
+            self.assertEqual(f.read(), '[]')
+        self.assertEqual(self.db.journal_entries, 6)
+        db2 = bookmarks.BookmarksDB(self.user_dir, 'bob')
+        self.assertSameDB(self.db, db2)
+        self.assertConsistent(db2)
+        self.assertEqual(db2.journal_entries, 6)
+        # Changes made after the restart get appended (incrementally)
+        db2.sync_bookmarks([make_bookmark('http://d.com/', ['Job'])])
+        self.assertEqual(db2.journal_entries, 7)
+        # A partially-written line (e.g. a crash) gets skipped
+        with open(db2.journal_path, 'a') as f:
+            f.write('{"put": {"url": "http://e.c')
+        db3 = bookmarks.BookmarksDB(self.user_dir, 'bob')
+        self.assertSameDB(db2, db3)
+        self.assertEqual(
+            db3.tags['Job'], set(['http://a.com/', 'http://d.com/']))
+
+    def test_journal_compaction(self):
+        old_limit = bookmarks.JOURNAL_MIN_ENTRIES
+        bookmarks.JOURNAL_MIN_ENTRIES = 5
+        try:
+            self.populate()
+            self.assertTrue(os.path.exists(self.db.journal_path))
+            self.db.rename_tag('News', 'Reading') # 5 entries in the journal
+            self.db.delete_bookmark(make_bookmark('ssh://c')) # Too many
+        finally:
+            bookmarks.JOURNAL_MIN_ENTRIES = old_limit
+        self.assertFalse(os.path.exists(self.db.journal_path))
+        self.assertEqual(self.db.journal_entries, 0)
+        db2 = bookmarks.BookmarksDB(self.user_dir, 'bob')
+        self.assertSameDB(self.db, db2)
+        self.assertConsistent(db2)
+
+    def test_changed_on_disk(self):
+        db = bookmarks.get_bookmarks_db(self.user_dir, 'bob')
+        self.assertTrue(bookmarks.get_bookmarks_db(self.user_dir, 'bob') is db)
+        # Something else (e.g. another server process) modifies the bookmarks
+        other = bookmarks.BookmarksDB(self.user_dir, 'bob')
+        other.sync_bookmarks([make_bookmark('http://a.com/')])
+        db2 = bookmarks.get_bookmarks_db(self.user_dir, 'bob')
+        self.assertFalse(db2 is db)
+        self.assertTrue('http://a.com/' in db2.bookmarks)
+
+class TestFaviconCache(unittest.TestCase):
+    """
+    Tests for :class:`bookmarks.FaviconCache`.
+    """
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp(prefix='favicons')
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir)
+
+    def test_fetch(self):
+        client = FakeHTTPClient({
+            'http://a.com/page': FakeResponse(
+                b'<link rel="icon" type="image/png" href="/i.png">'),
+            'http://a.com/i.png': FakeResponse(ICON, content_type='image/png'),
+        })
+        cache = bookmarks.FaviconCache(http_client=client, timeout=2.5)
+        results = []
+        cache.fetch('http://a.com/page', results.append)
+        self.assertEqual(len(results), 1)
+        self.assertTrue(results[0].startswith('data:image/png;base64,'))
+        self.assertEqual(
+            [url for url, kwargs in client.fetched],
+            ['http://a.com/page', 'http://a.com/i.png'])
+        # Fetches are time limited
+        for url, kwargs in client.fetched:
+            self.assertEqual(kwargs['connect_timeout'], 2.5)
+            self.assertEqual(kwargs['request_timeout'], 2.5)
+        # Served from the cache for any URL with the same origin
+        cache.fetch('http://A.com/other', results.append)
+        self.assertEqual(results[1], results[0])
+        self.assertEqual(len(client.fetched), 2)
+
+    def test_falls_back_to_favicon_ico(self):
+        client = FakeHTTPClient({
+            'http://a.com/': FakeResponse(b'<html></html>'),
+            'http://a.com/favicon.ico': FakeResponse(
+                ICON, content_type='image/x-icon'),
+        })
+        cache = bookmarks.FaviconCache(http_client=client)
+        results = []
+        cache.fetch('http://a.com/', results.append)
+        self.assertTrue(results[0].startswith('data:image/x-icon;base64,'))
+
+    def test_lru_eviction(self):
+        uri = 'data:image/png;base64,' + 'A' * 100
+        entry_size = len('http://a.com') + len(uri)
+        cache = bookmarks.FaviconCache(max_size=entry_size * 2)
+        cache.set('http://a.com', uri)
+        cache.set('http://b.com', uri)
+        self.assertEqual(cache.get('http://a.com'), (True, uri)) # Touch it
+        cache.set('http://c.com', uri) # Evicts b.com (least recently used)
+        self.assertEqual(list(cache.entries), ['http://a.com', 'http://c.com'])
+        self.assertEqual(cache.get('http://b.com'), (False, None))
+        self.assertEqual(cache.size, entry_size * 2)
+
+    def test_size_limit(self):
+        # Something bigger than max_size still gets cached (on its own)
+        cache = bookmarks.FaviconCache(max_size=10)
+        cache.set('http://a.com', 'data:image/png;base64,AAAA')
+        cache.set('http://b.com', 'data:image/png;base64,BBBB')
+        self.assertEqual(list(cache.entries), ['http://b.com'])
+        # Icons bigger than MAX_FAVICON_SIZE are ignored
+        client = FakeHTTPClient({
+            'http://big.com/': FakeResponse(
+                b'<link rel="icon" href="/huge.png">'),
+            'http://big.com/huge.png': FakeResponse(
+                b'\x00' * (bookmarks.MAX_FAVICON_SIZE + 1),
+                content_type='image/png'),
+        })
+        cache = bookmarks.FaviconCache(http_client=client)
+        results = []
+        cache.fetch('http://big.com/', results.append)
+        self.assertEqual(results, [None])
+        self.assertEqual(client.fetched[-1][0], 'http://big.com/favicon.ico')
+
+    def test_ttl_expiry(self):
+        cache = bookmarks.FaviconCache(
+            cache_dir=self.cache_dir, ttl=timedelta(seconds=0))
+        cache.set('http://a.com', 'data:image/png;base64,AAAA')
+        self.assertEqual(len(os.listdir(self.cache_dir)), 1)
+        self.assertEqual(cache.get('http://a.com'), (False, None))
+        self.assertEqual(cache.size, 0)
+        # Expired icons get pruned from the cache_dir at startup
+        bookmarks.FaviconCache(cache_dir=self.cache_dir)
+        self.assertEqual(os.listdir(self.cache_dir), [])
+
+    def test_persistence(self):
+        uri = 'data:image/png;base64,AAAA'
+        cache = bookmarks.FaviconCache(cache_dir=self.cache_dir)
+        cache.set('http://a.com', uri)
+        cache = bookmarks.FaviconCache(cache_dir=self.cache_dir)
+        self.assertEqual(cache.entries, {})
+        self.assertEqual(cache.get('http://a.com'), (True, uri))
+        self.assertTrue('http://a.com' in cache.entries)
+
+    def test_negative_caching(self):
+        client = FakeHTTPClient({}) # Everything is a 404
+        cache = bookmarks.FaviconCache(
+            http_client=client, cache_dir=self.cache_dir,
+            negative_ttl=timedelta(hours=1))
+        results = []
+        cache.fetch('http://broken.com/', results.append)
+        self.assertEqual(results, [None])
+        fetches = len(client.fetched)
+        cache.fetch('http://broken.com/foo', results.append)
+        self.assertEqual(results, [None, None])
+        self.assertEqual(len(client.fetched), fetches) # Not fetched again
+        self.assertEqual(cache.get('http://broken.com'), (True, None))
+        # Negative entries expire on their own schedule
+        cache = bookmarks.FaviconCache(
+            http_client=client, negative_ttl=timedelta(seconds=0))
+        cache.fetch('http://broken.com/', results.append)
+        self.assertEqual(cache.get('http://broken.com'), (False, None))
+
+    def test_concurrent_fetches(self):
+        client = FakeHTTPClient({}, defer=True)
+        cache = bookmarks.FaviconCache(http_client=client, max_fetches=1)
+        results = []
+        cache.fetch('http://a.com/1', results.append)
+        cache.fetch('http://a.com/2', results.append) # Shares the first fetch
+        cache.fetch('http://b.com/', results.append) # Has to wait its turn
+        self.assertEqual(
+            [url for url, kwargs in client.fetched], ['http://a.com/1'])
+        while client.deferred:
+            client.respond()
+        self.assertEqual(results, [None, None, None])
+        self.assertEqual(
+            [url for url, kwargs in client.fetched], [
+                'http://a.com/1', 'http://a.com/favicon.ico',
+                'http://b.com/', 'http://b.com/favicon.ico'])
+        self.assertEqual(cache.fetching, 0)
+
+    def test_not_http(self):
+        client = FakeHTTPClient({})
+        cache = bookmarks.FaviconCache(http_client=client)
+        results = []
+        cache.fetch('ssh://user@host', results.append)
+        self.assertEqual(results, [None])
+        self.assertEqual(client.fetched, [])
+
+class TestImportJSON(unittest.TestCase):
+    """
+    Tests for :func:`bookmarks.iter_bookmarks_json`.
+    """
+    def test_firefox(self):
+        results = list(bookmarks.iter_bookmarks_json(FIREFOX_JSON))
+        bms = [bm for bm, offset in results]
+        self.assertEqual(
+            [bm['url'] for bm in bms],
+            ['http://liftoffsoftware.com/', 'http://python.org/'])
+        self.assertEqual(bms[0]['name'], u'Gate One')
+        self.assertEqual(bms[0]['notes'], u'Web terminals')
+        self.assertEqual(bms[0]['tags'], [u'ssh', u'python'])
+        self.assertEqual(bms[0]['created'], 1370000000000)
+        self.assertEqual(bms[0]['updated'], 1370000001000)
+        self.assertEqual(bms[1]['tags'], [u'python'])
+        # Offsets point just past each bookmark
+        for bm, offset in results:
+            self.assertTrue(
+                FIREFOX_JSON.rindex(bm['url'], 0, offset) > offset - 200)
+
+    def test_objects(self):
+        objs = list(bookmarks.iter_json_objects(FIREFOX_JSON))
+        titles, obj, offset = objs[0]
+        self.assertEqual(titles, [u'', u'Bookmarks Menu'])
+        self.assertEqual(obj['title'], u'Gate One')
+        titles, obj, offset = objs[-1] # The root comes last
+        self.assertEqual(titles, [])
+        self.assertEqual(obj['root'], u'placesRoot')
+        self.assertFalse('children' in obj)
+        self.assertEqual(offset, len(FIREFOX_JSON))
+
+    def test_invalid(self):
+        for json_str in ('', '[]', '{"children": [{"title": "foo"}',
+                '{"children" []}'):
+            self.assertRaises(
+                ValueError, list, bookmarks.iter_bookmarks_json(json_str))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#       Copyright 2013 Liftoff Software Corporation
+#
+
+# Meta
+__author__ = 'Dan McDougall <daniel.mcdougall@liftoffsoftware.com>'
+
+"""
+Tests the header parsing and sizing functions and the worker pool in media.py.
+"""
+
+# Import Python built-ins
+import os, sys, time, struct, socket, unittest
+tests_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.abspath(os.path.join(tests_dir, '../')))
+import media
+import tornado.ioloop
+
+def fake_png(width, height):
+    return (b'\x89PNG\r\n\x1a\n' + struct.pack('>I', 13) + b'IHDR' +
+        struct.pack('>II', width, height) + b'\x08\x02\x00\x00\x00')
+
+def fake_jpeg(width, height):
+    app0 = b'\xff\xe0' + struct.pack('>H', 16) + b'JFIF\x00' + b'\x00' * 9
+    sof0 = (b'\xff\xc0' + struct.pack('>HBHH', 17, 8, height, width) +
+        b'\x00' * 10)
+    return b'\xff\xd8' + app0 + sof0
+
+class TestMedia(unittest.TestCase):
+    """
+    Tests for :func:`media.image_dimensions` and :func:`media.fit_dimensions`.
+    """
+    def test_image_dimensions(self):
+        self.assertEqual(media.image_dimensions(fake_png(800, 600)), (800, 600))
+        self.assertEqual(media.image_dimensions(fake_jpeg(320, 200)), (320, 200))
+        self.assertEqual(media.image_dimensions(b'GIF89a'), None)
+        self.assertEqual(media.image_dimensions(b'\xff\xd8\x00garbage'), None)
+
+    def test_fit_dimensions(self):
+        self.assertEqual(media.fit_dimensions((100, 50)), (100, 50))
+        self.assertEqual(media.fit_dimensions((1280, 480)), (640, 240))
+        self.assertEqual(media.fit_dimensions((480, 960)), (240, 480))
+
+class TestMediaPool(unittest.TestCase):
+    """
+    Tests for :class:`media.MediaPool` (using real worker processes).
+    """
+    def setUp(self):
+        # A listening socket like Gate One's own:
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sock.bind(('127.0.0.1', 0))
+        self.sock.listen(5)
+        self.io_loop = tornado.ioloop.IOLoop()
+        self.pool = media.MediaPool(
+            processes=2, io_loop=self.io_loop, per_user=1)
+        self.results = []
+
+    def tearDown(self):
+        self.pool.close()
+        self.sock.close()
+        self.io_loop.close()
+
+    def run_jobs(self, jobs, user='bob'):
+        """
+        Submits *jobs* (a list of `(func, args)`) and runs the IOLoop until
+        they've all finished.  Returns the results in the order they finished.
+        """
+        def callback(result):
+            self.results.append(result)
+            if len(self.results) == len(jobs):
+                self.io_loop.stop()
+        for func, args in jobs:
+            self.pool.submit(func, args, callback, user=user)
+        timeout = self.io_loop.add_timeout(
+            time.time() + 10, self.io_loop.stop)
+        self.io_loop.start()
+        self.io_loop.remove_timeout(timeout)
+        return self.results
+
+    def test_submit(self):
+        # More jobs than per_user so some have to wait their turn
+        results = self.run_jobs([
+            (media.image_dimensions, (fake_png(800, 600),)),
+            (media.image_dimensions, (fake_jpeg(320, 200),)),
+            (media.fit_dimensions, ((1280, 480),)),
+        ])
+        self.assertEqual(sorted(results), [(320, 200), (640, 240), (800, 600)])
+        self.assertEqual(self.pool.running, {})
+        self.assertEqual(self.pool.waiting, {})
+
+    def test_worker_errors(self):
+        # Exceptions in workers turn into None instead of lost callbacks
+        results = self.run_jobs([(media.fit_dimensions, (None,))])
+        self.assertEqual(results, [None])
+
+    def test_inherited_fds_closed(self):
+        # The workers must not hold onto the server's listening socket...
+        results = self.run_jobs([(os.fstat, (self.sock.fileno(),))] * 2)
+        self.assertEqual(results, [None, None])
+        # ...so that once the pool and the socket are closed the port can be
+        # bound again (e.g. by a re-exec'd Gate One)
+        port = self.sock.getsockname()[1]
+        self.pool.close()
+        self.sock.close()
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.sock.bind(('127.0.0.1', port))
+        self.sock.listen(5)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,170 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#       Copyright 2013 Liftoff Software Corporation
+#
+
+# Meta
+__author__ = 'Dan McDougall <daniel.mcdougall@liftoffsoftware.com>'
+
+"""
+Tests the command execution and process tracking functions in processes.py
+(and the :func:`utils.shell_command` wrapper around them).
+"""
+
+# Import Python built-ins
+import os, sys, time, signal, unittest
+from datetime import timedelta
+from subprocess import Popen
+tests_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.abspath(os.path.join(tests_dir, '../')))
+import processes
+import utils
+import tornado.ioloop
+
+class TestRun(unittest.TestCase):
+    """
+    Tests for :func:`processes.run`.
+    """
+    def test_output(self):
+        stdout, stderr, exitstatus = processes.run(
+            ['sh', '-c', 'echo out; echo err >&2; exit 3'])
+        self.assertEqual(stdout, u'out\n')
+        self.assertEqual(stderr, u'err\n')
+        self.assertEqual(exitstatus, 3)
+
+    def test_max_output(self):
+        stdout = processes.run(['yes'], timeout=0.5, max_output=1000)[0]
+        self.assertEqual(len(stdout), 1000)
+
+    def test_timeout_kills_group(self):
+        # The background sleep inherits stdout so if only the shell got killed
+        # run() would wait for the sleep to finish.
+        start = time.time()
+        stdout, stderr, exitstatus = processes.run(
+            'sleep 30 & sleep 30', timeout=timedelta(milliseconds=300),
+            shell=True)
+        self.assertTrue(time.time() - start < 5)
+        self.assertEqual(exitstatus, None)
+        self.assertTrue(stderr.startswith(u'Timeout'))
+
+    def test_missing_command(self):
+        stdout, stderr, exitstatus = processes.run(['/nonexistent/command'])
+        self.assertEqual(exitstatus, None)
+        self.assertTrue(stderr.startswith(u'Could not execute'))
+
+    def test_stats(self):
+        processes.STATS.pop('true', None)
+        processes.run(['true'])
+        processes.run(['true'])
+        self.assertEqual(processes.STATS['true']['calls'], 2)
+        self.assertEqual(processes.STATS['true']['failures'], 0)
+        self.assertTrue('true' in processes.stats_report())
+
+class TestRunAsync(unittest.TestCase):
+    """
+    Tests for :func:`processes.run_async` (using its own IOLoop).
+    """
+    def setUp(self):
+        self.io_loop = tornado.ioloop.IOLoop()
+        self.runner = processes.ProcessRunner(io_loop=self.io_loop)
+        self.results = []
+
+    def tearDown(self):
+        self.runner.close()
+        self.io_loop.close()
+
+    def callback(self, *result):
+        self.results.append(result)
+        self.io_loop.stop()
+
+    def execute(self, args, **kwargs):
+        self.runner.execute(args, self.callback, **kwargs)
+        # In case the callback never gets called:
+        self.io_loop.add_timeout(time.time() + 10, self.io_loop.stop)
+        self.io_loop.start()
+        return self.results[0]
+
+    def test_within_timeout(self):
+        # Numbers are seconds (not a deadline)
+        start = time.time()
+        result = self.execute(['sh', '-c', 'sleep 0.3; echo done'], timeout=5)
+        self.assertEqual(result, (u'done\n', u'', 0))
+        self.assertTrue(time.time() - start >= 0.3)
+
+    def test_within_timedelta(self):
+        result = self.execute(
+            ['sh', '-c', 'sleep 0.3; echo done'], timeout=timedelta(seconds=5))
+        self.assertEqual(result, (u'done\n', u'', 0))
+
+    def test_timeout(self):
+        start = time.time()
+        stdout, stderr, exitstatus = self.execute(['sleep', '30'], timeout=0.3)
+        self.assertTrue(0.3 <= time.time() - start < 5)
+        self.assertEqual(exitstatus, None)
+        self.assertTrue(stderr.startswith(u'Timeout'))
+
+class TestProcessTree(unittest.TestCase):
+    """
+    Tests for :func:`processes.process_table`, :func:`processes.process_tree`,
+    and :func:`processes.signal_tree`.
+    """
+    def setUp(self):
+        # A shell with two children (the sleeps) in its own process group
+        self.proc = Popen(
+            ['sh', '-c', 'sleep 30 & sleep 30 & wait'], preexec_fn=os.setsid)
+        for i in range(100): # Wait for the sleeps to start
+            table = processes.process_table()
+            if len(processes.process_tree(self.proc.pid, table)) == 3:
+                break
+            time.sleep(0.05)
+
+    def tearDown(self):
+        try:
+            os.killpg(self.proc.pid, signal.SIGKILL)
+        except OSError:
+            pass
+        self.proc.wait()
+
+    def test_process_table(self):
+        table = processes.process_table()
+        ppid, pgid, cmdline = table[self.proc.pid]
+        self.assertEqual(ppid, os.getpid())
+        self.assertEqual(pgid, self.proc.pid)
+        self.assertTrue('sleep 30 & sleep 30' in cmdline)
+
+    def test_process_tree(self):
+        table = processes.process_table()
+        tree = processes.process_tree(self.proc.pid, table)
+        self.assertEqual(tree[0], self.proc.pid)
+        self.assertEqual(len(tree), 3)
+        for pid in tree[1:]:
+            self.assertEqual(table[pid][0], self.proc.pid)
+            self.assertTrue(table[pid][2].startswith('sleep'))
+
+    def test_signal_tree(self):
+        tree = processes.signal_tree(self.proc.pid, signal.SIGKILL)
+        self.proc.wait()
+        for i in range(100): # The sleeps get reaped by init
+            table = processes.process_table()
+            if not [pid for pid in tree if pid in table]:
+                break
+            time.sleep(0.05)
+        self.assertEqual([pid for pid in tree if pid in table], [])
+
+    def test_parse_ps(self):
+        self.assertEqual(
+            processes.parse_ps(" 1   0   1 /sbin/init\n 42  1  42 sh -c x\n"),
+            {1: (0, 1, '/sbin/init'), 42: (1, 42, 'sh -c x')})
+
+class TestShellCommand(unittest.TestCase):
+    """
+    Tests for :func:`utils.shell_command`.
+    """
+    def test_shell_command(self):
+        self.assertEqual(
+            utils.shell_command('echo foo; echo bar >&2'), (0, 'foo\nbar'))
+        self.assertEqual(utils.shell_command('sleep 5', 0.2)[0], 255)
+
+if __name__ == "__main__":
+    unittest.main()
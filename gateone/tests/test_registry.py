@@ -0,0 +1,247 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#       Copyright 2013 Liftoff Software Corporation
+#
+
+# Meta
+__author__ = 'Dan McDougall <daniel.mcdougall@liftoffsoftware.com>'
+
+"""
+Tests the session registry backends in registry.py.
+"""
+
+# Import Python built-ins
+import os, sys, unittest, tempfile, shutil, time, sqlite3, Cookie
+tests_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.abspath(os.path.join(tests_dir, '../')))
+import registry
+import tornado.web, tornado.ioloop, tornado.websocket, tornado.httpserver
+import tornado.netutil
+
+class TestLocalRegistry(unittest.TestCase):
+    """
+    Tests for :class:`registry.LocalSessionRegistry`.
+    """
+    def setUp(self):
+        self.reg = registry.get_registry('local', 'node1', node_url='ws://a')
+        self.reg.register_node()
+
+    def test_claim_and_release(self):
+        owner = self.reg.claim_session('sess1', upn='bob')
+        self.assertTrue(self.reg.is_local(owner))
+        self.reg.claim_terminal('sess1', 'default', 1)
+        self.reg.add_share('share1', 'sess1', 'default', 1)
+        self.assertEqual(self.reg.terminals('sess1'), [('default', 1, 'node1')])
+        self.assertEqual(self.reg.share_owner('share1')['node_id'], 'node1')
+        self.reg.release_session('sess1')
+        self.assertEqual(self.reg.session_owner('sess1'), None)
+        self.assertEqual(self.reg.terminals('sess1'), [])
+        self.assertEqual(self.reg.share_owner('share1'), None)
+
+    def test_unknown_backend(self):
+        self.assertRaises(ValueError, registry.get_registry, 'nope', 'node1')
+
+class TestSQLiteRegistry(unittest.TestCase):
+    """
+    Tests for :class:`registry.SQLiteSessionRegistry` using two nodes that
+    share the same database (i.e. a two-node cluster).
+    """
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp(prefix='gateone_registry')
+        path = os.path.join(self.tempdir, 'registry.db')
+        self.node1 = registry.get_registry(
+            'sqlite', 'node1', node_url='ws://a', node_timeout=30, path=path)
+        self.node2 = registry.get_registry(
+            'sqlite', 'node2', node_url='ws://b', node_timeout=30, path=path)
+        self.node1.register_node()
+        self.node2.register_node()
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir, ignore_errors=True)
+
+    def test_ownership_is_shared(self):
+        owner = self.node1.claim_session('sess1', upn='bob')
+        self.assertTrue(self.node1.is_local(owner))
+        # node2 must not be able to steal a session owned by a live node
+        owner = self.node2.claim_session('sess1', upn='bob')
+        self.assertEqual(owner['node_id'], 'node1')
+        self.assertEqual(owner['url'], 'ws://a')
+        self.node1.claim_terminal('sess1', 'default', 1)
+        self.node1.add_share('share1', 'sess1', 'default', 1)
+        self.assertEqual(
+            self.node2.terminals('sess1'), [('default', 1, 'node1')])
+        self.assertEqual(self.node2.share_owner('share1')['node_id'], 'node1')
+        self.assertEqual(len(self.node2.nodes()), 2)
+
+    def test_dead_node_takeover(self):
+        self.node1.claim_session('sess1')
+        self.node1.claim_terminal('sess1', 'default', 1)
+        # Pretend node1 stopped sending heartbeats a while ago
+        self.node1.db.execute(
+            "UPDATE nodes SET heartbeat = ? WHERE node_id = 'node1'",
+            (time.time() - 60,))
+        self.assertEqual(self.node2.session_owner('sess1'), None)
+        owner = self.node2.claim_session('sess1')
+        self.assertTrue(self.node2.is_local(owner))
+        self.assertEqual(self.node2.terminals('sess1'), [])
+
+    def test_unregister_node(self):
+        self.node1.claim_session('sess1')
+        self.node1.unregister_node()
+        self.assertEqual(self.node2.session_owner('sess1'), None)
+        self.assertEqual([a['node_id'] for a in self.node2.nodes()], ['node2'])
+
+    def test_locked_database(self):
+        self.node1.claim_session('sess1')
+        # Some other node is in the middle of a (long) write
+        other = sqlite3.connect(self.node1.path, isolation_level=None)
+        other.execute("BEGIN EXCLUSIVE")
+        start = time.time()
+        try:
+            # Nothing may block the IOLoop for long or raise
+            self.node2.register_node()
+            # ...and nobody gets a session they can't be sure is theirs
+            self.assertEqual(self.node2.claim_session('sess2'), None)
+            self.assertEqual(self.node2.session_owner('sess1'), None)
+            self.assertEqual(self.node2.claim_terminal('sess2', 'default', 1),
+                None)
+            self.assertEqual(self.node2.terminals('sess1'), [])
+            self.assertEqual(self.node2.nodes(), [])
+        finally:
+            other.execute("ROLLBACK")
+            other.close()
+        self.assertTrue(time.time() - start < 5)
+        # Back to normal once the lock is released
+        self.assertEqual(
+            self.node2.session_owner('sess1')['node_id'], 'node1')
+        owner = self.node2.claim_session('sess2')
+        self.assertTrue(self.node2.is_local(owner))
+
+class EchoHandler(tornado.websocket.WebSocketHandler):
+    """
+    Sends back every message it receives (and the Cookie header it got when
+    asked for 'cookie').
+    """
+    def on_message(self, message):
+        if message == 'cookie':
+            message = self.request.headers.get('Cookie', '')
+        elif message == 'close':
+            self.close()
+            return
+        self.write_message(message)
+
+class TestUpstreamConnection(unittest.TestCase):
+    """
+    Tests :class:`registry.UpstreamConnection` against a Tornado WebSocket
+    server.
+    """
+    def setUp(self):
+        self.io_loop = tornado.ioloop.IOLoop()
+        app = tornado.web.Application([(r'/ws', EchoHandler)])
+        self.server = tornado.httpserver.HTTPServer(app, io_loop=self.io_loop)
+        sockets = tornado.netutil.bind_sockets(0, '127.0.0.1')
+        self.port = sockets[0].getsockname()[1]
+        self.server.add_sockets(sockets)
+        self.messages = []
+        self.events = []
+
+    def tearDown(self):
+        self.server.stop()
+        self.io_loop.close(all_fds=True)
+
+    def connect(self, path='/ws', headers={}):
+        conn = registry.UpstreamConnection(
+            'ws://127.0.0.1:%s%s' % (self.port, path), headers,
+            on_message=self.on_message,
+            on_close=lambda: self.stop('closed'),
+            io_loop=self.io_loop)
+        conn.connect(lambda: self.stop('connected'))
+        return conn
+
+    def on_message(self, message):
+        self.messages.append(message)
+        self.stop('message')
+
+    def stop(self, event):
+        self.events.append(event)
+        self.io_loop.stop()
+
+    def wait(self, seconds=5):
+        timeout = self.io_loop.add_timeout(
+            time.time() + seconds, lambda: self.stop('timeout'))
+        self.io_loop.start()
+        self.io_loop.remove_timeout(timeout)
+        return self.events[-1]
+
+    def test_messages(self):
+        conn = self.connect(headers={'Cookie': 'gateone_user="foo"'})
+        self.assertEqual(self.wait(), 'connected')
+        # Each size of frame length (7-bit, 16-bit, and 64-bit)
+        for message in (u'{"go:ping": 1}', u'\u2713' * 100, u'x' * 70000):
+            conn.write_message(message)
+            self.assertEqual(self.wait(), 'message')
+            self.assertEqual(self.messages[-1], message)
+        conn.write_message('cookie')
+        self.wait()
+        self.assertEqual(self.messages[-1], 'gateone_user="foo"')
+        conn.write_message('close') # Upstream closes the connection
+        self.assertEqual(self.wait(), 'closed')
+
+    def test_close(self):
+        conn = self.connect()
+        self.assertEqual(self.wait(), 'connected')
+        conn.close()
+        self.assertEqual(self.wait(0.5), 'timeout') # on_close isn't called
+
+    def test_refused(self):
+        self.connect(path='/nope') # 404
+        self.assertEqual(self.wait(), 'closed')
+        # Nothing listening at all
+        sock = tornado.netutil.bind_sockets(0, '127.0.0.1')[0]
+        self.port = sock.getsockname()[1]
+        sock.close()
+        self.connect()
+        self.assertEqual(self.wait(), 'closed')
+
+class TestProxyHeaders(unittest.TestCase):
+    """
+    Tests for :func:`registry.proxy_headers`.
+    """
+    secret = 'shared_cookie_secret'
+
+    def test_headers(self):
+        headers = registry.proxy_headers({
+            'Origin': 'https://gateone.example.com',
+            'Cookie': 'a=b',
+            'Host': 'node1:443',
+            'Sec-WebSocket-Key': 'xxx',
+        }, '10.0.0.5')
+        self.assertEqual(headers, {
+            'Origin': 'https://gateone.example.com',
+            'Cookie': 'a=b',
+            'X-Forwarded-For': '10.0.0.5',
+        })
+        headers = registry.proxy_headers(
+            {'X-Forwarded-For': '192.168.1.9'}, '10.0.0.5')
+        self.assertEqual(headers['X-Forwarded-For'], '192.168.1.9, 10.0.0.5')
+
+    def test_cookie_auth(self):
+        # The client authenticated with node1 (cookie-based auth)...
+        user = '{"upn": "bob@EXAMPLE.COM", "session": "sess1"}'
+        signed = tornado.web.create_signed_value(
+            self.secret, 'gateone_user', user)
+        client_headers = {
+            'Origin': 'https://gateone.example.com',
+            'Cookie': 'foo=bar; gateone_user="%s"' % signed,
+        }
+        # ...node1 proxies the connection to node2 which must see the same
+        # user (what get_secure_cookie('gateone_user') does):
+        headers = registry.proxy_headers(client_headers, '10.0.0.5')
+        cookies = Cookie.SimpleCookie()
+        cookies.load(headers['Cookie'])
+        self.assertEqual(tornado.web.decode_signed_value(
+            self.secret, 'gateone_user', cookies['gateone_user'].value), user)
+
+if __name__ == "__main__":
+    unittest.main()
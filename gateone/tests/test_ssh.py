@@ -0,0 +1,269 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#       Copyright 2013 Liftoff Software Corporation
+#
+
+# Meta
+__author__ = 'Dan McDougall <daniel.mcdougall@liftoffsoftware.com>'
+
+"""
+Tests the public key and certificate parsing in the ssh plugin (ssh.py).  The
+expected values below came from OpenSSH's ssh-keygen (-E md5 -lv, -E sha256
+-l, -B, and -L) run against the same keys.
+"""
+
+# Import Python built-ins
+import os, sys, unittest, tempfile, shutil, base64
+tests_dir = os.path.dirname(os.path.abspath(__file__))
+gateone_dir = os.path.abspath(os.path.join(tests_dir, '../'))
+sys.path.append(gateone_dir)
+sys.path.append(os.path.join(
+    gateone_dir, 'applications', 'terminal', 'plugins', 'ssh'))
+import ssh
+
+# Format: {<name>: {<what ssh-keygen says about it>}}
+KEYS = {
+    'id_rsa': {
+        'public': (
+            'ssh-rsa AAAAB3NzaC1yc2EAAAADAQABAAABAQDa5FuCTneKoAfLKXR2PZvS8YCn'
+            'MtrfKAxtnLWv9XJNCJRNzZGMAgcstxOSiD1g+5vdCYi8fyoiuQ6v6dLxdtBXdj1t'
+            'OShtHcqsqoqQh4BnlUyblZKA0SYYhYHFKRRKa92QtyTAQ5p2vFeXEJyBo018iFa0'
+            'rHTlMMIEbxg3wuoEh7tggbGuiFceXgibTP5IN5YflYW1890cMPZtc0ZuFmpHPfu8'
+            'i5Mi6/Bqbf1S9w7zgoeha36riNdPj58V9qY8tFiJ3OQLyOJV1XNB/zolWjIVRPju'
+            'WKHYWmr7CAWX0L1ruYZqPLGJcj7XmbPBjnPMlhSByYSopMOPYeiVHgYjv2OP rsa'
+            '@test'),
+        'keytype': 'RSA',
+        'bits': '2048',
+        'comment': 'rsa@test',
+        'fingerprint': '14:83:b0:51:f9:ee:71:21:84:0f:0c:e8:7e:59:f0:2a',
+        'sha256_fingerprint': (
+            'SHA256:bQ9lgAhjkb1EuiWFg2Swm3K+3qxtygTdEtyxRgOl+Kg'),
+        'bubblebabble': (
+            'xicin-ginaz-nulen-byzog-cudis-macyn-fosov-zeruf-cotec-zanuh-suxax'),
+        'randomart': '\n'.join((
+            '+---[RSA 2048]----+',
+            '|   .+=.+o        |',
+            '|  . .o* .o       |',
+            '| .  .o =.        |',
+            '|  .   o.+ .      |',
+            '| .   + .S. .     |',
+            '|  E +   o .      |',
+            '|   o   . o       |',
+            '|        .        |',
+            '|                 |',
+            '+------[MD5]------+',
+        )),
+    },
+    'id_ecdsa': {
+        'public': (
+            'ecdsa-sha2-nistp256 AAAAE2VjZHNhLXNoYTItbmlzdHAyNTYAAAAIbmlzdHAy'
+            'NTYAAABBBG/h0YDh//IIeNPi20DFIwdPkKU8Kd801Ep7wIkH+Pgv92PIHLUQ/ZyG'
+            'jr6oNc+a7M7NMQPVrop18DuN7c6mmwQ= ecdsa@test'),
+        'keytype': 'ECDSA',
+        'bits': '256',
+        'comment': 'ecdsa@test',
+        'fingerprint': '96:fa:8b:2e:14:52:7b:5d:a2:af:55:b4:5e:a5:36:20',
+        'sha256_fingerprint': (
+            'SHA256:y7C6NQJUrOO5zAg9FIAjZdotTt+ogZN74SkqNGEB1VA'),
+        'bubblebabble': (
+            'xovec-tafil-rugol-bebur-zidez-ditem-nasom-niciz-hytim-fykal-haxix'),
+        'randomart': '\n'.join((
+            '+---[ECDSA 256]---+',
+            '|                 |',
+            '|    .   E +   .  |',
+            '|   . . o = o o   |',
+            '|  . o o ..o =    |',
+            '|   . o .So o .   |',
+            '|    .  oo .      |',
+            '|   .  .o         |',
+            '|    . .o         |',
+            '|     oo o.       |',
+            '+------[MD5]------+',
+        )),
+    },
+    'id_ed25519': {
+        'public': (
+            'ssh-ed25519 AAAAC3NzaC1lZDI1NTE5AAAAIIAHPBwZ/uGF/m898WdiBWID3IlR'
+            'Xv/QKA2DtuS03d9f ed25519@test'),
+        'keytype': 'ED25519',
+        'bits': '256',
+        'comment': 'ed25519@test',
+        'fingerprint': 'd8:2d:c1:64:67:a4:5d:02:96:fa:13:53:9d:fa:1e:0f',
+        'sha256_fingerprint': (
+            'SHA256:pWHWAJnIwIxn433orKec4ZQhO98xEQgMDEuMuPgbk50'),
+        'bubblebabble': (
+            'xuhad-tanaz-zekys-nidad-kiren-monev-bomof-rumaf-pipas-binab-foxax'),
+        'randomart': '\n'.join((
+            '+--[ED25519 256]--+',
+            '|        =+=...   |',
+            '|       =.=.oo    |',
+            '|       .+...     |',
+            '|      .ooo.      |',
+            '|      ..So..     |',
+            '|        o.  E    |',
+            '|         . . +   |',
+            '|            . .  |',
+            '|                 |',
+            '+------[MD5]------+',
+        )),
+    },
+}
+
+# Format: {<name of the key it certifies>: <certificate>}
+CERTIFICATES = {
+    'id_ed25519': (
+        'ssh-ed25519-cert-v01@openssh.com AAAAIHNzaC1lZDI1NTE5LWNlcnQtdjA'
+        'xQG9wZW5zc2guY29tAAAAIEr9ra9zT6yq2jGi0WVdO2GLeINNbxWbi1NErB76s3Z'
+        '1AAAAIIAHPBwZ/uGF/m898WdiBWID3IlRXv/QKA2DtuS03d9fAAAAAAAAACoAAAA'
+        'BAAAACXRlc3QtY2VydAAAABAAAAAFYWxpY2UAAAADYm9iAAAAAF4L4QAAAAAAcNv'
+        'YgAAAAAAAAACCAAAAFXBlcm1pdC1YMTEtZm9yd2FyZGluZwAAAAAAAAAXcGVybWl'
+        '0LWFnZW50LWZvcndhcmRpbmcAAAAAAAAAFnBlcm1pdC1wb3J0LWZvcndhcmRpbmc'
+        'AAAAAAAAACnBlcm1pdC1wdHkAAAAAAAAADnBlcm1pdC11c2VyLXJjAAAAAAAAAAA'
+        'AAAAzAAAAC3NzaC1lZDI1NTE5AAAAIHkLfJJWn2iDJUoUQMdhanEk96BBnWmb9N2'
+        'UviT3tL/OAAAAUwAAAAtzc2gtZWQyNTUxOQAAAEBAm2aaari727uhLnJq5kyc5jQ'
+        'JeK6XAZkY5myahw8ZciwjBLDFK+g5cNmgPXVJEZZHcOeuyzMJl9uOSU6rT3kI ed'
+        '25519@test'),
+    'id_ecdsa': (
+        'ecdsa-sha2-nistp256-cert-v01@openssh.com AAAAKGVjZHNhLXNoYTItbml'
+        'zdHAyNTYtY2VydC12MDFAb3BlbnNzaC5jb20AAAAg4iDFZox+d6V4RwZnPFCwzlp'
+        'l0/K9XfFb4SqhKiuEpl0AAAAIbmlzdHAyNTYAAABBBG/h0YDh//IIeNPi20DFIwd'
+        'PkKU8Kd801Ep7wIkH+Pgv92PIHLUQ/ZyGjr6oNc+a7M7NMQPVrop18DuN7c6mmwQ'
+        'AAAAAAAAABwAAAAIAAAAJaG9zdC1jZXJ0AAAAFAAAABBob3N0LmV4YW1wbGUuY29'
+        'tAAAAAAAAAAD//////////wAAAAAAAAAAAAAAAAAAADMAAAALc3NoLWVkMjU1MTk'
+        'AAAAgeQt8klafaIMlShRAx2FqcST3oEGdaZv03ZS+JPe0v84AAABTAAAAC3NzaC1'
+        'lZDI1NTE5AAAAQDjB1/85ioTGnwzeh5EmIfSPtWUQEXnTaabVN0h/8SWi3xs4z5d'
+        'qUcIDiGC5SVk6QvOl5Lr35o4U9n+X1+93fQ8= ecdsa@test'),
+}
+
+class TestKeyParsing(unittest.TestCase):
+    """
+    Tests for :func:`ssh.parse_public_key` and the fingerprint functions.
+    """
+    def blob(self, name):
+        return base64.b64decode(KEYS[name]['public'].split()[1])
+
+    def test_parse_public_key(self):
+        for name, expected in KEYS.items():
+            key = ssh.parse_public_key(self.blob(name))
+            self.assertEqual(key['type'], expected['public'].split()[0])
+            self.assertEqual(key['keytype'], expected['keytype'])
+            self.assertEqual(str(key['bits']), expected['bits'])
+            self.assertFalse(key['cert'])
+
+    def test_fingerprints(self):
+        for name, expected in KEYS.items():
+            blob = self.blob(name)
+            self.assertEqual(ssh.md5_fingerprint(blob), expected['fingerprint'])
+            self.assertEqual(
+                ssh.sha256_fingerprint(blob), expected['sha256_fingerprint'])
+            self.assertEqual(ssh.bubblebabble(blob), expected['bubblebabble'])
+            self.assertEqual(
+                ssh.randomart(blob, expected['keytype'], expected['bits']),
+                expected['randomart'])
+
+    def test_parse_certificate(self):
+        blob = base64.b64decode(CERTIFICATES['id_ed25519'].split()[1])
+        key = ssh.parse_public_key(blob)
+        self.assertEqual(key['type'], 'ssh-ed25519-cert-v01@openssh.com')
+        self.assertEqual(key['keytype'], 'ED25519')
+        self.assertTrue(key['cert'])
+        # The certified key is the same as the one in id_ed25519.pub
+        self.assertEqual(key['key'], self.blob('id_ed25519'))
+
+    def test_bad_keys(self):
+        blob = self.blob('id_rsa')
+        self.assertRaises(ValueError, ssh.parse_public_key, blob[:-10])
+        self.assertRaises(ValueError, ssh.parse_public_key,
+            b'\x00\x00\x00\x07ssh-foo\x00\x00\x00\x00')
+
+class TestIdentityInfo(unittest.TestCase):
+    """
+    Tests for :func:`ssh.identity_info`.
+    """
+    def setUp(self):
+        self.ssh_dir = tempfile.mkdtemp(prefix='ssh')
+        for name, expected in KEYS.items():
+            self.write(name, 'NOT A REAL PRIVATE KEY\n')
+            self.write(name + '.pub', expected['public'] + '\n')
+        for name, cert in CERTIFICATES.items():
+            self.write(name + '-cert.pub', cert + '\n')
+        ssh.IDENTITY_CACHE.clear()
+
+    def tearDown(self):
+        shutil.rmtree(self.ssh_dir)
+        ssh.IDENTITY_CACHE.clear()
+
+    def write(self, filename, contents):
+        with open(os.path.join(self.ssh_dir, filename), 'w') as f:
+            f.write(contents)
+
+    def test_identity_info(self):
+        for name, expected in KEYS.items():
+            info = ssh.identity_info(os.path.join(self.ssh_dir, name))
+            self.assertEqual(info['public'], expected['public'] + '\n')
+            for key in ('keytype', 'bits', 'comment', 'fingerprint',
+                    'sha256_fingerprint', 'bubblebabble', 'randomart'):
+                self.assertEqual(info[key], expected[key])
+        info = ssh.identity_info(os.path.join(self.ssh_dir, 'id_rsa'))
+        self.assertEqual(info['certinfo'], '')
+
+    def test_user_certificate(self):
+        info = ssh.identity_info(os.path.join(self.ssh_dir, 'id_ed25519'))
+        self.assertEqual(info['certinfo'], '\n'.join((
+            'Type: ssh-ed25519-cert-v01@openssh.com user certificate',
+            'Public key: ED25519-CERT '
+                'd8:2d:c1:64:67:a4:5d:02:96:fa:13:53:9d:fa:1e:0f',
+            'Signing CA: ED25519 '
+                'da:a5:dd:61:51:e7:69:d7:86:6b:05:2b:d1:c8:e8:f4',
+            'Key ID: "test-cert"',
+            'Serial: 42',
+            'Valid: from 2020-01-01T00:00:00 to 2030-01-01T00:00:00',
+            'Principals: ',
+            ' alice',
+            ' bob',
+            'Critical Options: (none)',
+            'Extensions: ',
+            ' permit-X11-forwarding',
+            ' permit-agent-forwarding',
+            ' permit-port-forwarding',
+            ' permit-pty',
+            ' permit-user-rc',
+        )) + '\n')
+
+    def test_host_certificate(self):
+        info = ssh.identity_info(os.path.join(self.ssh_dir, 'id_ecdsa'))
+        self.assertEqual(info['certinfo'], '\n'.join((
+            'Type: ecdsa-sha2-nistp256-cert-v01@openssh.com host certificate',
+            'Public key: ECDSA-CERT '
+                '96:fa:8b:2e:14:52:7b:5d:a2:af:55:b4:5e:a5:36:20',
+            'Signing CA: ED25519 '
+                'da:a5:dd:61:51:e7:69:d7:86:6b:05:2b:d1:c8:e8:f4',
+            'Key ID: "host-cert"',
+            'Serial: 7',
+            'Valid: forever',
+            'Principals: ',
+            ' host.example.com',
+            'Critical Options: (none)',
+            'Extensions: (none)',
+        )) + '\n')
+
+    def test_cache(self):
+        id_path = os.path.join(self.ssh_dir, 'id_rsa')
+        info = ssh.identity_info(id_path)
+        self.assertTrue(id_path in ssh.IDENTITY_CACHE)
+        info['keytype'] = 'Modified' # Callers get their own copy
+        self.assertEqual(ssh.identity_info(id_path)['keytype'], 'RSA')
+        # Replacing the public key invalidates the cache
+        self.write('id_rsa.pub', KEYS['id_ed25519']['public'] + '\n')
+        self.assertEqual(ssh.identity_info(id_path)['keytype'], 'ED25519')
+
+    def test_unparseable(self):
+        self.write('id_rsa.pub', 'ssh-rsa garbage comment\n')
+        info = ssh.identity_info(os.path.join(self.ssh_dir, 'id_rsa'))
+        self.assertEqual(info['keytype'], 'Unknown')
+        self.assertEqual(info['fingerprint'], '')
+        self.assertEqual(info['comment'], 'comment')
+
+if __name__ == "__main__":
+    unittest.main()
@@ -56,6 +56,43 @@ class Test1Coding(unittest.TestCase):
         #print('It took %0.2fms to process the input' % (elapsed*1000.0))
 
 
+class Test2Hibernate(unittest.TestCase):
+    """
+    Tests :meth:`terminal.Terminal.hibernate` and :meth:`terminal.Terminal.wake`.
+    """
+    def test_hibernate_round_trip(self):
+        term = terminal.Terminal(24, 80)
+        term.write(u'\x1b[1;31mhello\x1b[0m world\r\n')
+        before = term.dump()
+        renditions = [list(r) for r in term.renditions]
+        self.assertTrue(term.hibernate())
+        self.assertFalse('screen' in term.__dict__)
+        self.assertEqual(term.hibernate(), None) # Already hibernating
+        self.assertEqual(term.dump(), before) # Wakes up automatically
+        self.assertEqual(term.snapshot, None)
+        self.assertEqual([list(r) for r in term.renditions], renditions)
+        term.write(u'more')
+        self.assertTrue(term.dump()[1].startswith(u'more'))
+
+class Test3HandlerTables(unittest.TestCase):
+    """
+    Tests :meth:`terminal.Terminal.handler_tables` and the per-instance views
+    of them.
+    """
+    def test_bound_handlers(self):
+        term = terminal.Terminal(24, 80)
+        term.write(u'foo')
+        term.csi_handlers['H']('5;10') # Cursor position
+        self.assertEqual((term.cursorY, term.cursorX), (4, 9))
+        self.assertEqual(
+            sorted(term.specials), sorted(term.handler_tables()[0]))
+
+    def test_read_only(self):
+        term = terminal.Terminal(24, 80)
+        def replace(table):
+            table['H'] = lambda *args: None
+        for table in (term.specials, term.esc_handlers, term.csi_handlers):
+            self.assertRaises(TypeError, replace, table)
 
 if __name__ == "__main__":
     print "Date & Time:\t\t\t%s" % time.ctime()
@@ -0,0 +1,321 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#       Copyright 2013 Liftoff Software Corporation
+#
+
+# Meta
+__author__ = 'Dan McDougall <daniel.mcdougall@liftoffsoftware.com>'
+
+"""
+Tests the pattern matching (expect) machinery and the fast-forwarding of
+runaway output in termio.py.
+"""
+
+# Import Python built-ins
+import os, sys, re, time, random, unittest
+tests_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.abspath(os.path.join(tests_dir, '../')))
+import termio, terminal
+try:
+    from tornado.concurrent import Future
+except ImportError: # Tornado < 3.0 (or not installed)
+    Future = None
+
+def new_multiplex(rows=24, cols=80):
+    m = termio.BaseMultiplex('true')
+    m.rows, m.cols = rows, cols
+    m.term = terminal.Terminal(rows, cols)
+    return m
+
+class TestPostprocess(unittest.TestCase):
+    """
+    Tests :func:`termio.combine_patterns` and
+    :meth:`termio.BaseMultiplex.postprocess`.
+    """
+    def test_combine_patterns(self):
+        regexes = [
+            re.compile('(?i)password:'), re.compile('^\$ $', re.MULTILINE),
+            re.compile(r'(\w+)=\1'), re.compile('a b', re.VERBOSE)]
+        combined, leftovers = termio.combine_patterns(regexes)
+        self.assertEqual(leftovers, regexes[2:])
+        self.assertTrue(combined.search(u'foo\nPASSWORD:'))
+        self.assertTrue(combined.search(u'foo\n$ '))
+        self.assertFalse(combined.search(u'foo=foo'))
+
+    def test_screen_text(self):
+        m = new_multiplex()
+        m.term_write(u'one   \r\ntwo')
+        self.assertEqual(m.screen_text(), u'one\ntwo')
+        version = m.screen_version
+        m.screen_text()
+        self.assertEqual(m.screen_version, version) # Nothing changed
+        m.term_write(u'!')
+        self.assertEqual(m.screen_text(), u'one\ntwo!')
+        self.assertEqual(m.screen_version, version + 1)
+
+    def test_expect_order(self):
+        m = new_multiplex()
+        matched = []
+        def callback(name, m_instance, match):
+            matched.append((name, match))
+        m.expect('first', lambda m, s: callback('first', m, s),
+            preprocess=False)
+        m.expect('second', lambda m, s: callback('second', m, s),
+            preprocess=False)
+        m.expect(re.compile(r'(\d)\1'), lambda m, s: callback('sticky', m, s),
+            sticky=True, preprocess=False)
+        m.term_write(u'second\r\n')
+        self.assertEqual(matched, []) # 'first' has to match first
+        m.term_write(u'first\r\n')
+        self.assertEqual(matched, [('first', u'first')])
+        m.term_write(u'\r\n') # 'second' still on the screen
+        self.assertEqual(matched[-1], ('second', u'second'))
+        m.term_write(u'22\r\n')
+        m.term_write(u'\r\n')
+        self.assertEqual(
+            [a for a in matched if a[0] == 'sticky'],
+            [('sticky', u'22'), ('sticky', u'22')])
+        self.assertEqual(len(m._patterns), 1)
+
+class TestFastForward(unittest.TestCase):
+    """
+    Tests that :meth:`termio.BaseMultiplex._fast_forward` ends up with the same
+    terminal state as emulating everything.
+    """
+    words = [
+        u'foo', u'bar', u'caf\xe9', u'日本', u'\t', u'\x1b[K',
+        u'\x1b[1m', u'\x1b[31m', u'\x1b[0m', u'\x1b[44;4m', u'\x1b[m']
+    # Things that can only show up before the tail
+    anything = words + [
+        u'\x1b[H', u'\x1b[5;10H', u'\x1b[2J', u'\x1bc', u'\x1b[3A', u'\r',
+        u'\n', u'\x1b]0;title %s\x07', u'\x1b[4h', u'\x1b[4l', u'\x1b[?7h',
+        u'\x1b[?7l', u'\x1b[?25l', u'\x0e', u'\x0f', u'\x1b(0', u'\x1b(B']
+
+    def random_line(self, rand, choices, length):
+        line = u''
+        for i in xrange(rand.randint(0, length)):
+            word = rand.choice(choices)
+            if u'%s' in word:
+                word = word % rand.randint(0, 9)
+            line += word + u' ' * rand.randint(0, 2)
+        return line
+
+    def random_stream(self, seed, lines):
+        rand = random.Random(seed)
+        head = u''.join(
+            self.random_line(rand, self.anything, 30) for i in xrange(500))
+        tail = u'\r\n'.join(
+            self.random_line(rand, self.words, 40) for i in xrange(lines))
+        return head + u'\r\n' + tail
+
+    def state(self, m):
+        term = m.term
+        rend = lambda rows: [
+            [term.renditions_store[c] for c in row] for row in rows]
+        return {
+            'screen': [row.tounicode() for row in term.screen],
+            'renditions': rend(term.renditions),
+            'scrollback': [row.tounicode() for row in term.scrollback_buf],
+            'scrollback_renditions': rend(term.scrollback_renditions),
+            'cursor': (term.cursorY, term.cursorX),
+            'cur_rendition': term.renditions_store[term.cur_rendition],
+            'title': term.title,
+            'modes': (term.expanded_modes, term.insert_mode),
+            'charset': (term.current_charset, term.charset),
+        }
+
+    def compare(self, stream):
+        slow, fast = new_multiplex(), new_multiplex()
+        slow.fast_forward = False
+        for m in (slow, fast):
+            m.term_write(u'already on the screen\r\n' * 5 + u'\x1b[32m')
+            m.term.init_scrollback()
+        skipped = len(fast._fast_forward(stream)) < len(stream)
+        slow.term_write(stream)
+        fast.term_write(stream)
+        slow_state, fast_state = self.state(slow), self.state(fast)
+        for key in slow_state: # (assertEqual's diffs would take forever)
+            self.assertTrue(
+                slow_state[key] == fast_state[key], "%s differs" % key)
+        return skipped
+
+    def test_random_streams(self):
+        for seed in xrange(3):
+            self.assertTrue(self.compare(self.random_stream(seed, 1500)))
+
+    def test_not_enough_lines(self):
+        # Not enough lines in the tail to refill the scrollback buffer
+        self.assertFalse(self.compare(self.random_stream(0, 1000)))
+
+    def test_state_from_skipped_output(self):
+        stream = (
+            u'\x1b[1;31m\x1b]0;skipped\x07\x1b[4h\x1b(0' + u'x\r\n' * 500 +
+            u'\x1b[44m' + u'tail\r\n' * 1500 + u'end')
+        self.assertTrue(self.compare(stream))
+
+    def test_cursor_movement_in_tail(self):
+        m = new_multiplex()
+        stream = u'foo\r\n' * 5000
+        self.assertNotEqual(m._fast_forward(stream), stream)
+        stream += u'\x1b[H'
+        self.assertEqual(m._fast_forward(stream), stream)
+
+class TestReading(unittest.TestCase):
+    """
+    Tests :func:`termio._read_fd` and the file descriptor that
+    :meth:`termio.MultiplexPOSIXIOLoop.spawn` hands to the IOLoop.
+    """
+    def test_short_read_stops(self):
+        # A blocking pipe:  Reading past what's there would hang forever
+        r, w = os.pipe()
+        try:
+            os.write(w, b'foo')
+            self.assertEqual(termio._read_fd(r), b'foo')
+            os.write(w, b'barbaz')
+            self.assertEqual(termio._read_fd(r, 3), b'bar')
+            self.assertEqual(termio._read_fd(r, 10), b'baz')
+        finally:
+            os.close(r)
+            os.close(w)
+
+    def test_nonblocking_fd(self):
+        import fcntl, io
+        stdin = sys.stdin
+        sys.stdin = io.StringIO() # Like a test runner capturing stdin
+        try:
+            m = termio.spawn('cat')
+        finally:
+            sys.stdin = stdin
+        try:
+            flags = fcntl.fcntl(m.fd, fcntl.F_GETFL)
+            self.assertTrue(flags & os.O_NONBLOCK)
+        finally:
+            m.terminate()
+
+class TestTimeouts(unittest.TestCase):
+    """
+    Tests :meth:`termio.BaseMultiplex.timeout_check` and
+    :meth:`termio.BaseMultiplex.next_deadline`.
+    """
+    def test_timeouts(self):
+        m = new_multiplex()
+        m._call_callback = lambda callback: callback()
+        errors = []
+        m.expect('a', 'x', timeout=0.05, errorback=lambda m: errors.append('a'))
+        m.expect('b', 'x', timeout=0, errorback=lambda m: errors.append('b'))
+        m.expect('c', 'x', timeout=0.01, sticky=True,
+            errorback=lambda m: errors.append('c'))
+        self.assertEqual(m.next_deadline(), m._patterns[2].deadline)
+        self.assertTrue(m.timeout_check())
+        self.assertEqual(errors, [])
+        time.sleep(0.06)
+        self.assertTrue(m.timeout_check()) # 'b' never times out
+        self.assertEqual(sorted(errors), ['a', 'c'])
+        self.assertEqual(len(m._patterns), 2) # Sticky patterns stick around
+        self.assertEqual(m.next_deadline(), None)
+        m.timeout_check()
+        self.assertEqual(len(errors), 2) # Only time out once
+
+@unittest.skipIf(Future is None, "Requires tornado.concurrent (Tornado 3.0+)")
+class TestFutures(unittest.TestCase):
+    """
+    Tests :meth:`termio.BaseMultiplex.expect_async` and
+    :meth:`termio.BaseMultiplex.read_until`.
+    """
+    def setUp(self):
+        self.m = new_multiplex()
+
+    def test_expect_async(self):
+        future = self.m.expect_async('(?i)password:', preprocess=False)
+        self.m.term_write(u'Enter ')
+        self.assertFalse(future.done())
+        self.m.term_write(u'Password: ')
+        self.assertEqual(future.result(), u'Password:')
+        self.assertEqual(self.m._patterns, [])
+
+    def test_read_until(self):
+        future = self.m.read_until(r'\$ $')
+        self.m.term_write(b'\x1b[1mhello\x1b[0m\r\n')
+        self.m.term_write(b'$')
+        self.assertFalse(future.done())
+        self.m.term_write(b' ')
+        self.assertEqual(future.result(), u'\x1b[1mhello\x1b[0m\r\n$ ')
+        self.assertEqual(self.m._patterns, [])
+
+    def test_read_until_multibyte(self):
+        # A UTF-8 character split across reads must come out intact
+        future = self.m.read_until(u'caf\xe9!')
+        self.m.term_write(b'caf\xc3')
+        self.m.term_write(b'\xa9!')
+        self.assertEqual(future.result(), u'caf\xe9!')
+
+    def test_read_until_window(self):
+        future = self.m.read_until(r'^\$ ', window=4)
+        self.m.term_write(b'one\ntwo $ ') # '$ ' isn't at the start of a line
+        self.m.term_write(b'three')
+        self.assertFalse(future.done())
+        self.m.term_write(b'\n$ ')
+        self.assertEqual(future.result(), u'one\ntwo $ three\n$ ')
+
+    def test_timeout(self):
+        future = self.m.expect_async('never', timeout=0.01)
+        time.sleep(0.02)
+        self.m.timeout_check()
+        self.assertRaises(termio.Timeout, future.result)
+
+@unittest.skipIf(Future is None, "Requires tornado.concurrent (Tornado 3.0+)")
+class TestFuturesLive(unittest.TestCase):
+    """
+    Drives real child processes with :meth:`termio.BaseMultiplex.expect_async`
+    and :meth:`termio.BaseMultiplex.read_until` on a running IOLoop.
+    """
+    # A delay, a prompt, and a response (with a multibyte character)
+    command = (
+        "sh -c 'sleep 0.1; printf \"Password: \"; read x; "
+        "printf \"welcome \\342\\234\\223\\n\"'")
+
+    def run_sync(self, func):
+        from tornado.ioloop import IOLoop
+        return IOLoop.instance().run_sync(func, timeout=30)
+
+    def test_conversation(self):
+        from tornado import gen
+        @gen.coroutine
+        def converse():
+            with termio.spawn(self.command) as m:
+                yield m.expect_async('Password:', preprocess=False)
+                m.writeline(u'secret')
+                output = yield m.read_until(u'welcome \u2713')
+            raise gen.Return(output)
+        @gen.coroutine
+        def run_all():
+            results = yield [converse() for i in range(20)]
+            raise gen.Return(results)
+        results = self.run_sync(run_all)
+        self.assertEqual(len(results), 20)
+        for output in results:
+            self.assertTrue(u'secret' in output)
+            self.assertTrue(output.endswith(u'welcome \u2713'))
+
+    def test_timeout(self):
+        from tornado import gen
+        @gen.coroutine
+        def wait_forever():
+            with termio.spawn('cat') as m:
+                yield m.expect_async('never', timeout=0.2, preprocess=False)
+        start = time.time()
+        self.assertRaises(termio.Timeout, self.run_sync, wait_forever)
+        self.assertTrue(time.time() - start < 5)
+
+    def test_program_terminated(self):
+        from tornado import gen
+        @gen.coroutine
+        def read_past_the_end():
+            with termio.spawn("sh -c 'echo bye'") as m:
+                yield m.read_until('never')
+        self.assertRaises(
+            termio.ProgramTerminated, self.run_sync, read_past_the_end)
+
+if __name__ == "__main__":
+    unittest.main()
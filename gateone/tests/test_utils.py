@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#       Copyright 2013 Liftoff Software Corporation
+#
+
+# Meta
+__author__ = 'Dan McDougall <daniel.mcdougall@liftoffsoftware.com>'
+
+"""
+Tests some of the functions in utils.py.
+"""
+
+# Import Python built-ins
+import os, sys, unittest
+tests_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.abspath(os.path.join(tests_dir, '../')))
+import utils
+
+class TestParseByteRange(unittest.TestCase):
+    """
+    Tests for :func:`utils.parse_byte_range`.
+    """
+    def test_ranges(self):
+        parse = utils.parse_byte_range
+        self.assertEqual(parse('bytes=0-499', 1000), (0, 500))
+        self.assertEqual(parse('bytes=500-', 1000), (500, 1000))
+        self.assertEqual(parse('bytes=-100', 1000), (900, 1000))
+        self.assertEqual(parse('bytes=900-5000', 1000), (900, 1000))
+        self.assertEqual(parse('bytes=-5000', 1000), (0, 1000))
+
+    def test_unsatisfiable(self):
+        self.assertEqual(utils.parse_byte_range('bytes=1000-', 1000)[0], 1000)
+        self.assertEqual(utils.parse_byte_range('bytes=-0', 1000)[0], 1000)
+
+    def test_ignored(self):
+        parse = utils.parse_byte_range
+        self.assertEqual(parse('bytes=0-1,5-9', 1000), None) # Multiple
+        self.assertEqual(parse('items=0-1', 1000), None)
+        self.assertEqual(parse('bytes=abc', 1000), None)
+        self.assertEqual(parse('bytes=500-100', 1000), None)
+
+class TestLRUCache(unittest.TestCase):
+    """
+    Tests for :class:`utils.LRUCache`.
+    """
+    def test_eviction(self):
+        cache = utils.LRUCache(2)
+        cache['a'] = 1
+        cache['b'] = 2
+        cache.get('a') # 'b' is now the least recently used
+        cache['c'] = 3
+        self.assertTrue('a' in cache)
+        self.assertFalse('b' in cache)
+        self.assertEqual(cache['c'], 3)
+        self.assertEqual(len(cache), 2)
+        self.assertRaises(KeyError, cache.__getitem__, 'b')
+
+    def test_order(self):
+        cache = utils.LRUCache(3)
+        for key in 'abc':
+            cache[key] = key
+        cache['a'] = 'A' # Replacing a value counts as using it
+        cache.get('b')
+        cache.get('b') # Already the most recently used
+        cache['d'] = 'd'
+        cache['e'] = 'e'
+        self.assertEqual(sorted(cache.data), ['b', 'd', 'e'])
+        cache.clear()
+        self.assertEqual(len(cache), 0)
+        cache['f'] = 'f'
+        self.assertEqual(cache.get('f'), 'f')
+        self.assertEqual(cache.get('a', 'gone'), 'gone')
+
+class TestJSONEncodeMessage(unittest.TestCase):
+    """
+    Tests for :func:`utils.json_encode_message`.
+    """
+    def test_round_trip(self):
+        message = {
+            'terminal:termupdate': {
+                'term': 1,
+                'screen': [u'<span class="f1">r\xe9sum\xe9</span>', u'', u'"'],
+                'scrollback': [],
+                'ratelimiter': False
+            },
+            2: [1, 'two', None]
+        }
+        encoded = utils.json_encode_message(message)
+        expected = dict(message)
+        expected['2'] = expected.pop(2) # JSON keys are always strings
+        self.assertEqual(utils.json_decode(encoded), expected)
+        # Lines are cached so they only get encoded once
+        self.assertTrue(u'"' in utils.ENCODED_STRINGS)
+        self.assertEqual(utils.json_encode_message(message), encoded)
+
+    def test_bounded(self):
+        for i in range(utils.MAX_ENCODED_STRINGS + 10):
+            utils.json_encode_message([u'line %s' % i])
+        self.assertEqual(len(utils.ENCODED_STRINGS), utils.MAX_ENCODED_STRINGS)
+        self.assertFalse(u'line 0' in utils.ENCODED_STRINGS)
+        self.assertTrue(u'line 10' in utils.ENCODED_STRINGS)
+
+    def test_floats(self):
+        # Numbers always go through the json module (full precision)
+        message = {'go:pong': 1381234567.123456, 'values': [0.1 + 0.2, 1e-7]}
+        self.assertEqual(
+            utils.json_decode(utils.json_encode_message(message)), message)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,206 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#       Copyright 2013 Liftoff Software Corporation
+#
+
+# Meta
+__author__ = 'Dan McDougall <daniel.mcdougall@liftoffsoftware.com>'
+
+"""
+Tests the file watchers in watcher.py.
+"""
+
+# Import Python built-ins
+import os, sys, time, unittest, tempfile, shutil
+tests_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.abspath(os.path.join(tests_dir, '../')))
+import watcher
+import tornado.ioloop
+
+try:
+    watcher.InotifyFileWatcher(tornado.ioloop.IOLoop()).stop()
+    INOTIFY = True
+except (OSError, AttributeError):
+    INOTIFY = False
+
+class WatcherTestCase(unittest.TestCase):
+    """
+    Runs a fresh IOLoop for each test and keeps track of which watched paths
+    had their functions called (in :attr:`calls`).
+    """
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp(prefix='watcher')
+        self.io_loop = tornado.ioloop.IOLoop()
+        self.watcher = self.make_watcher()
+        self.calls = []
+
+    def tearDown(self):
+        self.watcher.stop()
+        self.io_loop.close()
+        shutil.rmtree(self.tempdir)
+
+    def watch(self, path):
+        self.watcher.watch(path, lambda: self.calls.append(path))
+
+    def run_loop(self, seconds=0.3):
+        self.io_loop.add_timeout(time.time() + seconds, self.io_loop.stop)
+        self.io_loop.start()
+
+    def write(self, path, data):
+        with open(path, 'a') as f:
+            f.write(data)
+
+@unittest.skipIf(not INOTIFY, "inotify is not available")
+class TestInotifyFileWatcher(WatcherTestCase):
+    """
+    Tests for :class:`watcher.InotifyFileWatcher`.
+    """
+    def make_watcher(self):
+        return watcher.InotifyFileWatcher(
+            self.io_loop, coalesce=50, interval=50)
+
+    def test_create_modify_delete(self):
+        path = os.path.join(self.tempdir, 'settings.conf')
+        self.watch(path) # Doesn't exist yet
+        self.write(path, 'created')
+        self.run_loop()
+        self.assertEqual(self.calls, [path])
+        self.write(path, 'modified')
+        self.run_loop()
+        self.assertEqual(self.calls, [path, path])
+        os.remove(path)
+        self.run_loop()
+        self.assertEqual(self.calls, [path, path, path])
+
+    def test_other_files_ignored(self):
+        path = os.path.join(self.tempdir, 'watched')
+        self.watch(path)
+        self.write(os.path.join(self.tempdir, 'unwatched'), 'foo')
+        self.run_loop()
+        self.assertEqual(self.calls, [])
+
+    def test_directory(self):
+        self.watch(self.tempdir)
+        self.write(os.path.join(self.tempdir, 'new'), 'foo')
+        self.run_loop()
+        self.assertEqual(self.calls, [self.tempdir])
+        os.remove(os.path.join(self.tempdir, 'new'))
+        self.run_loop()
+        self.assertEqual(self.calls, [self.tempdir, self.tempdir])
+
+    def test_coalesce(self):
+        path = os.path.join(self.tempdir, 'theme.css')
+        self.watch(path)
+        for i in range(10):
+            self.write(path, 'line %s\n' % i)
+        self.run_loop()
+        self.assertEqual(self.calls, [path])
+
+    def test_replaced_by_rename(self):
+        # What most editors do when saving a file
+        path = os.path.join(self.tempdir, 'template.html')
+        self.write(path, 'old')
+        self.watch(path)
+        self.write(path + '.tmp', 'new')
+        os.rename(path + '.tmp', path)
+        self.run_loop()
+        self.assertEqual(self.calls, [path])
+        self.write(path, 'newer') # Still being watched
+        self.run_loop()
+        self.assertEqual(self.calls, [path, path])
+
+    def test_directory_recreated(self):
+        directory = os.path.join(self.tempdir, 'settings')
+        os.mkdir(directory)
+        self.watch(directory)
+        shutil.rmtree(directory)
+        self.run_loop()
+        self.assertEqual(self.calls, [directory])
+        self.assertEqual(self.watcher.missing, set([directory]))
+        os.mkdir(directory)
+        self.run_loop()
+        self.assertEqual(self.calls, [directory, directory])
+        self.assertEqual(self.watcher.missing, set())
+        self.assertEqual(self.watcher.checker, None)
+        self.write(os.path.join(directory, 'new'), 'foo') # Watched again
+        self.run_loop()
+        self.assertEqual(self.calls, [directory, directory, directory])
+
+    def test_parent_recreated(self):
+        directory = os.path.join(self.tempdir, 'settings')
+        path = os.path.join(directory, 'settings.conf')
+        os.mkdir(directory)
+        self.watch(path)
+        shutil.rmtree(directory)
+        self.run_loop()
+        self.calls = []
+        os.mkdir(directory)
+        self.write(path, 'foo')
+        self.run_loop()
+        self.assertEqual(self.calls, [path])
+        self.write(path, 'bar')
+        self.run_loop()
+        self.assertEqual(self.calls, [path, path])
+
+    def test_missing_directory(self):
+        directory = os.path.join(self.tempdir, 'settings')
+        path = os.path.join(directory, 'settings.conf')
+        self.watch(path) # Its directory doesn't exist yet
+        self.assertEqual(self.watcher.missing, set([directory]))
+        os.mkdir(directory)
+        self.write(path, 'foo')
+        self.run_loop()
+        self.assertEqual(self.calls, [path])
+        self.watcher.unwatch(path)
+        self.assertEqual(self.watcher.dirs, {})
+
+    def test_unwatch(self):
+        path = os.path.join(self.tempdir, 'settings.conf')
+        self.watch(path)
+        self.watcher.unwatch(path)
+        self.assertEqual(self.watcher.dirs, {})
+        self.watch(os.path.join(self.tempdir, 'missing', 'foo'))
+        self.watcher.unwatch(os.path.join(self.tempdir, 'missing', 'foo'))
+        self.assertEqual(self.watcher.missing, set())
+        self.assertEqual(self.watcher.checker, None)
+        self.write(path, 'foo')
+        self.run_loop()
+        self.assertEqual(self.calls, [])
+
+class TestPollingFileWatcher(WatcherTestCase):
+    """
+    Tests for :class:`watcher.PollingFileWatcher`.
+    """
+    def make_watcher(self):
+        return watcher.PollingFileWatcher(
+            self.io_loop, coalesce=50, interval=50)
+
+    def test_create_modify_delete(self):
+        path = os.path.join(self.tempdir, 'settings.conf')
+        self.watch(path)
+        self.write(path, 'created')
+        self.run_loop()
+        self.assertEqual(self.calls, [path])
+        os.utime(path, (time.time() + 10, time.time() + 10)) # Modified
+        self.run_loop()
+        self.assertEqual(self.calls, [path, path])
+        os.remove(path)
+        self.run_loop()
+        self.assertEqual(self.calls, [path, path, path])
+        self.watcher.unwatch(path)
+        self.assertEqual(self.watcher.checker, None) # Nothing left to poll
+
+    def test_directory_recreated(self):
+        directory = os.path.join(self.tempdir, 'settings')
+        os.mkdir(directory)
+        self.watch(directory)
+        shutil.rmtree(directory)
+        self.run_loop()
+        self.assertEqual(self.calls, [directory])
+        os.mkdir(directory)
+        self.run_loop()
+        self.assertEqual(self.calls, [directory, directory])
+
+if __name__ == "__main__":
+    unittest.main()
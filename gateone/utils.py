@@ -34,6 +34,10 @@ from tornado import locale
 from tornado.escape import json_encode as _json_encode
 from tornado.escape import json_decode
 from tornado.escape import to_unicode, utf8
+try:
+    import ujson as fast_json # Optional:  Much faster at encoding than json
+except ImportError:
+    fast_json = None
 
 # Globals
 MACOS = os.uname()[0] == 'Darwin'
@@ -106,6 +110,9 @@ FACILITIES = {
     'uucp': 64
 }
 SEPARATOR = u"\U000f0f0f" # The character used to separate frames in the log
+# How many JSON-encoded strings json_encode_message() will hold on to.  Plenty
+# for the screens of every active terminal (the lines that get sent repeatedly):
+MAX_ENCODED_STRINGS = 2000
 
 # Exceptions
 class UnknownFacility(Exception):
@@ -183,6 +190,77 @@ class RUDict(dict):
         """
         return self.__repr__() + "\n"
 
+class LRUCache(object):
+    """
+    A dict-like cache that holds at most *maxsize* items.  When it's full the
+    least recently used item gets discarded to make room for new ones.
+
+    The items are kept in a circular doubly-linked list (oldest first) so
+    that marking an item as recently used is cheap (`OrderedDict` is written
+    in pure Python on Python 2 and is several times slower at it).
+    """
+    def __init__(self, maxsize=128):
+        self.maxsize = maxsize
+        self.data = {} # Format: {<key>: [<prev>, <next>, <key>, <value>]}
+        self.root = [] # The list's sentinel (root[1] is the oldest link)
+        self.root[:] = [self.root, self.root, None, None]
+
+    def get(self, key, default=None):
+        """
+        Returns the value stored under *key* (marking it as recently used) or
+        *default* if there's nothing there.
+        """
+        link = self.data.get(key)
+        if link is None:
+            return default
+        # Move it to the end (most recently used)
+        prev_link, next_link, key, value = link
+        prev_link[1] = next_link
+        next_link[0] = prev_link
+        root = self.root
+        last = root[0]
+        last[1] = root[0] = link
+        link[0] = last
+        link[1] = root
+        return value
+
+    def __setitem__(self, key, value):
+        link = self.data.get(key)
+        if link is not None:
+            link[3] = value
+            self.get(key)
+            return
+        root = self.root
+        last = root[0]
+        last[1] = root[0] = self.data[key] = [last, root, key, value]
+        if len(self.data) > self.maxsize:
+            oldest = root[1]
+            root[1] = oldest[1]
+            oldest[1][0] = root
+            del self.data[oldest[2]]
+
+    def __getitem__(self, key):
+        value = self.get(key, KeyError)
+        if value is KeyError:
+            raise KeyError(key)
+        return value
+
+    def __contains__(self, key):
+        return key in self.data
+
+    def __len__(self):
+        return len(self.data)
+
+    def clear(self):
+        """
+        Empties the cache.
+        """
+        self.data.clear()
+        self.root[:] = [self.root, self.root, None, None]
+
+# Strings that have already been JSON-encoded by json_encode_message():
+ENCODED_STRINGS = LRUCache(MAX_ENCODED_STRINGS) # {<string>: <JSON string>}
+
 # Functions
 def noop(*args, **kwargs):
     """Do nothing (i.e. "No Operation")"""
@@ -344,42 +422,26 @@ def remove_pid(path):
 
 def shell_command(cmd, timeout_duration=5):
     """
-    Resets the SIGCHLD signal handler (if necessary), executes *cmd* via
-    :func:`commands.getstatusoutput`, then re-enables the SIGCHLD handler (if it
-    was set to something other than SIG_DFL).  Returns the result of
-    `getstatusoutput` which is a tuple in the form of::
+    Executes *cmd* via the shell (with stderr redirected to stdout) and returns
+    a tuple in the form of::
 
         (exitstatus, output)
 
-    If the command takes longer than *timeout_duration* seconds, it will be
-    auto-killed and the following will be returned::
+    If the command takes longer than *timeout_duration* seconds, it (and
+    anything it spawned) will be killed and the following will be returned::
 
         (255, _("ERROR: Timeout running shell command"))
+
+    .. note:: This blocks until the command completes.  Use :func:`processes.run_async` instead wherever possible.
     """
-    from commands import getstatusoutput
-    existing_handler = signal.getsignal(signal.SIGCHLD)
-    default = (255, _("ERROR: Timeout running shell command"))
-    if existing_handler != 0: # Something other than default
-        # Reset it to default so getstatusoutput will work properly
-        try:
-            signal.signal(signal.SIGCHLD, signal.SIG_DFL)
-        except ValueError:
-            # "Signal only works in the main thread" - no big deal.  This just
-            # means we never needed to call signal in the first place.
-            pass
-    result = timeout_func(
-        getstatusoutput,
-        args=(cmd,),
-        default=default,
-        timeout_duration=timeout_duration
-    )
-    try:
-        signal.signal(signal.SIGCHLD, existing_handler)
-    except ValueError:
-        # Like above, signal only works from within the main thread but our use
-        # of it here would only matter if we were in the main thread.
-        pass
-    return result
+    from processes import run
+    stdout, stderr, exitstatus = run(
+        '{ %s; } 2>&1' % cmd, timeout=timeout_duration, shell=True)
+    if exitstatus is None:
+        return (255, _("ERROR: Timeout running shell command"))
+    if stdout.endswith('\n'):
+        stdout = stdout[:-1]
+    return (exitstatus, stdout)
 
 def json_encode(obj):
     """
@@ -389,6 +451,62 @@ def json_encode(obj):
     """
     return to_unicode(_json_encode(obj))
 
+def _encode_string(string):
+    """
+    Returns *string* JSON-encoded, using (and adding to) `ENCODED_STRINGS`.
+
+    If the `ujson` module is installed it will be used instead of the `json`
+    module (it's several times faster).  Only strings get encoded this way
+    since ujson doesn't encode floats with the same precision as `json`.
+
+    .. note:: Like `tornado.escape.json_encode` the output is safe to embed in HTML since ujson escapes forward slashes (so "</script>" can't appear).
+    """
+    encoded = ENCODED_STRINGS.get(string)
+    if encoded is None:
+        if fast_json:
+            encoded = to_unicode(fast_json.dumps(string))
+        else:
+            encoded = json_encode(string)
+        ENCODED_STRINGS[string] = encoded
+    return encoded
+
+def json_encode_message(message):
+    """
+    JSON-encodes *message* (usually a dict) the same way as :func:`json_encode`
+    but strings in lists (e.g. the lines of a terminal's screen) and dict keys
+    are encoded via a cache (`ENCODED_STRINGS`).  That way lines that get sent
+    over and over again (full refreshes, shared terminals, etc) only ever get
+    encoded once.
+
+    This is what :class:`gateone.ApplicationWebSocket` uses to encode outbound
+    messages so call sites should just pass it dicts (as opposed to encoding
+    messages themselves).
+    """
+    if isinstance(message, dict):
+        items = []
+        for key, value in message.iteritems():
+            if not isinstance(key, basestring):
+                key = json_encode(key) # JSON keys are always strings
+            items.append(u'%s: %s' % (
+                _encode_string(key), json_encode_message(value)))
+        return u'{%s}' % u', '.join(items)
+    if isinstance(message, list):
+        if not message:
+            return u'[]'
+        if all(isinstance(a, basestring) for a in message):
+            return u'[%s]' % u', '.join( # (Lots of empty lines on screens)
+                [_encode_string(a) if a else u'""' for a in message])
+    # Skip the overhead of calling the encoder for the simple stuff:
+    if message is None:
+        return u'null'
+    elif message is True:
+        return u'true'
+    elif message is False:
+        return u'false'
+    elif type(message) in (int, long):
+        return unicode(message)
+    return json_encode(message)
+
 def get_translation():
     """
     Looks inside GATEONE_DIR/server.conf to determine the configured locale and
@@ -446,31 +564,36 @@ def gen_self_signed_openssl(path=None):
     keyfile_path = "%s/keyfile.pem" % path
     certfile_path = "%s/certificate.pem" % path
     subject = (
-        '-subj "/OU=%s (Self-Signed)/CN=Gate One/O=Liftoff Software"' %
+        '/OU=%s (Self-Signed)/CN=Gate One/O=Liftoff Software' %
         os.uname()[1] # Hostname
     )
-    gen_command = (
-        "openssl genrsa -aes256 -out %s.tmp -passout pass:password 4096" %
-        keyfile_path
-    )
-    decrypt_key_command = (
-        "openssl rsa -in %s.tmp -passin pass:password -out keyfile.pem" %
-        keyfile_path
-    )
-    csr_command = (
-        "openssl req -new -key %s -out temp.csr %s" % (keyfile_path, subject)
-    )
-    cert_command = (
-        "openssl x509 -req "    # Create a new x509 certificate
-        "-days 3650 "           # That lasts 10 years
-        "-in temp.csr "         # Using the CSR we just generated
-        "-signkey %s "          # Sign it with keyfile.pem that we just created
-        "-out %s"               # Save it as certificate.pem
-    )
-    cert_command = cert_command % (keyfile_path, certfile_path)
+    gen_command = [
+        "openssl", "genrsa", "-aes256", "-out", "%s.tmp" % keyfile_path,
+        "-passout", "pass:password", "4096"
+    ]
+    decrypt_key_command = [
+        "openssl", "rsa", "-in", "%s.tmp" % keyfile_path,
+        "-passin", "pass:password", "-out", keyfile_path
+    ]
+    csr_command = [
+        "openssl", "req", "-new", "-key", keyfile_path, "-out", "temp.csr",
+        "-subj", subject
+    ]
+    cert_command = [
+        "openssl", "x509", "-req", # Create a new x509 certificate
+        "-days", "3650",           # That lasts 10 years
+        "-in", "temp.csr",         # Using the CSR we just generated
+        "-signkey", keyfile_path,  # Sign it with keyfile.pem we just created
+        "-out", certfile_path      # Save it as certificate.pem
+    ]
+    def execute(command):
+        "Runs *command* (blocking) and returns `(exitstatus, output)`."
+        from processes import run
+        stdout, stderr, exitstatus = run(command, timeout=30)
+        return (exitstatus, stdout + stderr)
     logging.debug(_(
-        "Generating private key with command: %s" % gen_command))
-    exitstatus, output = shell_command(gen_command, 30)
+        "Generating private key with command: %s" % ' '.join(gen_command)))
+    exitstatus, output = execute(gen_command)
     if exitstatus != 0:
         error_msg = _(
             "An error occurred trying to create private SSL key:\n%s" % output)
@@ -478,8 +601,9 @@ def gen_self_signed_openssl(path=None):
             os.remove('%s.tmp' % keyfile_path)
         raise SSLGenerationError(error_msg)
     logging.debug(_(
-        "Decrypting private key with command: %s" % decrypt_key_command))
-    exitstatus, output = shell_command(decrypt_key_command, 30)
+        "Decrypting private key with command: %s" %
+        ' '.join(decrypt_key_command)))
+    exitstatus, output = execute(decrypt_key_command)
     if exitstatus != 0:
         error_msg = _(
             "An error occurred trying to decrypt private SSL key:\n%s" % output)
@@ -487,8 +611,8 @@ def gen_self_signed_openssl(path=None):
             os.remove('%s.tmp' % keyfile_path)
         raise SSLGenerationError(error_msg)
     logging.debug(_(
-        "Creating CSR with command: %s" % csr_command))
-    exitstatus, output = shell_command(csr_command, 30)
+        "Creating CSR with command: %s" % ' '.join(csr_command)))
+    exitstatus, output = execute(csr_command)
     if exitstatus != 0:
         error_msg = _(
             "An error occurred trying to create CSR:\n%s" % output)
@@ -498,8 +622,9 @@ def gen_self_signed_openssl(path=None):
             os.remove('temp.csr')
         raise SSLGenerationError(error_msg)
     logging.debug(_(
-        "Generating self-signed certificate with command: %s" % gen_command))
-    exitstatus, output = shell_command(cert_command, 30)
+        "Generating self-signed certificate with command: %s" %
+        ' '.join(cert_command)))
+    exitstatus, output = execute(cert_command)
     if exitstatus != 0:
         error_msg = _(
             "An error occurred trying to create certificate:\n%s" % output)
@@ -687,28 +812,8 @@ def get_process_tree(parent_pid):
 
     .. note:: Will include parent_pid in the output list.
     """
-    parent_pid = str(parent_pid) # Has to be a string
-    ps = which('ps')
-    retcode, output = shell_command('%s -ef' % ps)
-    out = [parent_pid]
-    pidmap = []
-    # Construct the pidmap:
-    for line in output.splitlines():
-        split_line = line.split()
-        pid = split_line[1]
-        ppid = split_line[2]
-        pidmap.append((pid, ppid))
-    def walk_pids(pidmap, checkpid):
-        """
-        Recursively walks the given *pidmap* and updates the *out* variable with
-        the child pids of *checkpid*.
-        """
-        for pid, ppid in pidmap:
-            if ppid == checkpid:
-                out.append(pid)
-                walk_pids(pidmap, pid)
-    walk_pids(pidmap, parent_pid)
-    return out
+    from processes import process_tree
+    return [str(pid) for pid in process_tree(int(parent_pid))]
 
 def kill_dtached_proc(session, term):
     """
@@ -717,63 +822,33 @@ def kill_dtached_proc(session, term):
     processess to kill.
     """
     logging.debug('kill_dtached_proc(%s, %s)' % (session, term))
+    from processes import process_table, signal_tree
     dtach_socket_name = 'dtach_%s' % term
-    to_kill = []
-    for f in os.listdir('/proc'):
-        pid_dir = os.path.join('/proc', f)
-        if os.path.isdir(pid_dir):
-            try:
-                pid = int(f)
-            except ValueError:
-                continue # Not a PID
-            try:
-                with open(os.path.join(pid_dir, 'cmdline')) as f:
-                    cmdline = f.read()
-                if cmdline and session in cmdline:
-                    if dtach_socket_name in cmdline:
-                        to_kill.append(pid)
-            except Exception as e:
-                #logging.debug("Couldn't read the cmdline of PID %s" % pid)
-                #logging.debug(e)
-                pass # Already dead, no big deal.
-                # Uncomment above if you're having problems or think otherwise.
-    for pid in to_kill:
-        kill_pids = get_process_tree(pid)
-        for _pid in kill_pids:
-            _pid = int(_pid)
-            try:
-                os.kill(_pid, signal.SIGTERM)
-            except OSError:
-                pass # Process already died.  Not a problem.
+    table = process_table() # Only read it once for everything below
+    for pid, (ppid, pgid, cmdline) in table.items():
+        if session in cmdline and dtach_socket_name in cmdline:
+            signal_tree(pid, signal.SIGTERM, table)
 
 def kill_dtached_proc_bsd(session, term):
     """
     A BSD-specific implementation of `kill_dtached_proc` since Macs don't have
-    /proc.  Seems simpler than :func:`kill_dtached_proc` but actually having to
-    call a subprocess is less efficient (due to the sophisticated signal
-    handling required by :func:`shell_command`).
+    /proc.  The process list comes from ``ps`` which gets executed without
+    blocking the IOLoop (via :func:`processes.run_async`).
     """
     logging.debug('kill_dtached_proc_bsd(%s, %s)' % (session, term))
-    ps = which('ps')
-    if MACOS:
-        psopts = "-ef"
-    elif OPENBSD:
-        psopts = "-aux"
-    cmd = (
-        "%s %s | "
-        "grep %s/dtach_%s | " # Limit to those matching our session/term combo
-        "grep -v grep | " # Get rid of grep from the results (if present)
-        "awk '{print $2}' " % (ps, psopts, session, term) # Just the PID please
-    )
-    logging.debug('kill cmd: %s' % cmd)
-    exitstatus, output = shell_command(cmd)
-    for line in output.splitlines():
-        pid_to_kill = line.strip() # Get rid of trailing newline
-        for pid in get_process_tree(pid_to_kill):
-            try:
-                os.kill(int(pid), signal.SIGTERM)
-            except OSError:
-                pass # Process already died.  Not a problem.
+    from processes import run_async, parse_ps, signal_tree, PS_COMMAND
+    dtach_socket = '%s/dtach_%s' % (session, term)
+    def got_processes(stdout, stderr, exitstatus):
+        if exitstatus != 0:
+            logging.error(_(
+                "Could not list processes to kill (%s): %s" % (
+                exitstatus, stderr)))
+            return
+        table = parse_ps(stdout)
+        for pid, (ppid, pgid, command) in table.items():
+            if dtach_socket in command:
+                signal_tree(pid, signal.SIGTERM, table)
+    run_async(PS_COMMAND, got_processes)
 
 def killall(session_dir, pid_file):
     """
@@ -783,30 +858,20 @@ def killall(session_dir, pid_file):
     :session_dir: The path to Gate One's session directory.
     :pid_file: The path to Gate One's PID file
     """
+    from processes import process_table
     sessions = os.listdir(session_dir)
-    for f in os.listdir('/proc'):
-        pid_dir = os.path.join('/proc', f)
-        if os.path.isdir(pid_dir):
-            try:
-                pid = int(f)
-                if pid == os.getpid():
-                    continue # It would be suicide!
-            except ValueError:
-                continue # Not a PID
-            cmdline_path = os.path.join(pid_dir, 'cmdline')
-            if os.path.exists(cmdline_path):
+    for pid, (ppid, pgid, cmdline) in process_table().items():
+        if pid == os.getpid():
+            continue # It would be suicide!
+        for session in sessions:
+            if session in cmdline:
                 try:
-                    with open(cmdline_path) as f:
-                        cmdline = f.read()
-                except IOError:
-                    # Can happen if a process ended as we were looking at it
-                    continue
-            for session in sessions:
-                if session in cmdline:
-                    try:
-                        os.kill(pid, signal.SIGTERM)
-                    except OSError:
-                        pass # PID is already dead--great
+                    os.kill(pid, signal.SIGTERM)
+                except OSError:
+                    pass # PID is already dead--great
+                break
+    if not pid_file:
+        return
     try:
         go_pid = int(open(pid_file).read())
     except:
@@ -817,25 +882,11 @@ def killall(session_dir, pid_file):
 def killall_bsd(session_dir):
     """
     A BSD-specific version of `killall` since Macs don't have /proc.
+
+    .. note:: :func:`killall` works on BSD now too (see :func:`processes.process_table`).  This is just here for backwards compatibility.
     """
-    # TODO: See if there's a better way to keep track of subprocesses so we
-    # don't have to enumerate the process table at all.
     logging.debug('killall_bsd(%s)' % session_dir)
-    sessions = os.listdir(session_dir)
-    if MACOS:
-        psopts = "-ef"
-    elif OPENBSD:
-        psopts = "-aux"
-    for session in sessions:
-        cmd = (
-            "ps %s | "
-            "grep %s | " # Limit to those matching the session
-            "grep -v grep | " # Get rid of grep from the results (if present)
-            "awk '{print $2}' | " # Just the PID please
-            "xargs kill" % (psopts, session) # Kill em'
-        )
-        logging.debug('killall cmd: %s' % cmd)
-        exitstatus, output = shell_command(cmd)
+    killall(session_dir, None)
 
 def get_applications(application_dir, enabled=None):
     """
@@ -1164,6 +1215,44 @@ def human_readable_bytes(nbytes):
     else:
         return '%d' % nbytes
 
+def parse_byte_range(header, size):
+    """
+    Parses the given HTTP Range *header* (e.g. 'bytes=0-499') for a file of
+    *size* bytes and returns a `(start, end)` tuple where *end* is exclusive
+    (like a slice).  Returns `None` if the header isn't something we
+    understand (e.g. multiple ranges) in which case it should be ignored and
+    the whole file sent.
+
+    If the range can't be satisfied (it starts past the end of the file) the
+    returned *start* will be equal to *size*.  Examples::
+
+        >>> parse_byte_range('bytes=0-499', 1000)
+        (0, 500)
+        >>> parse_byte_range('bytes=-100', 1000)
+        (900, 1000)
+        >>> parse_byte_range('bytes=500-', 1000)
+        (500, 1000)
+    """
+    units, sep, byte_range = header.partition('=')
+    if units.strip() != 'bytes' or ',' in byte_range:
+        return None
+    first, sep, last = byte_range.strip().partition('-')
+    if not sep:
+        return None
+    try:
+        if not first: # Suffix range (the last N bytes)
+            length = int(last)
+            if length <= 0:
+                return (size, size)
+            return (max(size - length, 0), size)
+        start = int(first)
+        end = int(last) + 1 if last else size
+    except ValueError:
+        return None
+    if last and end <= start: # Invalid
+        return None
+    return (min(start, size), min(end, size))
+
 def which(binary, path=None):
     """
     Returns the full path of *binary* (string) just like the 'which' command.
@@ -1424,19 +1513,20 @@ def get_or_cache(cache_dir, path, minify=True):
             # Cache it
             with open(cached_file_path, 'w') as f:
                 f.write(data)
+            # Clean up old versions of this file (if present).  Only needs to
+            # happen when a new version gets cached.
+            for fname in os.listdir(cache_dir):
+                if fname == cached_filename:
+                    continue
+                elif fname.split(':', 1)[0] == path.replace('/', '_'):
+                    # Older version present.  Remove it.
+                    os.remove(os.path.join(cache_dir, fname))
         else:
             with open(path) as f:
                 data = f.read()
     else:
         with open(path) as f:
             data = f.read()
-    # Clean up old versions of this file (if present)
-    for fname in os.listdir(cache_dir):
-        if fname == cached_filename:
-            continue
-        elif fname.split(':', 1)[0] == path.replace('/', '_'):
-            # Older version present.  Remove it.
-            os.remove(os.path.join(cache_dir, fname))
     return data
 
 def drop_privileges(uid='nobody', gid='nogroup', supl_groups=None):
@@ -1639,4 +1729,3 @@ def create_signature(secret, hmac_algo=hashlib.sha1, *parts):
 _ = get_translation()
 if MACOS or OPENBSD: # Apply BSD-specific stuff
     kill_dtached_proc = kill_dtached_proc_bsd
-    killall = killall_bsd
@@ -0,0 +1,398 @@
+# -*- coding: utf-8 -*-
+#
+#       Copyright 2013 Liftoff Software Corporation
+#
+# For license information see LICENSE.txt
+
+__doc__ = """\
+watcher.py - Calls functions when files or directories are modified.
+
+On Linux the kernel's inotify interface is used so watching files costs
+nothing until something actually changes.  Everywhere else (or if inotify is
+unavailable) files are checked periodically with `os.stat()`.
+
+Either way bursts of changes (e.g. an editor writing a file in several steps or
+a whole directory being updated) are coalesced so that each registered function
+gets called once per burst.  Example usage::
+
+    from watcher import get_file_watcher
+    def settings_changed():
+        print("Something in the settings dir changed!")
+    get_file_watcher().watch('/opt/gateone/settings', settings_changed)
+
+If a directory is watched its function will be called when any file inside of
+it is created, modified, moved, or removed.
+"""
+
+# Meta
+__version__ = '1.0'
+__version_info__ = (1, 0)
+__license__ = "AGPLv3 or Proprietary (see LICENSE.txt)"
+__author__ = 'Dan McDougall <daniel.mcdougall@liftoffsoftware.com>'
+
+# Import stdlib stuff
+import os
+import sys
+import time
+import errno
+import struct
+import logging
+
+# Import 3rd party stuff
+import tornado.ioloop
+
+# inotify constants (from linux/inotify.h)
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = 0o2000000
+# What we care about when watching a directory (files we watch are tracked
+# through their parent directory so that atomic renames get noticed too):
+WATCH_MASK = (IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM |
+    IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF |
+    IN_ONLYDIR)
+EVENT_HEADER = struct.Struct('iIII') # wd, mask, cookie, len
+
+FILE_WATCHER = None # Gets set by get_file_watcher()
+
+class FileWatcher(object):
+    """
+    The base class for file watchers.  Keeps track of which functions to call
+    for which paths and takes care of coalescing changes: Changed paths are
+    collected for *coalesce* milliseconds before their functions are called.
+    """
+    def __init__(self, io_loop=None, coalesce=250):
+        self.io_loop = io_loop or tornado.ioloop.IOLoop.instance()
+        self.coalesce = coalesce
+        self.watches = {} # Format: {<path>: [<function>, ...]}
+        self.pending = set() # Paths that changed since the last flush
+        self._flush_timeout = None
+
+    def watch(self, path, func):
+        """
+        Calls *func* (with no arguments) whenever the file or directory at
+        *path* is modified.
+        """
+        path = os.path.abspath(path)
+        if path not in self.watches:
+            self.watches[path] = []
+            self._add(path)
+        if func not in self.watches[path]:
+            self.watches[path].append(func)
+
+    def unwatch(self, path, func=None):
+        """
+        Stops calling *func* when *path* is modified.  If *func* is not given
+        all functions registered for *path* will be removed.
+        """
+        path = os.path.abspath(path)
+        if path not in self.watches:
+            return
+        if func and func in self.watches[path]:
+            self.watches[path].remove(func)
+        if not func or not self.watches[path]:
+            del self.watches[path]
+            self.pending.discard(path)
+            self._remove(path)
+
+    def changed(self, path):
+        """
+        Marks *path* as changed.  Its functions will be called once things have
+        been quiet for `self.coalesce` milliseconds.
+        """
+        self.pending.add(path)
+        if self._flush_timeout:
+            self.io_loop.remove_timeout(self._flush_timeout)
+        self._flush_timeout = self.io_loop.add_timeout(
+            time.time() + self.coalesce/1000.0, self.flush)
+
+    def flush(self):
+        """
+        Calls the functions registered for all pending (changed) paths.
+        """
+        self._flush_timeout = None
+        pending = self.pending
+        self.pending = set()
+        for path in pending:
+            for func in list(self.watches.get(path, ())):
+                try:
+                    func()
+                except Exception as e:
+                    logging.error(
+                        "Exception encountered trying to execute the file "
+                        "update function for %s..." % path)
+                    logging.error(e)
+
+    def stop(self):
+        """
+        Stops watching all paths.
+        """
+        for path in list(self.watches.keys()):
+            self.unwatch(path)
+        if self._flush_timeout:
+            self.io_loop.remove_timeout(self._flush_timeout)
+            self._flush_timeout = None
+
+    def _add(self, path):
+        """
+        Starts watching *path*.  Must be implemented by subclasses.
+        """
+        raise NotImplementedError
+
+    def _remove(self, path):
+        """
+        Stops watching *path*.  Must be implemented by subclasses.
+        """
+        raise NotImplementedError
+
+class PollingFileWatcher(FileWatcher):
+    """
+    A :class:`FileWatcher` that checks the modification times of all watched
+    paths every *interval* milliseconds.  Only runs while there's something to
+    watch.
+    """
+    def __init__(self, io_loop=None, coalesce=250, interval=5000):
+        FileWatcher.__init__(self, io_loop, coalesce)
+        self.interval = interval
+        self.signatures = {} # Format: {<path>: <signature>}
+        self.checker = None # Will be replaced with a PeriodicCallback
+
+    def signature(self, path):
+        """
+        Returns something that will differ if the file or directory at *path*
+        has been modified.  For directories the mtimes of the files inside are
+        included so that in-place edits get noticed.
+        """
+        try:
+            if not os.path.isdir(path):
+                return os.stat(path).st_mtime
+            out = [os.stat(path).st_mtime]
+            for fname in sorted(os.listdir(path)):
+                fpath = os.path.join(path, fname)
+                try:
+                    out.append((fname, os.stat(fpath).st_mtime))
+                except OSError:
+                    pass # Removed between listdir() and stat()
+            return tuple(out)
+        except OSError: # Doesn't exist (anymore)
+            return None
+
+    def check(self):
+        """
+        Marks any paths whose signature has changed as changed.
+        """
+        for path, old_signature in list(self.signatures.items()):
+            new_signature = self.signature(path)
+            if new_signature != old_signature:
+                self.signatures[path] = new_signature
+                self.changed(path)
+
+    def _add(self, path):
+        self.signatures[path] = self.signature(path)
+        if not self.checker:
+            self.checker = tornado.ioloop.PeriodicCallback(
+                self.check, self.interval, io_loop=self.io_loop)
+            self.checker.start()
+
+    def _remove(self, path):
+        self.signatures.pop(path, None)
+        if not self.signatures and self.checker:
+            self.checker.stop()
+            self.checker = None
+
+class InotifyFileWatcher(FileWatcher):
+    """
+    A :class:`FileWatcher` that uses Linux's inotify interface (via ctypes).
+    Directories are watched directly; files are watched via their parent
+    directory so that files replaced via rename (what most editors do) are
+    still tracked.
+
+    Directories that don't exist (or get removed) can't be watched with
+    inotify so they get checked for every *interval* milliseconds instead.
+    Once they (re)appear they'll be watched again and their watched paths
+    will be marked as changed.
+
+    Raises `OSError` if inotify isn't available.
+    """
+    def __init__(self, io_loop=None, coalesce=250, interval=5000):
+        FileWatcher.__init__(self, io_loop, coalesce)
+        self.interval = interval
+        import ctypes
+        # NOTE: libc is already loaded into our process so there's no need to
+        # go looking for it with ctypes.util.find_library() (which is slow):
+        self.libc = ctypes.CDLL(None, use_errno=True)
+        if not hasattr(self.libc, 'inotify_init1'):
+            raise OSError(errno.ENOSYS, "inotify is not available")
+        self.libc.inotify_add_watch.argtypes = [
+            ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        self.fd = self.libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err))
+        self.wds = {}  # Format: {<watch descriptor>: <directory>}
+        self.dirs = {} # Format: {<directory>: <watch descriptor>}
+        self.missing = set() # Directories waiting to (re)appear
+        self.checker = None # Will be replaced with a PeriodicCallback
+        self.io_loop.add_handler(
+            self.fd, self._handle_events, self.io_loop.READ)
+
+    def _dir_for(self, path):
+        """
+        Returns the directory that needs to be watched for *path*.
+        """
+        if path in self.dirs or path in self.missing or os.path.isdir(path):
+            return path
+        return os.path.dirname(path)
+
+    def _watched_in(self, directory):
+        """
+        Returns the watched paths that rely on the watch for *directory*.
+        """
+        return [
+            a for a in self.watches
+            if a == directory or os.path.dirname(a) == directory]
+
+    def _add(self, path):
+        directory = self._dir_for(path)
+        if directory in self.dirs or directory in self.missing:
+            return
+        self._add_watch(directory)
+
+    def _add_watch(self, directory):
+        """
+        Adds an inotify watch for *directory*.  If it doesn't exist it will be
+        added to `self.missing` (and checked for periodically).  Returns `True`
+        if the watch was added.
+        """
+        import ctypes
+        encoded = directory
+        if not isinstance(encoded, bytes):
+            encoded = encoded.encode(sys.getfilesystemencoding())
+        wd = self.libc.inotify_add_watch(self.fd, encoded, WATCH_MASK)
+        if wd < 0:
+            err = ctypes.get_errno()
+            if err in (errno.ENOENT, errno.ENOTDIR):
+                self._add_missing(directory)
+            else:
+                logging.error("Could not watch %s: %s" % (
+                    directory, os.strerror(err)))
+            return False
+        self.wds[wd] = directory
+        self.dirs[directory] = wd
+        return True
+
+    def _add_missing(self, directory):
+        """
+        Checks for *directory* every `self.interval` milliseconds until it
+        exists (again).
+        """
+        self.missing.add(directory)
+        if not self.checker:
+            self.checker = tornado.ioloop.PeriodicCallback(
+                self.check_missing, self.interval, io_loop=self.io_loop)
+            self.checker.start()
+
+    def check_missing(self):
+        """
+        Watches any missing directories that have (re)appeared and marks their
+        watched paths as changed.
+        """
+        for directory in list(self.missing):
+            if not os.path.isdir(directory):
+                continue
+            self.missing.discard(directory)
+            if self._add_watch(directory):
+                for path in self._watched_in(directory):
+                    self.changed(path)
+        if not self.missing and self.checker:
+            self.checker.stop()
+            self.checker = None
+
+    def _remove(self, path):
+        directory = self._dir_for(path)
+        # Only remove the watch if nothing else needs the directory
+        if self._watched_in(directory):
+            return
+        self.missing.discard(directory)
+        if not self.missing and self.checker:
+            self.checker.stop()
+            self.checker = None
+        wd = self.dirs.pop(directory, None)
+        if wd is not None:
+            del self.wds[wd]
+            self.libc.inotify_rm_watch(self.fd, wd)
+
+    def _handle_events(self, fd, events):
+        """
+        Reads all waiting inotify events and marks the corresponding watched
+        paths as changed.
+        """
+        while True:
+            try:
+                data = os.read(self.fd, 65536)
+            except OSError as e:
+                if e.errno in (errno.EAGAIN, errno.EINTR):
+                    return
+                raise
+            if not data:
+                return
+            offset = 0
+            while offset < len(data):
+                wd, mask, cookie, length = EVENT_HEADER.unpack_from(
+                    data, offset)
+                offset += EVENT_HEADER.size
+                name = data[offset:offset+length].rstrip(b'\0')
+                offset += length
+                if mask & IN_Q_OVERFLOW: # Missed events; assume the worst
+                    for path in self.watches:
+                        self.changed(path)
+                    continue
+                directory = self.wds.get(wd, None)
+                if directory is None:
+                    continue
+                if mask & IN_IGNORED: # Directory went away
+                    del self.wds[wd]
+                    self.dirs.pop(directory, None)
+                    if self._watched_in(directory): # Watch it when it's back
+                        self._add_missing(directory)
+                if directory in self.watches:
+                    self.changed(directory)
+                if name:
+                    if not isinstance(name, str):
+                        name = name.decode(sys.getfilesystemencoding())
+                    path = os.path.join(directory, name)
+                    if path in self.watches:
+                        self.changed(path)
+
+    def stop(self):
+        FileWatcher.stop(self)
+        self.io_loop.remove_handler(self.fd)
+        os.close(self.fd)
+
+def get_file_watcher(io_loop=None, interval=5000):
+    """
+    Returns the process-wide :class:`FileWatcher`, creating it if necessary.
+    An :class:`InotifyFileWatcher` will be used if possible, otherwise a
+    :class:`PollingFileWatcher` that checks files every *interval*
+    milliseconds.
+    """
+    global FILE_WATCHER
+    if FILE_WATCHER:
+        return FILE_WATCHER
+    try:
+        FILE_WATCHER = InotifyFileWatcher(io_loop, interval=interval)
+        logging.debug("Using inotify to watch files")
+    except (OSError, AttributeError) as e:
+        logging.debug("inotify unavailable (%s); polling files instead" % e)
+        FILE_WATCHER = PollingFileWatcher(io_loop, interval=interval)
+    return FILE_WATCHER